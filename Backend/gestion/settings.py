@@ -63,7 +63,12 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 12,
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'iva.authentication.CookiesJWTAuthentication',
-    ]
+    ],
+    # Mismo JSON que el renderer de DRF, generado con orjson (ver shared.renderers)
+    'DEFAULT_RENDERER_CLASSES': [
+        'shared.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 INSTALLED_APPS = [
@@ -89,6 +94,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'shared.compresion.CompresionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -197,6 +203,44 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 MEDIA_URL = '/media/'
 
+# Los archivos subidos se guardan una sola vez por contenido y cada nombre es un hard link al blob (ver
+# shared.almacenamiento). Los backups de MEDIA_ROOT deben preservar los hard links (rsync -H, tar).
+STORAGES = {
+    'default': {'BACKEND': 'shared.almacenamiento.AlmacenamientoDeduplicado'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Resultados de los trabajos en segundo plano de reportes (ver reportes.trabajos). No debe quedar dentro de MEDIA_ROOT,
+# que nginx sirve sin autenticación.
+REPORTES_RESULTADOS_DIR = env('REPORTES_RESULTADOS_DIR', default=os.path.join(BASE_DIR, 'resultados_reportes'))
+
+REPORTES_RETENCION_HORAS = env.int('REPORTES_RETENCION_HORAS', default=24)
+
+# Caché de PDFs generados (órdenes de pago y recibos, ver tesoreria.pdfs) y procesos para dibujar lotes en paralelo
+PDF_CACHE_DIR = env('PDF_CACHE_DIR', default=os.path.join(BASE_DIR, 'cache_pdf'))
+
+PDF_CACHE_RETENCION_DIAS = env.int('PDF_CACHE_RETENCION_DIAS', default=30)
+
+# Procesos del pool que dibuja los lotes grandes. Cada worker de gunicorn crea su propio pool recién con el primer lote
+# grande y lo mantiene, así que la memoria extra es workers x PDF_PROCESOS procesos con Django cargado; 1 desactiva el pool
+PDF_PROCESOS = env.int('PDF_PROCESOS', default=min(4, os.cpu_count() or 1))
+
+# Cada cuántos segundos los procesos que no atienden requests (comandos, workers) comparan su caché de catálogos con la
+# base (ver shared.catalogos); en los requests se compara una vez al empezar cada uno
+CATALOGOS_VALIDAR_SEGUNDOS = env.int('CATALOGOS_VALIDAR_SEGUNDOS', default=5)
+
+# Mantenimiento del historial de Registro (ver tesoreria.historial_mantenimiento): se compactan las versiones más viejas
+# que HISTORIAL_COMPACTAR_DIAS y se borran las más viejas que HISTORIAL_RETENCION_DIAS (0 = se conservan siempre)
+HISTORIAL_COMPACTAR_DIAS = env.int('HISTORIAL_COMPACTAR_DIAS', default=30)
+
+HISTORIAL_RETENCION_DIAS = env.int('HISTORIAL_RETENCION_DIAS', default=0)
+
+# Archivos que ExportarDocumentos lee por adelantado en hilos mientras arma el ZIP (conviene con un storage remoto)
+EXPORTAR_DOCUMENTOS_ANTICIPAR = env.int('EXPORTAR_DOCUMENTOS_ANTICIPAR', default=0)
+
+# Tamaño mínimo de las respuestas que se comprimen con brotli/gzip (ver shared.compresion)
+COMPRESION_MINIMO_BYTES = env.int('COMPRESION_MINIMO_BYTES', default=1024)
+
 X_FRAME_OPTIONS = 'ALLOW-FROM localhost'
 
 LOGIN_REDIRECT_URL = '/'
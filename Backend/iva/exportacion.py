@@ -0,0 +1,142 @@
+'''
+Exportación de los archivos de documentos en un ZIP por streaming (ExportarDocumentos).
+
+El ZIP se escribe con zipfile sobre una salida que no se puede posicionar: zipfile agrega un descriptor de datos después
+de cada archivo en lugar de volver atrás a completar el encabezado, así cada bloque comprimido se puede enviar apenas se
+escribe. Los archivos se leen de a bloques, y los formatos que ya vienen comprimidos (PDF, imágenes) se guardan sin
+volver a comprimirlos. La memoria queda en unos pocos MB sin importar la cantidad de documentos, y la descarga empieza
+con el primer archivo.
+'''
+import logging
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.http import StreamingHttpResponse
+
+logger = logging.getLogger(__name__)
+
+TAMANO_BLOQUE = 64 * 1024
+
+# Extensiones que ya están comprimidas: deflate no las achica y solo gasta CPU
+YA_COMPRIMIDOS = {'.pdf', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.zip', '.rar', '.7z', '.gz', '.xlsx', '.docx'}
+
+# Con lectura anticipada cada archivo se lee entero en un hilo; los más grandes se siguen leyendo de a bloques
+MAXIMO_ANTICIPADO = 4 * 1024 * 1024
+
+
+class _Salida:
+    '''Destino del ZIP que acumula lo escrito hasta que el generador lo envía. No tiene tell(), a propósito.'''
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, datos) -> int:
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self) -> bytes:
+        datos = b''.join(self.partes)
+        self.partes.clear()
+        return datos
+
+
+def compresion(nombre: str) -> int:
+    return zipfile.ZIP_STORED if os.path.splitext(nombre)[1].lower() in YA_COMPRIMIDOS else zipfile.ZIP_DEFLATED
+
+
+def _leer_entero(storage, nombre: str) -> bytes | None:
+    # Solo se adelantan los archivos chicos, para que la lectura anticipada no dispare la memoria
+    if storage.size(nombre) > MAXIMO_ANTICIPADO:
+        return None
+    with storage.open(nombre, 'rb') as archivo:
+        return archivo.read()
+
+
+def _bloques(storage, nombre: str):
+    with storage.open(nombre, 'rb') as archivo:
+        while True:
+            bloque = archivo.read(TAMANO_BLOQUE)
+            if not bloque:
+                return
+            yield bloque
+
+
+def zip_por_streaming(archivos, anticipar: int = 0):
+    '''
+    Genera los bytes de un ZIP con los archivos indicados, a medida que se escriben. archivos es un iterable de
+    (storage, nombre) y cada archivo se guarda en el ZIP con su nombre del storage. Con anticipar > 0 se leen hasta esa
+    cantidad de archivos por adelantado en hilos (útil si el storage es remoto). Los archivos que no se pueden leer se
+    omiten y se listan en errores.txt al final del ZIP.
+    '''
+    salida = _Salida()
+    errores = []
+    hilos = ThreadPoolExecutor(max_workers=anticipar) if anticipar > 0 else None
+    pendientes = deque()
+    archivos = iter(archivos)
+    try:
+        with zipfile.ZipFile(salida, 'w') as zip_file:
+            while True:
+                # Se mantienen hasta `anticipar` lecturas en curso por delante del archivo que se está escribiendo
+                while len(pendientes) < max(anticipar, 1):
+                    siguiente = next(archivos, None)
+                    if siguiente is None:
+                        break
+                    storage, nombre = siguiente
+                    futuro = hilos.submit(_leer_entero, storage, nombre) if hilos else None
+                    pendientes.append((storage, nombre, futuro))
+                if not pendientes:
+                    break
+
+                storage, nombre, futuro = pendientes.popleft()
+                info = zipfile.ZipInfo(nombre, date_time=datetime.now().timetuple()[:6])
+                info.compress_type = compresion(nombre)
+                try:
+                    contenido = futuro.result() if futuro else None
+                    if contenido is not None:
+                        bloques = (contenido[i:i + TAMANO_BLOQUE] for i in range(0, len(contenido), TAMANO_BLOQUE))
+                    else:
+                        bloques = _bloques(storage, nombre)
+                    # Se abre el archivo fuente antes de crear la entrada, así un archivo faltante no deja una entrada vacía
+                    bloques = iter(bloques)
+                    primero = next(bloques, b'')
+                except Exception as e:
+                    errores.append(f'{nombre}: {e}')
+                    continue
+                with zip_file.open(info, 'w') as destino:
+                    destino.write(primero)
+                    yield salida.vaciar()
+                    try:
+                        for bloque in bloques:
+                            destino.write(bloque)
+                            yield salida.vaciar()
+                    except OSError as e:
+                        # Lo ya enviado no se puede deshacer: el archivo queda incompleto y se avisa en errores.txt
+                        errores.append(f'{nombre}: incompleto, {e}')
+                yield salida.vaciar()
+
+            if errores:
+                logger.warning('Exportación ZIP con %s archivos omitidos', len(errores))
+                zip_file.writestr('errores.txt', '\n'.join(errores))
+        yield salida.vaciar()
+    finally:
+        if hilos:
+            hilos.shutdown(wait=False, cancel_futures=True)
+
+
+def respuesta_zip(archivos, nombre: str, anticipar: int = 0) -> StreamingHttpResponse:
+    '''Devuelve el ZIP por streaming, sin Content-Length: el tamaño final no se conoce hasta terminar.'''
+    response = StreamingHttpResponse(
+        (bloque for bloque in zip_por_streaming(archivos, anticipar) if bloque),
+        content_type='application/octet-stream',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    response['Cache-Control'] = 'no-cache'
+    # nginx no debe acumular la respuesta antes de enviarla
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -5,6 +5,7 @@ from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import transaction
 from tesoreria.models import Caja, Registro
+from shared import catalogos
 
 class Persona(models.Model):
     proveedor_receptor_choices = [
@@ -134,7 +135,7 @@ class Documento(models.Model):
             observacion = self.concepto,
             monto_gasto_ingreso_neto = -monto_pagado if monto_pagado else -self.total,
             moneda = self.moneda,
-            caja = Caja.objects.get_or_create(caja='Facturas')[0]
+            caja = catalogos.obtener_o_crear(Caja, 'Facturas')
         )
         registro.documento.set([self])
         return registro
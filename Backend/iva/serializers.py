@@ -2,6 +2,8 @@ from django.contrib.auth.models import Group, User
 from rest_framework import serializers
 from .models import Documento, EstadoDocumento, TiposDocumento, Persona, Imputacion, UnidadDeNegocio, ClienteProyecto
 from tesoreria.models import Registro
+from shared.serializers import CatalogoSlugRelatedField
+from shared.proyecciones import OMITIR, Calculado, ProyeccionSerializer
 from tesoreria.models import Presupuesto
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
@@ -78,9 +80,37 @@ class DocumentoCrudSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 class DocumentoSerializer(DocumentoCrudSerializer):
-    tipo_documento = serializers.SlugRelatedField(slug_field='tipo_documento', queryset=TiposDocumento.objects.all())
+    tipo_documento = CatalogoSlugRelatedField(slug_field='tipo_documento', queryset=TiposDocumento.objects.all())
     receptor = serializers.CharField(source="receptor.nombre", read_only=True)
     proveedor = serializers.CharField(source="proveedor.nombre", read_only=True)
-    imputacion = serializers.SlugRelatedField(slug_field='imputacion', queryset=Imputacion.objects.all(), required=False)
-    cliente_proyecto = serializers.SlugRelatedField(slug_field='cliente_proyecto', queryset=ClienteProyecto.objects.all(), required=False)
-    unidad_de_negocio = serializers.SlugRelatedField(slug_field='unidad_de_negocio', queryset=UnidadDeNegocio.objects.all(), required=False)
+    imputacion = CatalogoSlugRelatedField(slug_field='imputacion', queryset=Imputacion.objects.all(), required=False)
+    cliente_proyecto = CatalogoSlugRelatedField(slug_field='cliente_proyecto', queryset=ClienteProyecto.objects.all(), required=False)
+    unidad_de_negocio = CatalogoSlugRelatedField(slug_field='unidad_de_negocio', queryset=UnidadDeNegocio.objects.all(), required=False)
+
+def nombres_personas(filas: list, relacion: str) -> list:
+    """
+    Persona.nombre() de la relación para filas de values() que traen relacion, relacion__razon_social y
+    relacion__nombre_fantasia. Sin persona se omite el campo, igual que un CharField(source="relacion.nombre").
+    """
+    return [
+        OMITIR if fila[relacion] is None
+        else fila[f'{relacion}__razon_social'] or fila[f'{relacion}__nombre_fantasia'] or "Sin nombre"
+        for fila in filas
+    ]
+
+def rutas_persona(relacion: str) -> tuple:
+    return (relacion, f'{relacion}__razon_social', f'{relacion}__nombre_fantasia')
+
+class DocumentoProyeccion(ProyeccionSerializer):
+    """DocumentoSerializer sobre filas de values(), para los listados (ver shared.proyecciones)."""
+    receptor = Calculado(*rutas_persona('receptor'))
+    proveedor = Calculado(*rutas_persona('proveedor'))
+
+    class Meta:
+        serializer = DocumentoSerializer
+
+    def calcular_receptor(self, filas):
+        return nombres_personas(filas, 'receptor')
+
+    def calcular_proveedor(self, filas):
+        return nombres_personas(filas, 'proveedor')
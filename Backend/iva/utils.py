@@ -1,9 +1,100 @@
+from decimal import Decimal
+
 from tesoreria.models import Registro, Caja
 from iva.models import Imputacion
 from .models import Documento
+from shared import catalogos
+
+# Decimales de los montos de Registro
+CUATRO_DECIMALES = Decimal('0.0001')
+
+# Percepción del documento -> (imputación, observación) del registro PERCS, en el orden en que se crean
+PERCEPCIONES = {
+    'percepcion_de_iibb': ("IIBB ret/perc", "Perc. IIBB"),
+    'percepcion_de_iva': ("IVA ret/perc", "Perc. IVA"),
+}
+
+def importes_documento(documento: Documento) -> dict:
+    # Documento guarda solo el total: se imputa todo como neto, sin IVA discriminado, percepciones ni tipo de cambio propio
+    return {
+        'neto': documento.total or Decimal(0),
+        'iva': Decimal(0),
+        'tipo_de_cambio': None,
+        'percepcion_de_iibb': Decimal(0),
+        'percepcion_de_iva': Decimal(0),
+    }
+
+def dividir_monto(documento: Documento, monto) -> tuple[Decimal, Decimal]:
+    # Parte de una factura imputada a una obra: se reparte entre neto e IVA con la misma proporción que la factura
+    importes = importes_documento(documento)
+    monto = Decimal(str(monto))
+    if not importes['iva']:
+        return monto, Decimal(0)
+    neto = (monto * importes['neto'] / (importes['neto'] + importes['iva'])).quantize(CUATRO_DECIMALES)
+    return neto, monto - neto
+
+def registro_fc(documento: Documento, caja_facturas: Caja, presupuesto = None, cliente_proyecto = None, monto = None) -> Registro:
+    # Registro FC sin guardar, así la corrida de pagos los crea todos juntos con bulk_create. Con cliente_proyecto y
+    # monto es la parte de la factura imputada a esa obra (imputaciones múltiples)
+    importes = importes_documento(documento)
+    if cliente_proyecto is None:
+        cliente_proyecto = documento.cliente_proyecto or None # Si no se especifica, se asigna None, para asignar luego
+        unidad_de_negocio = documento.unidad_de_negocio or None # ""
+        neto, iva = importes['neto'], importes['iva']
+    else:
+        unidad_de_negocio = cliente_proyecto.unidad_de_negocio
+        neto, iva = dividir_monto(documento, monto)
+    return Registro(
+        caja=caja_facturas,
+        tipo_reg="FC",
+        añomes_imputacion=documento.añomes_imputacion_gasto,
+        fecha_reg=documento.fecha_documento,
+        unidad_de_negocio=unidad_de_negocio,
+        cliente_proyecto=cliente_proyecto,
+        imputacion=documento.imputacion or None, # ""
+        observacion=documento.concepto,
+        proveedor=documento.proveedor,
+        presupuesto = presupuesto,
+        monto_gasto_ingreso_neto=-neto,
+        iva_gasto_ingreso=-iva,
+        monto_op_rec=0,
+        moneda=documento.moneda,
+        tipo_de_cambio=importes['tipo_de_cambio'],
+        realizado=True
+    )
+
+def registros_percepciones_nuevos(documento: Documento, caja_facturas: Caja, existentes) -> list[Registro]:
+    # Registros PERCS sin guardar de las percepciones del documento que todavía no tienen uno. existentes son los pares
+    # (imputacion_id, monto_gasto_ingreso_neto) de los PERCS activos del documento
+    importes = importes_documento(documento)
+    existentes = set(existentes)
+    percs = []
+    for campo, (nombre_imputacion, observacion) in PERCEPCIONES.items():
+        monto = importes[campo]
+        if not monto:
+            continue
+        imputacion = catalogos.por_nombre(Imputacion, nombre_imputacion)
+        if (imputacion.pk, -monto) in existentes:
+            continue
+        percs.append(Registro(
+            caja=caja_facturas,
+            tipo_reg="PERCS",
+            añomes_imputacion=documento.añomes_imputacion_gasto,
+            fecha_reg=documento.fecha_documento,
+            imputacion=imputacion,
+            observacion=observacion,
+            proveedor=documento.proveedor,
+            monto_gasto_ingreso_neto=-monto,
+            iva_gasto_ingreso=0,
+            monto_op_rec=0,
+            moneda=documento.moneda,
+            tipo_de_cambio=importes['tipo_de_cambio'],
+            realizado=True
+        ))
+    return percs
 
-def registro_desde_documento_temporal(documento: Documento, documento_temporal: Documento, presupuesto = None):
-    registro = registro_desde_documento(documento_temporal, presupuesto)
+def registro_desde_imputacion(documento: Documento, cliente_proyecto, monto, presupuesto = None):
+    registro = registro_desde_documento(documento, presupuesto, cliente_proyecto, monto)
     registro.documento.set([documento])
     registro.save()
     documento.imputado = True
@@ -19,99 +110,37 @@ def registro_desde_documento_real(documento: Documento, presupuesto = None):
     percs = registros_percepciones(documento)
     return (registro, percs)
 
-def registro_desde_documento(documento: Documento, presupuesto = None):
+def registro_desde_documento(documento: Documento, presupuesto = None, cliente_proyecto = None, monto = None):
     try:
         # Pruebo primero si no existe ya un registro para ese documento, filtro también por cliente_proyecto porque un mismo documento puede tener más de un registro para distintas obras
-        registro = Registro.objects.filter(documento__in=[documento], cliente_proyecto=documento.cliente_proyecto, activo=True).first()
+        obra = cliente_proyecto if cliente_proyecto is not None else documento.cliente_proyecto
+        registro = Registro.objects.filter(documento__in=[documento], tipo_reg="FC", cliente_proyecto=obra, activo=True).first()
         if registro:
             documento.imputado = True
             documento.save()
             return registro
-        caja_facturas = Caja.objects.get(caja="Facturas")
-        registro = Registro.objects.create(
-            caja=caja_facturas,
-            tipo_reg="FC",
-            añomes_imputacion=documento.añomes_imputacion_gasto,
-            fecha_reg=documento.fecha_documento,
-            unidad_de_negocio=documento.unidad_de_negocio or None, # Si no se especifica, se asigna None, para asignar luego
-            cliente_proyecto=documento.cliente_proyecto or None, # ""
-            imputacion=documento.imputacion or None, # ""
-            observacion=documento.concepto,
-            proveedor=documento.proveedor,
-            presupuesto = presupuesto,
-            monto_gasto_ingreso_neto=-documento.neto,
-            iva_gasto_ingreso=-documento.iva,
-            monto_op_rec=0,
-            moneda=documento.moneda,
-            tipo_de_cambio=documento.tipo_de_cambio,
-            realizado=True
-        )
+        caja_facturas = catalogos.por_nombre(Caja, "Facturas")
+        registro = registro_fc(documento, caja_facturas, presupuesto, cliente_proyecto, monto)
+        registro.save()
         return registro
     except Exception as e:
         raise e
-    
+
 def registros_percepciones(documento: Documento):
     try:
-        # Variables para controlar si los registros existen
-        iva_exists = False
-        iibb_exists = False
-        iibb = documento.percepcion_de_iibb
-        iva = documento.percepcion_de_iva
-        percs = []
-        caja_facturas = Caja.objects.get(caja="Facturas")
-        if not iva and not iibb:
+        importes = importes_documento(documento)
+        if not any(importes[campo] for campo in PERCEPCIONES):
             return
-        
-        # Verificar registros existentes
-        registros = Registro.objects.filter(documento__in=[documento], tipo_reg="PERCS", activo=True)
-        
-        for registro in registros:
-            if registro.imputacion == Imputacion.objects.get(imputacion="IVA ret/perc") and registro.monto_gasto_ingreso_neto == documento.percepcion_de_iva:
-                iva_exists = True
-            if registro.imputacion == Imputacion.objects.get(imputacion="IIBB ret/perc") and registro.monto_gasto_ingreso_neto == documento.percepcion_de_iibb:
-                iibb_exists = True
-        
+        caja_facturas = catalogos.por_nombre(Caja, "Facturas")
+
         # Crear registros solo si no existen
-        if iibb and iibb != 0 and not iibb_exists:
-            registro = Registro.objects.create(
-                caja=caja_facturas,
-                tipo_reg="PERCS",
-                añomes_imputacion=documento.añomes_imputacion_gasto,
-                fecha_reg=documento.fecha_documento,
-                imputacion=Imputacion.objects.get(imputacion="IIBB ret/perc"),
-                observacion="Perc. IIBB",
-                proveedor=documento.proveedor,
-                monto_gasto_ingreso_neto=-iibb,
-                iva_gasto_ingreso=0,
-                monto_op_rec=0,
-                moneda=documento.moneda,
-                tipo_de_cambio=documento.tipo_de_cambio,
-                realizado=True
-            )
-            registro.documento.set([documento])
+        existentes = Registro.objects.filter(documento__in=[documento], tipo_reg="PERCS", activo=True).values_list(
+            'imputacion_id', 'monto_gasto_ingreso_neto'
+        )
+        percs = registros_percepciones_nuevos(documento, caja_facturas, existentes)
+        for registro in percs:
             registro.save()
-            percs.append(registro)
-        
-        if iva and iva != 0 and not iva_exists:
-            registro = Registro.objects.create(
-                caja=caja_facturas,
-                tipo_reg="PERCS",
-                añomes_imputacion=documento.añomes_imputacion_gasto,
-                fecha_reg=documento.fecha_documento,
-                imputacion=Imputacion.objects.get(imputacion="IVA ret/perc"),
-                observacion="Perc. IVA",
-                proveedor=documento.proveedor,
-                monto_gasto_ingreso_neto=-iva,
-                iva_gasto_ingreso=0,
-                monto_op_rec=0,
-                moneda=documento.moneda,
-                tipo_de_cambio=documento.tipo_de_cambio,
-                realizado=True
-            )
             registro.documento.set([documento])
-            registro.save()
-            percs.append(registro)
         return percs
     except Exception as e:
         raise e
-            
\ No newline at end of file
@@ -1,14 +1,13 @@
-from io import BytesIO
 import os
-import zipfile
-from django.http import HttpResponse
+from django.conf import settings
 
 from tesoreria.models import Caja, Registro
 from tesoreria.models.pagos import PagoFactura
+from .exportacion import respuesta_zip
 from .models import Documento, EstadoDocumento, Persona, UnidadDeNegocio, ClienteProyecto, Imputacion, TiposDocumento
 from django.contrib.auth.models import Group, User
 from rest_framework import permissions, viewsets
-from .serializers import (GroupSerializer, UserSerializer, DocumentoSerializer, DocumentoCrudSerializer, EstadoDocumentoSerializer, 
+from .serializers import (GroupSerializer, UserSerializer, DocumentoSerializer, DocumentoCrudSerializer, DocumentoProyeccion, EstadoDocumentoSerializer, 
                           TiposDocumentoSerializer, ImputacionSerializer, PersonaSerializer, UnidadDeNegocioSerializer, ClienteProyectoSerializer)
 from rest_framework import status, filters
 from rest_framework.views import APIView
@@ -18,6 +17,9 @@ from rest_framework import generics
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.db import transaction
 from django_filters import rest_framework as drf_filters
+from shared.condicional import RespuestaCondicionalMixin
+from shared.proyecciones import ListadoProyectadoMixin
+from shared import versiones
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     """
@@ -132,15 +134,16 @@ class GroupViewSet(viewsets.ModelViewSet):
     serializer_class = GroupSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-class DocumentoActivoViewSet(generics.ListCreateAPIView):
+class DocumentoActivoViewSet(ListadoProyectadoMixin, generics.ListCreateAPIView):
     """
     Ednpoint de la API para listar y crear documentos activos, se usa solo para listar.
     """
     permission_classes = [permissions.IsAuthenticated]
     queryset = Documento.objects.filter(activo=True).order_by('-fecha_documento')
     serializer_class = DocumentoSerializer
+    serializer_proyeccion = DocumentoProyeccion
 
-class DocumentoImpagoViewSet(generics.ListCreateAPIView):
+class DocumentoImpagoViewSet(ListadoProyectadoMixin, generics.ListCreateAPIView):
     """
     Ednpoint de la API para listar y crear documentos impagos, se usa solo para listar.  
     Filtra todos los documentos que no tengan una instancia de PagoFactura asociada.
@@ -148,6 +151,7 @@ class DocumentoImpagoViewSet(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [filters.SearchFilter]
     serializer_class = DocumentoSerializer
+    serializer_proyeccion = DocumentoProyeccion
     search_fields = [
         'proveedor__razon_social', 'proveedor__cnpj', 'proveedor__nombre_fantasia',
         'receptor__razon_social', 'receptor__cnpj', 'receptor__nombre_fantasia',
@@ -157,11 +161,12 @@ class DocumentoImpagoViewSet(generics.ListCreateAPIView):
     ]
     queryset = Documento.objects.all().order_by('-id')
 
-class DocumentoInactivoViewSet(generics.ListCreateAPIView):
+class DocumentoInactivoViewSet(ListadoProyectadoMixin, generics.ListCreateAPIView):
     """Endpoint de la API para listar y crear documentos inactivos ("eliminados"), se usa solo para listar."""
     permission_classes = [permissions.IsAuthenticated]
     queryset = Documento.objects.filter(activo=False).order_by('-fecha_documento')
     serializer_class = DocumentoSerializer
+    serializer_proyeccion = DocumentoProyeccion
 
 class HistorialDocumento(APIView):
     """
@@ -187,19 +192,21 @@ class HistorialDocumento(APIView):
         serializer = EstadoDocumentoSerializer(historial, many=True)
         return Response(serializer.data)
     
-class PersonaDetail(generics.RetrieveUpdateDestroyAPIView):
+class PersonaDetail(RespuestaCondicionalMixin, generics.RetrieveUpdateDestroyAPIView):
     """APIView genérica para obtener, actualizar o eliminar un usuario"""
     queryset = Persona.objects.all().order_by('id')
     serializer_class = PersonaSerializer
     permission_classes = [permissions.IsAuthenticated]
+    modelos_etag = [Persona]
 
-class ClienteProyectoDetail(generics.RetrieveUpdateDestroyAPIView):
+class ClienteProyectoDetail(RespuestaCondicionalMixin, generics.RetrieveUpdateDestroyAPIView):
     """APIView genérica para obtener, actualizar o eliminar un cliente/proyecto"""
     permission_classes = [permissions.IsAuthenticated]
     queryset = ClienteProyecto.objects.all().order_by('id')
     serializer_class = ClienteProyectoSerializer
+    modelos_etag = [ClienteProyecto]
 
-class DocumentoList(generics.ListCreateAPIView):
+class DocumentoList(ListadoProyectadoMixin, generics.ListCreateAPIView):
     """
     Vista para listar y crear documentos.
     Esta vista utiliza `generics.ListCreateAPIView` para proporcionar la operacion
@@ -214,6 +221,7 @@ class DocumentoList(generics.ListCreateAPIView):
     """
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = DocumentoSerializer
+    serializer_proyeccion = DocumentoProyeccion
     filter_backends = [filters.OrderingFilter, filters.SearchFilter, drf_filters.DjangoFilterBackend]
     filterset_fields = {
         'proveedor__razon_social': ['icontains', 'isnull', 'exact'],
@@ -298,7 +306,7 @@ class DocumentoDetail(generics.RetrieveUpdateDestroyAPIView):
         except Exception as e:
             return Response({'success': False, 'error': str(e)})
 
-class ProveedorList(generics.ListCreateAPIView):
+class ProveedorList(RespuestaCondicionalMixin, generics.ListCreateAPIView):
     """
     Vista API para listar y crear personas 'Proveedor' activas.  
     Solo los usuarios autenticados pueden acceder a esta vista.
@@ -313,6 +321,7 @@ class ProveedorList(generics.ListCreateAPIView):
     }
     search_fields = ['razon_social', 'nombre_fantasia', 'cnpj']
     queryset = Persona.objects.filter(proveedor_receptor=1, activo=True).order_by('id')
+    modelos_etag = [Persona]
 
     def delete(self, request, *args, **kwargs):
         try:
@@ -335,6 +344,7 @@ class ProveedorList(generics.ListCreateAPIView):
                         return Response({'success': False, 'message': 'Ya existe un proveedor con ese cnpj'}, status=status.HTTP_400_BAD_REQUEST)
                     else:
                         persona.update(activo=True)
+                        versiones.incrementar(Persona)
                         return Response({'success': True, 'message': 'Proveedor restaurado correctamente'}, status=status.HTTP_201_CREATED)
 
             serializer.is_valid(raise_exception=True)
@@ -343,7 +353,7 @@ class ProveedorList(generics.ListCreateAPIView):
         except Exception as e:
             return Response({'success': False, 'error': str(e)})
         
-class ReceptorList(generics.ListCreateAPIView):
+class ReceptorList(RespuestaCondicionalMixin, generics.ListCreateAPIView):
     """
     Vista API para listar y crear personas 'Receptor' activas.  
     Solo los usuarios autenticados pueden acceder a esta vista.
@@ -358,8 +368,9 @@ class ReceptorList(generics.ListCreateAPIView):
     }
     search_fields = ['razon_social', 'nombre_fantasia', 'cnpj']
     queryset = Persona.objects.filter(proveedor_receptor=2, activo=True).order_by('id')
+    modelos_etag = [Persona]
 
-class UnidadDeNegocioList(generics.ListCreateAPIView):
+class UnidadDeNegocioList(RespuestaCondicionalMixin, generics.ListCreateAPIView):
     """
     Vista API para listar y crear instancias de 'UnidadDeNegocio'.  
     Solo los usuarios autenticados pueden acceder a esta vista.
@@ -370,8 +381,9 @@ class UnidadDeNegocioList(generics.ListCreateAPIView):
     filter_backends = [filters.OrderingFilter, filters.SearchFilter, drf_filters.DjangoFilterBackend]
     filterset_fields = { 'unidad_de_negocio': ['icontains', 'isnull', 'exact'] }
     search_fields = ['unidad_de_negocio']
+    modelos_etag = [UnidadDeNegocio]
 
-class ClienteProyectoList(generics.ListCreateAPIView):
+class ClienteProyectoList(RespuestaCondicionalMixin, generics.ListCreateAPIView):
     """
     Vista API para listar y crear instancias activas de 'ClienteProyecto'.  
     Solo los usuarios autenticados pueden acceder a esta vista.
@@ -382,8 +394,9 @@ class ClienteProyectoList(generics.ListCreateAPIView):
     filterset_fields = { 'unidad_de_negocio__unidad_de_negocio': ['icontains', 'isnull', 'exact'], 'cliente_proyecto': ['icontains', 'isnull', 'exact'] }
     search_fields = ['unidad_de_negocio__unidad_de_negocio', 'cliente_proyecto']
     queryset = ClienteProyecto.objects.filter(activo=True).order_by('id')
+    modelos_etag = [ClienteProyecto, UnidadDeNegocio]
 
-class ImputacionList(generics.ListCreateAPIView):
+class ImputacionList(RespuestaCondicionalMixin, generics.ListCreateAPIView):
     """
     Vista API para listar y crear instancias de 'Imputacion'.  
     Solo los usuarios autenticados pueden acceder a esta vista.
@@ -394,8 +407,9 @@ class ImputacionList(generics.ListCreateAPIView):
     filter_backends = [filters.OrderingFilter, filters.SearchFilter, drf_filters.DjangoFilterBackend]
     filterset_fields = { 'imputacion': ['icontains', 'isnull', 'exact'] }
     search_fields = ['imputacion']
+    modelos_etag = [Imputacion]
 
-class TipoDocumentoList(generics.ListCreateAPIView):
+class TipoDocumentoList(RespuestaCondicionalMixin, generics.ListCreateAPIView):
     """
     Vista API para listar y crear instancias de 'TiposDocumento'.  
     Solo los usuarios autenticados pueden acceder a esta vista.
@@ -403,6 +417,7 @@ class TipoDocumentoList(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     queryset = TiposDocumento.objects.all().order_by('id')
     serializer_class = TiposDocumentoSerializer
+    modelos_etag = [TiposDocumento]
 
 class RestaurarDocumento(APIView):
     """
@@ -440,59 +455,30 @@ class ExportarDocumentos(APIView):
         try:
             # Aplicar filtros (ajusta según tu modelo)
             queryset = Documento.objects.filter(añomes_imputacion_contable=añomes, archivo__isnull=False, activo=True, receptor__razon_social="Quinto Diseño SRL")
+            nombres = queryset.exclude(archivo='').order_by('id').values_list('archivo', flat=True)
             
-            if not queryset.exists():
+            if not nombres.exists():
                 return Response(
                     {"error": "No se encontraron documentos para el período especificado"}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # Crear ZIP en memoria
-            zip_buffer = BytesIO()
-            files_added = 0
-            errors = []
-            
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for obj in queryset:
-                    if obj.archivo:
-                        try:
-                            if obj.archivo.storage.exists(obj.archivo.name):
-                                # Leer el archivo desde el storage
-                                file_content = obj.archivo.read()
-                                
-                                # Añadir al ZIP
-                                zip_file.writestr(obj.archivo.name, file_content)
-                                files_added += 1
-                                
-                        except Exception as e:
-                            errors.append(f"Error con archivo ID {obj.id}: {str(e)}")
-                            continue
-            
-            if files_added == 0:
+            # Antes de empezar a enviar se verifica que haya al menos un archivo; los faltantes se listan en errores.txt
+            storage = Documento._meta.get_field('archivo').storage
+            if not any(storage.exists(nombre) for nombre in nombres.iterator()):
                 return Response(
                     {"error": "No se encontraron archivos válidos para exportar"}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            zip_buffer.seek(0)
-            
-            # Crear respuesta HTTP con el ZIP
-            response = HttpResponse(
-                zip_buffer.getvalue(),
-                content_type='application/octet-stream'
-            )
-            
             # Nombre del archivo con timestamp
             from django.utils import timezone
             timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
             filename = f"export_{timestamp}.zip"
             
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            response['Content-Length'] = len(zip_buffer.getvalue())
-            response['Content-Transfer-Encoding'] = 'binary'
-            response['Cache-Control'] = 'no-cache'
-            
-            return response
+            # El ZIP se envía a medida que se arma (ver iva.exportacion)
+            archivos = ((storage, nombre) for nombre in nombres.iterator())
+            return respuesta_zip(archivos, filename, anticipar=settings.EXPORTAR_DOCUMENTOS_ANTICIPAR)
             
         except Exception as e:
             return Response(
@@ -0,0 +1,290 @@
+'''
+Tabla de hechos mensual (GastoMensual) para los reportes agregados.
+
+Cada fila suma los registros de un mes de imputación con la misma combinación de dimensiones (caja, cliente/proyecto,
+unidad de negocio, imputación, proveedor, tipo de registro, moneda y activo). Al guardar o eliminar un registro las
+señales restan su aporte anterior y suman el nuevo, así los totales de un reporte se leen de unas pocas filas
+agregadas en lugar de recorrer todos los registros.
+
+Las actualizaciones masivas (queryset.update, bulk_create) no disparan señales: después de ellas hay que llamar a
+sincronizar_hechos con los registros modificados. Sus meses se juntan y se reconstruyen una sola vez al confirmar la
+transacción, aunque se llame muchas veces dentro de un mismo request.
+
+Los reportes leen la tabla solo después de la primera reconstrucción completa (EstadoHechos.construida): hasta
+entonces las filas que cargaron las señales son parciales.
+'''
+import threading
+import weakref
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from tesoreria.cotizaciones import cotizacion_vigente
+from tesoreria.models import Registro
+
+from .models import EstadoHechos, GastoMensual
+from .motor import convertir_a_usd
+
+# Dimensiones de Registro, en el orden en que forman la clave
+DIMENSIONES = [
+    'añomes_imputacion', 'caja_id', 'cliente_proyecto_id', 'unidad_de_negocio_id', 'imputacion_id',
+    'proveedor_id', 'tipo_reg', 'moneda_id', 'activo',
+]
+VALORES = ['monto_gasto_ingreso_neto', 'iva_gasto_ingreso', 'monto_op_rec', 'fecha_reg', 'tipo_de_cambio']
+CAMPOS = DIMENSIONES + VALORES
+MONEDA = DIMENSIONES.index('moneda_id')
+
+# Montos que acumula cada fila de GastoMensual
+MEDIDAS = ['monto_gasto_ingreso_neto', 'iva_gasto_ingreso', 'monto_op_rec', 'total_gasto_ingreso_usd', 'monto_op_rec_usd']
+
+# Columna de totales_por -> valores de GastoMensual que la identifican
+ETIQUETAS = {
+    'añomes_imputacion': ['añomes_imputacion'],
+    'unidad_de_negocio': ['unidad_de_negocio__unidad_de_negocio'],
+    'cliente_proyecto': ['cliente_proyecto__cliente_proyecto'],
+    'proveedor': ['proveedor_id', 'proveedor__razon_social', 'proveedor__nombre_fantasia'],
+    'imputacion': ['imputacion__imputacion'],
+    'caja': ['caja__caja'],
+    'moneda': ['moneda_id'],
+    'tipo_reg': ['tipo_reg'],
+}
+
+CERO = Decimal(0)
+CUATRO_DECIMALES = Decimal('0.0001')
+
+
+def clave(dimensiones) -> str:
+    return '|'.join('' if valor is None else str(valor) for valor in dimensiones)
+
+
+def _decimal(valor) -> Decimal:
+    return CERO if valor is None else valor
+
+
+def aportes(filas: list) -> list[tuple]:
+    '''
+    Calcula el aporte de cada fila (tuplas en el orden de CAMPOS) a la tabla de hechos.
+    Devuelve una lista de (dimensiones, medidas) con las medidas en el orden de MEDIDAS.
+    '''
+    if not filas:
+        return []
+    dimensiones = len(DIMENSIONES)
+    netos = [_decimal(fila[dimensiones]) for fila in filas]
+    ivas = [_decimal(fila[dimensiones + 1]) for fila in filas]
+    ops = [_decimal(fila[dimensiones + 2]) for fila in filas]
+    vigentes = {fecha: cotizacion_vigente(fecha) for fecha in {fila[dimensiones + 3] for fila in filas}}
+
+    # Misma conversión que reportes.motor, sobre arrays
+    moneda = [fila[MONEDA] for fila in filas]
+    tipo_de_cambio = [fila[dimensiones + 4] for fila in filas]
+    cotizacion = [vigentes[fila[dimensiones + 3]] for fila in filas]
+    totales_usd = convertir_a_usd([neto + iva for neto, iva in zip(netos, ivas)], moneda, tipo_de_cambio, cotizacion)
+    ops_usd = convertir_a_usd(ops, moneda, tipo_de_cambio, cotizacion)
+
+    return [
+        (tuple(fila[:dimensiones]), (netos[i], ivas[i], ops[i], totales_usd[i], ops_usd[i]))
+        for i, fila in enumerate(filas)
+    ]
+
+
+def leer_registro(registro_id: int):
+    return Registro.objects.filter(pk=registro_id).values_list(*CAMPOS).first()
+
+
+def _sumar(dimensiones: tuple, medidas: tuple, cantidad: int, signo: int) -> None:
+    fila, _ = GastoMensual.objects.get_or_create(
+        clave=clave(dimensiones), defaults=dict(zip(DIMENSIONES, dimensiones))
+    )
+    cambios = {campo: F(campo) + signo * valor for campo, valor in zip(MEDIDAS, medidas) if valor}
+    if cantidad:
+        cambios['cantidad'] = F('cantidad') + signo * cantidad
+    if cambios:
+        GastoMensual.objects.filter(pk=fila.pk).update(**cambios)
+    if signo < 0:
+        GastoMensual.objects.filter(pk=fila.pk, cantidad__lte=0).delete()
+
+
+@transaction.atomic
+def aplicar_cambio(anterior, actual) -> None:
+    '''
+    Actualiza la tabla de hechos con el cambio de un registro: anterior y actual son sus tuplas de CAMPOS antes y
+    después (None si el registro no existía o se eliminó).
+    '''
+    calculados = aportes([fila for fila in [anterior, actual] if fila is not None])
+    aporte_anterior = calculados.pop(0) if anterior is not None else None
+    aporte_actual = calculados.pop(0) if actual is not None else None
+    if aporte_anterior == aporte_actual:
+        return
+
+    # Si no cambiaron las dimensiones alcanza con sumar la diferencia en la misma fila
+    if aporte_anterior and aporte_actual and aporte_anterior[0] == aporte_actual[0]:
+        diferencia = tuple(nuevo - viejo for nuevo, viejo in zip(aporte_actual[1], aporte_anterior[1]))
+        _sumar(aporte_actual[0], diferencia, 0, 1)
+        return
+    if aporte_anterior:
+        _sumar(*aporte_anterior, 1, -1)
+    if aporte_actual:
+        _sumar(*aporte_actual, 1, 1)
+
+
+@transaction.atomic
+def reconstruir_hechos(meses=None, chunk_size: int = 5000) -> int:
+    '''
+    Reconstruye la tabla de hechos desde los registros, completa o solo para los meses de imputación indicados.
+    Devuelve la cantidad de filas escritas.
+    '''
+    registros = Registro.objects.all()
+    existentes = GastoMensual.objects.all()
+    if meses is not None:
+        meses = list(meses)
+        registros = registros.filter(añomes_imputacion__in=meses)
+        existentes = existentes.filter(añomes_imputacion__in=meses)
+    existentes.delete()
+
+    acumulado = {}
+    iterador = registros.order_by('id').values_list(*CAMPOS).iterator(chunk_size=chunk_size)
+    bloque = []
+    for fila in iterador:
+        bloque.append(fila)
+        if len(bloque) >= chunk_size:
+            _acumular(acumulado, bloque)
+            bloque = []
+    _acumular(acumulado, bloque)
+
+    filas = [
+        GastoMensual(
+            clave=clave(dimensiones), cantidad=cantidad,
+            **dict(zip(DIMENSIONES, dimensiones)), **dict(zip(MEDIDAS, medidas)),
+        )
+        for dimensiones, (cantidad, medidas) in acumulado.items()
+    ]
+    GastoMensual.objects.bulk_create(filas, batch_size=1000)
+    if meses is None:
+        EstadoHechos.objects.update_or_create(pk=1, defaults={'construida': True, 'fecha_construccion': timezone.now()})
+    return len(filas)
+
+
+def _acumular(acumulado: dict, bloque: list) -> None:
+    for dimensiones, medidas in aportes(bloque):
+        cantidad, totales = acumulado.get(dimensiones, (0, (CERO,) * len(MEDIDAS)))
+        acumulado[dimensiones] = (cantidad + 1, tuple(total + valor for total, valor in zip(totales, medidas)))
+
+
+class _MesesPendientes:
+    '''Meses a reconstruir al confirmar la transacción; se registra una sola vez con on_commit.'''
+
+    def __init__(self):
+        self.meses = set()
+
+    def __call__(self):
+        _local.pendientes = None
+        reconstruir_hechos(self.meses)
+
+
+# Reconstrucción pendiente de la transacción en curso de este hilo (las conexiones de Django son por hilo)
+_local = threading.local()
+
+
+def _pendientes() -> _MesesPendientes:
+    # Solo se guarda una referencia débil: el callback lo retiene on_commit, y si la transacción (o el savepoint en el
+    # que se registró) se deshace Django lo descarta, la referencia queda vacía y se registra otro
+    referencia = getattr(_local, 'pendientes', None)
+    pendientes = referencia() if referencia is not None else None
+    if pendientes is None:
+        pendientes = _MesesPendientes()
+        transaction.on_commit(pendientes)
+        _local.pendientes = weakref.ref(pendientes)
+    return pendientes
+
+
+def programar_meses(meses) -> int:
+    '''
+    Agrega los meses a la reconstrucción pendiente de la transacción en curso (fuera de una transacción se
+    reconstruyen enseguida). Devuelve la cantidad de meses agregados.
+    '''
+    meses = set(meses)
+    if not meses:
+        return 0
+    if not transaction.get_connection().in_atomic_block:
+        reconstruir_hechos(meses)
+        return len(meses)
+    _pendientes().meses.update(meses)
+    return len(meses)
+
+
+def sincronizar_hechos(registros) -> int:
+    '''
+    Programa la reconstrucción de los meses de los registros modificados con queryset.update() o bulk_create, que no
+    disparan señales. Recibe un queryset o una lista de ids.
+    '''
+    if not hasattr(registros, 'values_list'):
+        registros = Registro.objects.filter(id__in=registros)
+    return programar_meses(registros.values_list('añomes_imputacion', flat=True).distinct())
+
+
+def reconstruir_desde_fecha(fecha) -> int:
+    '''
+    Programa la reconstrucción de los meses con registros desde la fecha: se usa al cambiar una cotización, que cambia
+    los montos en USD.
+    '''
+    if isinstance(fecha, str):
+        fecha = date.fromisoformat(fecha[:10])
+    return programar_meses(Registro.objects.filter(fecha_reg__gte=fecha).values_list('añomes_imputacion', flat=True).distinct())
+
+
+def hechos_disponibles() -> bool:
+    '''
+    Indica si la tabla de hechos está completa. Hasta que reconstruir_hechos reconstruye toda la tabla por primera vez
+    los reportes siguen calculando sobre Registro.
+    '''
+    return EstadoHechos.objects.filter(pk=1, construida=True).exists()
+
+
+def _nombre_proveedor(proveedor_id, razon_social, nombre_fantasia):
+    # Igual que Persona.nombre
+    if proveedor_id is None:
+        return None
+    return razon_social or nombre_fantasia or 'Sin nombre'
+
+
+def totales_por(hechos, campo: str) -> list[dict]:
+    '''
+    Mismo resultado que reportes.motor.totales_por, pero leyendo las filas ya agregadas de GastoMensual.
+    hechos es un queryset de GastoMensual con los filtros del reporte.
+    '''
+    if campo not in ETIQUETAS:
+        raise ValueError(f'No se puede agrupar por {campo}')
+    consulta = hechos.values(*ETIQUETAS[campo]).annotate(
+        total_cantidad=Sum('cantidad'), **{f'total_{medida}': Sum(medida) for medida in MEDIDAS}
+    ).order_by()
+
+    # Varias claves de la base pueden tener la misma etiqueta (p. ej. dos proveedores con el mismo nombre)
+    grupos = {}
+    for fila in consulta:
+        valores = [fila[lookup] for lookup in ETIQUETAS[campo]]
+        etiqueta = _nombre_proveedor(*valores) if campo == 'proveedor' else valores[0]
+        grupo = grupos.setdefault(etiqueta, {'cantidad': 0, **{medida: CERO for medida in MEDIDAS}})
+        grupo['cantidad'] += fila['total_cantidad'] or 0
+        for medida in MEDIDAS:
+            # SQLite suma los decimales en punto flotante, se vuelven a llevar a 4 decimales
+            grupo[medida] += (fila[f'total_{medida}'] or CERO).quantize(CUATRO_DECIMALES)
+
+    # Sumas exactas, como Decimal igual que reportes.motor
+    filas = [
+        {
+            campo: etiqueta,
+            'cantidad': grupo['cantidad'],
+            'monto_gasto_ingreso_neto': grupo['monto_gasto_ingreso_neto'],
+            'iva_gasto_ingreso': grupo['iva_gasto_ingreso'],
+            'total_gasto_ingreso': grupo['monto_gasto_ingreso_neto'] + grupo['iva_gasto_ingreso'],
+            'monto_op_rec': grupo['monto_op_rec'],
+            'total_gasto_ingreso_usd': grupo['total_gasto_ingreso_usd'],
+            'monto_op_rec_usd': grupo['monto_op_rec_usd'],
+        }
+        for etiqueta, grupo in grupos.items()
+    ]
+    filas.sort(key=lambda fila: (fila[campo] is None, fila[campo] if fila[campo] is not None else 0))
+    return filas
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from reportes.hechos import reconstruir_hechos
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye la tabla de hechos mensual (GastoMensual) desde los registros'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mes', type=int, action='append', help='Mes de imputación a reconstruir (AAAAMM), se puede repetir. Por defecto reconstruye todo')
+
+    def handle(self, *args, **options):
+        filas = reconstruir_hechos(options.get('mes'))
+        self.stdout.write(self.style.SUCCESS(f'{filas} filas escritas en la tabla de hechos'))
@@ -0,0 +1,92 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand, CommandError
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántos segundos se liberan trabajos colgados y se borran resultados vencidos
+INTERVALO_MANTENIMIENTO = 60
+
+
+def inicializar_proceso():
+    # Los procesos del pool arrancan con spawn, así que cada uno inicializa Django por su cuenta
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gestion.settings')
+    django.setup()
+
+
+def procesar_trabajo(trabajo_id: int, token: str) -> int | None:
+    from reportes.trabajos import ejecutar_trabajo
+    return ejecutar_trabajo(trabajo_id, token)
+
+
+class Command(BaseCommand):
+    help = 'Procesa la cola de trabajos de reportes (TrabajoReporte) con un pool de procesos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=2, help='Cantidad de trabajos que se ejecutan en paralelo')
+        parser.add_argument('--intervalo', type=float, default=2.0, help='Segundos entre consultas a la cola cuando no hay trabajos')
+        parser.add_argument('--una-vez', action='store_true', help='Procesa los trabajos pendientes y termina')
+
+    def handle(self, *args, **options):
+        from reportes.trabajos import tomar_trabajo, liberar_colgados, limpiar_vencidos, devolver_a_la_cola
+        from tesoreria.pdfs import limpiar_cache
+
+        procesos = max(1, options['procesos'])
+        self.stdout.write(f'Procesando trabajos de reportes con {procesos} procesos')
+
+        # spawn en lugar de fork: los procesos hijos no heredan las conexiones abiertas a la base de datos
+        contexto = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto, initializer=inicializar_proceso) as pool:
+            en_curso = {}
+            ultimo_mantenimiento = 0.0
+            try:
+                while True:
+                    if time.monotonic() - ultimo_mantenimiento > INTERVALO_MANTENIMIENTO:
+                        liberados = liberar_colgados()
+                        expirados = limpiar_vencidos()
+                        pdfs_borrados = limpiar_cache()
+                        if liberados or expirados or pdfs_borrados:
+                            self.stdout.write(f'{liberados} trabajos liberados, {expirados} resultados vencidos borrados, '
+                                              f'{pdfs_borrados} PDFs sin uso borrados de la caché')
+                        ultimo_mantenimiento = time.monotonic()
+
+                    for futuro, (trabajo_id, _) in list(en_curso.items()):
+                        if futuro.done():
+                            if isinstance(futuro.exception(), BrokenProcessPool):
+                                raise futuro.exception()
+                            del en_curso[futuro]
+                            if futuro.exception():
+                                logger.error('El trabajo %s terminó con error: %s', trabajo_id, futuro.exception())
+                            else:
+                                self.stdout.write(f'Trabajo {trabajo_id} procesado')
+
+                    tomados = False
+                    while len(en_curso) < procesos:
+                        tomado = tomar_trabajo()
+                        if not tomado:
+                            break
+                        try:
+                            en_curso[pool.submit(procesar_trabajo, *tomado)] = tomado
+                        except BrokenProcessPool:
+                            devolver_a_la_cola([tomado])
+                            raise
+                        tomados = True
+
+                    if options['una_vez'] and not en_curso and not tomados:
+                        break
+                    if not tomados:
+                        time.sleep(options['intervalo'])
+            except KeyboardInterrupt:
+                self.stdout.write('Esperando a que terminen los trabajos en curso...')
+            except BrokenProcessPool:
+                # Se cayó un proceso del pool (p. ej. por falta de memoria): los trabajos en curso vuelven a la cola
+                devolver_a_la_cola(list(en_curso.values()))
+                raise CommandError('Se detuvo un proceso del pool, los trabajos en curso volvieron a la cola')
+
+        self.stdout.write(self.style.SUCCESS('Workers detenidos'))
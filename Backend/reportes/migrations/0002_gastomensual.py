@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iva', '0001_initial'),
+        ('reportes', '0001_initial'),
+        ('shared', '0001_initial'),
+        ('tesoreria', '0007_cotizaciondiaria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GastoMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=200, unique=True)),
+                ('añomes_imputacion', models.IntegerField()),
+                ('tipo_reg', models.CharField(max_length=5)),
+                ('activo', models.BooleanField(default=True)),
+                ('cantidad', models.IntegerField(default=0)),
+                ('monto_gasto_ingreso_neto', models.DecimalField(decimal_places=4, default=0, max_digits=24)),
+                ('iva_gasto_ingreso', models.DecimalField(decimal_places=4, default=0, max_digits=24)),
+                ('monto_op_rec', models.DecimalField(decimal_places=4, default=0, max_digits=24)),
+                ('total_gasto_ingreso_usd', models.DecimalField(decimal_places=4, default=0, max_digits=24)),
+                ('monto_op_rec_usd', models.DecimalField(decimal_places=4, default=0, max_digits=24)),
+                ('caja', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='tesoreria.caja')),
+                ('cliente_proyecto', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='iva.clienteproyecto')),
+                ('imputacion', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='iva.imputacion')),
+                ('moneda', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='shared.moneda')),
+                ('proveedor', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='iva.persona')),
+                ('unidad_de_negocio', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='iva.unidaddenegocio')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['añomes_imputacion'], name='gastomensual_anomes_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:22
+
+from django.db import migrations, models
+
+
+def crear_estado(apps, schema_editor):
+    # Sin registros la tabla de hechos vacía ya está completa; si hay, queda sin construir hasta correr reconstruir_hechos
+    Registro = apps.get_model('tesoreria', 'Registro')
+    EstadoHechos = apps.get_model('reportes', 'EstadoHechos')
+    EstadoHechos.objects.create(pk=1, construida=not Registro.objects.exists())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0002_gastomensual'),
+        ('tesoreria', '0007_cotizaciondiaria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoHechos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('construida', models.BooleanField(default=False)),
+                ('fecha_construccion', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(crear_estado, migrations.RunPython.noop),
+    ]
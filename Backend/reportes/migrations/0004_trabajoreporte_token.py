@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0003_estadohechos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajoreporte',
+            name='token',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -1,3 +1,89 @@
 from django.db import models
 
-# Create your models here.
+
+class TrabajoReporte(models.Model):
+    '''
+    Trabajo en segundo plano para exportaciones y reportes pesados.
+    Los crea el endpoint trabajos/ y los procesa el comando run_workers, ver reportes.trabajos.
+    '''
+    PENDIENTE = 1
+    EN_PROCESO = 2
+    TERMINADO = 3
+    ERROR = 4
+    EXPIRADO = 5
+    ESTADO_CHOICES = [
+        (PENDIENTE, "Pendiente"),
+        (EN_PROCESO, "En proceso"),
+        (TERMINADO, "Terminado"),
+        (ERROR, "Error"),
+        (EXPIRADO, "Expirado"),
+    ]
+
+    tipo = models.CharField(max_length=50)
+    parametros = models.JSONField(default=dict, blank=True)
+    usuario = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='trabajos_reporte')
+    estado = models.IntegerField(choices=ESTADO_CHOICES, default=PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    token = models.CharField(max_length=32, blank=True, default='') # Toma del worker que lo está ejecutando
+    error = models.TextField(blank=True, default='')
+    archivo = models.CharField(max_length=255, blank=True, default='') # Ruta relativa a REPORTES_RESULTADOS_DIR
+    nombre_archivo = models.CharField(max_length=255, blank=True, default='')
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+    expira = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', 'creado'], name='trabajoreporte_estado_idx'),
+        ]
+
+    def __str__(self):
+        return f"Trabajo {self.pk} - {self.tipo} - {self.get_estado_display()}"
+
+
+class GastoMensual(models.Model):
+    '''
+    Tabla de hechos pre-agregada: montos y cantidad de registros por mes de imputación y cada combinación de
+    caja, cliente/proyecto, unidad de negocio, imputación, proveedor, tipo de registro, moneda y estado.
+    Los montos están en la moneda del registro (la moneda es una de las dimensiones) y también convertidos a USD.
+    Se mantiene con deltas desde las señales de Registro, ver reportes.hechos.
+    '''
+    clave = models.CharField(max_length=200, unique=True) # Dimensiones concatenadas, ver reportes.hechos.clave
+    añomes_imputacion = models.IntegerField()
+    # Sin restricción en la base: es una tabla derivada y no debe impedir borrar los datos de referencia
+    caja = models.ForeignKey('tesoreria.Caja', on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    cliente_proyecto = models.ForeignKey('iva.ClienteProyecto', on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    unidad_de_negocio = models.ForeignKey('iva.UnidadDeNegocio', on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    imputacion = models.ForeignKey('iva.Imputacion', on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    proveedor = models.ForeignKey('iva.Persona', on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    tipo_reg = models.CharField(max_length=5)
+    moneda = models.ForeignKey('shared.Moneda', on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    activo = models.BooleanField(default=True)
+    cantidad = models.IntegerField(default=0)
+    monto_gasto_ingreso_neto = models.DecimalField(decimal_places=4, max_digits=24, default=0)
+    iva_gasto_ingreso = models.DecimalField(decimal_places=4, max_digits=24, default=0)
+    monto_op_rec = models.DecimalField(decimal_places=4, max_digits=24, default=0)
+    total_gasto_ingreso_usd = models.DecimalField(decimal_places=4, max_digits=24, default=0)
+    monto_op_rec_usd = models.DecimalField(decimal_places=4, max_digits=24, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['añomes_imputacion'], name='gastomensual_anomes_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.añomes_imputacion} - {self.clave} - {self.cantidad}"
+
+
+class EstadoHechos(models.Model):
+    '''
+    Fila única que indica si GastoMensual está completa. La marca reconstruir_hechos cuando reconstruye toda la tabla;
+    hasta entonces los reportes calculan sobre Registro aunque las señales ya hayan cargado algunas filas.
+    '''
+    construida = models.BooleanField(default=False)
+    fecha_construccion = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Tabla de hechos {'construida' if self.construida else 'sin construir'}"
@@ -0,0 +1,212 @@
+'''
+Motor de reportes de registros sobre arrays (pandas/NumPy).
+
+En lugar de serializar cada Registro con RegistroListSerializer, se leen solo las columnas necesarias con values_list
+(los nombres de las relaciones vienen en la misma consulta) y los cálculos se hacen por columna: total, conversión a
+USD con la cotización MEP vigente, formato de fecha y totales agrupados.
+
+Las filas tienen las mismas columnas que la salida de RegistroListSerializer que usaban los reportes, con la fecha como
+dd/mm/aaaa y saldo_acumulado solo si el queryset viene anotado con él. Los montos, los montos en USD (a 4 decimales) y
+el tipo de cambio (a 2) se entregan como Decimal, y los totales agrupados son sumas exactas de esos Decimal. La moneda
+se compara por id (MONEDA_ARS, MONEDA_USD), igual que tesoreria.serializers.monto_en_usd.
+'''
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from tesoreria.cotizaciones import cotizacion_vigente
+from tesoreria.models import Presupuesto
+
+# Clave de salida -> lookup de values_list (None si se calcula en el motor)
+COLUMNAS = {
+    'id': 'id',
+    'tipo_reg': 'tipo_reg',
+    'caja': 'caja__caja',
+    'certificado': 'certificado_id',
+    'documento': None,
+    'fecha_reg': 'fecha_reg',
+    'añomes_imputacion': 'añomes_imputacion',
+    'unidad_de_negocio': 'unidad_de_negocio__unidad_de_negocio',
+    'cliente_proyecto': 'cliente_proyecto__cliente_proyecto',
+    'proveedor': None,
+    'caja_contrapartida': 'caja_contrapartida__caja',
+    'imputacion': 'imputacion__imputacion',
+    'presupuesto': None,
+    'observacion': 'observacion',
+    'monto_gasto_ingreso_neto': 'monto_gasto_ingreso_neto',
+    'iva_gasto_ingreso': 'iva_gasto_ingreso',
+    'total_gasto_ingreso': None,
+    'total_gasto_ingreso_usd': None,
+    'monto_op_rec': 'monto_op_rec',
+    'monto_op_rec_usd': None,
+    'moneda': 'moneda_id',
+    'tipo_de_cambio': 'tipo_de_cambio',
+    'realizado': 'realizado',
+    'saldo_acumulado': 'saldo_acumulado',
+    'dolar_mep_value': None,
+}
+
+# Columnas que el serializer solo incluye si el queryset viene anotado con ellas
+ANOTACIONES = ['saldo_acumulado']
+
+# Columnas auxiliares que se leen para calcular las de salida
+AUXILIARES = ['proveedor_id', 'proveedor__razon_social', 'proveedor__nombre_fantasia', 'presupuesto_id']
+
+CAMPOS = [lookup for lookup in COLUMNAS.values() if lookup and lookup not in ANOTACIONES] + AUXILIARES
+
+# Columnas por las que se pueden pedir totales (?agrupar=)
+AGRUPABLES = ['añomes_imputacion', 'unidad_de_negocio', 'cliente_proyecto', 'proveedor', 'imputacion', 'caja', 'moneda', 'tipo_reg']
+
+MONTOS = ['monto_gasto_ingreso_neto', 'iva_gasto_ingreso', 'total_gasto_ingreso', 'monto_op_rec']
+MONTOS_USD = ['total_gasto_ingreso_usd', 'monto_op_rec_usd']
+
+MONEDA_ARS = 1
+MONEDA_USD = 2
+
+CERO = Decimal('0.0000')
+UNO = Decimal(1)
+DOS_DECIMALES = Decimal('0.01')
+CUATRO_DECIMALES = Decimal('0.0001')
+
+
+def campos(registros) -> list:
+    '''CAMPOS más las columnas de ANOTACIONES con las que viene anotado el queryset de registros.'''
+    return CAMPOS + [anotacion for anotacion in ANOTACIONES if anotacion in registros.query.annotations]
+
+
+def leer_registros(registros) -> list:
+    '''Devuelve las tuplas (en el orden de campos(registros)) del queryset de registros, en una sola consulta.'''
+    return list(registros.values_list(*campos(registros)))
+
+
+def _decimales(serie: pd.Series) -> pd.Series:
+    return serie.map(lambda valor: CERO if valor is None else valor).astype(object)
+
+
+def _a_float(serie: pd.Series) -> np.ndarray:
+    return np.array([np.nan if valor is None else float(valor) for valor in serie], dtype=float)
+
+
+def _presupuestos(ids) -> dict:
+    # El nombre del presupuesto es su __str__, igual que el StringRelatedField del serializer
+    ids = [int(presupuesto_id) for presupuesto_id in ids if not pd.isna(presupuesto_id)]
+    if not ids:
+        return {}
+    presupuestos = Presupuesto.objects.filter(id__in=ids).select_related('cliente_proyecto', 'proveedor')
+    return {presupuesto.id: str(presupuesto) for presupuesto in presupuestos}
+
+
+def _cotizaciones(fechas: pd.Series) -> pd.Series:
+    # Una búsqueda en la caché de cotizaciones por fecha distinta, no por fila
+    vigentes = {fecha: cotizacion_vigente(fecha) for fecha in fechas.dropna().unique()}
+    cotizaciones = fechas.map(vigentes).astype(object)
+    return cotizaciones.where(cotizaciones.notna(), None)
+
+
+def convertir_a_usd(valores, moneda, tipo_de_cambio, cotizacion) -> np.ndarray:
+    '''
+    Convierte los montos (Decimal) a USD con la misma regla que tesoreria.serializers.monto_en_usd: los registros en
+    USD se dividen por su tipo de cambio (o por la cotización MEP si no tienen), los registros en ARS por la cotización
+    MEP y los de otras monedas quedan en 0. moneda son los ids de las monedas; tipo_de_cambio y cotizacion, Decimal o
+    None. Las condiciones se evalúan sobre arrays y la división se hace en Decimal, redondeada a 4 decimales.
+    '''
+    valores = np.asarray(valores, dtype=object)
+    moneda = np.asarray(moneda, dtype=object)
+    tipo_de_cambio = np.asarray(tipo_de_cambio, dtype=object)
+    cotizacion = np.asarray(cotizacion, dtype=object)
+    tc = _a_float(tipo_de_cambio)
+    mep = _a_float(cotizacion)
+
+    usd = moneda == MONEDA_USD
+    por_tipo_de_cambio = usd & (tc > 1)
+    por_cotizacion = (usd & ~por_tipo_de_cambio & (mep > 1)) | (moneda == MONEDA_ARS)
+    # Sin cotización (o en 0) los registros en ARS se dividen por 1, como en monto_en_usd
+    divisor = np.where(por_tipo_de_cambio, tipo_de_cambio, np.where(np.isnan(mep) | (mep == 0), UNO, cotizacion))
+
+    convertir = (por_tipo_de_cambio | por_cotizacion) & (_a_float(valores) != 0)
+    resultado = np.full(len(valores), CERO, dtype=object)
+    if convertir.any():
+        resultado[convertir] = [valor.quantize(CUATRO_DECIMALES) for valor in valores[convertir] / divisor[convertir]]
+    return resultado
+
+
+def calcular(tuplas: list, columnas: list = CAMPOS) -> pd.DataFrame:
+    '''
+    Arma el DataFrame del reporte a partir de las tuplas de leer_registros (con sus columnas, ver campos), con todas
+    las columnas de COLUMNAS. Los montos, los montos en USD y el tipo de cambio quedan como Decimal.
+    '''
+    # dtype object conserva los ids enteros aunque haya nulos (pandas los pasaría a float)
+    df = pd.DataFrame(tuplas, columns=columnas, dtype=object)
+    df = df.rename(columns={lookup: clave for clave, lookup in COLUMNAS.items() if lookup})
+    df = df.where(df.notna(), None)
+
+    for campo in ['monto_gasto_ingreso_neto', 'iva_gasto_ingreso', 'monto_op_rec']:
+        df[campo] = _decimales(df[campo])
+    # Suma exacta de Decimales, elemento a elemento en el array de objetos
+    df['total_gasto_ingreso'] = (df['monto_gasto_ingreso_neto'].to_numpy() + df['iva_gasto_ingreso'].to_numpy()).tolist()
+
+    cotizacion = _cotizaciones(df['fecha_reg'])
+    moneda = df['moneda'].to_numpy()
+    tipo_de_cambio = df['tipo_de_cambio'].to_numpy()
+    df['total_gasto_ingreso_usd'] = convertir_a_usd(df['total_gasto_ingreso'].to_numpy(), moneda, tipo_de_cambio, cotizacion.to_numpy()).tolist()
+    df['monto_op_rec_usd'] = convertir_a_usd(df['monto_op_rec'].to_numpy(), moneda, tipo_de_cambio, cotizacion.to_numpy()).tolist()
+
+    # Los reportes muestran el tipo de cambio con 2 decimales, como el DecimalField del serializer
+    df['tipo_de_cambio'] = df['tipo_de_cambio'].map(
+        lambda valor: Decimal('0.00') if valor is None else valor.quantize(DOS_DECIMALES)
+    )
+    if 'saldo_acumulado' in df:
+        # Igual que el DecimalField del serializer: texto con 2 decimales
+        df['saldo_acumulado'] = df['saldo_acumulado'].map(
+            lambda valor: None if valor is None else str(Decimal(valor).quantize(DOS_DECIMALES))
+        )
+    df['dolar_mep_value'] = cotizacion.map(
+        lambda valor: str(Decimal(valor or 0).quantize(DOS_DECIMALES))
+    )
+
+    # Proveedor: razón social, nombre de fantasía o "Sin nombre" (Persona.nombre); None si el registro no tiene
+    nombre = df['proveedor__razon_social'].replace('', None)
+    nombre = nombre.fillna(df['proveedor__nombre_fantasia'].replace('', None)).fillna('Sin nombre')
+    df['proveedor'] = nombre.where(df['proveedor_id'].notna(), None)
+    df['presupuesto'] = df['presupuesto_id'].map(_presupuestos(df['presupuesto_id'].unique())).astype(object)
+    df['presupuesto'] = df['presupuesto'].where(df['presupuesto'].notna(), None)
+
+    fechas = pd.to_datetime(df['fecha_reg']).dt.strftime('%d/%m/%Y')
+    df['fecha_reg'] = fechas.where(fechas.notna(), None)
+    df['documento'] = ''
+    return df[[clave for clave in COLUMNAS if clave in df]].copy()
+
+
+def procesar(tuplas: list, columnas: list = CAMPOS) -> list[dict]:
+    '''Convierte las tuplas de leer_registros en las filas del reporte.'''
+    if not tuplas:
+        return []
+    return calcular(tuplas, columnas).to_dict('records')
+
+
+def reporte_registros(registros) -> list[dict]:
+    '''Filas del reporte de gastos para el queryset de registros (ver GastoPorEntidad).'''
+    return procesar(leer_registros(registros), campos(registros))
+
+
+def totales_por(registros, campo: str) -> list[dict]:
+    '''
+    Totales del reporte agrupados por una de las columnas de AGRUPABLES: cantidad de registros, montos y montos en USD
+    (sumas exactas de Decimal). Ordenado por el valor de la columna.
+    '''
+    if campo not in AGRUPABLES:
+        raise ValueError(f'No se puede agrupar por {campo}')
+    tuplas = list(registros.values_list(*CAMPOS))
+    if not tuplas:
+        return []
+    df = calcular(tuplas)
+    grupos = df.groupby(campo, sort=False, dropna=False)
+    totales = grupos[MONTOS + MONTOS_USD].agg(lambda serie: serie.to_numpy().sum())
+    totales.insert(0, 'cantidad', grupos.size())
+    filas = totales.reset_index().to_dict('records')
+    for fila in filas:
+        fila[campo] = None if pd.isna(fila[campo]) else fila[campo]
+        fila['cantidad'] = int(fila['cantidad'])
+    filas.sort(key=lambda fila: (fila[campo] is None, fila[campo] if fila[campo] is not None else 0))
+    return filas
@@ -0,0 +1,14 @@
+from rest_framework import serializers
+from .models import TrabajoReporte
+from .trabajos import TIPOS_TRABAJO
+
+
+class TrabajoReporteSerializer(serializers.ModelSerializer):
+    estado_display = serializers.CharField(source='get_estado_display', read_only=True)
+    tipo = serializers.ChoiceField(choices=list(TIPOS_TRABAJO))
+
+    class Meta:
+        model = TrabajoReporte
+        fields = ["id", "tipo", "parametros", "estado", "estado_display", "intentos", "error", "nombre_archivo",
+                  "creado", "iniciado", "terminado", "expira"]
+        read_only_fields = ["estado", "intentos", "error", "nombre_archivo", "creado", "iniciado", "terminado", "expira"]
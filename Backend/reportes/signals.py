@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete
+from django.dispatch import receiver
+from tesoreria.models import Registro, DolarMEP
+from tesoreria.cotizaciones import invalidar_cache
+from reportes.hechos import aplicar_cambio, leer_registro, reconstruir_desde_fecha
+
+@receiver(pre_save, sender=Registro)
+def guardar_hecho_anterior(sender, instance, raw=False, **kwargs):
+    """
+    Guarda los valores del registro antes de modificarlo, para restar su aporte anterior de la tabla de hechos.
+    """
+    instance._hecho_anterior = leer_registro(instance.pk) if instance.pk and not raw else None
+
+@receiver(post_save, sender=Registro)
+def actualizar_gasto_mensual(sender, instance, raw=False, **kwargs):
+    """
+    Mantiene la tabla de hechos mensual (GastoMensual) cada vez que se guarda un registro (ver reportes.hechos).
+    """
+    if raw:
+        return
+    aplicar_cambio(getattr(instance, '_hecho_anterior', None), leer_registro(instance.pk))
+
+@receiver(pre_delete, sender=Registro)
+def descontar_gasto_mensual(sender, instance, **kwargs):
+    """
+    Resta el aporte del registro de la tabla de hechos antes de eliminarlo.
+    """
+    aplicar_cambio(leer_registro(instance.pk), None)
+
+@receiver(post_save, sender=DolarMEP)
+@receiver(post_delete, sender=DolarMEP)
+def recalcular_gasto_mensual_usd(sender, instance, raw=False, **kwargs):
+    """
+    Al cambiar una cotización cambian los montos en USD de los registros desde esa fecha. Se recalcula al confirmar
+    la transacción, cuando el calendario de cotizaciones ya está actualizado.
+    """
+    if raw:
+        return
+    fechas = [str(instance.fecha)[:10]]
+    if getattr(instance, '_fecha_anterior', None):
+        fechas.append(str(instance._fecha_anterior))
+    desde = min(fechas)
+
+    def recalcular():
+        invalidar_cache()
+        reconstruir_desde_fecha(desde)
+
+    transaction.on_commit(recalcular)
@@ -1,3 +1,134 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from iva.models import Persona
+from reportes import hechos, motor, trabajos
+from reportes.models import GastoMensual, TrabajoReporte
+from shared.models import Moneda
+from tesoreria.cotizaciones import invalidar_cache
+from tesoreria.models import Caja, DolarMEP, Registro
+
+
+class TrabajosTests(TestCase):
+    def setUp(self):
+        self.resultados = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.resultados, ignore_errors=True)
+        ajustes = override_settings(REPORTES_RESULTADOS_DIR=self.resultados)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        moneda = Moneda.objects.create(nombre='ARS')
+        caja = Caja.objects.create(caja='Banco', moneda=moneda)
+        proveedor = Persona.objects.create(razon_social='Proveedor', cnpj='123', cbu_alias='alias.proveedor')
+        self.op = Registro.objects.create(
+            tipo_reg='OP', caja=caja, fecha_reg=date(2024, 3, 5), añomes_imputacion=202403, proveedor=proveedor,
+            moneda=moneda, monto_op_rec=-10,
+        )
+
+    def encolar(self):
+        return trabajos.encolar('transferencia_masiva', {'op': str(self.op.id), 'formato': 'csv'}, self.usuario)
+
+    def test_ejecuta_la_vista_con_los_parametros_del_trabajo(self):
+        trabajo = self.encolar()
+        self.assertEqual(trabajos.ejecutar_trabajo(*trabajos.tomar_trabajo()), TrabajoReporte.TERMINADO)
+
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.nombre_archivo, 'transferencia_masiva.csv')
+        with open(trabajos.ruta_resultado(trabajo), encoding='utf-8-sig') as archivo:
+            self.assertIn('123,alias.proveedor,Proveedor,10.00', archivo.read())
+
+    def test_descarta_el_resultado_de_un_worker_colgado(self):
+        trabajo = self.encolar()
+        colgado = trabajos.tomar_trabajo()
+        TrabajoReporte.objects.update(iniciado=timezone.now() - trabajos.TIEMPO_MAXIMO - timedelta(minutes=1))
+        self.assertEqual(trabajos.liberar_colgados(), 1)
+
+        # Otro worker lo toma y lo termina; el colgado termina después y no puede pisar el resultado
+        nuevo = trabajos.tomar_trabajo()
+        self.assertEqual(trabajos.ejecutar_trabajo(*nuevo), TrabajoReporte.TERMINADO)
+        self.assertIsNone(trabajos.ejecutar_trabajo(*colgado))
+        self.assertEqual(trabajos.devolver_a_la_cola([colgado]), 0)
+
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, TrabajoReporte.TERMINADO)
+        self.assertEqual(os.path.dirname(trabajo.archivo), os.path.join(str(trabajo.pk), nuevo[1]))
+        self.assertEqual(os.listdir(os.path.join(self.resultados, str(trabajo.pk))), [nuevo[1]])
+
+
+class RegistrosTestCase(TestCase):
+    def setUp(self):
+        ars = Moneda.objects.create(pk=motor.MONEDA_ARS, nombre='ARS')
+        usd = Moneda.objects.create(pk=motor.MONEDA_USD, nombre='USD')
+        self.caja = Caja.objects.create(caja='Banco', moneda=ars)
+        self.proveedor = Persona.objects.create(razon_social='Proveedor')
+        DolarMEP.objects.create(fecha=date(2024, 3, 1), compra=Decimal('1000'), venta=Decimal('1010'))
+        # La caché de cotizaciones se invalida al confirmar, y TestCase nunca confirma
+        invalidar_cache()
+        self.addCleanup(invalidar_cache)
+        self.monedas = {'ARS': ars, 'USD': usd}
+
+    def registro(self, moneda, neto, tipo_de_cambio=None):
+        return Registro.objects.create(
+            tipo_reg='FC', caja=self.caja, fecha_reg=date(2024, 3, 5), añomes_imputacion=202403, proveedor=self.proveedor,
+            moneda=self.monedas[moneda], tipo_de_cambio=tipo_de_cambio, monto_gasto_ingreso_neto=neto,
+            iva_gasto_ingreso=Decimal('0.5'),
+        )
+
+class MotorTests(RegistrosTestCase):
+    def test_convierte_a_usd_segun_la_moneda(self):
+        self.registro('ARS', Decimal('1999.5'))
+        self.registro('USD', Decimal('2399.5'), tipo_de_cambio=Decimal('1200'))
+        self.registro('USD', Decimal('99.5'), tipo_de_cambio=Decimal('1'))
+
+        filas = motor.reporte_registros(Registro.objects.order_by('id'))
+        # ARS por la cotización MEP, USD por su tipo de cambio o, si es 1, por la cotización MEP
+        self.assertEqual([fila['total_gasto_ingreso_usd'] for fila in filas], [Decimal('2'), Decimal('2'), Decimal('0.1')])
+        self.assertEqual(filas[0]['total_gasto_ingreso'], Decimal('2000.0000'))
+
+        totales = motor.totales_por(Registro.objects.all(), 'moneda')
+        self.assertEqual([(fila['moneda'], fila['total_gasto_ingreso_usd']) for fila in totales], [(1, Decimal('2')), (2, Decimal('2.1'))])
+
+
+class HechosTests(RegistrosTestCase):
+    def test_los_totales_en_usd_coinciden_con_el_motor(self):
+        self.registro('ARS', Decimal('1999.5'))
+        self.registro('USD', Decimal('2399.5'), tipo_de_cambio=Decimal('1200'))
+        self.registro('USD', Decimal('99.5'), tipo_de_cambio=Decimal('1'))
+        self.assertEqual(
+            hechos.totales_por(GastoMensual.objects.all(), 'moneda'), motor.totales_por(Registro.objects.all(), 'moneda')
+        )
+
+        # Un cambio de cotización recalcula los montos en USD al confirmar la transacción
+        with self.captureOnCommitCallbacks(execute=True):
+            DolarMEP.objects.filter(fecha=date(2024, 3, 1)).first().delete()
+            DolarMEP.objects.create(fecha=date(2024, 3, 1), compra=Decimal('500'), venta=Decimal('510'))
+        totales = hechos.totales_por(GastoMensual.objects.all(), 'moneda')
+        self.assertEqual([fila['total_gasto_ingreso_usd'] for fila in totales], [Decimal('4'), Decimal('2.2')])
+
+    def test_reconstruye_los_meses_una_vez_por_transaccion(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            hechos.programar_meses([202403])
+            hechos.programar_meses([202404])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(callbacks[0].meses, {202403, 202404})
+        callbacks[0]()
+
+        # Si se deshace el savepoint en el que se registró, los meses siguientes van a un callback nuevo
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    hechos.programar_meses([202403])
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            hechos.programar_meses([202404])
+        self.assertEqual([callback.meses for callback in callbacks], [{202404}])
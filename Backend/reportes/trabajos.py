@@ -0,0 +1,217 @@
+'''
+Cola de trabajos en segundo plano para exportaciones pesadas.
+
+Un trabajo guarda el tipo de exportación, sus parámetros y el usuario que la pidió. El comando run_workers toma los
+trabajos pendientes y los ejecuta en un pool de procesos: cada tipo corre la misma vista que el endpoint sincrónico
+(con el usuario del trabajo), y el archivo que devuelve se guarda en REPORTES_RESULTADOS_DIR hasta que expira.
+Así las exportaciones largas no ocupan los workers de gunicorn.
+'''
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import uuid
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import F
+from django.core.handlers.wsgi import WSGIRequest
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import TrabajoReporte
+
+logger = logging.getLogger(__name__)
+
+# Tipos de trabajo habilitados: vista que lo resuelve, método HTTP y parámetros fijos
+TIPOS_TRABAJO = {
+    'db_total': {'vista': 'reportes.views.DB_Total', 'metodo': 'get', 'parametros': {'stream': 'xlsx'}},
+    'gastos_por_obra': {'vista': 'reportes.views.GastoPorObra', 'metodo': 'get', 'parametros': {'export': 'true'}},
+    'gastos_por_unidad': {'vista': 'reportes.views.GastoPorUnidad', 'metodo': 'get', 'parametros': {'export': 'true'}},
+    'gastos_por_proveedor': {'vista': 'reportes.views.GastoPorProveedor', 'metodo': 'get', 'parametros': {'export': 'true'}},
+    'gastos_por_casa': {'vista': 'reportes.views.GastosPorCasa', 'metodo': 'get', 'parametros': {'export': 'true'}},
+    'exportar_documentos': {'vista': 'iva.views.ExportarDocumentos', 'metodo': 'post', 'parametros': {}},
+    'transferencia_masiva': {'vista': 'tesoreria.views.pagos.TransferenciaMasivaPorArchivo', 'metodo': 'get', 'parametros': {}},
+}
+
+# Reintentos ante errores inesperados (los errores de validación de la vista no se reintentan)
+MAX_INTENTOS = 3
+
+# Un trabajo en proceso durante más de este tiempo se considera colgado (p. ej. se cayó el worker)
+TIEMPO_MAXIMO = timedelta(minutes=60)
+
+
+class ErrorTrabajo(Exception):
+    '''Error definitivo de un trabajo, que no tiene sentido reintentar.'''
+
+
+def encolar(tipo: str, parametros: dict, usuario) -> TrabajoReporte:
+    if tipo not in TIPOS_TRABAJO:
+        raise ValueError(f'Tipo de trabajo inválido: {tipo}')
+    return TrabajoReporte.objects.create(tipo=tipo, parametros=parametros or {}, usuario=usuario)
+
+
+def tomar_trabajo() -> tuple[int, str] | None:
+    '''
+    Marca como en proceso el trabajo pendiente más viejo y devuelve (id, token), o None si no hay pendientes.
+    Usa un update condicional para que dos workers no tomen el mismo trabajo (funciona igual en Postgres y SQLite).
+    El token identifica esta toma: el worker solo puede terminar o devolver el trabajo mientras siga siendo suyo.
+    '''
+    candidatos = TrabajoReporte.objects.filter(estado=TrabajoReporte.PENDIENTE).order_by('creado', 'id').values_list('id', flat=True)[:10]
+    for trabajo_id in candidatos:
+        token = uuid.uuid4().hex
+        tomado = TrabajoReporte.objects.filter(id=trabajo_id, estado=TrabajoReporte.PENDIENTE).update(
+            estado=TrabajoReporte.EN_PROCESO, iniciado=timezone.now(), intentos=F('intentos') + 1, token=token
+        )
+        if tomado:
+            return trabajo_id, token
+    return None
+
+
+def devolver_a_la_cola(tomados: list) -> int:
+    '''Vuelve a dejar pendientes trabajos tomados (pares (id, token)) que no se llegaron a ejecutar.'''
+    devueltos = 0
+    for trabajo_id, token in tomados:
+        devueltos += TrabajoReporte.objects.filter(id=trabajo_id, token=token, estado=TrabajoReporte.EN_PROCESO).update(
+            estado=TrabajoReporte.PENDIENTE, intentos=F('intentos') - 1, token=''
+        )
+    return devueltos
+
+
+def ruta_resultado(trabajo: TrabajoReporte) -> str:
+    return os.path.join(settings.REPORTES_RESULTADOS_DIR, trabajo.archivo)
+
+
+def _nombre_archivo(response, trabajo: TrabajoReporte) -> str:
+    disposicion = response.get('Content-Disposition', '')
+    encontrado = re.search(r'filename="?([^";]+)"?', disposicion)
+    nombre = encontrado.group(1) if encontrado else f'{trabajo.tipo}_{trabajo.pk}'
+    return os.path.basename(nombre)
+
+
+def _request(metodo: str, parametros: dict) -> WSGIRequest:
+    '''Request interno para la vista: los parámetros van en la query string (GET) o como cuerpo JSON (POST).'''
+    cuerpo = b'' if metodo == 'get' else json.dumps(parametros).encode()
+    return WSGIRequest({
+        'REQUEST_METHOD': metodo.upper(),
+        'PATH_INFO': '/',
+        'QUERY_STRING': urlencode(parametros, doseq=True) if metodo == 'get' else '',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(cuerpo)),
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(cuerpo),
+    })
+
+
+def _ejecutar_vista(trabajo: TrabajoReporte):
+    config = TIPOS_TRABAJO[trabajo.tipo]
+    request = _request(config['metodo'], {**trabajo.parametros, **config['parametros']})
+    # DRF toma este usuario como autenticado, igual que si hubiera llegado con su token
+    request._force_auth_user = trabajo.usuario
+    request.user = trabajo.usuario
+
+    response = import_string(config['vista']).as_view()(request)
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    return response
+
+
+def _guardar_respuesta(response, trabajo: TrabajoReporte, token: str) -> dict:
+    '''Escribe el resultado en una carpeta propia de esta toma y devuelve los campos del trabajo que lo describen.'''
+    nombre = _nombre_archivo(response, trabajo)
+    # Un worker colgado que sigue corriendo escribe en su propia carpeta y no pisa el archivo del que lo reemplazó
+    relativo = os.path.join(str(trabajo.pk), token, nombre)
+    destino = os.path.join(settings.REPORTES_RESULTADOS_DIR, relativo)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+
+    # Se escribe en un temporal y se renombra, así nunca se descarga un archivo a medio escribir
+    temporal = destino + '.parcial'
+    try:
+        with open(temporal, 'wb') as archivo:
+            if response.streaming:
+                for bloque in response.streaming_content:
+                    archivo.write(bloque if isinstance(bloque, bytes) else bloque.encode())
+            else:
+                archivo.write(response.content)
+        os.replace(temporal, destino)
+    finally:
+        response.close()
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+    return {
+        'archivo': relativo,
+        'nombre_archivo': nombre,
+        'content_type': response.get('Content-Type', 'application/octet-stream'),
+    }
+
+
+def ejecutar_trabajo(trabajo_id: int, token: str) -> int | None:
+    '''
+    Ejecuta un trabajo ya tomado con tomar_trabajo y guarda el resultado. Se llama desde los procesos de run_workers.
+    Devuelve el estado final, o None si mientras tanto liberar_colgados devolvió el trabajo a la cola (el resultado de
+    esta toma se descarta).
+    '''
+    trabajo = TrabajoReporte.objects.select_related('usuario').get(id=trabajo_id)
+    campos = {}
+    try:
+        response = _ejecutar_vista(trabajo)
+        if response.status_code != 200:
+            contenido = b'' if response.streaming else response.content
+            raise ErrorTrabajo(f'La exportación devolvió {response.status_code}: {contenido.decode(errors="replace")[:1000]}')
+        campos.update(_guardar_respuesta(response, trabajo, token))
+        ahora = timezone.now()
+        campos.update(estado=TrabajoReporte.TERMINADO, terminado=ahora, error='',
+                      expira=ahora + timedelta(hours=settings.REPORTES_RETENCION_HORAS))
+    except ErrorTrabajo as e:
+        campos.update(estado=TrabajoReporte.ERROR, terminado=timezone.now(), error=str(e))
+    except Exception as e:
+        logger.exception('Error en el trabajo de reporte %s', trabajo_id)
+        campos['error'] = str(e)
+        if trabajo.intentos < MAX_INTENTOS:
+            campos.update(estado=TrabajoReporte.PENDIENTE, token='')
+        else:
+            campos.update(estado=TrabajoReporte.ERROR, terminado=timezone.now())
+
+    # Solo si el trabajo sigue tomado por este worker: si no, otro worker ya lo está haciendo (o lo terminó)
+    guardado = TrabajoReporte.objects.filter(id=trabajo_id, token=token, estado=TrabajoReporte.EN_PROCESO).update(**campos)
+    if not guardado:
+        logger.warning('El trabajo de reporte %s ya no pertenece a este worker, se descarta su resultado', trabajo_id)
+        shutil.rmtree(os.path.join(settings.REPORTES_RESULTADOS_DIR, str(trabajo_id), token), ignore_errors=True)
+        return None
+    return campos['estado']
+
+
+def liberar_colgados() -> int:
+    '''
+    Devuelve a la cola los trabajos que quedaron en proceso más de TIEMPO_MAXIMO (o los da por fallidos si ya
+    agotaron los reintentos). Devuelve la cantidad de trabajos liberados.
+    '''
+    limite = timezone.now() - TIEMPO_MAXIMO
+    colgados = TrabajoReporte.objects.filter(estado=TrabajoReporte.EN_PROCESO, iniciado__lt=limite)
+    # Se les borra el token, así el worker colgado (si sigue corriendo) ya no puede guardar su resultado
+    fallidos = colgados.filter(intentos__gte=MAX_INTENTOS).update(
+        estado=TrabajoReporte.ERROR, terminado=timezone.now(), error='El trabajo superó el tiempo máximo de ejecución',
+        token='',
+    )
+    return fallidos + colgados.update(estado=TrabajoReporte.PENDIENTE, token='')
+
+
+def limpiar_vencidos() -> int:
+    '''
+    Borra del disco los resultados vencidos y marca sus trabajos como expirados. Devuelve la cantidad de trabajos expirados.
+    '''
+    vencidos = TrabajoReporte.objects.filter(estado=TrabajoReporte.TERMINADO, expira__lt=timezone.now())
+    expirados = 0
+    for trabajo in vencidos:
+        carpeta = os.path.join(settings.REPORTES_RESULTADOS_DIR, str(trabajo.pk))
+        shutil.rmtree(carpeta, ignore_errors=True)
+        expirados += TrabajoReporte.objects.filter(id=trabajo.pk, estado=TrabajoReporte.TERMINADO).update(
+            estado=TrabajoReporte.EXPIRADO, archivo=''
+        )
+    return expirados
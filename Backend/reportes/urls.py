@@ -13,4 +13,7 @@ urlpatterns = [
     path('mdo_vs_ppto/', views.MDOVSPresupuesto.as_view(), name='mdo_vs_ppto'),
     path('mdo_vs_ppto_x_entidad/', views.MDOVSPresupuestoPorProveedor.as_view(), name='mdo_vs_ppto_x_entidad'),
     path('movimientos_de_caja/', views.MovimientosDeCaja.as_view(), name='movimientos_de_caja'),
+    path('trabajos/', views.TrabajoReporteList.as_view(), name='trabajos'),
+    path('trabajos/<int:pk>/', views.TrabajoReporteDetail.as_view(), name='trabajo_detalle'),
+    path('trabajos/<int:pk>/descarga/', views.TrabajoReporteDescarga.as_view(), name='trabajo_descarga'),
 ]
\ No newline at end of file
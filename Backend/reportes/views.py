@@ -1,4 +1,15 @@
 from tesoreria.models import Registro, DolarMEP, Presupuesto
+from tesoreria.cotizaciones import cotizacion_vigente
+from .exportacion import filas_por_bloques, respuesta_csv, respuesta_xlsx
+from .motor import AGRUPABLES, reporte_registros, totales_por
+from .models import TrabajoReporte, GastoMensual
+from . import hechos
+from .serializers import TrabajoReporteSerializer
+from .trabajos import encolar, ruta_resultado
+from rest_framework import generics
+from rest_framework.permissions import IsAuthenticated
+from django.http import FileResponse
+import os
 from tesoreria.serializers import RegistroSerializer, RegistroCC, PresupuestoViewSerializer, RegistroListSerializer
 from iva.models import Persona, ClienteProyecto
 from rest_framework.views import APIView
@@ -34,17 +45,11 @@ class GastosPorCasa(APIView):
             return Response({'detail': 'Debe especificar un cliente/proyecto'}, status=status.HTTP_400_BAD_REQUEST)
         registros = Registro.objects.filter(cliente_proyecto__id=cliente_proyecto_id)
 
-        fechas = [x['fecha_reg'] for x in registros.values('fecha_reg')]
-        # Obtener todos los DolarMEP en un solo query
-        dolar_mep_values = DolarMEP.objects.filter(fecha__in=fechas).values('fecha', 'compra')
-
-        # Crear un diccionario: {fecha: compra}
-        dolar_map = {str(item['fecha']): float(item['compra']) for item in dolar_mep_values}
         table = []
 
         for registro in registros:
             total_gasto_ingreso = (registro.monto_gasto_ingreso_neto if registro.monto_gasto_ingreso_neto else Decimal(0)) + (registro.iva_gasto_ingreso if registro.iva_gasto_ingreso else Decimal(0))
-            fecha_str = str(registro.fecha_reg)
+            dolar_mep = cotizacion_vigente(registro.fecha_reg)
             row = {
                 "Fecha Reg": registro.fecha_reg,
                 "Tipo Doc": registro.tipo_reg,
@@ -53,7 +58,7 @@ class GastosPorCasa(APIView):
                 "Observaciones": registro.observacion,
                 "ID_Presupuesto": registro.presupuesto.__str__() if registro.presupuesto else "",
                 "Total Gasto/Ingreso": total_gasto_ingreso,
-                "Total Gasto/Ingreso USD": total_gasto_ingreso / Decimal(dolar_map[fecha_str]) if fecha_str in dolar_map else 0,
+                "Total Gasto/Ingreso USD": total_gasto_ingreso / dolar_mep if dolar_mep else 0,
             }
             table.append(row)
 
@@ -287,6 +292,20 @@ class GastoPorEntidad(APIView):
         if isinstance(registros, Response):
             return registros
 
+        # ?agrupar=<columna> devuelve los totales agrupados en lugar de las filas
+        agrupar = request.query_params.get('agrupar')
+        if agrupar:
+            if agrupar not in AGRUPABLES:
+                return Response({'detail': f'No se puede agrupar por {agrupar}. Opciones: {", ".join(AGRUPABLES)}'}, status=status.HTTP_400_BAD_REQUEST)
+            # Con la tabla de hechos cargada los totales salen de las filas ya agregadas por mes
+            if hechos.hechos_disponibles():
+                data = hechos.totales_por(self.get_filtered_hechos(request), agrupar)
+            else:
+                data = totales_por(registros, agrupar)
+            if request.query_params.get('export', None) == 'true':
+                return self.export_to_excel(data, f'{self.entidad or "total"}_por_{agrupar}')
+            return Response(data)
+
         data = self.serialize_and_process_data(registros)
 
         if request.query_params.get('export', None) == 'true':
@@ -295,23 +314,8 @@ class GastoPorEntidad(APIView):
         return Response(data)
     
     def serialize_and_process_data(self, registros):
-        data = RegistroListSerializer(registros, many=True).data
-        
-        # Process the data with the annotated dolar_mep_value
-        for x in data:
-            x['total_gasto_ingreso'] = float(x.get('monto_gasto_ingreso_neto') or 0) + float(x.get('iva_gasto_ingreso') or 0)
-            x['monto_gasto_ingreso_neto'] = float(x.get('monto_gasto_ingreso_neto') or 0)
-            x['iva_gasto_ingreso'] = float(x.get('iva_gasto_ingreso') or 0)
-            x['monto_op_rec'] = float(x.get('monto_op_rec') or 0)
-            x['tipo_de_cambio'] = float(x.get('tipo_de_cambio') or 0)
-            x['documento'] = ""
-            
-            # Format the date
-            if x.get('fecha_reg'):
-                fecha_parts = x['fecha_reg'].split("-")
-                x['fecha_reg'] = f"{fecha_parts[2]}/{fecha_parts[1]}/{fecha_parts[0]}"
-        
-        return data
+        # Las filas se calculan por columnas con reportes.motor, sin serializar registro por registro
+        return reporte_registros(registros)
 
     def get_filtered_registros(self, request):
         # Filtro por entidad
@@ -334,22 +338,22 @@ class GastoPorEntidad(APIView):
             añomes_min = int(añomes_min)
             registros = registros.filter(añomes_imputacion__gte=añomes_min)
 
-        # Subquery to get the DolarMEP compra rate for each registro's fecha_reg
-        dolar_subquery = DolarMEP.objects.filter(
-            fecha=OuterRef('fecha_reg')
-        ).values('compra')[:1]  # Only take the first match
-
-        # Annotate the registro queryset with the dolar_mep value
-        registros = registros.annotate(
-            dolar_mep_value=Coalesce(
-                Subquery(dolar_subquery),
-                Value(0),  # Default value when no match
-                output_field=DecimalField(max_digits=10, decimal_places=2)
-            )
-        )
-        
+        # La cotización MEP de cada registro la resuelve reportes.motor con la caché de tesoreria.cotizaciones
         return registros
 
+    def get_filtered_hechos(self, request):
+        # Mismos filtros que get_filtered_registros, sobre la tabla de hechos (ver reportes.hechos)
+        filas = GastoMensual.objects.exclude(tipo_reg__in=EXCLUDED_TIPO_REGS)
+        if self.entidad:
+            filas = filas.filter(**{self.entidad: request.query_params.get(self.entidad)})
+        añomes_max = request.query_params.get('anomes_max', None)
+        añomes_min = request.query_params.get('anomes_min', None)
+        if añomes_max not in [None, ""]:
+            filas = filas.filter(añomes_imputacion__lte=int(añomes_max))
+        if añomes_min not in [None, ""]:
+            filas = filas.filter(añomes_imputacion__gte=int(añomes_min))
+        return filas
+
     def export_to_excel(self, data, entidad=None):
         try:
             if not data:
@@ -399,6 +403,15 @@ class DB_Total(APIView):
     def get(self, request):
         registros = Registro.objects.all()
         temp_view = GastoPorEntidad()  # create instance of GastoPorEntidad
+
+        # ?stream=csv o ?stream=xlsx exporta de a bloques sin cargar toda la tabla en memoria (ver reportes.exportacion)
+        stream = request.query_params.get('stream')
+        if stream in ['csv', 'xlsx']:
+            filas = filas_por_bloques(registros)
+            if stream == 'csv':
+                return respuesta_csv(filas, 'db_total')
+            return respuesta_xlsx(filas, 'db_total')
+
         data = temp_view.serialize_and_process_data(registros)
         return temp_view.export_to_excel(data, 'db_total')
 
@@ -426,9 +439,17 @@ class CuentasCorrientes(APIView):
                 registros = Registro.objects.filter(cliente_proyecto__id=int(cliente_proyecto), tipo_reg__in=['FCV', 'REC', 'RECFC', 'ISF', 'RETS'], activo=True).exclude(imputacion__imputacion="Diferencia de cambio").order_by('fecha_reg')
         else:
             registros = Registro.objects.filter(proveedor__id=int(proveedor), activo=True).exclude(imputacion__imputacion="Diferencia de cambio").order_by('fecha_reg')
-        monto_op_rec = registros.aggregate(saldo=Sum('monto_op_rec'))['saldo'] or 0
-        monto_gasto_ingreso_neto = registros.aggregate(saldo=Sum('monto_gasto_ingreso_neto'))['saldo'] or 0
-        iva_gasto_ingreso = registros.aggregate(saldo=Sum('iva_gasto_ingreso'))['saldo'] or 0
+        # El saldo sale de la tabla de hechos si está cargada (mismos filtros, sobre filas agregadas por mes)
+        totales = registros
+        if hechos.hechos_disponibles():
+            if proveedor is None:
+                totales = GastoMensual.objects.filter(cliente_proyecto__id=int(cliente_proyecto), tipo_reg__in=['FCV', 'REC', 'RECFC', 'ISF', 'RETS'], activo=True).exclude(imputacion__imputacion="Diferencia de cambio")
+            else:
+                totales = GastoMensual.objects.filter(proveedor__id=int(proveedor), activo=True).exclude(imputacion__imputacion="Diferencia de cambio")
+        totales = totales.aggregate(monto_op_rec=Sum('monto_op_rec'), monto_gasto_ingreso_neto=Sum('monto_gasto_ingreso_neto'), iva_gasto_ingreso=Sum('iva_gasto_ingreso'))
+        monto_op_rec = totales['monto_op_rec'] or 0
+        monto_gasto_ingreso_neto = totales['monto_gasto_ingreso_neto'] or 0
+        iva_gasto_ingreso = totales['iva_gasto_ingreso'] or 0
         saldo = -monto_op_rec + monto_gasto_ingreso_neto + iva_gasto_ingreso
         data.append({
             'persona': Persona.objects.get(id=proveedor).nombre_fantasia if proveedor else ClienteProyecto.objects.get(id=cliente_proyecto).cliente_proyecto,
@@ -484,4 +505,55 @@ class MovimientosDeCaja(APIView):
             'saldo_inicial': saldo_inicial,
             'saldo_final': saldo_final,
             'registros': data
-        })
\ No newline at end of file
+        })
+
+class TrabajoReporteList(generics.ListCreateAPIView):
+    '''
+    Lista los trabajos de reportes del usuario y encola uno nuevo. El trabajo lo procesa el comando run_workers.
+    POST: {"tipo": "db_total", "parametros": {...}} con los mismos parámetros que el endpoint sincrónico.
+    '''
+    permission_classes = [IsAuthenticated]
+    serializer_class = TrabajoReporteSerializer
+
+    def get_queryset(self):
+        return TrabajoReporte.objects.filter(usuario=self.request.user).order_by('-creado')[:50]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        trabajo = encolar(serializer.validated_data['tipo'], serializer.validated_data.get('parametros'), request.user)
+        return Response(TrabajoReporteSerializer(trabajo).data, status=status.HTTP_202_ACCEPTED)
+
+
+class TrabajoReporteDetail(generics.RetrieveAPIView):
+    '''
+    Estado de un trabajo de reportes.
+    '''
+    permission_classes = [IsAuthenticated]
+    serializer_class = TrabajoReporteSerializer
+
+    def get_queryset(self):
+        return TrabajoReporte.objects.filter(usuario=self.request.user)
+
+
+class TrabajoReporteDescarga(APIView):
+    '''
+    Descarga el resultado de un trabajo terminado mientras no haya expirado.
+    '''
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        try:
+            trabajo = TrabajoReporte.objects.get(pk=pk, usuario=request.user)
+        except TrabajoReporte.DoesNotExist:
+            return Response({'detail': 'Trabajo no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+
+        if trabajo.estado == TrabajoReporte.EXPIRADO:
+            return Response({'detail': 'El resultado expiró, hay que generar el reporte de nuevo'}, status=status.HTTP_410_GONE)
+        if trabajo.estado != TrabajoReporte.TERMINADO:
+            return Response({'detail': f'El trabajo todavía no terminó ({trabajo.get_estado_display()})'}, status=status.HTTP_409_CONFLICT)
+
+        ruta = ruta_resultado(trabajo)
+        if not os.path.exists(ruta):
+            return Response({'detail': 'No se encontró el archivo del resultado'}, status=status.HTTP_410_GONE)
+        return FileResponse(open(ruta, 'rb'), as_attachment=True, filename=trabajo.nombre_archivo, content_type=trabajo.content_type)
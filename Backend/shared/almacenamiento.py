@@ -0,0 +1,213 @@
+'''
+Almacenamiento de archivos subidos sin duplicados (storage por defecto, ver STORAGES en settings).
+
+Cada contenido se guarda una sola vez en MEDIA_ROOT/blobs/<2 primeros caracteres>/<sha256>, y el archivo con su nombre
+de siempre (documentos/<proveedor>/<año>/..., archivos/..., documentos/op/...) es un hard link a ese blob. Así las rutas,
+las URLs que sirve nginx y los nombres de ExportarDocumentos no cambian, pero la misma factura subida varias veces ocupa
+disco (y backup, con rsync -H o tar) una sola vez.
+
+La cantidad de referencias de un blob es la cantidad de links del archivo menos uno (el propio blob): borrar un archivo
+con el storage descuenta una referencia sin tocar la base. Los blobs que quedan sin referencias los borra el comando
+recolectar_archivos, y deduplicar_archivos convierte los archivos que ya estaban en MEDIA_ROOT.
+'''
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.files.storage import FileSystemStorage
+
+logger = logging.getLogger(__name__)
+
+CARPETA_BLOBS = 'blobs'
+CARPETA_TEMPORALES = os.path.join(CARPETA_BLOBS, 'tmp')
+TAMANO_BLOQUE = 1024 * 1024
+
+# Temporales más viejos que esto quedaron de una subida interrumpida
+TEMPORALES_VENCIDOS = 3600
+
+# recolectar_archivos --huerfanos no borra archivos más nuevos que esto: pueden ser de una subida cuya fila todavía no
+# está confirmada en la base
+ARCHIVOS_RECIENTES = 3600
+
+
+def hash_archivo(ruta: str) -> str:
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        while bloque := archivo.read(TAMANO_BLOQUE):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+class AlmacenamientoDeduplicado(FileSystemStorage):
+    '''FileSystemStorage que guarda cada contenido una sola vez y enlaza los nombres a ese blob.'''
+
+    def ruta_blob(self, sha: str) -> str:
+        return self.path(os.path.join(CARPETA_BLOBS, sha[:2], sha))
+
+    def referencias(self, sha: str) -> int:
+        '''Cantidad de archivos que apuntan al blob (0 si no existe o ya no lo usa nadie).'''
+        try:
+            return os.stat(self.ruta_blob(sha)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def _crear_carpeta(self, ruta: str) -> None:
+        if self.directory_permissions_mode is not None:
+            mascara = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(ruta, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(mascara)
+        else:
+            os.makedirs(ruta, exist_ok=True)
+
+    def _temporal(self, content) -> tuple[str, str]:
+        '''Copia el contenido a un temporal dentro de MEDIA_ROOT calculando su hash. Devuelve (ruta, sha256).'''
+        carpeta = self.path(CARPETA_TEMPORALES)
+        self._crear_carpeta(carpeta)
+        descriptor, temporal = tempfile.mkstemp(dir=carpeta)
+        sha = hashlib.sha256()
+        try:
+            with os.fdopen(descriptor, 'wb') as destino:
+                if hasattr(content, 'seek') and content.seekable():
+                    content.seek(0)
+                for bloque in content.chunks(TAMANO_BLOQUE):
+                    if isinstance(bloque, str):
+                        bloque = bloque.encode()
+                    sha.update(bloque)
+                    destino.write(bloque)
+        except BaseException:
+            os.remove(temporal)
+            raise
+        if self.file_permissions_mode is not None:
+            os.chmod(temporal, self.file_permissions_mode)
+        return temporal, sha.hexdigest()
+
+    def guardar_blob(self, temporal: str, sha: str) -> str:
+        '''Registra el temporal como blob si ese contenido todavía no estaba. Devuelve la ruta del blob.'''
+        blob = self.ruta_blob(sha)
+        self._crear_carpeta(os.path.dirname(blob))
+        try:
+            os.link(temporal, blob)
+        except FileExistsError:
+            pass
+        return blob
+
+    def _enlazar(self, origen: str, destino: str) -> None:
+        try:
+            os.link(origen, destino)
+        except FileExistsError:
+            raise
+        except OSError as e:
+            # Sistemas de archivos sin hard links: se guarda una copia, sin deduplicar
+            logger.warning('No se pudo crear el hard link %s (%s), se copia el archivo', destino, e)
+            with open(origen, 'rb') as fuente, open(destino, 'xb') as copia:
+                shutil.copyfileobj(fuente, copia, TAMANO_BLOQUE)
+
+    def _save(self, name, content):
+        temporal, sha = self._temporal(content)
+        try:
+            blob = self.guardar_blob(temporal, sha)
+            ruta = self.path(name)
+            self._crear_carpeta(os.path.dirname(ruta))
+            while True:
+                try:
+                    try:
+                        self._enlazar(blob, ruta)
+                    except FileNotFoundError:
+                        # recolectar_archivos borró el blob entre guardar_blob y el link: se vuelve a crear
+                        blob = self.guardar_blob(temporal, sha)
+                        self._enlazar(blob, ruta)
+                except FileExistsError:
+                    # Mismo manejo de nombres repetidos que FileSystemStorage
+                    name = self.get_available_name(name)
+                    ruta = self.path(name)
+                else:
+                    break
+        finally:
+            os.remove(temporal)
+
+        name = os.path.relpath(ruta, self.location)
+        self._ensure_location_group_id(ruta)
+        return str(name).replace('\\', '/')
+
+    def deduplicar(self, name: str) -> int:
+        '''
+        Reemplaza un archivo existente por un link a su blob. Devuelve los bytes liberados (el tamaño del archivo si su
+        contenido ya estaba en otro blob, 0 si no).
+        '''
+        ruta = self.path(name)
+        estado = os.stat(ruta)
+        sha = hash_archivo(ruta)
+        blob = self.ruta_blob(sha)
+        try:
+            estado_blob = os.stat(blob)
+        except FileNotFoundError:
+            # Primera vez que aparece este contenido: el propio archivo pasa a ser el blob
+            self.guardar_blob(ruta, sha)
+            return 0
+        if estado_blob.st_ino == estado.st_ino and estado_blob.st_dev == estado.st_dev:
+            return 0
+
+        # Se crea el link con otro nombre y se renombra encima, así el archivo nunca deja de existir
+        temporal = f'{ruta}.dedup'
+        os.link(blob, temporal)
+        os.replace(temporal, ruta)
+        return estado.st_size if estado.st_nlink == 1 else 0
+
+    def blobs(self):
+        '''Recorre los blobs guardados: (sha256, ruta).'''
+        raiz = self.path(CARPETA_BLOBS)
+        if not os.path.isdir(raiz):
+            return
+        for prefijo in sorted(os.listdir(raiz)):
+            carpeta = os.path.join(raiz, prefijo)
+            if len(prefijo) != 2 or not os.path.isdir(carpeta):
+                continue
+            for sha in sorted(os.listdir(carpeta)):
+                yield sha, os.path.join(carpeta, sha)
+
+    def archivos(self):
+        '''Recorre los nombres de todos los archivos guardados (sin los blobs).'''
+        for carpeta, subcarpetas, nombres in os.walk(self.location):
+            relativa = os.path.relpath(carpeta, self.location)
+            if relativa == '.':
+                subcarpetas[:] = [subcarpeta for subcarpeta in subcarpetas if subcarpeta != CARPETA_BLOBS]
+            for nombre in nombres:
+                yield os.path.normpath(os.path.join(relativa, nombre)).replace('\\', '/')
+
+    def modificado(self, name: str) -> float:
+        '''
+        Último cambio del archivo, en segundos desde epoch. Un link nuevo a un blob viejo conserva el mtime del blob, pero
+        os.link actualiza el ctime del inode, así que se toma el mayor de los dos.
+        '''
+        estado = os.stat(self.path(name))
+        return max(estado.st_mtime, estado.st_ctime)
+
+    def recolectar(self, simular: bool = False) -> tuple[int, int]:
+        '''Borra los blobs sin referencias y los temporales abandonados. Devuelve (cantidad, bytes) borrados.'''
+        borrados = liberados = 0
+        for sha, ruta in self.blobs():
+            estado = os.stat(ruta)
+            if estado.st_nlink > 1:
+                continue
+            if not simular:
+                os.remove(ruta)
+            borrados += 1
+            liberados += estado.st_size
+
+        carpeta_temporales = self.path(CARPETA_TEMPORALES)
+        if os.path.isdir(carpeta_temporales):
+            limite = time.time() - TEMPORALES_VENCIDOS
+            for nombre in os.listdir(carpeta_temporales):
+                ruta = os.path.join(carpeta_temporales, nombre)
+                estado = os.stat(ruta)
+                if estado.st_mtime < limite:
+                    if not simular:
+                        os.remove(ruta)
+                    borrados += 1
+                    liberados += estado.st_size
+        return borrados, liberados
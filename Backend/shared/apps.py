@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class SharedConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shared'
+
+    def ready(self):
+        from shared import catalogos, versiones
+        catalogos.conectar()
+        versiones.conectar()
@@ -0,0 +1,182 @@
+'''
+Caché en memoria de los catálogos chicos (cajas, imputaciones, sub imputaciones, clientes/proyectos, unidades de
+negocio, monedas y tipos de documento), para no consultar la base cada vez que se busca uno por nombre.
+
+Cada proceso guarda su copia de cada catálogo junto con la versión que tenía en VersionCatalogo (ver shared.versiones)
+cuando la leyó. Las señales post_save/post_delete de esos modelos incrementan la versión en la base al confirmar la
+transacción (y descartan la copia del proceso que hizo el cambio; mientras la transacción no termina ese proceso lee el
+catálogo de la base sin guardarlo, porque el cambio todavía se puede deshacer). Los demás procesos comparan sus
+versiones con la base, con una sola consulta para todos los catálogos: al empezar cada request, y fuera de un request
+(comandos, workers) cada CATALOGOS_VALIDAR_SEGUNDOS. Si un nombre no está en la copia se vuelve a validar antes de dar
+error, así un catálogo recién creado en otro proceso se encuentra enseguida.
+
+Los cambios que no disparan señales (bulk_create, update()) tienen que llamar a invalidar(modelo).
+'''
+import copy
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save
+
+from . import versiones
+
+# Modelos con caché: (campo por el que se buscan por nombre, relaciones que se leen junto con cada objeto). Las
+# relaciones tienen que ser también catálogos, así un cambio en ellas invalida la copia
+CATALOGOS = {
+    'tesoreria.Caja': ('caja', ['moneda']),
+    'iva.Imputacion': ('imputacion', []),
+    'tesoreria.SubImputacion': ('nombre', []),
+    'iva.ClienteProyecto': ('cliente_proyecto', ['unidad_de_negocio']),
+    'iva.UnidadDeNegocio': ('unidad_de_negocio', []),
+    'shared.Moneda': ('nombre', []),
+    'iva.TiposDocumento': ('tipo_documento', []),
+}
+
+_lock = threading.RLock()
+# {modelo: {'versiones': {modelo o relación: versión}, 'por_id': {id: instancia}, 'por_nombre': {nombre: [ids]}}}
+_copias = {}
+# Momento de la última validación contra la base; None obliga a validar en la próxima búsqueda
+_validado = None
+
+
+def _etiqueta(modelo) -> str:
+    etiqueta = modelo._meta.label
+    if etiqueta not in CATALOGOS:
+        raise ValueError(f'{etiqueta} no es un catálogo con caché')
+    return etiqueta
+
+
+def _versiones() -> dict:
+    from .models import VersionCatalogo
+    return dict(VersionCatalogo.objects.values_list('modelo', 'version'))
+
+
+def _validar(forzar: bool = False) -> None:
+    '''Descarta las copias cuya versión ya no coincide con la de la base.'''
+    global _validado
+    ahora = time.monotonic()
+    if not forzar and _validado is not None and ahora - _validado < settings.CATALOGOS_VALIDAR_SEGUNDOS:
+        return
+    versiones = _versiones()
+    with _lock:
+        for etiqueta, copia in list(_copias.items()):
+            if any(version != versiones.get(modelo, 0) for modelo, version in copia['versiones'].items()):
+                del _copias[etiqueta]
+        _validado = ahora
+
+
+def _dependencias(etiqueta: str) -> list:
+    modelo = apps.get_model(etiqueta)
+    return [etiqueta] + [modelo._meta.get_field(relacion).related_model._meta.label for relacion in CATALOGOS[etiqueta][1]]
+
+
+def _cargar(etiqueta: str) -> dict:
+    # La versión se lee antes que las filas: si el catálogo cambia en el medio, la próxima validación lo vuelve a leer
+    versiones = _versiones()
+    modelo = apps.get_model(etiqueta)
+    campo, relaciones = CATALOGOS[etiqueta]
+    dependencias = _dependencias(etiqueta)
+    por_id = {}
+    por_nombre = {}
+    for objeto in modelo.objects.select_related(*relaciones).order_by('id'):
+        por_id[objeto.pk] = objeto
+        por_nombre.setdefault(getattr(objeto, campo), []).append(objeto.pk)
+    return {
+        'versiones': {dependencia: versiones.get(dependencia, 0) for dependencia in dependencias},
+        'por_id': por_id,
+        'por_nombre': por_nombre,
+    }
+
+
+def _copia(modelo) -> dict:
+    etiqueta = _etiqueta(modelo)
+    if versiones.pendientes() & set(_dependencias(etiqueta)):
+        # Cambios de esta transacción que todavía no se confirmaron: se leen sin guardarlos en la caché
+        return _cargar(etiqueta)
+    _validar()
+    with _lock:
+        copia = _copias.get(etiqueta)
+        if copia is None:
+            copia = _copias[etiqueta] = _cargar(etiqueta)
+        return copia
+
+
+def _buscar(modelo, buscar):
+    '''Ejecuta buscar(copia); si no encuentra nada valida contra la base y vuelve a intentar una vez.'''
+    resultado = buscar(_copia(modelo))
+    if resultado is None:
+        _validar(forzar=True)
+        resultado = buscar(_copia(modelo))
+    return resultado
+
+
+def por_nombre(modelo, nombre: str):
+    '''
+    Equivale a modelo.objects.get(<campo de nombre>=nombre): lanza DoesNotExist si no existe y MultipleObjectsReturned
+    si hay más de uno con ese nombre. Devuelve una copia, que se puede modificar sin afectar la caché.
+    '''
+    ids = _buscar(modelo, lambda copia: copia['por_nombre'].get(nombre))
+    if not ids:
+        raise modelo.DoesNotExist(f'No existe {modelo._meta.verbose_name} "{nombre}"')
+    if len(ids) > 1:
+        raise modelo.MultipleObjectsReturned(f'Hay más de un {modelo._meta.verbose_name} "{nombre}"')
+    return por_id(modelo, ids[0])
+
+
+def por_id(modelo, pk: int):
+    '''Equivale a modelo.objects.get(pk=pk). Devuelve una copia.'''
+    objeto = _buscar(modelo, lambda copia: copia['por_id'].get(int(pk)))
+    if objeto is None:
+        raise modelo.DoesNotExist(f'No existe {modelo._meta.verbose_name} con id {pk}')
+    return copy.copy(objeto)
+
+
+def primero_por_nombre(modelo, nombre: str):
+    '''Equivale a modelo.objects.filter(<campo de nombre>=nombre).first(): el de menor id, o None si no hay ninguno.'''
+    ids = _buscar(modelo, lambda copia: copia['por_nombre'].get(nombre))
+    return por_id(modelo, ids[0]) if ids else None
+
+
+def ids_por_nombre(modelo, nombre: str) -> set:
+    '''Ids de todos los objetos con ese nombre (vacío si no hay ninguno).'''
+    return set(_copia(modelo)['por_nombre'].get(nombre, []))
+
+
+def obtener_o_crear(modelo, nombre: str):
+    '''Equivale a modelo.objects.get_or_create(<campo de nombre>=nombre)[0].'''
+    try:
+        return por_nombre(modelo, nombre)
+    except modelo.DoesNotExist:
+        return modelo.objects.get_or_create(**{CATALOGOS[_etiqueta(modelo)][0]: nombre})[0]
+
+
+def invalidar(modelo) -> None:
+    '''Incrementa la versión del catálogo (al confirmar la transacción), así todos los procesos lo vuelven a leer.'''
+    etiqueta = _etiqueta(modelo)
+    versiones.incrementar(modelo)
+    with _lock:
+        for otra, copia in list(_copias.items()):
+            if etiqueta in copia['versiones']:
+                del _copias[otra]
+
+
+def _al_cambiar(sender, raw=False, **kwargs):
+    if not raw:
+        invalidar(sender)
+
+
+def _al_empezar_request(**kwargs):
+    global _validado
+    _validado = None
+
+
+def conectar() -> None:
+    '''Conecta las señales de los catálogos. Se llama desde SharedConfig.ready.'''
+    for etiqueta in CATALOGOS:
+        modelo = apps.get_model(etiqueta)
+        post_save.connect(_al_cambiar, sender=modelo, dispatch_uid=f'catalogo_save_{etiqueta}')
+        post_delete.connect(_al_cambiar, sender=modelo, dispatch_uid=f'catalogo_delete_{etiqueta}')
+    request_started.connect(_al_empezar_request, dispatch_uid='catalogos_request')
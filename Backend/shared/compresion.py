@@ -0,0 +1,85 @@
+'''
+Compresión de las respuestas de la API según Accept-Encoding: brotli si el cliente lo acepta y el paquete está
+instalado, si no gzip.
+
+Solo se comprimen las respuestas JSON y CSV de al menos COMPRESION_MINIMO_BYTES, que no sean streaming (las
+exportaciones en ZIP ya vienen comprimidas) y que no traigan ya un Content-Encoding.
+
+Comprimir un secreto junto con texto que manda el cliente permite adivinarlo por el tamaño de la respuesta (BREACH).
+Por eso no se comprime el HTML (admin, API navegable), que lleva el token CSRF, ni las respuestas que setean cookies
+(login y refresh de tokens). Los bytes al azar que gzip agrega en el encabezado, igual que el GZipMiddleware de Django,
+solo dificultan el ataque y brotli no los tiene: la protección es no comprimir esas respuestas.
+'''
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # sin brotli se comprime solo con gzip
+    brotli = None
+
+# Calidad de brotli: 4-5 comprime parecido a gzip -9 con menos CPU; los niveles altos son para archivos estáticos
+CALIDAD_BROTLI = 5
+
+TIPOS_COMPRIMIBLES = {'application/json', 'text/csv'}
+
+
+def _aceptadas(accept_encoding: str) -> set:
+    '''Codificaciones aceptadas por el cliente (las que tienen q=0 no cuentan).'''
+    aceptadas = set()
+    for parte in accept_encoding.split(','):
+        codificacion, _, parametros = parte.strip().partition(';')
+        calidad = parametros.strip()
+        if calidad.startswith('q='):
+            try:
+                if float(calidad[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        aceptadas.add(codificacion.strip().lower())
+    return aceptadas
+
+
+def _comprimible(content_type: str) -> bool:
+    return content_type.partition(';')[0].strip().lower() in TIPOS_COMPRIMIBLES
+
+
+class CompresionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or not _comprimible(response.get('Content-Type', ''))
+            or len(response.content) < settings.COMPRESION_MINIMO_BYTES
+        ):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if response.cookies:
+            return response
+
+        aceptadas = _aceptadas(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in aceptadas:
+            codificacion = 'br'
+            comprimido = brotli.compress(response.content, quality=CALIDAD_BROTLI)
+        elif 'gzip' in aceptadas:
+            codificacion = 'gzip'
+            comprimido = compress_string(response.content, max_random_bytes=100)
+        else:
+            return response
+        if len(comprimido) >= len(response.content):
+            return response
+
+        response.content = comprimido
+        response.headers['Content-Length'] = str(len(comprimido))
+        response.headers['Content-Encoding'] = codificacion
+        # El cuerpo ya no es byte a byte el mismo: el ETag pasa a ser débil (If-None-Match lo sigue aceptando)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
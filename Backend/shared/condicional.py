@@ -0,0 +1,67 @@
+'''
+Lecturas condicionales de la API (ETag / Last-Modified).
+
+Las vistas con RespuestaCondicionalMixin declaran en modelos_etag los modelos de los que depende su respuesta. Antes
+de consultar los datos se leen las versiones de esos modelos (ver shared.versiones, una sola consulta) y el ETag es un
+hash de esas versiones, la URL con sus parámetros, el usuario y el formato de la respuesta. Si el cliente manda el
+mismo ETag en If-None-Match se responde 304 sin consultar ni serializar nada; si no, la respuesta lleva el ETag y el
+momento del último cambio en Last-Modified.
+
+Las versiones se leen antes que los datos, así un cambio que se confirme en el medio cambia el ETag de la próxima
+lectura aunque esta ya haya visto los datos nuevos. Si cambia el formato de alguna respuesta sin cambiar los datos hay
+que incrementar VERSION.
+'''
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from . import versiones
+
+VERSION = 1
+
+
+class RespuestaCondicionalMixin:
+    '''
+    Agrega ETag y Last-Modified a list y retrieve, y responde 304 si el cliente ya tiene la respuesta. Va antes de la
+    vista genérica en la herencia.
+    '''
+    # Modelos de los que depende la respuesta, incluidos los que aparecen a través de relaciones
+    modelos_etag = []
+
+    def list(self, request, *args, **kwargs):
+        return self.respuesta_condicional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.respuesta_condicional(super().retrieve, request, *args, **kwargs)
+
+    def validadores(self, request) -> tuple:
+        '''(ETag, último cambio como timestamp o None) de la respuesta pedida.'''
+        etiquetas = sorted(modelo._meta.label for modelo in self.modelos_etag)
+        leidas = versiones.leer(etiquetas)
+        clave = [
+            VERSION, request.get_full_path(), request.user.pk, request.accepted_media_type,
+            *(f'{etiqueta}:{leidas.get(etiqueta, (0, None))[0]}' for etiqueta in etiquetas),
+        ]
+        etag = '"%s"' % hashlib.sha1('|'.join(map(str, clave)).encode()).hexdigest()
+        cambios = [modificado for _, modificado in leidas.values()]
+        return etag, int(max(cambios).timestamp()) if cambios else None
+
+    def respuesta_condicional(self, metodo, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or not self.modelos_etag:
+            return metodo(request, *args, **kwargs)
+        etag, ultimo_cambio = self.validadores(request)
+        respuesta = get_conditional_response(request, etag=etag, last_modified=ultimo_cambio)
+        if respuesta is None:
+            respuesta = metodo(request, *args, **kwargs)
+            if respuesta.status_code != 200:
+                return respuesta
+        elif respuesta.status_code != 304:
+            # 412 de If-Match / If-Unmodified-Since
+            return respuesta
+        respuesta['ETag'] = etag
+        if ultimo_cambio is not None:
+            respuesta['Last-Modified'] = http_date(ultimo_cambio)
+        # El navegador guarda la respuesta pero la revalida siempre con If-None-Match
+        respuesta['Cache-Control'] = 'private, no-cache'
+        return respuesta
@@ -0,0 +1,41 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from shared.almacenamiento import AlmacenamientoDeduplicado, hash_archivo
+
+
+class Command(BaseCommand):
+    help = 'Convierte los archivos que ya estaban en MEDIA_ROOT en hard links a su blob, para no guardar contenidos repetidos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true', help='Solo informa cuánto espacio se liberaría')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, AlmacenamientoDeduplicado):
+            raise CommandError('El storage por defecto no es AlmacenamientoDeduplicado (ver STORAGES en settings)')
+
+        archivos = liberados = 0
+        # Para --simular: inodos ya vistos de cada contenido
+        inodos = {}
+        for nombre in default_storage.archivos():
+            archivos += 1
+            try:
+                if options['simular']:
+                    ruta = default_storage.path(nombre)
+                    estado = os.stat(ruta)
+                    vistos = inodos.setdefault(hash_archivo(ruta), set())
+                    # Un archivo se liberaría si su contenido ya apareció en otro inodo
+                    if vistos and (estado.st_dev, estado.st_ino) not in vistos:
+                        liberados += estado.st_size
+                    vistos.add((estado.st_dev, estado.st_ino))
+                else:
+                    liberados += default_storage.deduplicar(nombre)
+            except OSError as e:
+                self.stderr.write(f'{nombre}: {e}')
+            if archivos % 1000 == 0:
+                self.stdout.write(f'{archivos} archivos revisados')
+
+        accion = 'se liberarían' if options['simular'] else 'liberados'
+        self.stdout.write(self.style.SUCCESS(f'{archivos} archivos revisados, {liberados / 1024 / 1024:.1f} MB {accion}'))
@@ -0,0 +1,107 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+
+from shared.compresion import CALIDAD_BROTLI, brotli
+from shared.renderers import ORJSONRenderer
+from tesoreria.models import CertificadoObra, Registro
+from tesoreria.serializers import CertificadoSerializer, RegistroListProyeccion, RegistroProyeccion, RegistroSerializer
+
+
+def _mejor_tiempo(funcion, repeticiones: int) -> float:
+    '''Menor tiempo de varias ejecuciones, en milisegundos.'''
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos) * 1000
+
+
+class Command(BaseCommand):
+    help = ('Mide el tiempo de render JSON (DRF contra orjson) y el tamaño con gzip y brotli de las respuestas más '
+            'grandes de la API, con los datos de la base')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=1000, help='Registros por respuesta (por defecto 1000, la página más grande)')
+        parser.add_argument('--repeticiones', type=int, default=5, help='Veces que se mide cada render (se toma la mejor)')
+
+    def cargas(self, filas: int) -> dict:
+        '''Datos ya serializados con la misma forma que las respuestas de las vistas.'''
+        registros = Registro.objects.filter(activo=True).order_by('-id')
+        if not registros.exists():
+            raise CommandError('No hay registros para medir')
+        cargas = {}
+
+        # RegistroViewSet: una página con el saldo acumulado y los montos en USD
+        pagina = RegistroListProyeccion.proyectar(registros.annotate(saldo_acumulado=F('saldo_caja__saldo')))[:filas]
+        cargas['registros (página)'] = {
+            'count': registros.count(), 'next': None, 'previous': None,
+            'results': RegistroListProyeccion(pagina, many=True).data,
+        }
+
+        # ConciliacionCajaData: los registros de la caja con más movimientos
+        caja = registros.values('caja').annotate(cantidad=Count('id')).order_by('-cantidad').first()['caja']
+        cargas['conciliación de caja'] = RegistroProyeccion(
+            RegistroProyeccion.proyectar(Registro.objects.filter(caja=caja).order_by('id'))[:filas], many=True
+        ).data
+
+        # ListadoConsumosPresupuesto: los consumos del presupuesto con más registros
+        presupuesto = registros.exclude(presupuesto=None).values('presupuesto').annotate(
+            cantidad=Count('id')
+        ).order_by('-cantidad').first()
+        if presupuesto:
+            consumos = Registro.objects.filter(presupuesto=presupuesto['presupuesto']).order_by('fecha_reg')
+            cargas['consumos de presupuesto'] = RegistroProyeccion(RegistroProyeccion.proyectar(consumos)[:filas], many=True).data
+
+        # CuentasCorrientesClientes: certificados con sus pagos y saldos Decimal sin serializar
+        cliente = registros.exclude(cliente_proyecto=None).values('cliente_proyecto').annotate(
+            cantidad=Count('id')
+        ).order_by('-cantidad').first()
+        if cliente:
+            certificados = CertificadoObra.objects.filter(cliente_proyecto_id=cliente['cliente_proyecto']).order_by('numero')
+            pagos = Registro.objects.filter(cliente_proyecto_id=cliente['cliente_proyecto'])
+            detalle = [
+                {
+                    'certificado': CertificadoSerializer(certificado).data,
+                    'pagos': RegistroSerializer(pagos.filter(certificado_id=certificado.id)[:filas], many=True).data,
+                    'saldo': certificado.saldo,
+                }
+                for certificado in certificados
+            ]
+            if not detalle:
+                detalle = [{'certificado': None, 'pagos': RegistroSerializer(pagos[:filas], many=True).data, 'saldo': None}]
+            cargas['cuenta corriente de cliente'] = [{'cliente': cliente['cliente_proyecto'], 'detalle': detalle, 'saldo': None}]
+        return cargas
+
+    def handle(self, *args, **options):
+        repeticiones = options['repeticiones']
+        drf = JSONRenderer()
+        rapido = ORJSONRenderer()
+        contexto = {'request': RequestFactory().get('/')}
+        self.stdout.write(
+            f"{'respuesta':<30}{'DRF ms':>9}{'orjson ms':>11}{'x':>6}{'bytes':>11}{'gzip':>10}{'gzip ms':>9}"
+            f"{'brotli':>10}{'brotli ms':>11}"
+        )
+        for nombre, datos in self.cargas(options['filas']).items():
+            esperado = drf.render(datos, 'application/json', contexto)
+            obtenido = rapido.render(datos, 'application/json', contexto)
+            if json.loads(esperado) != json.loads(obtenido):
+                raise CommandError(f'{nombre}: el JSON de orjson no coincide con el de DRF')
+            tiempo_drf = _mejor_tiempo(lambda: drf.render(datos, 'application/json', contexto), repeticiones)
+            tiempo_rapido = _mejor_tiempo(lambda: rapido.render(datos, 'application/json', contexto), repeticiones)
+            gzip_bytes = len(gzip.compress(obtenido, compresslevel=6))
+            tiempo_gzip = _mejor_tiempo(lambda: gzip.compress(obtenido, compresslevel=6), repeticiones)
+            brotli_bytes, tiempo_brotli = '-', '-'
+            if brotli is not None:
+                brotli_bytes = len(brotli.compress(obtenido, quality=CALIDAD_BROTLI))
+                tiempo_brotli = f'{_mejor_tiempo(lambda: brotli.compress(obtenido, quality=CALIDAD_BROTLI), repeticiones):.1f}'
+            self.stdout.write(
+                f'{nombre:<30}{tiempo_drf:>9.1f}{tiempo_rapido:>11.1f}{tiempo_drf / tiempo_rapido:>6.1f}'
+                f'{len(obtenido):>11}{gzip_bytes:>10}{tiempo_gzip:>9.1f}{brotli_bytes:>10}{tiempo_brotli:>11}'
+            )
@@ -0,0 +1,68 @@
+import time
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+
+from shared.almacenamiento import ARCHIVOS_RECIENTES, AlmacenamientoDeduplicado
+
+
+def nombres_referenciados() -> set:
+    '''Nombres de archivo guardados en algún FileField de la base, incluidas las tablas de historial.'''
+    nombres = set()
+    for modelo in apps.get_models():
+        campos = [campo.name for campo in modelo._meta.concrete_fields if isinstance(campo, models.FileField)]
+        for campo in campos:
+            nombres.update(
+                modelo._default_manager.exclude(**{campo: ''}).exclude(**{f'{campo}__isnull': True})
+                .values_list(campo, flat=True).distinct().iterator()
+            )
+    return nombres
+
+
+def huerfanos(referenciados: set, limite: float):
+    '''Archivos que no están en referenciados y no cambiaron después de limite (los más nuevos pueden estar subiéndose).'''
+    for nombre in default_storage.archivos():
+        if nombre in referenciados:
+            continue
+        try:
+            if default_storage.modificado(nombre) > limite:
+                continue
+        except FileNotFoundError:
+            continue
+        yield nombre
+
+
+class Command(BaseCommand):
+    help = 'Borra los blobs de archivos que ya no usa ningún archivo y, con --huerfanos, los archivos que no están en la base'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true', help='Solo informa lo que se borraría')
+        parser.add_argument('--huerfanos', action='store_true',
+                            help='Borra también los archivos de MEDIA_ROOT que no referencia ningún FileField')
+        parser.add_argument('--gracia', type=int, default=ARCHIVOS_RECIENTES,
+                            help='Con --huerfanos, segundos desde el último cambio antes de considerar huérfano un archivo')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, AlmacenamientoDeduplicado):
+            raise CommandError('El storage por defecto no es AlmacenamientoDeduplicado (ver STORAGES en settings)')
+        simular = options['simular']
+        accion = 'se borrarían' if simular else 'borrados'
+
+        if options['huerfanos']:
+            # El límite se toma antes de leer la base: un archivo subido después de leerla es más nuevo y se saltea
+            limite = time.time() - options['gracia']
+            cantidad = 0
+            for nombre in huerfanos(nombres_referenciados(), limite):
+                self.stdout.write(f'Huérfano: {nombre}')
+                if not simular:
+                    default_storage.delete(nombre)
+                cantidad += 1
+            self.stdout.write(f'{cantidad} archivos huérfanos {accion}')
+
+        # Los blobs se recolectan después, así los que quedaron sin referencias por los huérfanos se borran en la misma pasada
+        borrados, liberados = default_storage.recolectar(simular=simular)
+        self.stdout.write(self.style.SUCCESS(
+            f'{borrados} blobs y temporales {accion}, {liberados / 1024 / 1024:.1f} MB'
+        ))
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0002_version_catalogo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='versioncatalogo',
+            name='modificado',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 class Municipio(models.Model):
     nombre = models.CharField(max_length=100)
@@ -23,3 +24,17 @@ class Moneda(models.Model):
         verbose_name = "Moneda"
         verbose_name_plural = "Monedas"
         ordering = ['nombre']
+
+class VersionCatalogo(models.Model):
+    # Contador de cambios de cada catálogo o tabla versionada (ver shared.versiones), lo incrementan las señales del
+    # modelo. Lo usan la caché de catálogos y los ETag de la API
+    modelo = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    modificado = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.modelo} v{self.version}"
+
+    class Meta:
+        verbose_name = "Versión de catálogo"
+        verbose_name_plural = "Versiones de catálogos"
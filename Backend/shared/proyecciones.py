@@ -0,0 +1,174 @@
+'''
+Serializers de solo lectura para los listados grandes, sin instanciar los modelos.
+
+Un ProyeccionSerializer reproduce la salida de un serializer de DRF (Meta.serializer) leyendo las filas con values().
+De cada campo del serializer se deduce la columna que hay que leer, con los joins necesarios: el slug de un
+SlugRelatedField, el id de un PrimaryKeyRelatedField y la columna o anotación del mismo nombre para los demás. El valor
+se convierte con el mismo campo de DRF, así el JSON queda idéntico. Los ManyToMany de ids se leen con una consulta a la
+tabla intermedia por lote de filas.
+
+Los campos que no salen de una columna (métodos, propiedades, fuentes con punto, StringRelatedField) se declaran con
+Calculado(rutas) y los resuelve el método calcular_<campo>(filas) para todo el lote a la vez. Puede devolver OMITIR en
+las filas donde el serializer original no incluye el campo. Si un campo no se puede deducir ni está declarado, la
+proyección falla al compilarse en lugar de devolver otro JSON.
+
+Las vistas usan ListadoProyectadoMixin: filtran y ordenan el queryset de siempre, lo proyectan con values() y la
+paginación corta directamente los diccionarios.
+'''
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, RelatedField, SlugRelatedField
+from rest_framework.response import Response
+
+# Filas que se convierten juntas (con una consulta a cada tabla intermedia por lote)
+TAMAÑO_LOTE = 1000
+
+# Valor de calcular_<campo> para las filas en las que el serializer original no incluye el campo (SkipField de DRF)
+OMITIR = object()
+
+# Campos de DRF que devuelven tal cual el valor que trae values()
+_SIN_CONVERSION = (serializers.IntegerField, serializers.CharField, serializers.BooleanField, SlugRelatedField, PrimaryKeyRelatedField)
+
+
+class Calculado:
+    '''Campo que resuelve calcular_<campo>(filas) para todo el lote, leyendo las rutas del ORM indicadas.'''
+
+    def __init__(self, *rutas: str):
+        self.rutas = rutas
+
+
+class ProyeccionListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        filas = list(data)
+        resultado = []
+        for inicio in range(0, len(filas), TAMAÑO_LOTE):
+            resultado.extend(self.child.representar_lote(filas[inicio:inicio + TAMAÑO_LOTE]))
+        return resultado
+
+
+class ProyeccionSerializer(serializers.BaseSerializer):
+    '''
+    Reproduce Meta.serializer sobre las filas de proyectar(queryset). Solo lectura y solo con many=True.
+    '''
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        kwargs['child'] = cls()
+        return ProyeccionListSerializer(*args, **kwargs)
+
+    @classmethod
+    def compilar(cls) -> list:
+        '''
+        Columnas de la proyección en el orden del serializer original, como (campo, tipo, rutas, extra). Se arma una
+        sola vez por clase.
+        '''
+        if '_columnas' in cls.__dict__:
+            return cls._columnas
+        original = cls.Meta.serializer()
+        modelo = original.Meta.model
+        calculados = {
+            nombre: valor for base in reversed(cls.__mro__) for nombre, valor in vars(base).items()
+            if isinstance(valor, Calculado)
+        }
+        pk = modelo._meta.pk.name
+        columnas = []
+        for nombre, campo in original.fields.items():
+            if campo.write_only:
+                continue
+            if nombre in calculados:
+                columnas.append((nombre, 'calculado', calculados[nombre].rutas, None))
+            elif isinstance(campo, ManyRelatedField) and type(campo.child_relation) is PrimaryKeyRelatedField:
+                columnas.append((nombre, 'ids', (pk,), modelo._meta.get_field(campo.source)))
+            elif (
+                '.' in campo.source or campo.source == '*'
+                or isinstance(campo, (serializers.SerializerMethodField, serializers.BaseSerializer, ManyRelatedField))
+                or isinstance(campo, RelatedField) and not isinstance(campo, (SlugRelatedField, PrimaryKeyRelatedField))
+            ):
+                raise ImproperlyConfigured(
+                    f'{cls.__name__}: el campo {nombre} de {type(original).__name__} no sale de una columna, '
+                    f'hay que declararlo con Calculado'
+                )
+            elif isinstance(campo, SlugRelatedField):
+                columnas.append((nombre, 'columna', (f'{campo.source}__{campo.slug_field}',), None))
+            elif isinstance(campo, serializers.FileField) and getattr(campo, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+                columnas.append((nombre, 'archivo', (campo.source,), modelo._meta.get_field(campo.source).storage))
+            else:
+                convertir = None if isinstance(campo, _SIN_CONVERSION) else campo.to_representation
+                columnas.append((nombre, 'columna', (campo.source,), convertir))
+        cls._campos = original.fields
+        cls._columnas = columnas
+        return columnas
+
+    @classmethod
+    def proyectar(cls, queryset):
+        '''El queryset como values() con las columnas que necesita la proyección.'''
+        rutas = dict.fromkeys(ruta for _, _, rutas, _ in cls.compilar() for ruta in rutas)
+        return queryset.values(*rutas)
+
+    def formatear(self, campo: str, valores: list) -> list:
+        '''Convierte los valores con el campo del serializer original (los None quedan None).'''
+        convertir = self._campos[campo].to_representation
+        return [None if valor is None else convertir(valor) for valor in valores]
+
+    def ids(self, relacion, ruta_pk: str, filas: list) -> list:
+        '''Ids relacionados por el ManyToMany de cada fila, en el orden de relacion.all(), con una sola consulta.'''
+        intermedia = relacion.remote_field.through
+        origen, destino = relacion.m2m_field_name(), relacion.m2m_reverse_field_name()
+        campos = (intermedia._meta.get_field(origen).attname, intermedia._meta.get_field(destino).attname)
+        relacionados = {}
+        consulta = intermedia.objects.filter(**{f'{campos[0]}__in': [fila[ruta_pk] for fila in filas]}).order_by(destino)
+        for pk_origen, pk_destino in consulta.values_list(*campos):
+            relacionados.setdefault(pk_origen, []).append(pk_destino)
+        return [relacionados.get(fila[ruta_pk], []) for fila in filas]
+
+    def archivos(self, almacenamiento, ruta: str, filas: list) -> list:
+        '''URL de cada archivo, absoluta si hay request en el contexto, igual que FileField de DRF.'''
+        request = self.context.get('request')
+        urls = []
+        for fila in filas:
+            if not fila[ruta]:
+                urls.append(None)
+                continue
+            url = almacenamiento.url(fila[ruta])
+            urls.append(request.build_absolute_uri(url) if request is not None else url)
+        return urls
+
+    def representar_lote(self, filas: list) -> list:
+        valores = {}
+        for nombre, tipo, rutas, extra in self.compilar():
+            if tipo == 'calculado':
+                valores[nombre] = getattr(self, f'calcular_{nombre}')(filas)
+            elif tipo == 'ids':
+                valores[nombre] = self.ids(extra, rutas[0], filas)
+            elif tipo == 'archivo':
+                valores[nombre] = self.archivos(extra, rutas[0], filas)
+            elif extra is None:
+                valores[nombre] = [fila[rutas[0]] for fila in filas]
+            else:
+                valores[nombre] = [None if fila[rutas[0]] is None else extra(fila[rutas[0]]) for fila in filas]
+        nombres = list(valores)
+        return [
+            {nombre: valor for nombre, valor in zip(nombres, fila) if valor is not OMITIR}
+            for fila in zip(*valores.values())
+        ]
+
+    def to_representation(self, instance):
+        return self.representar_lote([instance])[0]
+
+
+class ListadoProyectadoMixin:
+    '''
+    list() que pagina y serializa las filas de serializer_proyeccion.proyectar(queryset) en lugar de instancias del
+    modelo. Va antes de la vista genérica en la herencia (y después de RespuestaCondicionalMixin).
+    '''
+    serializer_proyeccion = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.serializer_proyeccion.proyectar(self.filter_queryset(self.get_queryset()))
+        pagina = self.paginate_queryset(queryset)
+        if pagina is not None:
+            serializer = self.serializer_proyeccion(pagina, many=True, context=self.get_serializer_context())
+            return self.get_paginated_response(serializer.data)
+        serializer = self.serializer_proyeccion(queryset, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
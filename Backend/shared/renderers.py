@@ -0,0 +1,26 @@
+'''
+Renderer JSON de la API con orjson.
+
+Genera el mismo JSON que el JSONRenderer de DRF (compacto, UTF-8, con U+2028/U+2029 escapados) pero serializa las
+listas grandes varias veces más rápido. orjson resuelve en C los tipos básicos, los UUID y las subclases de dict/list
+que devuelven los serializers; lo que no conoce (Decimal, fechas, lazy strings, querysets) pasa por el encoder de DRF,
+así los Decimal de los aggregate siguen saliendo como número y las fechas con el mismo formato. Si el cliente pide
+JSON indentado se usa el renderer de DRF.
+'''
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+OPCIONES = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        contenido = orjson.dumps(data, default=JSONEncoder().default, option=OPCIONES)
+        # Igual que DRF: estos separadores son válidos en JSON pero no en JavaScript
+        return contenido.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
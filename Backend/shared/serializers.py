@@ -1,5 +1,6 @@
 from .models import Municipio, Moneda
-from rest_framework.serializers import ModelSerializer
+from . import catalogos
+from rest_framework.serializers import ModelSerializer, SlugRelatedField
 
 class MunicipioSerializer(ModelSerializer):
     class Meta:
@@ -9,4 +10,23 @@ class MunicipioSerializer(ModelSerializer):
 class MonedaSerializer(ModelSerializer):
     class Meta:
         model = Moneda
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class CatalogoSlugRelatedField(SlugRelatedField):
+    """
+    SlugRelatedField que resuelve el nombre con la caché de catálogos (ver shared.catalogos) en lugar de consultar la base.
+    Solo se usa la caché si el queryset es el catálogo completo y slug_field es su campo de nombre; si no, o si el
+    valor no es texto, se comporta igual que SlugRelatedField.
+    """
+
+    def to_internal_value(self, data):
+        modelo = self.get_queryset().model
+        campo = catalogos.CATALOGOS.get(modelo._meta.label, (None,))[0]
+        if campo != self.slug_field or self.get_queryset().query.where or not isinstance(data, str):
+            return super().to_internal_value(data)
+        try:
+            return catalogos.por_nombre(modelo, data)
+        except modelo.DoesNotExist:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=data)
+        except modelo.MultipleObjectsReturned:
+            self.fail('invalid')
@@ -1,3 +1,113 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import date
+from io import StringIO
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from iva.models import Documento, Persona, TiposDocumento
+from shared import versiones
+from shared.almacenamiento import AlmacenamientoDeduplicado
+from shared.compresion import CompresionMiddleware
+from shared.models import Moneda, VersionCatalogo
+from tesoreria.models import DolarMEP
+
+
+class AlmacenamientoDeduplicadoTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def test_guarda_cada_contenido_una_vez_y_recolecta_los_blobs_sin_uso(self):
+        almacenamiento = AlmacenamientoDeduplicado()
+        primero = almacenamiento.save('documentos/a.pdf', ContentFile(b'factura'))
+        segundo = almacenamiento.save('archivos/b.pdf', ContentFile(b'factura'))
+        repetido = almacenamiento.save('documentos/a.pdf', ContentFile(b'otra factura'))
+
+        self.assertNotEqual(repetido, primero)
+        self.assertTrue(os.path.samefile(almacenamiento.path(primero), almacenamiento.path(segundo)))
+        self.assertEqual(sorted(almacenamiento.archivos()), sorted([primero, segundo, repetido]))
+        self.assertEqual(len(list(almacenamiento.blobs())), 2)
+
+        almacenamiento.delete(primero)
+        self.assertEqual(almacenamiento.recolectar(), (0, 0))
+        almacenamiento.delete(segundo)
+        self.assertEqual(almacenamiento.recolectar(simular=True), (1, len(b'factura')))
+        self.assertEqual(almacenamiento.recolectar(), (1, len(b'factura')))
+        blobs = [ruta for _, ruta in almacenamiento.blobs()]
+        self.assertEqual(len(blobs), 1)
+        self.assertTrue(os.path.samefile(blobs[0], almacenamiento.path(repetido)))
+        with almacenamiento.open(repetido) as archivo:
+            self.assertEqual(archivo.read(), b'otra factura')
+
+    def test_huerfanos_respeta_la_base_y_los_archivos_recientes(self):
+        persona = Persona.objects.create(razon_social='Proveedor')
+        referenciado = default_storage.save('documentos/a.pdf', ContentFile(b'factura'))
+        Documento.objects.create(
+            tipo_documento=TiposDocumento.objects.create(tipo_documento='NF'), fecha_documento=date(2024, 3, 1),
+            proveedor=persona, receptor=persona, numero=1, añomes_imputacion_gasto=202403, total=1, concepto='x',
+            moneda=Moneda.objects.create(nombre='ARS'), archivo=referenciado,
+        )
+        huerfano = default_storage.save('documentos/b.pdf', ContentFile(b'subida sin confirmar'))
+
+        # Recién subido: puede ser de una transacción que todavía no se confirmó
+        call_command('recolectar_archivos', '--huerfanos', stdout=StringIO())
+        self.assertTrue(default_storage.exists(huerfano))
+
+        salida = StringIO()
+        call_command('recolectar_archivos', '--huerfanos', '--gracia', '0', stdout=salida)
+        self.assertIn(f'Huérfano: {huerfano}', salida.getvalue())
+        self.assertFalse(default_storage.exists(huerfano))
+        self.assertTrue(default_storage.exists(referenciado))
+        self.assertEqual(len(list(default_storage.blobs())), 1)
+
+
+class VersionesTests(TestCase):
+    def test_incrementa_una_vez_por_transaccion(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            versiones.incrementar(Persona)
+            versiones.incrementar(Persona, DolarMEP)
+            self.assertEqual(versiones.pendientes(), {'iva.Persona', 'tesoreria.DolarMEP'})
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(versiones.leer(['iva.Persona'])['iva.Persona'][0], 1)
+
+    def test_un_savepoint_deshecho_descarta_sus_modelos(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    versiones.incrementar(Persona)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            self.assertEqual(versiones.pendientes(), set())
+            versiones.incrementar(DolarMEP)
+            self.assertEqual(versiones.pendientes(), {'tesoreria.DolarMEP'})
+        self.assertEqual([callback.etiquetas for callback in callbacks], [{'tesoreria.DolarMEP'}])
+        callbacks[0]()
+        self.assertEqual(list(VersionCatalogo.objects.values_list('modelo', flat=True)), ['tesoreria.DolarMEP'])
+
+
+class CompresionTests(TestCase):
+    def responder(self, content_type, encoding='gzip, br'):
+        cuerpo = b'{"csrfmiddlewaretoken": "x"} ' * 100
+        middleware = CompresionMiddleware(lambda request: HttpResponse(cuerpo, content_type=content_type))
+        return middleware(RequestFactory().get('/', HTTP_ACCEPT_ENCODING=encoding))
+
+    def test_comprime_json_y_csv(self):
+        for content_type in ('application/json', 'text/csv; charset=utf-8'):
+            self.assertEqual(self.responder(content_type, 'gzip').get('Content-Encoding'), 'gzip')
+
+    def test_no_comprime_html(self):
+        # El HTML del admin y de la API navegable lleva el token CSRF (BREACH)
+        for content_type in ('text/html; charset=utf-8', 'application/javascript'):
+            respuesta = self.responder(content_type)
+            self.assertFalse(respuesta.has_header('Content-Encoding'))
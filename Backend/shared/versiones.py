@@ -0,0 +1,120 @@
+'''
+Contadores de cambios por tabla (VersionCatalogo).
+
+Cada modelo versionado tiene una fila con un número que se incrementa cada vez que cambia alguno de sus objetos, y el
+momento del último cambio. Los usan la caché de catálogos (shared.catalogos) y los ETag de la API
+(shared.condicional): si la versión no cambió, los datos tampoco.
+
+El incremento se hace al confirmar la transacción, así ningún proceso puede leer la versión nueva con los datos
+viejos, y una sola vez por modelo y transacción. Los catálogos se incrementan desde shared.catalogos; los demás
+modelos de VERSIONADOS con las señales post_save/post_delete/m2m_changed que conecta conectar(). Los cambios que no
+disparan señales (bulk_create, update()) tienen que llamar a incrementar(modelo), igual que se hace con los saldos y el
+índice de búsqueda.
+'''
+import threading
+import weakref
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils import timezone
+
+# Modelos que no son catálogos pero de los que dependen respuestas con ETag
+VERSIONADOS = [
+    'iva.Persona',
+    'tesoreria.Registro',
+    'tesoreria.Presupuesto',
+    'tesoreria.EstadoPresupuesto',
+    'tesoreria.CertificadoObra',
+    'tesoreria.DolarMEP',
+]
+
+
+class _Incremento:
+    '''Callback de on_commit que junta los modelos cambiados en una transacción.'''
+
+    def __init__(self):
+        self.etiquetas = set()
+
+    def __call__(self):
+        _local.incremento = None
+        _incrementar(self.etiquetas)
+
+
+# Incremento pendiente de la transacción en curso de este hilo (las conexiones de Django son por hilo)
+_local = threading.local()
+
+
+def _pendiente() -> _Incremento | None:
+    # Solo se guarda una referencia débil: el callback lo retiene on_commit, y si la transacción (o el savepoint en el
+    # que se registró) se deshace Django lo descarta y la referencia queda vacía
+    referencia = getattr(_local, 'incremento', None)
+    return referencia() if referencia is not None else None
+
+
+def _incrementar(etiquetas) -> None:
+    from .models import VersionCatalogo
+    ahora = timezone.now()
+    for etiqueta in sorted(etiquetas):
+        if not VersionCatalogo.objects.filter(modelo=etiqueta).update(version=F('version') + 1, modificado=ahora):
+            # Las versiones que no están en la base valen 0
+            VersionCatalogo.objects.get_or_create(modelo=etiqueta, defaults={'version': 1, 'modificado': ahora})
+
+
+def incrementar(*modelos) -> None:
+    '''Incrementa la versión de los modelos cuando se confirme la transacción actual (o enseguida si no hay una).'''
+    etiquetas = {modelo._meta.label for modelo in modelos}
+    conexion = transaction.get_connection()
+    if not conexion.in_atomic_block:
+        _incrementar(etiquetas)
+        return
+    pendiente = _pendiente()
+    if pendiente is None:
+        pendiente = _Incremento()
+        transaction.on_commit(pendiente)
+        _local.incremento = weakref.ref(pendiente)
+    pendiente.etiquetas |= etiquetas
+
+
+def pendientes() -> set:
+    '''Modelos cambiados en la transacción actual cuya versión todavía no se incrementó.'''
+    if not transaction.get_connection().in_atomic_block:
+        return set()
+    pendiente = _pendiente()
+    return set(pendiente.etiquetas) if pendiente is not None else set()
+
+
+def leer(etiquetas) -> dict:
+    '''{etiqueta: (versión, último cambio)} de los modelos pedidos que ya cambiaron alguna vez (una consulta).'''
+    from .models import VersionCatalogo
+    return {
+        modelo: (version, modificado)
+        for modelo, version, modificado in VersionCatalogo.objects.filter(modelo__in=list(etiquetas)).values_list(
+            'modelo', 'version', 'modificado'
+        )
+    }
+
+
+def _al_cambiar(sender, raw=False, **kwargs):
+    if not raw:
+        incrementar(sender)
+
+
+def _al_cambiar_relacion(sender, instance, action, reverse, model, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    # instance es el dueño del campo salvo que se haya modificado desde el otro lado de la relación
+    incrementar(model if reverse else type(instance))
+
+
+def conectar() -> None:
+    '''Conecta las señales de los modelos de VERSIONADOS. Se llama desde SharedConfig.ready.'''
+    for etiqueta in VERSIONADOS:
+        modelo = apps.get_model(etiqueta)
+        post_save.connect(_al_cambiar, sender=modelo, dispatch_uid=f'version_save_{etiqueta}')
+        post_delete.connect(_al_cambiar, sender=modelo, dispatch_uid=f'version_delete_{etiqueta}')
+        for campo in modelo._meta.many_to_many:
+            m2m_changed.connect(
+                _al_cambiar_relacion, sender=campo.remote_field.through, dispatch_uid=f'version_m2m_{etiqueta}_{campo.name}'
+            )
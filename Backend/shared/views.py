@@ -3,6 +3,7 @@ from .models import Municipio, Moneda
 from .serializers import MunicipioSerializer, MonedaSerializer
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions
+from .condicional import RespuestaCondicionalMixin
 
 class SoftDeleteModelViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -21,6 +22,7 @@ class MunicipioViewSet(SoftDeleteModelViewSet):
     queryset = Municipio.objects.all()
     serializer_class = MunicipioSerializer
 
-class MonedaViewSet(SoftDeleteModelViewSet):
+class MonedaViewSet(RespuestaCondicionalMixin, SoftDeleteModelViewSet):
     queryset = Moneda.objects.all()
     serializer_class = MonedaSerializer
+    modelos_etag = [Moneda]
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from tesoreria.models.archivos import Archivo
+from tesoreria.models.correos import CorreoSaliente
 from tesoreria.models import Caja, Tarea, Registro, Presupuesto, EstadoPresupuesto, Echeq, CertificadoObra, Comentario, Notificacion,DolarMEP,Retencion, subimputaciones, PagoFactura, IndiceCAC
 from simple_history.admin import SimpleHistoryAdmin
 # Register your models here.
@@ -25,4 +26,5 @@ admin.site.register(Retencion)
 admin.site.register(Tarea)
 admin.site.register(subimputaciones.SubImputacion)
 admin.site.register(IndiceCAC)
-admin.site.register(subimputaciones.SubImputacionMapping)
\ No newline at end of file
+admin.site.register(subimputaciones.SubImputacionMapping)
+admin.site.register(CorreoSaliente)
@@ -0,0 +1,86 @@
+'''
+Carga del grafo de objetos asociados a un registro (vista RegistrosAsociados).
+
+Se recorre el grafo por niveles con consultas IN (registro -> documentos -> registros de esos documentos ->
+retenciones; registro -> órdenes de pago -> sus documentos y registros) y las relaciones muchos a muchos se traen con
+Prefetch, así la cantidad de consultas es fija sin importar cuántos documentos, retenciones o registros tenga un pago.
+'''
+from django.db.models import Prefetch, Q
+
+from iva.models import Documento
+
+from .models import PagoFactura, Registro, Retencion
+from .models.archivos import Archivo
+
+# Campos de los registros vinculados que se devuelven en 'registros', uno por id
+CAMPOS_REGISTRO = [
+    'id', 'tipo_reg', 'fecha_reg', 'caja_id', 'caja__caja', 'monto_op_rec', 'monto_gasto_ingreso_neto',
+    'iva_gasto_ingreso', 'observacion', 'realizado', 'activo',
+]
+
+
+def _solo_ids(relacion: str) -> Prefetch:
+    # Los serializers solo muestran los ids de las relaciones muchos a muchos
+    return Prefetch(relacion, queryset=Registro.objects.only('id'))
+
+
+def cargar_asociados(registro_id: int) -> dict:
+    '''
+    Devuelve el registro y sus objetos asociados: documentos, retenciones (las del registro y las de los registros que
+    comparten sus documentos), certificado, órdenes de pago, archivos y los registros vinculados a las retenciones y
+    órdenes de pago. Lanza Registro.DoesNotExist si el registro no existe.
+    '''
+    registro = Registro.objects.select_related('certificado__cliente_proyecto').get(id=registro_id)
+
+    documentos_del_registro = Registro.documento.through.objects.filter(registro_id=registro_id).values('documento_id')
+    documentos = list(
+        Documento.objects.filter(id__in=documentos_del_registro)
+        .select_related('tipo_documento', 'proveedor', 'receptor', 'imputacion', 'cliente_proyecto', 'unidad_de_negocio')
+    )
+
+    # Registros que comparten algún documento con este (incluido el propio registro)
+    registros_de_documentos = Registro.documento.through.objects.filter(
+        documento_id__in=documentos_del_registro
+    ).values('registro_id')
+    retenciones = list(
+        Retencion.objects.filter(
+            Q(registro_id=registro_id)
+            | Q(id__in=Retencion.registro_fc.through.objects.filter(
+                registro_id__in=registros_de_documentos
+            ).values('retencion_id'))
+        ).order_by('id').prefetch_related(_solo_ids('registro_fc'))
+    )
+
+    if registro.tipo_reg != 'FC':
+        pagos = PagoFactura.objects.filter(registros_pago__id=registro_id)
+    else:
+        pagos = PagoFactura.objects.filter(registros_fc=registro_id)
+    pagos = list(pagos.prefetch_related(
+        Prefetch('documentos', queryset=Documento.objects.only('id')),
+        _solo_ids('registros_fc'),
+        _solo_ids('registros_pago'),
+    ))
+
+    archivos = list(Archivo.objects.filter(registros=registro_id))
+
+    vinculados = set()
+    for retencion in retenciones:
+        vinculados.add(retencion.registro_id)
+        vinculados.update(relacionado.id for relacionado in retencion.registro_fc.all())
+    for pago in pagos:
+        vinculados.update(relacionado.id for relacionado in pago.registros_fc.all())
+        vinculados.update(relacionado.id for relacionado in pago.registros_pago.all())
+    vinculados.discard(registro_id)
+    registros = []
+    if vinculados:
+        registros = list(Registro.objects.filter(id__in=vinculados).order_by('fecha_reg', 'id').values(*CAMPOS_REGISTRO))
+
+    return {
+        'registro': registro,
+        'documentos': documentos,
+        'retenciones': retenciones,
+        'certificado': registro.certificado,
+        'pagos': pagos,
+        'archivos': archivos,
+        'registros': registros,
+    }
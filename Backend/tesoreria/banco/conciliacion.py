@@ -28,6 +28,8 @@ from rest_framework.response import Response
 from rest_framework import status
 from tesoreria.serializers import ConciliacionCSVSerializer, GastoBancarioSerializer, OPDesdeConciliacionSerializer
 from tesoreria.models import Registro, Caja
+from shared import catalogos
+from tesoreria.banco.indice import IndiceRegistros
 from iva.models import UnidadDeNegocio, ClienteProyecto, Imputacion, Persona
 from decimal import Decimal
 
@@ -128,7 +130,7 @@ class ConciliacionCSVUploadView(APIView):
 
         return fecha_parsed, monto_value, iva
 
-    def aplicar_criterio(self, fecha_parsed: str, cod_concepto: str, nro_cheque: str, debito: str, credito: str, iva: str, nro_doc: str, concepto: str) -> tuple:
+    def aplicar_criterio(self, fecha_parsed: str, cod_concepto: str, nro_cheque: str, debito: str, credito: str, iva: str, nro_doc: str, concepto: str, indice: IndiceRegistros = None) -> tuple:
         '''
         Aplica el criterio de clasificación a un movimiento bancario y devuelve sus características.
 
@@ -139,6 +141,7 @@ class ConciliacionCSVUploadView(APIView):
         @param credito: Monto acreditado en el movimiento.
         @param nro_doc: Número de documento (CNPJ) asociado al movimiento.
         @param concepto: Concepto del movimiento.
+        @param indice: Índice de registros del extracto (ver tesoreria.banco.indice). Si no se pasa o no cubre la fecha, se arma uno para esa fecha.
 
         @returns:
             transaction_type: Tipo de transacción.
@@ -147,6 +150,8 @@ class ConciliacionCSVUploadView(APIView):
         '''
         # Formateamos el monto y la fecha
         fecha_parsed, monto_value, iva = self.formatear_monto_fecha(fecha_parsed, debito, credito, iva)
+        if indice is None or not indice.cubre(fecha_parsed):
+            indice = IndiceRegistros(fecha_parsed, fecha_parsed)
 
         transaction_type = None
         sub_type = None
@@ -174,33 +179,19 @@ class ConciliacionCSVUploadView(APIView):
                 sub_type = gastos_sub_types_map.get(cod_concepto)
             # Verificamos si ya existe un registro con estos datos en la caja del banco
             if fecha_parsed:
-                ya_cargado = Registro.objects.filter(
-                    fecha_reg=fecha_parsed,
-                    monto_op_rec=monto_value+iva,
-                    caja__caja="Banco ICBC",
-                    activo=True,
-                    imputacion__imputacion=gastos_bancarios_map[cod_concepto]['imputacion']
-                ).exists()
+                ya_cargado = indice.existe_gasto_bancario(
+                    fecha_parsed, monto_value+iva, gastos_bancarios_map[cod_concepto]['imputacion']
+                )
 
         # 4. FCI
         elif cod_concepto == RESCATE_FCI:
             transaction_type, sub_type = 'fci', 'Rescate FCI'
             if fecha_parsed:
-                ya_cargado = Registro.objects.filter(
-                    fecha_reg=fecha_parsed,
-                    monto_op_rec=monto_value,
-                    caja_contrapartida__caja="Fondo inversión",
-                    activo=True
-                ).exists()
+                ya_cargado = indice.existe_movimiento_fci(fecha_parsed, monto_value)
         elif cod_concepto == SUSCRIPCION_FCI:
             transaction_type, sub_type = 'fci', 'Suscripción FCI'
             if fecha_parsed:
-                ya_cargado = Registro.objects.filter(
-                    fecha_reg=fecha_parsed,
-                    monto_op_rec=monto_value,
-                    caja_contrapartida__caja="Fondo inversión",
-                    activo=True
-                ).exists()
+                ya_cargado = indice.existe_movimiento_fci(fecha_parsed, monto_value)
 
         # 5. Resto: se clasifica como 'pago' y se usa el concepto recibido
         else:
@@ -210,23 +201,25 @@ class ConciliacionCSVUploadView(APIView):
         if nro_doc and fecha_parsed:
             monto_value = round(Decimal(monto_value),4)
             if monto_value < 0:
-                ya_cargado = Registro.objects.filter(
-                    fecha_reg=fecha_parsed,
-                    monto_op_rec=monto_value,
-                    proveedor__cnpj=nro_doc,
-                    activo=True
-                ).exists()
+                ya_cargado = indice.existe_pago(fecha_parsed, monto_value, nro_doc)
             else:
                 # TODO: acá debería tambien buscar por CNPJ del cliente, pero la estructura actual de la db no almacena ese dato en el registro
-                ya_cargado = Registro.objects.filter(
-                    fecha_reg=fecha_parsed,
-                    monto_op_rec=monto_value,
-                    tipo_reg__in=['REC', 'ISF'],
-                    activo=True
-                ).exists()
+                ya_cargado = indice.existe_cobro(fecha_parsed, monto_value)
 
         return transaction_type, sub_type, ya_cargado
 
+    def fechas_extracto(self, reader) -> list:
+        '''
+        Devuelve las fechas contables válidas del extracto (las inválidas las reporta aplicar_criterio).
+        '''
+        fechas = []
+        for row in reader:
+            try:
+                fechas.append(datetime.strptime(row.get('Fecha contable', '').strip(), '%d/%m/%Y').date())
+            except ValueError:
+                continue
+        return fechas
+
     def transformar_datos(self, reader):
         '''
         Método que recibe un archivo CSV con los movimientos del banco y devuelve un JSON con los movimientos clasificados.
@@ -238,6 +231,9 @@ class ConciliacionCSVUploadView(APIView):
         gastos_bancarios = []
         fci = []
 
+        # Una sola consulta con todos los registros del rango de fechas del extracto
+        indice = IndiceRegistros.para_fechas(self.fechas_extracto(reader))
+
         for i, row in enumerate(reader):
             # Campos del CSV
             concepto = row.get('Concepto', '').strip()
@@ -262,7 +258,7 @@ class ConciliacionCSVUploadView(APIView):
                 continue
 
             # Aplicamos el criterio de clasificación
-            transaction_type, sub_type, ya_cargado = self.aplicar_criterio(fecha,cod_concepto, nro_cheque, debito, credito, iva, nro_doc, concepto)
+            transaction_type, sub_type, ya_cargado = self.aplicar_criterio(fecha,cod_concepto, nro_cheque, debito, credito, iva, nro_doc, concepto, indice)
 
             # Armamos el diccionario con los datos del movimiento
             movimiento = {
@@ -342,15 +338,15 @@ class CrearGastoBancario(APIView):
                 monto_op_rec=monto+iva,
                 realizado=True,
                 tipo_reg=gastos_bancarios_map[data['cod_concepto']]['tipo_reg'],
-                unidad_de_negocio=UnidadDeNegocio.objects.get(unidad_de_negocio=gastos_bancarios_map[data['cod_concepto']]['unidad_de_negocio']),
-                cliente_proyecto=ClienteProyecto.objects.get(cliente_proyecto=gastos_bancarios_map[data['cod_concepto']]['cliente_proyecto']),
-                imputacion=Imputacion.objects.get(imputacion=gastos_bancarios_map[data['cod_concepto']]['imputacion']),
+                unidad_de_negocio=catalogos.por_nombre(UnidadDeNegocio, gastos_bancarios_map[data['cod_concepto']]['unidad_de_negocio']),
+                cliente_proyecto=catalogos.por_nombre(ClienteProyecto, gastos_bancarios_map[data['cod_concepto']]['cliente_proyecto']),
+                imputacion=catalogos.por_nombre(Imputacion, gastos_bancarios_map[data['cod_concepto']]['imputacion']),
                 proveedor=Persona.objects.get(nombre_fantasia=gastos_bancarios_map[data['cod_concepto']]['proveedor']),
                 observacion=gastos_bancarios_map[data['cod_concepto']]['observacion'],
                 añomes_imputacion = str(fecha).split("-")[0] + str(fecha).split("-")[1],
                 moneda = 1,
                 tipo_de_cambio=1,
-                caja = Caja.objects.get(caja="Banco ICBC"),
+                caja = catalogos.por_nombre(Caja, "Banco ICBC"),
             )
             registro.save()
             return Response({"message": "Gasto bancario creado exitosamente"}, status=status.HTTP_201_CREATED)
@@ -411,7 +407,7 @@ class CrearPagoDesdePlantilla(APIView):
                 añomes_imputacion=int(fecha_obj.strftime("%Y%m")),
                 moneda=1,
                 tipo_de_cambio=1,
-                caja=Caja.objects.get(caja="Banco ICBC"),
+                caja=catalogos.por_nombre(Caja, "Banco ICBC"),
             )
             registro.save()
             
@@ -494,7 +490,7 @@ class CrearPagosMultiplesDesdePlantilla(APIView):
                         añomes_imputacion=int(fecha_obj.strftime("%Y%m")),
                         moneda=1,
                         tipo_de_cambio=1,
-                        caja=Caja.objects.get(caja="Banco ICBC"),
+                        caja=catalogos.por_nombre(Caja, "Banco ICBC"),
                     )
                     registro.save()
                     registros_creados.append(registro.id)
@@ -0,0 +1,94 @@
+'''
+Índice en memoria de los registros de un extracto bancario, para la conciliación.
+
+En lugar de un .exists() por cada movimiento del extracto, se leen una sola vez los registros activos del rango de
+fechas del extracto y se arman índices por (fecha, monto), por (fecha, monto, cnpj) y por tipo de registro. Cada
+movimiento se resuelve con búsquedas en esos índices, aplicando los mismos criterios que ConciliacionCSVUploadView.
+'''
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+
+from tesoreria.models import Registro
+
+CAJA_BANCO = "Banco ICBC"
+CAJA_FCI = "Fondo inversión"
+TIPOS_COBRO = ['REC', 'ISF']
+
+CUATRO_DECIMALES = Decimal('0.0001')
+
+
+def normalizar_monto(valor) -> Decimal:
+    '''Lleva el monto a Decimal con 4 decimales (los de monto_op_rec), así coinciden los floats del extracto.'''
+    if isinstance(valor, float):
+        valor = repr(valor)
+    return Decimal(valor).quantize(CUATRO_DECIMALES)
+
+
+def normalizar_fecha(valor) -> date:
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+class IndiceRegistros:
+    '''
+    Registros activos entre desde y hasta (inclusive), indexados para conciliar un extracto con una sola consulta.
+    '''
+
+    def __init__(self, desde, hasta):
+        self.desde = normalizar_fecha(desde)
+        self.hasta = normalizar_fecha(hasta)
+        # (fecha, monto) -> [(caja, caja_contrapartida, imputacion)]
+        self.por_fecha_monto = defaultdict(list)
+        # (fecha, monto, cnpj) de los registros con proveedor
+        self.por_cnpj = set()
+        # tipo_reg -> {(fecha, monto)}
+        self.por_tipo = defaultdict(set)
+
+        filas = Registro.objects.filter(activo=True, fecha_reg__range=(self.desde, self.hasta)).values_list(
+            'fecha_reg', 'monto_op_rec', 'caja__caja', 'caja_contrapartida__caja', 'imputacion__imputacion',
+            'proveedor__cnpj', 'tipo_reg',
+        )
+        for fecha, monto, caja, contrapartida, imputacion, cnpj, tipo_reg in filas:
+            if monto is None:
+                continue
+            clave = (normalizar_fecha(fecha), normalizar_monto(monto))
+            self.por_fecha_monto[clave].append((caja, contrapartida, imputacion))
+            if cnpj:
+                self.por_cnpj.add((*clave, cnpj))
+            self.por_tipo[tipo_reg].add(clave)
+
+    @classmethod
+    def para_fechas(cls, fechas):
+        '''Arma el índice para el rango que cubre las fechas indicadas.'''
+        fechas = [normalizar_fecha(fecha) for fecha in fechas]
+        if not fechas:
+            return None
+        return cls(min(fechas), max(fechas))
+
+    def cubre(self, fecha) -> bool:
+        return self.desde <= normalizar_fecha(fecha) <= self.hasta
+
+    def _candidatos(self, fecha, monto) -> list:
+        return self.por_fecha_monto.get((normalizar_fecha(fecha), normalizar_monto(monto)), [])
+
+    def existe_gasto_bancario(self, fecha, monto, imputacion: str) -> bool:
+        '''Registro en la caja del banco con la imputación del gasto.'''
+        return any(caja == CAJA_BANCO and imputacion_registro == imputacion
+                   for caja, _, imputacion_registro in self._candidatos(fecha, monto))
+
+    def existe_movimiento_fci(self, fecha, monto) -> bool:
+        '''Registro con contrapartida en el fondo de inversión.'''
+        return any(contrapartida == CAJA_FCI for _, contrapartida, _ in self._candidatos(fecha, monto))
+
+    def existe_pago(self, fecha, monto, cnpj: str) -> bool:
+        '''Registro del proveedor con ese CNPJ.'''
+        return (normalizar_fecha(fecha), normalizar_monto(monto), cnpj) in self.por_cnpj
+
+    def existe_cobro(self, fecha, monto) -> bool:
+        '''Registro de cobro (REC o ISF).'''
+        clave = (normalizar_fecha(fecha), normalizar_monto(monto))
+        return any(clave in self.por_tipo.get(tipo_reg, ()) for tipo_reg in TIPOS_COBRO)
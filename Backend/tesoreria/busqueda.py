@@ -0,0 +1,135 @@
+'''
+Búsqueda de registros sobre un documento de texto desnormalizado (RegistroBusqueda).
+
+En lugar de un icontains por cada uno de los search_fields de RegistroViewSet (con sus joins), cada registro guarda
+un único texto con todos esos valores. En Postgres ese texto tiene un índice GIN trigram (para ILIKE '%x%'); en SQLite
+se replica en una tabla FTS5 con tokenizador trigram. Así el costo de buscar no crece con la tabla. En los dos motores
+el criterio es el mismo que el icontains de SearchFilter: el término tiene que aparecer tal cual en el texto (no se
+usa búsqueda por palabras con stemming, que devolvería resultados que antes no aparecían).
+'''
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from .models import Registro, RegistroBusqueda
+
+TABLA_FTS = 'tesoreria_registrobusqueda_fts'
+
+
+def _valor(valor) -> str:
+    return '' if valor is None else str(valor)
+
+
+def texto_busqueda(registro: Registro) -> str:
+    '''
+    Arma el texto de búsqueda de un registro con los mismos campos que RegistroViewSet.search_fields,
+    más los números de los documentos asociados.
+    '''
+    proveedor = registro.proveedor
+    partes = [
+        registro.id,
+        registro.fecha_reg,
+        proveedor.razon_social if proveedor else None,
+        proveedor.nombre_fantasia if proveedor else None,
+        registro.cliente_proyecto.cliente_proyecto if registro.cliente_proyecto else None,
+        registro.observacion,
+        registro.iva_gasto_ingreso,
+        registro.monto_op_rec,
+        registro.monto_gasto_ingreso_neto,
+        registro.caja.caja if registro.caja else None,
+        registro.caja_contrapartida.caja if registro.caja_contrapartida else None,
+        registro.imputacion.imputacion if registro.imputacion else None,
+        registro.presupuesto.observacion if registro.presupuesto else None,
+        registro.añomes_imputacion,
+        registro.tipo_reg,
+        registro.unidad_de_negocio.unidad_de_negocio if registro.unidad_de_negocio else None,
+    ]
+    for documento in registro.documento.all():
+        partes.append(f'{documento.serie}-{documento.numero}')
+        partes.append(documento.numero)
+    return ' | '.join(_valor(parte) for parte in partes if parte not in (None, ''))
+
+
+def indexar_registros(registros=None, chunk_size: int = 1000) -> int:
+    '''
+    Regenera el texto de búsqueda de los registros indicados (queryset o lista de ids), o de todos si es None.
+    Devuelve la cantidad de registros indexados.
+    '''
+    queryset = Registro.objects.all()
+    if registros is not None:
+        queryset = queryset.filter(id__in=registros.values('id') if hasattr(registros, 'values') else registros)
+    queryset = queryset.select_related(
+        'proveedor', 'cliente_proyecto', 'caja', 'caja_contrapartida', 'imputacion', 'presupuesto', 'unidad_de_negocio'
+    ).prefetch_related('documento').order_by('id')
+
+    filas = []
+    indexados = 0
+    for registro in queryset.iterator(chunk_size=chunk_size):
+        filas.append(RegistroBusqueda(registro_id=registro.pk, texto=texto_busqueda(registro)))
+        if len(filas) >= chunk_size:
+            indexados += _guardar(filas)
+            filas = []
+    if filas:
+        indexados += _guardar(filas)
+    return indexados
+
+
+def _guardar(filas: list) -> int:
+    RegistroBusqueda.objects.bulk_create(
+        filas, update_conflicts=True, unique_fields=['registro'], update_fields=['texto']
+    )
+    return len(filas)
+
+
+def _escapar_like(termino: str) -> str:
+    return termino.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _subconsulta(vendor: str, termino: str):
+    '''
+    Devuelve la subconsulta (sql, params) con los ids de registro que contienen el término,
+    o None si el motor no tiene índice de texto y hay que usar el ORM.
+    '''
+    if vendor == 'postgresql':
+        return (
+            'SELECT registro_id FROM tesoreria_registrobusqueda '
+            "WHERE texto ILIKE %s ESCAPE '\\'",
+            [f'%{_escapar_like(termino)}%'],
+        )
+    # El tokenizador trigram de FTS5 necesita al menos 3 caracteres
+    if vendor == 'sqlite' and len(termino) >= 3:
+        return (
+            f'SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s',
+            ['"' + termino.replace('"', '""') + '"'],
+        )
+    return None
+
+
+def buscar_registros(queryset, terminos: list):
+    '''
+    Filtra el queryset de registros dejando los que contienen todos los términos (mismo criterio que SearchFilter).
+    '''
+    vendor = connections[queryset.db].vendor
+    for termino in terminos:
+        subconsulta = _subconsulta(vendor, termino)
+        if subconsulta:
+            queryset = queryset.filter(id__in=RawSQL(*subconsulta))
+        else:
+            queryset = queryset.filter(
+                id__in=RegistroBusqueda.objects.filter(texto__icontains=termino).values('registro_id')
+            )
+    return queryset
+
+
+class RegistroSearchFilter(filters.SearchFilter):
+    '''
+    Reemplazo de SearchFilter para registros que usa el índice de búsqueda en vez de un icontains por campo.
+    Acepta el mismo parámetro ?search= y respeta search_fields para el esquema de la API.
+    '''
+
+    def filter_queryset(self, request, queryset, view):
+        terminos = self.get_search_terms(request)
+        if not terminos:
+            return queryset
+        return buscar_registros(queryset, terminos)
+
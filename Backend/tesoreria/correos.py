@@ -0,0 +1,238 @@
+'''
+Bandeja de salida de correos (CorreoSaliente).
+
+Los helpers de tesoreria.mails no envían: guardan cada correo en la bandeja, dentro de la misma transacción que el
+cambio que lo origina, así un correo no se pierde si se reinicia el proceso y el request no espera al servidor SMTP.
+El comando enviar_correos toma los pendientes de a lotes y los envía por una sola conexión SMTP por lote. Las
+plantillas se compilan una vez por proceso y los objetos del contexto se leen con una consulta por modelo y por lote.
+Si un envío falla se reintenta más tarde, con una espera que se duplica en cada intento. Si un objeto del contexto
+ya no existe el correo queda en error en lugar de enviarse incompleto.
+'''
+import json
+import logging
+import smtplib
+import uuid
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import models
+from django.db.models import F
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import CorreoSaliente
+
+logger = logging.getLogger(__name__)
+
+MAX_INTENTOS = 8
+# Espera antes del primer reintento; se duplica en cada intento hasta ESPERA_MAXIMA
+ESPERA_BASE = timedelta(minutes=1)
+ESPERA_MAXIMA = timedelta(hours=6)
+
+# Un correo tomado por un worker durante más de este tiempo se considera colgado (p. ej. se cayó el worker)
+TIEMPO_MAXIMO = timedelta(minutes=10)
+
+# Los correos enviados se borran de la bandeja pasado este tiempo
+RETENCION = timedelta(days=30)
+
+# Errores de la conexión SMTP (no del correo en particular): se reintenta el resto del lote con una conexión nueva
+ERRORES_CONEXION = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def _referencia(valor):
+    # Los objetos del contexto se guardan como referencia y se vuelven a leer al enviar
+    if isinstance(valor, models.Model):
+        return {'modelo': valor._meta.label, 'pk': valor.pk}
+    return valor
+
+
+def _es_referencia(valor) -> bool:
+    return isinstance(valor, dict) and set(valor) == {'modelo', 'pk'}
+
+
+class ObjetoEliminado(LookupError):
+    '''Un objeto del contexto del correo se eliminó después de encolarlo.'''
+
+
+def preparar(asunto: str, plantilla: str, contexto: dict, destinatario: str, remitente: str = None) -> CorreoSaliente:
+    '''Arma un correo para la bandeja, sin guardarlo. plantilla va sin extensión (p. ej. "emails/presupuesto").'''
+    return CorreoSaliente(
+        asunto=asunto[:255],
+        remitente=remitente or settings.EMAIL_HOST_USER,
+        destinatario=destinatario,
+        plantilla=plantilla,
+        contexto={clave: _referencia(valor) for clave, valor in contexto.items()},
+    )
+
+
+def encolar(correos: list) -> list:
+    '''Guarda los correos en la bandeja con una sola consulta. Se descartan los que no tienen destinatario.'''
+    correos = [correo for correo in correos if correo.destinatario]
+    if not correos:
+        return []
+    return CorreoSaliente.objects.bulk_create(correos)
+
+
+def tomar_lote(cantidad: int = 50) -> list:
+    '''
+    Marca como en envío hasta `cantidad` correos pendientes cuyo próximo intento ya llegó y los devuelve.
+    El update condicional con un identificador de lote evita que dos workers tomen el mismo correo.
+    '''
+    ahora = timezone.now()
+    candidatos = list(CorreoSaliente.objects.filter(
+        estado=CorreoSaliente.PENDIENTE, proximo_intento__lte=ahora
+    ).order_by('proximo_intento', 'id').values_list('id', flat=True)[:cantidad])
+    if not candidatos:
+        return []
+    lote = uuid.uuid4().hex
+    CorreoSaliente.objects.filter(id__in=candidatos, estado=CorreoSaliente.PENDIENTE).update(
+        estado=CorreoSaliente.ENVIANDO, lote=lote, tomado=ahora, intentos=F('intentos') + 1
+    )
+    return list(CorreoSaliente.objects.filter(lote=lote, estado=CorreoSaliente.ENVIANDO).order_by('id'))
+
+
+class Plantillas:
+    '''
+    Renderiza los correos de un lote. Las plantillas compiladas quedan en memoria del proceso; los objetos del contexto
+    se leen una vez por lote (una consulta por modelo) y un mismo contexto se renderiza una sola vez.
+    '''
+    compiladas = {}
+
+    def __init__(self, correos: list):
+        self.objetos = {}
+        self.renderizados = {}
+        por_modelo = {}
+        for correo in correos:
+            for valor in correo.contexto.values():
+                if _es_referencia(valor):
+                    por_modelo.setdefault(valor['modelo'], set()).add(valor['pk'])
+        for modelo, pks in por_modelo.items():
+            for pk, objeto in apps.get_model(modelo).objects.in_bulk(list(pks)).items():
+                self.objetos[(modelo, pk)] = objeto
+
+    @classmethod
+    def plantilla(cls, nombre: str):
+        if nombre not in cls.compiladas:
+            cls.compiladas[nombre] = get_template(nombre)
+        return cls.compiladas[nombre]
+
+    def objeto(self, referencia: dict):
+        clave = (referencia['modelo'], referencia['pk'])
+        if clave not in self.objetos:
+            raise ObjetoEliminado(f"{referencia['modelo']} {referencia['pk']} ya no existe")
+        return self.objetos[clave]
+
+    def contexto(self, correo: CorreoSaliente) -> dict:
+        return {
+            clave: self.objeto(valor) if _es_referencia(valor) else valor
+            for clave, valor in correo.contexto.items()
+        }
+
+    def renderizar(self, correo: CorreoSaliente) -> tuple[str, str]:
+        '''Devuelve el texto plano y el HTML del correo.'''
+        clave = (correo.plantilla, json.dumps(correo.contexto, sort_keys=True, default=str))
+        if clave not in self.renderizados:
+            contexto = self.contexto(correo)
+            self.renderizados[clave] = (
+                self.plantilla(f'{correo.plantilla}.txt').render(contexto),
+                self.plantilla(f'{correo.plantilla}.html').render(contexto),
+            )
+        return self.renderizados[clave]
+
+
+def _espera(intentos: int) -> timedelta:
+    return min(ESPERA_BASE * 2 ** max(intentos - 1, 0), ESPERA_MAXIMA)
+
+
+def _fallido(correo: CorreoSaliente, error, definitivo: bool = False) -> None:
+    correo.error = str(error)[:2000]
+    if definitivo or correo.intentos >= MAX_INTENTOS:
+        correo.estado = CorreoSaliente.ERROR
+    else:
+        correo.estado = CorreoSaliente.PENDIENTE
+        correo.proximo_intento = timezone.now() + _espera(correo.intentos)
+    # Solo si sigue tomado por este lote: liberar_colgados pudo devolverlo a la cola y otro worker tomarlo
+    CorreoSaliente.objects.filter(pk=correo.pk, lote=correo.lote, estado=CorreoSaliente.ENVIANDO).update(
+        estado=correo.estado, proximo_intento=correo.proximo_intento, error=correo.error
+    )
+
+
+def enviar_lote(correos: list, conexion=None) -> int:
+    '''
+    Envía los correos tomados con tomar_lote por una sola conexión SMTP. Los que fallan vuelven a la cola con espera
+    creciente (o quedan en error si agotaron los intentos o no se pueden renderizar). Devuelve la cantidad enviada.
+    '''
+    if not correos:
+        return 0
+    plantillas = Plantillas(correos)
+    conexion = conexion or get_connection()
+    try:
+        conexion.open()
+    except Exception as e:
+        logger.warning('No se pudo conectar al servidor SMTP: %s', e)
+        for correo in correos:
+            _fallido(correo, e)
+        return 0
+
+    enviados = []
+    try:
+        for correo in correos:
+            try:
+                texto, html = plantillas.renderizar(correo)
+            except (TemplateDoesNotExist, TemplateSyntaxError, ObjetoEliminado) as e:
+                _fallido(correo, e, definitivo=True)
+                continue
+            mensaje = EmailMultiAlternatives(
+                subject=correo.asunto,
+                body=texto,
+                from_email=correo.remitente,
+                to=[correo.destinatario],
+                connection=conexion,
+            )
+            mensaje.attach_alternative(html, "text/html")
+            try:
+                mensaje.send()
+                enviados.append(correo.pk)
+            except ERRORES_CONEXION as e:
+                # Se cortó la conexión: este correo se reintenta más tarde y el resto sigue con una conexión nueva
+                _fallido(correo, e)
+                conexion.close()
+                try:
+                    conexion.open()
+                except Exception as e:
+                    logger.warning('No se pudo reconectar al servidor SMTP: %s', e)
+                    pendientes = correos[correos.index(correo) + 1:]
+                    for pendiente in pendientes:
+                        _fallido(pendiente, e)
+                    break
+            except Exception as e:
+                _fallido(correo, e)
+    finally:
+        conexion.close()
+        if enviados:
+            # Igual que en _fallido, no se pisa un correo que ya tomó otro lote
+            CorreoSaliente.objects.filter(
+                id__in=enviados, lote__in={correo.lote for correo in correos}, estado=CorreoSaliente.ENVIANDO
+            ).update(estado=CorreoSaliente.ENVIADO, enviado=timezone.now(), error='')
+    return len(enviados)
+
+
+def liberar_colgados() -> int:
+    '''
+    Devuelve a la cola los correos que quedaron en envío más de TIEMPO_MAXIMO. Se les borra el lote, así el worker
+    que los tenía ya no puede marcarlos como enviados o fallidos.
+    '''
+    limite = timezone.now() - TIEMPO_MAXIMO
+    return CorreoSaliente.objects.filter(estado=CorreoSaliente.ENVIANDO, tomado__lt=limite).update(
+        estado=CorreoSaliente.PENDIENTE, proximo_intento=timezone.now(), lote=''
+    )
+
+
+def limpiar_enviados() -> int:
+    '''Borra de la bandeja los correos enviados hace más de RETENCION.'''
+    limite = timezone.now() - RETENCION
+    borrados, _ = CorreoSaliente.objects.filter(estado=CorreoSaliente.ENVIADO, enviado__lt=limite).delete()
+    return borrados
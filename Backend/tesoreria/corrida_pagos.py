@@ -0,0 +1,333 @@
+'''
+Corrida de pagos: varias órdenes de pago, de uno o varios proveedores, en un solo request (CorridaPagosView).
+
+Cada orden es lo mismo que recibe ProcessPaymentView (facturas, medios de pago e imputaciones múltiples), pero en lugar
+de procesarlas de a una:
+- preparar_corrida lee de una vez todas las facturas y los registros FC y PERCS que ya existen para ellas, y arma en
+  memoria los registros FC y PERCS (con los mismos valores que iva.utils, que usa ProcessPaymentView), OP y RETH, las
+  retenciones y los pagos. Si alguna orden tiene errores no se guarda nada;
+- aplicar_corrida guarda todo con operaciones masivas en una transacción corta. Los números de OP son los ids de
+  PagoFactura, que asigna la secuencia de la base, así dos corridas simultáneas nunca repiten número;
+- generar_ops dibuja los PDFs de las órdenes después del commit, en paralelo (ver tesoreria.pdfs), sin mantener la
+  transacción abierta.
+
+Los medios de pago en moneda extranjera se guardan con RegistroCrudSerializer, igual que en ProcessPaymentView, porque
+además del registro crean los de diferencia de cambio.
+'''
+import logging
+from datetime import date
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from simple_history.utils import bulk_create_with_history
+
+from iva.models import Documento, EstadoDocumento, Imputacion
+from iva.utils import PERCEPCIONES, importes_documento, registro_fc, registros_percepciones_nuevos
+from reportes.hechos import sincronizar_hechos
+from shared import catalogos, versiones
+
+from . import pdfs
+from .busqueda import indexar_registros
+from .models import Caja, PagoFactura, Registro, Retencion
+from .opdf import datos_orden_pago
+from .saldos import recalcular_saldos
+
+logger = logging.getLogger(__name__)
+
+TIPOS_FACTURA = ['FC', 'PERCS']
+CLIENTE_VARIOS = 'Varios'
+IMPUTACION_RETENCION = 'Impuesto a las Ganancias ret/perc'
+MONEDA_USD = 2
+ESTADO_PAGADO = 3
+
+
+def _fecha(valor) -> date:
+    return valor if isinstance(valor, date) else date.fromisoformat(str(valor)[:10])
+
+
+def necesita_tipo_de_cambio(medio: dict) -> bool:
+    '''Los medios en moneda extranjera pasan por la lógica de diferencia de cambio de RegistroCrudSerializer.'''
+    return medio.get('tipo_de_cambio') not in (None, 1) or medio['caja'].moneda_id == MONEDA_USD
+
+
+def _pk(registro) -> int:
+    # Los registros que ya existían se guardan en el plan por id, los nuevos como instancias sin guardar
+    return registro if isinstance(registro, int) else registro.pk
+
+
+def preparar_corrida(ordenes: list) -> tuple[list, list]:
+    '''
+    Arma en memoria todo lo que se guarda para cada orden. Recibe las órdenes validadas con OrdenPagoLoteSerializer y
+    devuelve (plan, errores); errores es una lista de {'orden': índice, ...} y si no está vacía el plan no se debe aplicar.
+    '''
+    ids = [factura_id for orden in ordenes for factura_id in orden['facturas']]
+    documentos = Documento.objects.select_related(
+        'proveedor', 'cliente_proyecto__unidad_de_negocio', 'unidad_de_negocio', 'imputacion', 'tipo_documento', 'moneda',
+    ).in_bulk(ids)
+    caja_facturas = catalogos.obtener_o_crear(Caja, 'Facturas')
+    # El nombre de la imputación no es único: si está repetido se usa la primera
+    imputacion_retencion = catalogos.primero_por_nombre(Imputacion, IMPUTACION_RETENCION)
+
+    # Registros FC activos que ya tienen las facturas: se reutilizan igual que en registro_desde_documento
+    por_documento_y_obra = {}
+    for fila in Registro.objects.filter(documento__in=ids, tipo_reg='FC', activo=True).order_by('id').values(
+        'id', 'documento', 'cliente_proyecto_id'
+    ):
+        por_documento_y_obra.setdefault((fila['documento'], fila['cliente_proyecto_id']), fila['id'])
+
+    # PERCS activos de las facturas con percepciones, para no repetirlos (ver registros_percepciones)
+    con_percepciones = [
+        documento.id for documento in documentos.values()
+        if any(importes_documento(documento)[campo] for campo in PERCEPCIONES)
+    ]
+    percepciones_existentes = {}
+    if con_percepciones:
+        for fila in Registro.objects.filter(documento__in=con_percepciones, tipo_reg='PERCS', activo=True).values(
+            'documento', 'imputacion_id', 'monto_gasto_ingreso_neto'
+        ):
+            percepciones_existentes.setdefault(fila['documento'], []).append(
+                (fila['imputacion_id'], fila['monto_gasto_ingreso_neto'])
+            )
+
+    errores = []
+    plan = []
+    orden_de_factura = {}
+    for indice, orden in enumerate(ordenes):
+        error = {}
+        faltantes = [factura_id for factura_id in orden['facturas'] if factura_id not in documentos]
+        if faltantes:
+            error['facturas'] = f'No existen las facturas {faltantes}'
+        repetidas = [factura_id for factura_id in orden['facturas'] if factura_id in orden_de_factura]
+        if repetidas:
+            error['facturas'] = f'Las facturas {repetidas} ya están en otra orden de la corrida'
+        duplicadas = sorted({factura_id for factura_id in orden['facturas'] if orden['facturas'].count(factura_id) > 1})
+        if duplicadas:
+            error['facturas'] = f'Las facturas {duplicadas} están repetidas en la orden'
+        for factura_id in orden['facturas']:
+            orden_de_factura.setdefault(factura_id, indice)
+        if imputacion_retencion is None and any(medio['tipo'] == 'Retención' for medio in orden['medios_pago']):
+            error['medios_pago'] = f'No existe la imputación {IMPUTACION_RETENCION}'
+        if error:
+            errores.append({'orden': indice, **error})
+            continue
+
+        facturas = [documentos[factura_id] for factura_id in orden['facturas']]
+        imputaciones_multiples = orden.get('imputaciones_multiples')
+        varios = [factura for factura in facturas
+                  if factura.cliente_proyecto and factura.cliente_proyecto.cliente_proyecto == CLIENTE_VARIOS]
+        if varios and not imputaciones_multiples:
+            errores.append({
+                'orden': indice,
+                'detail': 'Imputación múltiple requerida',
+                'facturas_varios': [{'id': f.id, 'numero': f"{f.serie}{f.tipo_documento.tipo_documento}{f.numero}",
+                                     'proveedor': f.proveedor.razon_social, 'total': f.total,
+                                     'neto': importes_documento(f)['neto'], 'iva': importes_documento(f)['iva']}
+                                    for f in varios],
+            })
+            continue
+        imputadas = {imputacion['factura_id'] for imputacion in imputaciones_multiples or []}
+        sin_imputar = [factura.id for factura in varios if factura.id not in imputadas]
+        if sin_imputar:
+            errores.append({'orden': indice, 'imputaciones_multiples': f'Faltan las imputaciones de las facturas {sin_imputar}'})
+            continue
+
+        # Las facturas pagadas quedan con la fecha del último medio de pago, como en ProcessPaymentView
+        fecha_facturas = _fecha(orden['medios_pago'][-1]['fecha'])
+        registros_fc = []
+        enlaces = []
+        for factura in facturas:
+            if factura in varios:
+                obras = [
+                    (imputacion['cliente_proyecto'], imputacion['monto'])
+                    for imputacion in imputaciones_multiples if imputacion['factura_id'] == factura.id
+                ]
+            else:
+                obras = [(None, None)]
+            for cliente_proyecto, monto in obras:
+                obra = cliente_proyecto if cliente_proyecto is not None else factura.cliente_proyecto
+                clave = (factura.id, obra.id if obra else None)
+                if clave in por_documento_y_obra:
+                    registros_fc.append(por_documento_y_obra[clave])
+                    continue
+                registro = registro_fc(factura, caja_facturas, cliente_proyecto=cliente_proyecto, monto=monto)
+                por_documento_y_obra[clave] = registro
+                registros_fc.append(registro)
+                enlaces.append((registro, factura.id))
+            for registro in registros_percepciones_nuevos(
+                factura, caja_facturas, percepciones_existentes.get(factura.id, [])
+            ):
+                registros_fc.append(registro)
+                enlaces.append((registro, factura.id))
+
+        medios = []
+        for medio in orden['medios_pago']:
+            fecha = _fecha(medio['fecha'])
+            retencion = medio['tipo'] == 'Retención'
+            registro = None
+            if not necesita_tipo_de_cambio(medio):
+                registro = Registro(
+                    tipo_reg='OP' if not retencion else 'RETH',
+                    caja=medio['caja'],
+                    añomes_imputacion=fecha.year * 100 + fecha.month,
+                    imputacion=imputacion_retencion if retencion else None,
+                    fecha_reg=fecha,
+                    proveedor=facturas[0].proveedor,
+                    observacion=facturas[0].concepto if facturas[0].concepto else None if not retencion else 'Retención',
+                    # El usuario indica los montos positivos, pero los registros al ser gastos deben ser negativos
+                    monto_op_rec=-medio['monto'],
+                    moneda_id=medio['caja'].moneda_id,
+                    tipo_de_cambio=medio.get('tipo_de_cambio'),
+                    realizado=fecha <= date.today(),
+                )
+                enlaces.extend((registro, factura.id) for factura in facturas)
+            medios.append({'medio': medio, 'registro': registro, 'retencion': retencion})
+
+        plan.append({
+            'orden': indice,
+            'facturas': facturas,
+            'medios': medios,
+            'registros_fc': registros_fc,
+            'enlaces': enlaces,
+            'fecha_facturas': fecha_facturas,
+        })
+    return plan, errores
+
+
+def _registro_con_tipo_de_cambio(medio: dict, facturas: list) -> Registro:
+    # Mismo camino que ProcessPaymentView.registrar_pago, que además crea los registros de diferencia de cambio
+    from .serializers import RegistroCrudSerializer
+
+    retencion = medio['tipo'] == 'Retención'
+    fecha = _fecha(medio['fecha'])
+    serializer = RegistroCrudSerializer(data={
+        'tipo_reg': 'OP' if not retencion else 'RETH',
+        'caja': medio['caja'].id,
+        'documento': [factura.id for factura in facturas],
+        'añomes_imputacion': fecha.year * 100 + fecha.month,
+        'imputacion': catalogos.primero_por_nombre(Imputacion, IMPUTACION_RETENCION).pk if retencion else None,
+        'fecha_reg': medio['fecha'],
+        'proveedor': facturas[0].proveedor.id,
+        'observacion': facturas[0].concepto if facturas[0].concepto else None if not retencion else 'Retención',
+        'monto_op_rec': -medio['monto'],
+        'moneda': medio['caja'].moneda_id,
+        'tipo_de_cambio': medio.get('tipo_de_cambio'),
+        'realizado': 1 if fecha <= date.today() else 0,
+    })
+    serializer.is_valid(raise_exception=True)
+    return serializer.save()
+
+
+@transaction.atomic
+def aplicar_corrida(plan: list, usuario=None) -> list:
+    '''Guarda el plan de preparar_corrida con operaciones masivas. Devuelve los PagoFactura creados, en orden.'''
+    facturas_ids = [factura.id for orden in plan for factura in orden['facturas']]
+
+    # Registros FC, OP y RETH nuevos, con su historial, y sus documentos
+    nuevos = []
+    for orden in plan:
+        nuevos.extend(registro for registro in orden['registros_fc'] if not isinstance(registro, int))
+        nuevos.extend(medio['registro'] for medio in orden['medios'] if medio['registro'] is not None)
+    bulk_create_with_history(nuevos, Registro, batch_size=500, default_user=usuario)
+    RegistroDocumento = Registro.documento.through
+    RegistroDocumento.objects.bulk_create([
+        RegistroDocumento(registro_id=registro.pk, documento_id=documento_id)
+        for orden in plan for registro, documento_id in orden['enlaces']
+    ], batch_size=1000)
+
+    # Los medios en moneda extranjera se guardan de a uno, con sus registros de diferencia de cambio
+    for orden in plan:
+        for medio in orden['medios']:
+            if medio['registro'] is None:
+                medio['registro'] = _registro_con_tipo_de_cambio(medio['medio'], orden['facturas'])
+
+    # Retenciones
+    retenciones = []
+    for orden in plan:
+        for medio in orden['medios']:
+            if medio['retencion']:
+                retenciones.append((Retencion(
+                    registro=medio['registro'],
+                    numero=medio['medio'].get('numero_certificado'),
+                    tipo=medio['medio'].get('tipo_retencion') or 'IIGG',
+                    pdf_file=medio['medio'].get('pdf_file'),
+                ), orden))
+    Retencion.objects.bulk_create([retencion for retencion, _ in retenciones])
+    Retencion.registro_fc.through.objects.bulk_create([
+        Retencion.registro_fc.through(retencion_id=retencion.pk, registro_id=_pk(registro))
+        for retencion, orden in retenciones for registro in orden['registros_fc']
+    ], batch_size=1000)
+
+    # Pagos: el id que asigna la base es el número de la OP
+    hoy = date.today()
+    pagos = PagoFactura.objects.bulk_create([
+        PagoFactura(monto=sum(medio['medio']['monto'] for medio in orden['medios']), fecha_pago=hoy)
+        for orden in plan
+    ])
+    PagoFactura.documentos.through.objects.bulk_create([
+        PagoFactura.documentos.through(pagofactura_id=pago.pk, documento_id=factura.id)
+        for pago, orden in zip(pagos, plan) for factura in orden['facturas']
+    ], batch_size=1000)
+    PagoFactura.registros_pago.through.objects.bulk_create([
+        PagoFactura.registros_pago.through(pagofactura_id=pago.pk, registro_id=medio['registro'].pk)
+        for pago, orden in zip(pagos, plan) for medio in orden['medios']
+    ], batch_size=1000)
+    PagoFactura.registros_fc.through.objects.bulk_create([
+        PagoFactura.registros_fc.through(pagofactura_id=pago.pk, registro_id=_pk(registro))
+        for pago, orden in zip(pagos, plan) for registro in orden['registros_fc']
+    ], batch_size=1000)
+
+    # Las facturas pagadas (y sus percepciones) pasan a la fecha del pago
+    movidos = []
+    # (caja, fecha) que cambian los registros movidos: la fecha que tenían y la nueva
+    fechas_movidos = set()
+    for fecha in {orden['fecha_facturas'] for orden in plan}:
+        facturas_fecha = [factura.id for orden in plan if orden['fecha_facturas'] == fecha for factura in orden['facturas']]
+        registros_factura = Registro.objects.filter(documento__id__in=facturas_fecha, tipo_reg__in=TIPOS_FACTURA)
+        filas = list(registros_factura.values('id', 'caja_id', 'fecha_reg'))
+        movidos.extend(filas)
+        for fila in filas:
+            fechas_movidos.update([(fila['caja_id'], fila['fecha_reg']), (fila['caja_id'], fecha)])
+        registros_factura.update(fecha_reg=fecha)
+
+    Documento.objects.filter(id__in=facturas_ids, imputado=False).update(imputado=True)
+    EstadoDocumento.objects.bulk_create([
+        EstadoDocumento(documento_id=factura_id, estado=ESTADO_PAGADO, usuario=usuario) for factura_id in facturas_ids
+    ])
+
+    # bulk_create y update() no disparan señales: saldos, búsqueda y tabla de hechos se actualizan una vez por caja
+    desde_por_caja = {}
+    fechas = {(registro.caja_id, registro.fecha_reg) for registro in nuevos} | fechas_movidos
+    for caja_id, fecha in fechas:
+        fecha = _fecha(fecha)
+        desde_por_caja[caja_id] = min(fecha, desde_por_caja.get(caja_id, fecha))
+    for caja_id, desde in desde_por_caja.items():
+        recalcular_saldos(caja_id, desde=desde)
+    ids = {registro.pk for registro in nuevos} | {fila['id'] for fila in movidos}
+    indexar_registros(list(ids))
+    sincronizar_hechos(list(ids))
+    versiones.incrementar(Registro)
+    return pagos
+
+
+def generar_ops(plan: list, pagos: list) -> list:
+    '''
+    Dibuja las órdenes de pago de una corrida ya guardada (en paralelo si son muchas) y las guarda en PagoFactura.op.
+    También la usa ProcessPaymentView para un solo pago. Se llama después del commit. Devuelve los pagos con op
+    cargada; si falla el dibujo los pagos quedan sin PDF.
+    '''
+    lista_datos = []
+    for orden, pago in zip(plan, pagos):
+        proveedor = orden['facturas'][0].proveedor
+        datos_proveedor = {'op_nro': pago.pk, 'nombre': proveedor.razon_social, 'cnpj': proveedor.cnpj}
+        lista_datos.append(datos_orden_pago(
+            "orden_de_pago.pdf", datos_proveedor, [medio['medio'] for medio in orden['medios']], orden['facturas']
+        ))
+    try:
+        contenidos = pdfs.renderizar_lote('orden_pago', lista_datos)
+    except Exception as e:
+        logger.error('No se pudieron generar las OPs de la corrida de pagos %s: %s', [pago.pk for pago in pagos], e)
+        return pagos
+    for pago, contenido in zip(pagos, contenidos):
+        pago.op.save('op.pdf', ContentFile(contenido), save=False)
+    PagoFactura.objects.bulk_update(pagos, ['op'], batch_size=500)
+    return pagos
@@ -0,0 +1,136 @@
+'''
+Calendario de cotizaciones del dólar MEP y caché en memoria para las conversiones de moneda.
+
+CotizacionDiaria tiene una fila por día desde la primera cotización cargada, con la última cotización vigente a esa
+fecha (forward fill). Se actualiza desde las señales de DolarMEP, así que alta, edición o baja de una cotización solo
+recalcula el tramo del calendario que va desde esa fecha en adelante.
+
+Cada proceso guarda el calendario en un diccionario {fecha: (compra, venta, fecha_cotizacion)}, así convertir un
+registro es una búsqueda en memoria en lugar de una subconsulta por fila.
+'''
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import DolarMEP, CotizacionDiaria
+
+# Segundos que un proceso reutiliza el calendario antes de volver a leerlo (los otros workers de gunicorn no se enteran
+# de los cambios, el proceso que modifica una cotización invalida su caché al confirmar la transacción)
+CACHE_TTL = 60
+
+_lock = threading.Lock()
+_cache = {
+    'cargado': 0.0,
+    'calendario': {},
+    'fechas': [],
+}
+
+
+def _fecha(valor) -> date:
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+@transaction.atomic
+def actualizar_calendario(desde=None) -> int:
+    '''
+    Regenera CotizacionDiaria desde la fecha indicada (o completo) hasta hoy o la última cotización si es posterior.
+    Devuelve la cantidad de días escritos.
+    '''
+    cotizaciones = DolarMEP.objects.order_by('fecha', 'id')
+    filas_existentes = CotizacionDiaria.objects.all()
+    vigente = None
+    if desde:
+        desde = _fecha(desde)
+        vigente = DolarMEP.objects.filter(fecha__lt=desde).order_by('-fecha', '-id').first()
+        cotizaciones = cotizaciones.filter(fecha__gte=desde)
+        filas_existentes = filas_existentes.filter(fecha__gte=desde)
+    filas_existentes.delete()
+
+    # Si hay varias cotizaciones para el mismo día vale la primera, igual que las búsquedas con .first()
+    por_fecha = {}
+    for cotizacion in cotizaciones:
+        por_fecha.setdefault(cotizacion.fecha, cotizacion)
+
+    if not por_fecha and not vigente:
+        _invalidar_al_confirmar()
+        return 0
+
+    dia = desde if vigente else min(por_fecha)
+    hasta = max([date.today(), *por_fecha])
+    filas = []
+    while dia <= hasta:
+        vigente = por_fecha.get(dia, vigente)
+        filas.append(CotizacionDiaria(
+            fecha=dia, compra=vigente.compra, venta=vigente.venta, fecha_cotizacion=vigente.fecha
+        ))
+        dia += timedelta(days=1)
+    CotizacionDiaria.objects.bulk_create(filas, batch_size=1000)
+    _invalidar_al_confirmar()
+    return len(filas)
+
+
+def _invalidar_al_confirmar() -> None:
+    transaction.on_commit(invalidar_cache)
+
+
+def invalidar_cache() -> None:
+    with _lock:
+        _cache['cargado'] = 0.0
+
+
+def _calendario() -> tuple:
+    with _lock:
+        if time.monotonic() - _cache['cargado'] > CACHE_TTL or not _cache['cargado']:
+            calendario = {
+                fecha: (compra, venta, fecha_cotizacion)
+                for fecha, compra, venta, fecha_cotizacion in CotizacionDiaria.objects.order_by('fecha').values_list(
+                    'fecha', 'compra', 'venta', 'fecha_cotizacion')
+            }
+            _cache['calendario'] = calendario
+            _cache['fechas'] = list(calendario)
+            _cache['cargado'] = time.monotonic()
+        return _cache['calendario'], _cache['fechas']
+
+
+def _buscar(fecha) -> tuple:
+    calendario, fechas = _calendario()
+    fecha = _fecha(fecha)
+    fila = calendario.get(fecha)
+    if fila is None and fechas and fecha > fechas[-1]:
+        # Después del final del calendario sigue vigente la última cotización
+        fila = calendario[fechas[-1]]
+    return fila
+
+
+def cotizacion_vigente(fecha, campo: str = 'compra') -> Decimal | None:
+    '''
+    Devuelve la cotización vigente a la fecha (la del día o la última anterior), o None si es anterior a la primera.
+    Es la que se usa para convertir montos a USD.
+    '''
+    if not fecha:
+        return None
+    fila = _buscar(fecha)
+    if fila is None:
+        return None
+    return fila[0] if campo == 'compra' else fila[1]
+
+
+def cotizacion_exacta(fecha, campo: str = 'compra') -> Decimal | None:
+    '''
+    Devuelve la cotización cargada exactamente para la fecha, o None si ese día no tiene cotización.
+    Se usa para la diferencia de cambio, que se registra recién cuando se carga la cotización del día (ver DolarMEPList.post).
+    '''
+    if not fecha:
+        return None
+    fila = _buscar(fecha)
+    if fila is not None and fila[2] == _fecha(fecha):
+        return fila[0] if campo == 'compra' else fila[1]
+    # La caché puede no tener todavía una cotización cargada por otro proceso: en ese caso consultamos la tabla
+    return DolarMEP.objects.filter(fecha=fecha).values_list(campo, flat=True).first()
@@ -0,0 +1,339 @@
+'''
+Revaluación por diferencia de cambio al cargar, corregir o eliminar cotizaciones DolarMEP.
+
+Cada registro con tipo de cambio propio (> 1) distinto de la cotización MEP del día genera registros "Diferencia de
+cambio" en la misma fecha, por (cotización - tipo de cambio) * monto en USD, repartidos por cliente/proyecto según sus
+documentos (misma regla que usaba DolarMEPList.post). Los registros en USD sin tipo de cambio (1) se pasan a pesos con
+la cotización.
+
+revaluar recibe la cotización de un conjunto de fechas (None si la fecha se quedó sin cotización), calcula en una sola
+pasada las diferencias que corresponden y las compara con las que ya existen: inserta, actualiza y borra con operaciones
+masivas, con sus filas de historial. Los saldos, la búsqueda y la tabla de hechos se actualizan una vez al final.
+'''
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from iva.models import ClienteProyecto, Imputacion, UnidadDeNegocio
+from reportes.hechos import programar_meses
+from shared import catalogos, versiones
+
+from .busqueda import indexar_registros
+from .historial_mantenimiento import CAMBIO_AUTOMATICO
+from .models import DolarMEP, Registro
+from .saldos import recalcular_saldos
+
+IMPUTACION = 'Diferencia de cambio'
+OBSERVACION = 'Diferencia de cambio'
+INDIRECTOS = 'Indirectos'
+TIPOS_PAGO = ['PSF', 'OP', 'OPFC']
+MONEDA_ARS = 1
+MONEDA_USD = 2
+
+MONTOS = ['monto_gasto_ingreso_neto', 'iva_gasto_ingreso', 'monto_op_rec']
+
+DOS_DECIMALES = Decimal('0.01')
+CUATRO_DECIMALES = Decimal('0.0001')
+
+def _fecha(valor) -> date:
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+def _redondear(valor, decimales=CUATRO_DECIMALES):
+    return None if valor is None else Decimal(valor).quantize(decimales)
+
+
+def _imputacion() -> Imputacion:
+    imputacion = catalogos.primero_por_nombre(Imputacion, IMPUTACION)
+    if imputacion is None:
+        raise ValueError(f"No existe la imputación '{IMPUTACION}'")
+    return imputacion
+
+
+def _documentos(registro_ids) -> dict:
+    '''registro_id -> [(documento_id, total, cliente_proyecto_id, unidad_de_negocio_id)], en una sola consulta.'''
+    documentos = {}
+    filas = Registro.documento.through.objects.filter(registro_id__in=registro_ids).order_by('documento_id').values_list(
+        'registro_id', 'documento_id', 'documento__total', 'documento__cliente_proyecto_id', 'documento__unidad_de_negocio_id'
+    )
+    for registro_id, *documento in filas:
+        documentos.setdefault(registro_id, []).append(tuple(documento))
+    return documentos
+
+
+class _Indirectos:
+    '''Unidad de negocio y cliente/proyecto "Indirectos" de las diferencias de los MC, se buscan solo si hacen falta.'''
+
+    def __init__(self):
+        self._ids = None
+
+    def ids(self) -> tuple:
+        if self._ids is None:
+            unidad = UnidadDeNegocio.objects.filter(unidad_de_negocio=INDIRECTOS).values_list('id', flat=True).first()
+            cliente = ClienteProyecto.objects.filter(cliente_proyecto=INDIRECTOS).values_list('id', flat=True).first()
+            if unidad is None or cliente is None:
+                raise ValueError(f"No existe la unidad de negocio o el cliente/proyecto '{INDIRECTOS}'")
+            self._ids = (unidad, cliente)
+        return self._ids
+
+
+def diferencia(registro: Registro, tc_mep: Decimal) -> Decimal | None:
+    '''Diferencia de cambio del registro con la cotización, o None si no corresponde.'''
+    tc_reg = registro.tipo_de_cambio
+    if not tc_reg or tc_reg <= 1 or tc_reg == tc_mep or registro.monto_op_rec is None:
+        return None
+    dif = ((tc_mep - tc_reg) * (registro.monto_op_rec / tc_reg)).quantize(DOS_DECIMALES)
+    return dif or None
+
+
+def diferencias_del_registro(registro: Registro, tc_mep: Decimal, documentos: list, indirectos: _Indirectos) -> list[dict]:
+    '''
+    Registros de diferencia de cambio que le corresponden a un registro, como dicts con los campos a guardar
+    (más 'documentos', los ids a asociar).
+    '''
+    dif = diferencia(registro, tc_mep)
+    if dif is None:
+        return []
+    fecha = _fecha(registro.fecha_reg)
+    tipo_reg = 'PSF' if registro.tipo_reg in TIPOS_PAGO else 'ISF'
+    base = {
+        'fecha_reg': fecha,
+        'añomes_imputacion': fecha.year * 100 + fecha.month,
+        'tipo_reg': tipo_reg,
+        'caja_id': registro.caja_id,
+        'caja_contrapartida_id': None,
+        'unidad_de_negocio_id': registro.unidad_de_negocio_id,
+        'cliente_proyecto_id': registro.cliente_proyecto_id,
+        'proveedor_id': registro.proveedor_id,
+        'tipo_de_cambio': registro.tipo_de_cambio,
+        'monto': dif,
+        'realizado': fecha <= date.today(),
+        'documentos': (),
+    }
+
+    # Con documentos la diferencia se reparte por cliente/proyecto en proporción al total de cada documento
+    total_documentos = sum(total or 0 for _, total, _, _ in documentos)
+    if documentos and total_documentos:
+        montos = {}
+        por_cliente = {}
+        for documento_id, total, cliente_id, unidad_id in documentos:
+            montos[cliente_id] = montos.get(cliente_id, 0) + ((total or 0) / total_documentos * dif).quantize(DOS_DECIMALES)
+            por_cliente.setdefault(cliente_id, []).append((documento_id, unidad_id))
+        return [
+            {
+                **base,
+                'cliente_proyecto_id': cliente_id,
+                'unidad_de_negocio_id': registro.unidad_de_negocio_id or docs[0][1],
+                'monto': montos[cliente_id],
+                'realizado': True,
+                'documentos': tuple(documento_id for documento_id, _ in docs),
+            }
+            for cliente_id, docs in por_cliente.items()
+        ]
+
+    # Los movimientos entre cuentas solo generan diferencia del lado que sale, imputada a Indirectos
+    if registro.tipo_reg == 'MC':
+        if registro.monto_op_rec > 0:
+            return []
+        unidad_id, cliente_id = indirectos.ids()
+        return [{
+            **base,
+            'tipo_reg': 'ISF',
+            'añomes_imputacion': registro.añomes_imputacion,
+            'caja_contrapartida_id': registro.caja_contrapartida_id,
+            'unidad_de_negocio_id': unidad_id,
+            'cliente_proyecto_id': cliente_id,
+            'proveedor_id': None,
+            'realizado': True,
+        }]
+
+    return [base]
+
+
+def _clave(fecha, tipo_reg, caja_id, caja_contrapartida_id, unidad_de_negocio_id, cliente_proyecto_id, proveedor_id,
+           tipo_de_cambio, documentos) -> tuple:
+    return (_fecha(fecha), tipo_reg, caja_id, caja_contrapartida_id, unidad_de_negocio_id, cliente_proyecto_id,
+            proveedor_id, _redondear(tipo_de_cambio), tuple(sorted(documentos)))
+
+
+def _clave_esperada(esperada: dict) -> tuple:
+    return _clave(esperada['fecha_reg'], esperada['tipo_reg'], esperada['caja_id'], esperada['caja_contrapartida_id'],
+                  esperada['unidad_de_negocio_id'], esperada['cliente_proyecto_id'], esperada['proveedor_id'],
+                  esperada['tipo_de_cambio'], esperada['documentos'])
+
+
+def _clave_existente(registro: Registro, documentos: list) -> tuple:
+    return _clave(registro.fecha_reg, registro.tipo_reg, registro.caja_id, registro.caja_contrapartida_id,
+                  registro.unidad_de_negocio_id, registro.cliente_proyecto_id, registro.proveedor_id,
+                  registro.tipo_de_cambio, [documento[0] for documento in documentos])
+
+
+def calcular_revaluacion(cotizaciones: dict) -> dict:
+    '''
+    Calcula los cambios de la revaluación sin guardarlos. cotizaciones es fecha -> compra (None si la fecha no tiene
+    cotización). Devuelve un dict con:
+    - nuevos: registros de diferencia a insertar (sin guardar) y los ids de documentos de cada uno
+    - actualizados: registros de diferencia existentes con el monto corregido
+    - eliminados: registros de diferencia que ya no corresponden
+    - convertidos: registros en USD sin tipo de cambio, pasados a pesos con la cotización
+    '''
+    cotizaciones = {_fecha(fecha): (None if compra is None else Decimal(compra)) for fecha, compra in cotizaciones.items()}
+    cambios = {'nuevos': [], 'actualizados': [], 'eliminados': [], 'convertidos': []}
+    if not cotizaciones:
+        return cambios
+    imputacion = _imputacion()
+    indirectos = _Indirectos()
+
+    # Una consulta para los registros de origen de todas las fechas y otra para las diferencias ya generadas
+    fuentes = list(Registro.objects.filter(
+        fecha_reg__in=[fecha for fecha, compra in cotizaciones.items() if compra is not None]
+    ).exclude(imputacion=imputacion).order_by('id'))
+    existentes = list(Registro.objects.filter(
+        fecha_reg__in=list(cotizaciones), imputacion=imputacion, observacion=OBSERVACION
+    ).order_by('id'))
+    documentos = _documentos([registro.pk for registro in fuentes + existentes])
+
+    esperadas = {}
+    for registro in fuentes:
+        tc_mep = cotizaciones[_fecha(registro.fecha_reg)]
+        tc_reg = registro.tipo_de_cambio
+        if tc_reg and tc_reg > 1 and tc_reg != tc_mep:
+            for esperada in diferencias_del_registro(registro, tc_mep, documentos.get(registro.pk, []), indirectos):
+                esperadas.setdefault(_clave_esperada(esperada), []).append(esperada)
+        elif registro.moneda_id == MONEDA_USD and tc_reg == 1:
+            # Un registro en USD con tipo de cambio 1 no tiene el tipo de cambio cargado: se toma el MEP del día
+            for campo in MONTOS:
+                valor = getattr(registro, campo)
+                setattr(registro, campo, (valor * tc_mep).quantize(CUATRO_DECIMALES) if valor else None)
+            registro.tipo_de_cambio = tc_mep
+            cambios['convertidos'].append(registro)
+
+    por_clave = {}
+    for registro in existentes:
+        por_clave.setdefault(_clave_existente(registro, documentos.get(registro.pk, [])), []).append(registro)
+
+    for clave in set(esperadas) | set(por_clave):
+        pendientes = list(esperadas.get(clave, []))
+        sobrantes = []
+        # Primero se descartan las que ya tienen el monto correcto, así no se reescriben
+        for registro in por_clave.get(clave, []):
+            igual = next((esperada for esperada in pendientes if esperada['monto'] == registro.monto_op_rec
+                          and esperada['monto'] == registro.monto_gasto_ingreso_neto), None)
+            if igual is not None:
+                pendientes.remove(igual)
+            else:
+                sobrantes.append(registro)
+        for registro, esperada in zip(sobrantes, pendientes):
+            registro.monto_gasto_ingreso_neto = esperada['monto']
+            registro.monto_op_rec = esperada['monto']
+            cambios['actualizados'].append(registro)
+        cambios['eliminados'].extend(sobrantes[len(pendientes):])
+        for esperada in pendientes[len(sobrantes):]:
+            nuevo = Registro(
+                fecha_reg=esperada['fecha_reg'],
+                añomes_imputacion=esperada['añomes_imputacion'],
+                tipo_reg=esperada['tipo_reg'],
+                caja_id=esperada['caja_id'],
+                caja_contrapartida_id=esperada['caja_contrapartida_id'],
+                unidad_de_negocio_id=esperada['unidad_de_negocio_id'],
+                cliente_proyecto_id=esperada['cliente_proyecto_id'],
+                proveedor_id=esperada['proveedor_id'],
+                imputacion=imputacion,
+                observacion=OBSERVACION,
+                monto_gasto_ingreso_neto=esperada['monto'],
+                monto_op_rec=esperada['monto'],
+                tipo_de_cambio=esperada['tipo_de_cambio'],
+                moneda_id=MONEDA_ARS,
+                realizado=esperada['realizado'],
+            )
+            cambios['nuevos'].append((nuevo, esperada['documentos']))
+    return cambios
+
+
+def _borrar(registros: list, usuario=None) -> None:
+    '''
+    Borra los registros con el delete() del queryset, que también borra o desvincula sus relaciones y deja la fila de
+    historial '-' de cada uno. Son pocos registros por fecha: los saldos y la tabla de hechos los vuelve a calcular
+    aplicar_revaluacion al final.
+    '''
+    if not registros:
+        return
+    ids = [registro.pk for registro in registros]
+    ahora = timezone.now()
+    Registro.objects.filter(id__in=ids).delete()
+    # El historial de un delete() masivo no sabe quién ni por qué: se marca como cambio automático, igual que las altas
+    cambios = {'history_change_reason': CAMBIO_AUTOMATICO}
+    if usuario is not None:
+        cambios['history_user'] = usuario
+    Registro.history.filter(id__in=ids, history_type='-', history_date__gte=ahora).update(**cambios)
+
+
+@transaction.atomic
+def aplicar_revaluacion(cambios: dict, usuario=None) -> None:
+    '''Guarda los cambios de calcular_revaluacion con operaciones masivas y actualiza las tablas derivadas.'''
+    nuevos = [registro for registro, _ in cambios['nuevos']]
+    if nuevos:
+        bulk_create_with_history(nuevos, Registro, batch_size=500, default_user=usuario,
+                                 default_change_reason=CAMBIO_AUTOMATICO)
+        Registro.documento.through.objects.bulk_create([
+            Registro.documento.through(registro_id=registro.pk, documento_id=documento_id)
+            for registro, documentos in cambios['nuevos'] for documento_id in documentos
+        ])
+    if cambios['actualizados']:
+        bulk_update_with_history(cambios['actualizados'], Registro, ['monto_gasto_ingreso_neto', 'monto_op_rec'],
+                                 batch_size=500, default_user=usuario, default_change_reason=CAMBIO_AUTOMATICO)
+    if cambios['convertidos']:
+        bulk_update_with_history(cambios['convertidos'], Registro, MONTOS + ['tipo_de_cambio'],
+                                 batch_size=500, default_user=usuario, default_change_reason=CAMBIO_AUTOMATICO)
+    _borrar(cambios['eliminados'], usuario)
+
+    # Las operaciones masivas no disparan señales: saldos, búsqueda y hechos se actualizan una vez por caja y por mes
+    tocados = nuevos + cambios['actualizados'] + cambios['convertidos'] + cambios['eliminados']
+    if not tocados:
+        return
+    desde_por_caja = {}
+    for registro in tocados:
+        fecha = _fecha(registro.fecha_reg)
+        desde_por_caja[registro.caja_id] = min(fecha, desde_por_caja.get(registro.caja_id, fecha))
+    for caja_id, desde in desde_por_caja.items():
+        recalcular_saldos(caja_id, desde=desde)
+    eliminados = {registro.pk for registro in cambios['eliminados']}
+    indexar_registros([registro.pk for registro in tocados if registro.pk not in eliminados])
+    programar_meses({registro.añomes_imputacion for registro in tocados})
+    versiones.incrementar(Registro)
+
+
+def resumen(cambios: dict) -> dict:
+    return {clave: len(valor) for clave, valor in cambios.items()}
+
+
+def revaluar(cotizaciones: dict, usuario=None, simular: bool = False) -> dict:
+    '''
+    Revalúa las fechas indicadas (fecha -> compra, None si la fecha no tiene cotización). Con simular solo calcula.
+    Devuelve la cantidad de registros nuevos, actualizados, eliminados y convertidos.
+    '''
+    cambios = calcular_revaluacion(cotizaciones)
+    if not simular:
+        aplicar_revaluacion(cambios, usuario)
+    return resumen(cambios)
+
+
+def cotizaciones_de(fechas) -> dict:
+    '''fecha -> compra de DolarMEP para las fechas indicadas (None si no tienen cotización), en una consulta.'''
+    cotizaciones = {_fecha(fecha): None for fecha in fechas}
+    # Si hay más de una cotización para la fecha se usa la primera que se cargó
+    for fecha, compra in DolarMEP.objects.filter(fecha__in=list(cotizaciones)).order_by('-id').values_list('fecha', 'compra'):
+        cotizaciones[_fecha(fecha)] = compra
+    return cotizaciones
+
+
+def revaluar_fechas(fechas, usuario=None, simular: bool = False) -> dict:
+    '''Revalúa las fechas con la cotización que tienen guardada en DolarMEP.'''
+    return revaluar(cotizaciones_de(fechas), usuario, simular)
@@ -0,0 +1,74 @@
+'''
+Lectura del historial de cambios de Registro (acción historial de RegistroViewSet).
+
+Los nombres de proveedor, cliente/proyecto, imputación y caja de todas las versiones pedidas se resuelven juntos, con una
+consulta in_bulk por modelo, en lugar de un .get() por versión y por campo. Las diferencias entre cada versión y la
+anterior se calculan acá, así la vista de auditoría de un registro muy editado hace siempre la misma cantidad de
+consultas y el frontend no tiene que comparar las versiones.
+'''
+from iva.models import ClienteProyecto, Imputacion, Persona
+
+from .models import Caja
+
+# Campo de nombre en la respuesta: (campo FK del registro, modelo, campos que se leen, cómo se muestra, etiqueta si
+# el objeto ya no existe)
+RELACIONES = {
+    'proveedor_nombre': (
+        'proveedor_id', Persona, ['razon_social', 'nombre_fantasia'], lambda persona: persona.nombre(), 'Proveedor'
+    ),
+    'cliente_proyecto_nombre': ('cliente_proyecto_id', ClienteProyecto, ['cliente_proyecto'], str, 'Cliente'),
+    'imputacion_nombre': ('imputacion_id', Imputacion, ['imputacion'], str, 'Imputación'),
+    'caja_nombre': ('caja_id', Caja, ['caja'], str, 'Caja'),
+}
+
+# Campos que se comparan entre versiones
+CAMPOS_COMPARADOS = [
+    'tipo_reg', 'fecha_reg', 'monto_gasto_ingreso_neto', 'iva_gasto_ingreso', 'monto_op_rec', 'observacion',
+    'realizado', 'activo', 'moneda', 'tipo_de_cambio', 'proveedor_nombre', 'cliente_proyecto_nombre',
+    'imputacion_nombre', 'caja_nombre',
+]
+
+TIPOS_CAMBIO = {
+    '+': 'Creado',
+    '~': 'Modificado',
+    '-': 'Eliminado',
+}
+
+
+def resolver_nombres(versiones) -> dict:
+    '''
+    Devuelve {campo de nombre: {id: nombre}} para todas las versiones, con una consulta por modelo. Los ids que ya no
+    existen (p. ej. un proveedor borrado) quedan con un texto que indica el id.
+    '''
+    nombres = {}
+    for campo, (atributo, modelo, campos, mostrar, etiqueta) in RELACIONES.items():
+        ids = {getattr(version, atributo) for version in versiones} - {None}
+        objetos = modelo.objects.only('id', *campos).in_bulk(ids) if ids else {}
+        nombres[campo] = {
+            pk: mostrar(objetos[pk]) if pk in objetos else f'{etiqueta} ID: {pk}'
+            for pk in ids
+        }
+    return nombres
+
+
+def nombre(nombres: dict, campo: str, version):
+    pk = getattr(version, RELACIONES[campo][0])
+    if pk is None:
+        return None
+    return nombres.get(campo, {}).get(pk)
+
+
+def cambios(actual: dict, anterior: dict | None) -> list:
+    '''
+    Diferencias campo por campo entre dos versiones ya serializadas. Sin versión anterior (la creación, o la primera
+    versión que se conserva) se listan todos los campos con valor.
+    '''
+    if anterior is None:
+        return [
+            {'campo': campo, 'anterior': None, 'nuevo': actual.get(campo)}
+            for campo in CAMPOS_COMPARADOS if actual.get(campo) not in (None, '')
+        ]
+    return [
+        {'campo': campo, 'anterior': anterior.get(campo), 'nuevo': actual.get(campo)}
+        for campo in CAMPOS_COMPARADOS if actual.get(campo) != anterior.get(campo)
+    ]
@@ -0,0 +1,119 @@
+'''
+Mantenimiento de la tabla de historial de Registro (comando compactar_historial).
+
+Cada save de un registro copia la fila entera a tesoreria_historicalregistro, también los que no cambian nada y los que
+hacen los procesos automáticos (revaluación por diferencia de cambio). Para que la tabla no crezca más rápido que
+Registro:
+- compactar borra las versiones que no cambian ningún campo respecto de la anterior y, de cada tramo de versiones
+  automáticas seguidas con poca diferencia entre sí (una misma corrida del proceso), deja solo la última. Las versiones
+  que guardan los usuarios no se unen nunca: cada una es un cambio que alguien hizo y se audita. Solo toca versiones
+  más viejas que HISTORIAL_COMPACTAR_DIAS, así lo reciente se sigue viendo completo;
+- la retención (HISTORIAL_RETENCION_DIAS, 0 = sin límite) borra las versiones más viejas que ese plazo, salvo la última
+  que sobrevive a la compactación en cada registro, que queda como estado inicial del historial que se conserva.
+
+Borrar una versión intermedia equivale a unir sus cambios con la versión siguiente: cada fila guarda el registro
+completo, así que las diferencias que muestra la acción historial siguen siendo correctas.
+'''
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Registro
+
+# Motivo de cambio con que se guardan las versiones de los procesos automáticos
+CAMBIO_AUTOMATICO = 'Automático'
+
+# Versiones automáticas seguidas con menos de esta diferencia se consideran una misma corrida del proceso
+VENTANA_AUTOMATICA = timedelta(minutes=1)
+
+TAMANO_LOTE = 2000
+
+
+def _campos() -> list:
+    return [campo.attname for campo in Registro.history.model.tracked_fields]
+
+
+def _misma_operacion(version: dict, siguiente: dict) -> bool:
+    if version['history_type'] != '~' or siguiente['history_type'] != '~':
+        return False
+    if version['history_change_reason'] != CAMBIO_AUTOMATICO or siguiente['history_change_reason'] != CAMBIO_AUTOMATICO:
+        return False
+    return siguiente['history_date'] - version['history_date'] < VENTANA_AUTOMATICA
+
+
+def _a_borrar(versiones: list, campos: list, compactar_hasta, retener_desde) -> list:
+    '''history_id de las versiones de un registro (ordenadas de la más vieja a la más nueva) que se pueden borrar.'''
+    borrar = set()
+
+    if compactar_hasta is not None:
+        for anterior, version in zip(versiones, versiones[1:]):
+            if version['history_date'] >= compactar_hasta:
+                break
+            if version['history_type'] == '~' and all(version[campo] == anterior[campo] for campo in campos):
+                # No cambió nada: la versión anterior ya tiene el mismo estado
+                borrar.add(version['history_id'])
+            elif _misma_operacion(anterior, version):
+                # Se une con la siguiente del mismo tramo, que guarda el estado final de la operación
+                borrar.add(anterior['history_id'])
+
+    if retener_desde is not None:
+        # La versión que queda como estado inicial tiene que ser una de las que no se borran al compactar
+        viejas = [
+            version for version in versiones
+            if version['history_date'] < retener_desde and version['history_id'] not in borrar
+        ]
+        if viejas and viejas[-1] is versiones[-1] and versiones[-1]['history_type'] == '-':
+            # Registro borrado antes del plazo: no queda nada que auditar
+            borrar.update(version['history_id'] for version in viejas)
+        else:
+            borrar.update(version['history_id'] for version in viejas[:-1])
+
+    return sorted(borrar)
+
+
+def _versiones_por_registro(campos: list):
+    historico = Registro.history.model
+    columnas = ['history_id', 'history_date', 'history_type', 'history_user_id', 'history_change_reason', *campos]
+    actual, versiones = None, []
+    consulta = historico.objects.order_by('id', 'history_date', 'history_id').values(*columnas)
+    for version in consulta.iterator(chunk_size=TAMANO_LOTE):
+        if version['id'] != actual and versiones:
+            yield versiones
+            versiones = []
+        actual = version['id']
+        versiones.append(version)
+    if versiones:
+        yield versiones
+
+
+def compactar(compactar_dias: int = None, retencion_dias: int = None, simular: bool = False) -> dict:
+    '''
+    Compacta el historial y aplica la retención. Sin argumentos usa HISTORIAL_COMPACTAR_DIAS y
+    HISTORIAL_RETENCION_DIAS. Devuelve la cantidad de versiones revisadas y borradas.
+    '''
+    if compactar_dias is None:
+        compactar_dias = settings.HISTORIAL_COMPACTAR_DIAS
+    if retencion_dias is None:
+        retencion_dias = settings.HISTORIAL_RETENCION_DIAS
+    ahora = timezone.now()
+    compactar_hasta = ahora - timedelta(days=compactar_dias) if compactar_dias >= 0 else None
+    retener_desde = ahora - timedelta(days=retencion_dias) if retencion_dias > 0 else None
+
+    campos = _campos()
+    historico = Registro.history.model
+    revisadas = borradas = 0
+    pendientes = []
+    for versiones in _versiones_por_registro(campos):
+        revisadas += len(versiones)
+        pendientes.extend(_a_borrar(versiones, campos, compactar_hasta, retener_desde))
+        if len(pendientes) >= TAMANO_LOTE:
+            borradas += len(pendientes)
+            if not simular:
+                historico.objects.filter(history_id__in=pendientes)._raw_delete(historico.objects.db)
+            pendientes = []
+    borradas += len(pendientes)
+    if pendientes and not simular:
+        historico.objects.filter(history_id__in=pendientes)._raw_delete(historico.objects.db)
+    return {'revisadas': revisadas, 'borradas': borradas}
+
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from tesoreria.cotizaciones import actualizar_calendario
+
+
+class Command(BaseCommand):
+    help = 'Regenera el calendario diario de cotizaciones MEP (CotizacionDiaria) a partir de DolarMEP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=str, help='Fecha YYYY-MM-DD desde la que regenerar (por defecto todo el calendario)')
+
+    def handle(self, *args, **options):
+        dias = actualizar_calendario(options.get('desde'))
+        self.stdout.write(self.style.SUCCESS(f'{dias} días de cotización actualizados'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Compacta el historial de Registro y aplica la retención configurada'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true', help='Solo informa cuántas versiones se borrarían')
+        parser.add_argument('--compactar-dias', type=int, default=None,
+                            help='Compacta las versiones más viejas que esta cantidad de días (por defecto HISTORIAL_COMPACTAR_DIAS, -1 para no compactar)')
+        parser.add_argument('--retencion-dias', type=int, default=None,
+                            help='Borra las versiones más viejas que esta cantidad de días (por defecto HISTORIAL_RETENCION_DIAS, 0 para no borrar)')
+
+    def handle(self, *args, **options):
+        from tesoreria.historial_mantenimiento import compactar
+
+        resultado = compactar(options['compactar_dias'], options['retencion_dias'], simular=options['simular'])
+        accion = 'se borrarían' if options['simular'] else 'borradas'
+        self.stdout.write(f"{resultado['revisadas']} versiones revisadas, {resultado['borradas']} {accion}")
+        self.stdout.write(self.style.SUCCESS('Historial compactado'))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+# Cada cuántos segundos se liberan correos colgados y se borran los enviados viejos
+INTERVALO_MANTENIMIENTO = 300
+
+
+class Command(BaseCommand):
+    help = 'Envía los correos de la bandeja de salida (CorreoSaliente) de a lotes, con una conexión SMTP por lote'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=50, help='Cantidad de correos que se envían por conexión')
+        parser.add_argument('--intervalo', type=float, default=5.0, help='Segundos entre consultas a la bandeja cuando no hay correos')
+        parser.add_argument('--una-vez', action='store_true', help='Envía los correos pendientes y termina')
+
+    def handle(self, *args, **options):
+        from tesoreria.correos import enviar_lote, liberar_colgados, limpiar_enviados, tomar_lote
+
+        lote = max(1, options['lote'])
+        self.stdout.write(f'Enviando correos de la bandeja de salida en lotes de {lote}')
+        ultimo_mantenimiento = 0.0
+        try:
+            while True:
+                if time.monotonic() - ultimo_mantenimiento > INTERVALO_MANTENIMIENTO:
+                    liberados = liberar_colgados()
+                    borrados = limpiar_enviados()
+                    if liberados or borrados:
+                        self.stdout.write(f'{liberados} correos liberados, {borrados} correos enviados borrados')
+                    ultimo_mantenimiento = time.monotonic()
+
+                correos = tomar_lote(lote)
+                if correos:
+                    enviados = enviar_lote(correos)
+                    self.stdout.write(f'{enviados} de {len(correos)} correos enviados')
+                    # Si el lote vino completo puede haber más pendientes: se sigue sin esperar
+                    if len(correos) == lote:
+                        continue
+                if options['una_vez']:
+                    break
+                time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS('Envío de correos detenido'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from tesoreria.models import Registro
+from tesoreria.busqueda import indexar_registros
+
+
+class Command(BaseCommand):
+    help = 'Regenera el texto de búsqueda de los registros (RegistroBusqueda)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--faltantes', action='store_true', help='Indexa solo los registros que todavía no tienen texto de búsqueda')
+
+    def handle(self, *args, **options):
+        registros = None
+        if options.get('faltantes'):
+            registros = Registro.objects.filter(busqueda__isnull=True)
+
+        indexados = indexar_registros(registros)
+        self.stdout.write(self.style.SUCCESS(f'{indexados} registros indexados para búsqueda'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from shared import versiones
+from tesoreria.models import Caja, Registro
+from tesoreria.saldos import recalcular_saldos
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye los saldos acumulados por registro (SaldoCaja) para reparar diferencias'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--caja', type=int, help='ID de la caja a recalcular (por defecto todas)')
+        parser.add_argument('--desde', type=str, help='Fecha YYYY-MM-DD desde la que recalcular (por defecto toda la historia)')
+
+    def handle(self, *args, **options):
+        cajas = Caja.objects.all().order_by('id')
+        if options.get('caja'):
+            cajas = cajas.filter(id=options['caja'])
+            if not cajas.exists():
+                self.stdout.write(self.style.ERROR(f"Caja {options['caja']} no encontrada"))
+                return
+
+        for caja in cajas:
+            escritas = recalcular_saldos(caja.id, options.get('desde'))
+            self.stdout.write(f'{caja.caja}: {escritas} saldos recalculados')
+        # El saldo acumulado se muestra en el listado de registros
+        versiones.incrementar(Registro)
+        self.stdout.write(self.style.SUCCESS('Saldos recalculados correctamente'))
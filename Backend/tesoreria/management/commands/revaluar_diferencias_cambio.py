@@ -0,0 +1,49 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from tesoreria.diferencia_cambio import IMPUTACION, revaluar_fechas
+from tesoreria.models import DolarMEP, Registro
+
+
+class Command(BaseCommand):
+    help = ('Recalcula los registros de diferencia de cambio (y pasa a pesos los registros en USD sin tipo de cambio) '
+            'con las cotizaciones DolarMEP cargadas, para corregir datos históricos')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=str, help='Fecha YYYY-MM-DD desde la que revaluar (por defecto toda la historia)')
+        parser.add_argument('--hasta', type=str, help='Fecha YYYY-MM-DD hasta la que revaluar (por defecto hoy)')
+        parser.add_argument('--dias', type=int, default=31, help='Cantidad de fechas que se revalúan por transacción')
+        parser.add_argument('--simular', action='store_true', help='Solo muestra los cambios, sin guardarlos')
+
+    def handle(self, *args, **options):
+        hasta = date.fromisoformat(options['hasta']) if options.get('hasta') else date.today()
+        cotizaciones = DolarMEP.objects.filter(fecha__lte=hasta)
+        diferencias = Registro.objects.filter(fecha_reg__lte=hasta, imputacion__imputacion=IMPUTACION)
+        if options.get('desde'):
+            desde = date.fromisoformat(options['desde'])
+            cotizaciones = cotizaciones.filter(fecha__gte=desde)
+            diferencias = diferencias.filter(fecha_reg__gte=desde)
+
+        # Las fechas con cotización y las que tienen diferencias generadas (por si se quedaron sin cotización)
+        fechas = sorted(
+            set(cotizaciones.values_list('fecha', flat=True)) | set(diferencias.values_list('fecha_reg', flat=True))
+        )
+        if not fechas:
+            self.stdout.write('No hay fechas para revaluar')
+            return
+
+        totales = {}
+        dias = max(options['dias'], 1)
+        for inicio in range(0, len(fechas), dias):
+            bloque = fechas[inicio:inicio + dias]
+            cambios = revaluar_fechas(bloque, simular=options['simular'])
+            for clave, cantidad in cambios.items():
+                totales[clave] = totales.get(clave, 0) + cantidad
+            self.stdout.write(f'{bloque[0]} a {bloque[-1]}: ' + ', '.join(f'{cantidad} {clave}' for clave, cantidad in cambios.items()))
+
+        resumen = ', '.join(f'{cantidad} {clave}' for clave, cantidad in totales.items())
+        if options['simular']:
+            self.stdout.write(self.style.WARNING(f'Simulación, no se guardó ningún cambio: {resumen}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Diferencias de cambio revaluadas: {resumen}'))
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:43
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Mismo criterio que tesoreria.saldos, copiado para no depender del código actual de la app
+TIPOS_SIN_MOVIMIENTO = ['FC', 'SICC', 'RETS', 'RETH', 'PERCS']
+CUATRO_DECIMALES = Decimal('0.0001')
+
+
+def calcular_saldos(apps, schema_editor):
+    '''Carga el aporte y el saldo acumulado de todos los registros, caja por caja, como recalcular_saldos.'''
+    Caja = apps.get_model('tesoreria', 'Caja')
+    Registro = apps.get_model('tesoreria', 'Registro')
+    SaldoCaja = apps.get_model('tesoreria', 'SaldoCaja')
+    Imputacion = apps.get_model('iva', 'Imputacion')
+    imputaciones_dif = set(Imputacion.objects.filter(imputacion='Diferencia de cambio').values_list('id', flat=True))
+
+    SaldoCaja.objects.all().delete()
+    for caja_id, moneda_id in Caja.objects.values_list('id', 'moneda_id'):
+        saldo = Decimal(0)
+        filas = []
+        registros = Registro.objects.filter(caja_id=caja_id).order_by('fecha_reg', 'id').values_list(
+            'id', 'fecha_reg', 'activo', 'realizado', 'tipo_reg', 'imputacion_id', 'monto_op_rec', 'tipo_de_cambio')
+        for pk, fecha, activo, realizado, tipo_reg, imputacion_id, monto, tipo_de_cambio in registros.iterator(chunk_size=2000):
+            aporte = Decimal(0)
+            if activo and realizado and tipo_reg not in TIPOS_SIN_MOVIMIENTO and imputacion_id not in imputaciones_dif:
+                aporte = Decimal(str(monto or 0))
+                if moneda_id and moneda_id > 1:
+                    aporte = aporte / Decimal(str(tipo_de_cambio)) if tipo_de_cambio else Decimal(0)
+                aporte = aporte.quantize(CUATRO_DECIMALES)
+            saldo += aporte
+            filas.append(SaldoCaja(registro_id=pk, caja_id=caja_id, fecha=fecha, aporte=aporte, saldo=saldo))
+            if len(filas) >= 2000:
+                SaldoCaja.objects.bulk_create(filas)
+                filas = []
+        SaldoCaja.objects.bulk_create(filas)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tesoreria', '0003_alter_dolarmep_compra_alter_dolarmep_venta_and_more'),
+        ('iva', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='saldocaja',
+            name='aporte',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=20),
+        ),
+        migrations.AlterField(
+            model_name='saldocaja',
+            name='registro',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='saldo_caja', to='tesoreria.registro'),
+        ),
+        migrations.AlterField(
+            model_name='saldocaja',
+            name='saldo',
+            field=models.DecimalField(decimal_places=4, max_digits=20),
+        ),
+        migrations.AddIndex(
+            model_name='saldocaja',
+            index=models.Index(fields=['caja', 'fecha', 'registro'], name='saldocaja_caja_fecha_reg_idx'),
+        ),
+        migrations.RunPython(calcular_saldos, migrations.RunPython.noop),
+    ]
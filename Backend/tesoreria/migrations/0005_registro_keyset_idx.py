@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tesoreria', '0004_saldocaja_incremental'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='registro',
+            index=models.Index(fields=['activo', 'fecha_reg', 'id'], name='registro_activo_fecha_id_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TABLA_FTS = 'tesoreria_registrobusqueda_fts'
+
+
+def crear_indices_texto(apps, schema_editor):
+    # Índices de texto propios de cada motor, ver tesoreria.busqueda
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS registrobusqueda_texto_trgm_idx '
+            'ON tesoreria_registrobusqueda USING gin (texto gin_trgm_ops)'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5('
+            "texto, content='tesoreria_registrobusqueda', content_rowid='registro_id', tokenize='trigram')"
+        )
+        # Triggers para que la tabla FTS5 siga a RegistroBusqueda, incluso con bulk_create
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ai AFTER INSERT ON tesoreria_registrobusqueda BEGIN '
+            f'INSERT INTO {TABLA_FTS}(rowid, texto) VALUES (new.registro_id, new.texto); END'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ad AFTER DELETE ON tesoreria_registrobusqueda BEGIN '
+            f"INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, texto) VALUES ('delete', old.registro_id, old.texto); END"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_au AFTER UPDATE ON tesoreria_registrobusqueda BEGIN '
+            f"INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, texto) VALUES ('delete', old.registro_id, old.texto); "
+            f'INSERT INTO {TABLA_FTS}(rowid, texto) VALUES (new.registro_id, new.texto); END'
+        )
+
+
+def eliminar_indices_texto(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS registrobusqueda_texto_trgm_idx')
+    elif vendor == 'sqlite':
+        for sufijo in ['ai', 'ad', 'au']:
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {TABLA_FTS}_{sufijo}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLA_FTS}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tesoreria', '0005_registro_keyset_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroBusqueda',
+            fields=[
+                ('registro', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='busqueda', serialize=False, to='tesoreria.registro')),
+                ('texto', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.RunPython(crear_indices_texto, eliminar_indices_texto),
+    ]
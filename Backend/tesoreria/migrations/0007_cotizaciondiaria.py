@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:50
+
+from datetime import date, timedelta
+
+from django.db import migrations, models
+
+
+def llenar_calendario(apps, schema_editor):
+    # Carga inicial del calendario a partir de las cotizaciones existentes (ver tesoreria.cotizaciones.actualizar_calendario)
+    DolarMEP = apps.get_model('tesoreria', 'DolarMEP')
+    CotizacionDiaria = apps.get_model('tesoreria', 'CotizacionDiaria')
+    por_fecha = {}
+    for cotizacion in DolarMEP.objects.order_by('fecha', 'id'):
+        por_fecha.setdefault(cotizacion.fecha, cotizacion)
+    if not por_fecha:
+        return
+    dia = min(por_fecha)
+    hasta = max([date.today(), *por_fecha])
+    vigente = None
+    filas = []
+    while dia <= hasta:
+        vigente = por_fecha.get(dia, vigente)
+        filas.append(CotizacionDiaria(fecha=dia, compra=vigente.compra, venta=vigente.venta, fecha_cotizacion=vigente.fecha))
+        dia += timedelta(days=1)
+    CotizacionDiaria.objects.bulk_create(filas, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tesoreria', '0006_registrobusqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CotizacionDiaria',
+            fields=[
+                ('fecha', models.DateField(primary_key=True, serialize=False)),
+                ('compra', models.DecimalField(decimal_places=4, max_digits=20)),
+                ('venta', models.DecimalField(decimal_places=4, max_digits=20)),
+                ('fecha_cotizacion', models.DateField()),
+            ],
+        ),
+        migrations.RunPython(llenar_calendario, migrations.RunPython.noop),
+    ]
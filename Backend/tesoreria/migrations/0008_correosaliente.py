@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tesoreria', '0007_cotizaciondiaria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorreoSaliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asunto', models.CharField(max_length=255)),
+                ('remitente', models.CharField(max_length=254)),
+                ('destinatario', models.CharField(max_length=254)),
+                ('plantilla', models.CharField(max_length=100)),
+                ('contexto', models.JSONField(blank=True, default=dict)),
+                ('estado', models.IntegerField(choices=[(1, 'Pendiente'), (2, 'Enviando'), (3, 'Enviado'), (4, 'Error')], default=1)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('proximo_intento', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lote', models.CharField(blank=True, default='', max_length=32)),
+                ('error', models.TextField(blank=True, default='')),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('tomado', models.DateTimeField(blank=True, null=True)),
+                ('enviado', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'proximo_intento'], name='correo_estado_proximo_idx')],
+            },
+        ),
+    ]
@@ -5,6 +5,7 @@ from django.db import transaction
 from tesoreria.models.pagos import PagoFactura
 from tesoreria.models import subimputaciones
 from .archivos import Archivo
+from .correos import CorreoSaliente
 from django.utils import timezone 
 from simple_history.models import HistoricalRecords
 
@@ -119,6 +120,12 @@ class Registro(RegistroAbstracto):
     def __str__(self):
         return f"{self.tipo_reg} - {self.fecha_reg} - {self.cliente_proyecto} - {self.proveedor} - {self.observacion}"
 
+    class Meta:
+        indexes = [
+            # Soporta la paginación por cursor de RegistroViewSet (ver tesoreria.paginacion)
+            models.Index(fields=['activo', 'fecha_reg', 'id'], name='registro_activo_fecha_id_idx'),
+        ]
+
 class PlantillaRegistro(models.Model):
     nombre = models.CharField(max_length=50)
     tipo_reg = models.CharField(max_length=5, choices=RegistroAbstracto.TIPO_REG_CHOICES)
@@ -145,10 +152,28 @@ class Retencion(models.Model):
     tipo = models.CharField(max_length=10, default="IIGG")
 
 class SaldoCaja(models.Model):
+    '''
+    Saldo acumulado de la caja hasta cada registro (inclusive), en orden (fecha, registro).
+    Se mantiene de forma incremental desde tesoreria.saldos, ver comando recalcular_saldos.
+    '''
     fecha = models.DateField()
     caja = models.ForeignKey('tesoreria.Caja', on_delete=models.DO_NOTHING)
-    registro = models.OneToOneField('tesoreria.Registro', on_delete=models.DO_NOTHING, null=True, blank=True)
-    saldo = models.DecimalField(decimal_places=2, max_digits= 20)
+    registro = models.OneToOneField('tesoreria.Registro', on_delete=models.DO_NOTHING, null=True, blank=True, related_name='saldo_caja')
+    aporte = models.DecimalField(decimal_places=4, max_digits= 20, default=0)
+    saldo = models.DecimalField(decimal_places=4, max_digits= 20)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['caja', 'fecha', 'registro'], name='saldocaja_caja_fecha_reg_idx'),
+        ]
+
+class RegistroBusqueda(models.Model):
+    '''
+    Documento de búsqueda desnormalizado de cada registro (proveedor, caja, imputación, observación, etc. en un solo texto).
+    Lo indexa un GIN trigram + tsvector en Postgres o una tabla FTS5 en SQLite, ver tesoreria.busqueda.
+    '''
+    registro = models.OneToOneField('tesoreria.Registro', on_delete=models.CASCADE, primary_key=True, related_name='busqueda')
+    texto = models.TextField(blank=True, default='')
 
 class Echeq(models.Model): # Defino este modelo porque los registros no tienen un campo para guardar el número de echeq, además puede servir para lógica de acreditación diferida
     numero = models.CharField(max_length=8)
@@ -237,6 +262,16 @@ class DolarMEP(models.Model):
     compra = models.DecimalField(decimal_places=4, max_digits= 20)
     venta = models.DecimalField(decimal_places=4, max_digits= 20)
 
+class CotizacionDiaria(models.Model):
+    '''
+    Calendario con una fila por día y la cotización MEP vigente a esa fecha (la del día o la última anterior).
+    Se regenera desde las señales de DolarMEP, ver tesoreria.cotizaciones.
+    '''
+    fecha = models.DateField(primary_key=True)
+    compra = models.DecimalField(decimal_places=4, max_digits= 20)
+    venta = models.DecimalField(decimal_places=4, max_digits= 20)
+    fecha_cotizacion = models.DateField() # Fecha de la cotización DolarMEP de la que sale el valor
+
 class ConciliacionCaja(models.Model):
     fecha = models.DateTimeField(auto_now=True)
     caja = models.ForeignKey('tesoreria.Caja', on_delete=models.DO_NOTHING)
@@ -0,0 +1,41 @@
+from django.db import models
+from django.utils import timezone
+
+
+class CorreoSaliente(models.Model):
+    '''
+    Bandeja de salida de correos. Los avisos (gasto a recuperar, nuevo presupuesto, menciones) se guardan acá en la misma
+    transacción que el cambio que los origina y los envía el comando enviar_correos, ver tesoreria.correos.
+    '''
+    PENDIENTE = 1
+    ENVIANDO = 2
+    ENVIADO = 3
+    ERROR = 4
+    ESTADO_CHOICES = [
+        (PENDIENTE, "Pendiente"),
+        (ENVIANDO, "Enviando"),
+        (ENVIADO, "Enviado"),
+        (ERROR, "Error"),
+    ]
+
+    asunto = models.CharField(max_length=255)
+    remitente = models.CharField(max_length=254)
+    destinatario = models.CharField(max_length=254)
+    plantilla = models.CharField(max_length=100) # Sin extensión: se renderizan el .txt y el .html
+    contexto = models.JSONField(default=dict, blank=True) # Los objetos se guardan como {'modelo': label, 'pk': id}
+    estado = models.IntegerField(choices=ESTADO_CHOICES, default=PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    lote = models.CharField(max_length=32, blank=True, default='') # Lote del worker que lo tomó
+    error = models.TextField(blank=True, default='')
+    creado = models.DateTimeField(auto_now_add=True)
+    tomado = models.DateTimeField(null=True, blank=True)
+    enviado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', 'proximo_intento'], name='correo_estado_proximo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.destinatario} - {self.asunto} - {self.get_estado_display()}"
@@ -16,11 +16,22 @@ class PagoFactura(models.Model):
         self.documentos.update(imputado=True)
 
     def delete(self, *args, **kwargs):
+        from tesoreria.saldos import sincronizar_saldos # Import local para evitar imports circulares
+        from shared import versiones
         self.documentos.update(imputado=False)
         self.registros_pago.update(activo=False)
         self.registros_fc.update(activo=False)
+        versiones.incrementar(self.registros_pago.model)
+        # Los registros inactivos dejan de sumar al saldo de la caja
+        sincronizar_saldos(self.registros_pago.all())
         self.activo = False
         super().save(update_fields=['activo'])
 
     def __str__(self):
-        return f"PagoFactura {self.pk} - {self.registros_fc.first().proveedor} - Monto: {format(self.monto, '.2f')} - Fecha: {self.fecha_pago}"
\ No newline at end of file
+        # Si los registros ya vienen cargados con prefetch_related se usan sin volver a consultar
+        if 'registros_fc' in getattr(self, '_prefetched_objects_cache', {}):
+            registro = next(iter(self.registros_fc.all()), None)
+        else:
+            registro = self.registros_fc.select_related('proveedor').first()
+        proveedor = registro.proveedor if registro else None
+        return f"PagoFactura {self.pk} - {proveedor} - Monto: {format(self.monto, '.2f')} - Fecha: {self.fecha_pago}"
\ No newline at end of file
@@ -1,46 +1,89 @@
 from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
 from datetime import datetime
 from io import BytesIO
 from django.core.files import File
 from tesoreria.models import Caja
+from tesoreria import pdfs
 
-def generar_pdf_orden_pago(nombre_archivo, proveedor_datos, medios_pago: dict, documentos):
-    # Configuración básica
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    ancho, alto = A4
-
-    empresa_datos = {
+EMPRESA_DATOS = {
     'nombre': 'Quinto Diseño SRL',
     'direccion': 'Caminante 80, 1er piso, oficina 108',
     'localidad': 'Nordelta - Buenos Aires - Argentina',
 }
 
+def datos_orden_pago(nombre_archivo, proveedor_datos, medios_pago: dict, documentos) -> dict:
+    """
+    Arma los textos de la orden de pago. Es la única parte que consulta la base: el dibujo (dibujar_orden_pago) solo usa
+    este diccionario, que además es la clave de la caché de PDFs.
+    """
+    cajas = Caja.objects.filter(caja__in=[medio['caja'] for medio in medios_pago]).values('caja', 'codigo')
+    cajas_dict = {caja['caja']: caja['codigo'] or "" for caja in cajas}
+
+    medios = []
+    total_medios = 0
+    for medio in medios_pago:
+        fecha_array = str(medio['fecha']).split("-")
+        medios.append({
+            'tipo': str(medio['tipo']),
+            'banco': "ICBC" if str(medio["caja"]) == "Banco ICBC" else "",
+            'interno': cajas_dict.get(str(medio['caja']),""),
+            'numero': str(medio['numero_certificado']) if medio['numero_certificado'] else "",
+            'fecha': f"{fecha_array[2]}/{fecha_array[1]}/{fecha_array[0]}",
+            'pesos': f"$ {(medio['monto']*medio['tipo_de_cambio'] if medio['tipo_de_cambio'] else medio['monto']):,.2f}",
+        })
+        total_medios += medio['monto']
+
+    docs = []
+    total_docs = 0
+    for doc in documentos:
+        total = doc.total or 0
+        docs.append({
+            'documento': f"{doc.tipo_documento} {doc.serie}-{doc.numero}",
+            'interno': str(doc.id),
+            'pesos': f"$ {total:,.2f}",
+        })
+        total_docs += total
+
+    return {
+        'titulo': nombre_archivo,
+        'fecha': datetime.now().strftime('%d/%m/%Y'),
+        'op_nro': str(proveedor_datos['op_nro']),
+        'cnpj': str(proveedor_datos['cnpj']),
+        'proveedor': str(proveedor_datos['nombre']),
+        'medios': medios,
+        'total_medios': f"$ {total_medios:,.2f}",
+        'documentos': docs,
+        'total_documentos': f"$ {total_docs:,.2f}",
+    }
+
+def dibujar_orden_pago(c, datos: dict):
+    """
+    Dibuja la orden de pago en el canvas a partir de datos_orden_pago, sin consultar la base (ver tesoreria.pdfs).
+    """
+    ancho, alto = A4
+
     # Encabezado con datos de la empresa
     c.setFont("Helvetica-Bold", 12)
     c.drawString(150, alto - 40, "ORDEN DE PAGO PROVEEDOR",)
     
-    # Logo (posición aproximada)
-    c.drawImage("jt.png", 50, alto - 110, width=100, height=100, mask='auto')
+    # Logo (posición aproximada), leído una sola vez por proceso
+    c.drawImage(pdfs.logo(), 50, alto - 110, width=100, height=100, mask='auto')
     
     # Datos de la empresa
     c.setFont("Helvetica", 10)
-    c.drawString(150, alto - 60, empresa_datos['nombre'])
-    c.drawString(150, alto - 75, empresa_datos['direccion'])
-    c.drawString(150, alto - 90, empresa_datos['localidad'])
+    c.drawString(150, alto - 60, EMPRESA_DATOS['nombre'])
+    c.drawString(150, alto - 75, EMPRESA_DATOS['direccion'])
+    c.drawString(150, alto - 90, EMPRESA_DATOS['localidad'])
     
     # Fecha
-    c.drawString(500, alto - 40, f"Fecha: {datetime.now().strftime('%d/%m/%Y')}")
+    c.drawString(500, alto - 40, f"Fecha: {datos['fecha']}")
     
     c.line(50, alto - 117, 550, alto - 117)
 
     # Datos del proveedor
-    c.drawString(50, alto - 140, f"OP NRO.: {proveedor_datos['op_nro']}")
-    c.drawString(350, alto - 140, f"CNPJ: {proveedor_datos['cnpj']}")
-    c.drawString(50, alto - 160, f"Proveedor: {proveedor_datos['nombre']}")
+    c.drawString(50, alto - 140, f"OP NRO.: {datos['op_nro']}")
+    c.drawString(350, alto - 140, f"CNPJ: {datos['cnpj']}")
+    c.drawString(50, alto - 160, f"Proveedor: {datos['proveedor']}")
     c.line(50, alto - 190, 550, alto - 190)
     
     # Sección de Medios de Pago
@@ -60,28 +103,20 @@ def generar_pdf_orden_pago(nombre_archivo, proveedor_datos, medios_pago: dict, d
     
     # Datos de medios de pago
     y_pos -= 20
-    total_medios = 0
-
-    cajas = Caja.objects.filter(caja__in=[medio['caja'] for medio in medios_pago]).values('caja', 'codigo')
-    cajas_dict = {caja['caja']: caja['codigo'] or "" for caja in cajas}
-
-    for medio in medios_pago:
-        c.drawString(50, y_pos, str(medio['tipo']))
-        c.drawString(150, y_pos, "ICBC" if str(medio["caja"]) == "Banco ICBC" else "")
-        c.drawString(200, y_pos, cajas_dict.get(str(medio['caja']),""))
-        if medio['numero_certificado']:
-            c.drawString(250, y_pos, str(medio['numero_certificado']))
-        fecha_array = str(medio['fecha']).split("-")
-        fecha = f"{fecha_array[2]}/{fecha_array[1]}/{fecha_array[0]}"
-        c.drawString(400, y_pos, fecha)
-        c.drawRightString(550, y_pos, f"$ {(medio['monto']*medio['tipo_de_cambio'] if medio['tipo_de_cambio'] else medio['monto']):,.2f}")
+    for medio in datos['medios']:
+        c.drawString(50, y_pos, medio['tipo'])
+        c.drawString(150, y_pos, medio['banco'])
+        c.drawString(200, y_pos, medio['interno'])
+        if medio['numero']:
+            c.drawString(250, y_pos, medio['numero'])
+        c.drawString(400, y_pos, medio['fecha'])
+        c.drawRightString(550, y_pos, medio['pesos'])
         y_pos -= 20
-        total_medios += medio['monto']
         
     # Total del medio de pago
     c.line(450, y_pos, 550, y_pos)
     c.drawString(400, y_pos - 15, "Total pagos:")
-    c.drawRightString(550, y_pos - 15, f"$ {total_medios:,.2f}")
+    c.drawRightString(550, y_pos - 15, datos['total_medios'])
     y_pos -= 30
     
     # Sección de Documentos Cancelados
@@ -97,19 +132,16 @@ def generar_pdf_orden_pago(nombre_archivo, proveedor_datos, medios_pago: dict, d
     c.line(50, y_pos+10, 550, y_pos+10)
     
     y_pos -= 30
-    total_docs = 0
-    for doc in documentos:
-        c.drawString(50, y_pos, f"{doc.tipo_documento} {doc.serie}-{doc.numero}")
-        c.drawString(300, y_pos, str(doc.id))
-        total = doc.neto + doc.iva + doc.percepcion_de_iibb + doc.percepcion_de_iva + doc.exento + doc.no_gravado
-        c.drawRightString(550, y_pos, f"$ {total:,.2f}")
-        total_docs += total
+    for doc in datos['documentos']:
+        c.drawString(50, y_pos, doc['documento'])
+        c.drawString(300, y_pos, doc['interno'])
+        c.drawRightString(550, y_pos, doc['pesos'])
         y_pos -= 20
     
     # Total de documentos
     c.line(450, y_pos, 550, y_pos)
     c.drawString(400, y_pos - 15, "Total documentos:")
-    c.drawRightString(550, y_pos - 15, f"$ {total_docs:,.2f}")
+    c.drawRightString(550, y_pos - 15, datos['total_documentos'])
     
     # Sección de firmas
     y_pos = 100
@@ -130,10 +162,16 @@ def generar_pdf_orden_pago(nombre_archivo, proveedor_datos, medios_pago: dict, d
     # Nombre del archivo en pie de página
     c.setFont("Helvetica", 8)
     
-    # Generar PDF para enviarlo a Django
-    c.setTitle(nombre_archivo)
-    c.save()
+    c.setTitle(datos['titulo'])
+
+def generar_pdf_orden_pago(nombre_archivo, proveedor_datos, medios_pago: dict, documentos):
+    datos = datos_orden_pago(nombre_archivo, proveedor_datos, medios_pago, documentos)
+
+    # Generar PDF para enviarlo a Django (desde la caché si ya se generó una OP con los mismos datos)
+    return pdf_orden_pago(datos)
 
-    buffer.seek(0)
-    pdf = File(buffer, name="op.pdf")
-    return pdf
\ No newline at end of file
+def pdf_orden_pago(datos: dict) -> File:
+    """
+    PDF de la orden de pago a partir de datos_orden_pago, listo para guardar en PagoFactura.op.
+    """
+    return File(BytesIO(pdfs.renderizar('orden_pago', datos)), name="op.pdf")
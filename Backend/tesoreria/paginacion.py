@@ -0,0 +1,174 @@
+'''
+Clases de paginación para los listados de registros.
+
+- RegistroPagination: paginación por número de página (la original). Con ?conteo=aproximado evita el COUNT(*) exacto.
+- RegistroKeysetPagination: paginación por cursor sobre (fecha_reg, id). El costo de cada página no depende de
+  qué tan profundo se esté en la historia, porque no usa OFFSET.
+'''
+import base64
+import hashlib
+import json
+from datetime import date
+
+from django.core.cache import cache
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Segundos durante los que se reutiliza un conteo cacheado
+CONTEO_CACHE_TTL = 60
+
+
+def conteo_aproximado(queryset) -> int:
+    '''
+    Devuelve una cantidad aproximada de filas para el queryset.
+    En Postgres usa la estimación del planificador (basada en reltuples/estadísticas), en otros motores
+    cachea el conteo exacto durante CONTEO_CACHE_TTL segundos.
+    '''
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    clave = 'conteo:' + hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+    return cache.get_or_set(clave, queryset.count, CONTEO_CACHE_TTL)
+
+
+class ConteoAproximadoPaginator(DjangoPaginator):
+    '''Paginator de Django que reemplaza el COUNT(*) exacto por conteo_aproximado.'''
+
+    @cached_property
+    def count(self):
+        return conteo_aproximado(self.object_list)
+
+
+class RegistroPagination(PageNumberPagination):
+    page_size = 30
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    conteo_query_param = 'conteo'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.conteo_query_param) == 'aproximado':
+            self.django_paginator_class = ConteoAproximadoPaginator
+        else:
+            self.django_paginator_class = DjangoPaginator
+        return super().paginate_queryset(queryset, request, view)
+
+
+class RegistroKeysetPagination(BasePagination):
+    '''
+    Paginación por cursor (keyset) sobre (fecha_reg, id).
+    Por defecto ordena de más nuevo a más viejo; con ?ordering=fecha_reg ordena de más viejo a más nuevo.
+    Respeta los filtros y la búsqueda porque solo agrega la condición del cursor al queryset ya filtrado.
+    Acepta querysets de modelos o de values() (ver shared.proyecciones), que tienen que incluir fecha_reg e id.
+    '''
+    page_size = 30
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    conteo_query_param = 'conteo'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def codificar_cursor(self, fecha, pk, anterior=False) -> str:
+        data = json.dumps({'f': str(fecha), 'id': pk, 'a': anterior}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decodificar_cursor(self, cursor: str) -> tuple:
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            return date.fromisoformat(data['f']), int(data['id']), bool(data.get('a', False))
+        except Exception:
+            raise NotFound('Cursor inválido')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ascendente = request.query_params.get('ordering') in ['fecha_reg', 'id']
+        self.count = conteo_aproximado(queryset) if request.query_params.get(self.conteo_query_param) == 'aproximado' else None
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        fecha = pk = None
+        anterior = False
+        if cursor:
+            fecha, pk, anterior = self.decodificar_cursor(cursor)
+
+        # Al retroceder se recorre en sentido inverso y después se da vuelta la página
+        ascendente = self.ascendente != anterior
+        if ascendente:
+            queryset = queryset.order_by('fecha_reg', 'id')
+            if cursor:
+                queryset = queryset.filter(Q(fecha_reg__gt=fecha) | Q(fecha_reg=fecha, id__gt=pk))
+        else:
+            queryset = queryset.order_by('-fecha_reg', '-id')
+            if cursor:
+                queryset = queryset.filter(Q(fecha_reg__lt=fecha) | Q(fecha_reg=fecha, id__lt=pk))
+
+        resultados = list(queryset[:self.page_size + 1])
+        hay_mas = len(resultados) > self.page_size
+        resultados = resultados[:self.page_size]
+        if anterior:
+            resultados.reverse()
+
+        self.tiene_siguiente = hay_mas if not anterior else bool(cursor)
+        self.tiene_anterior = bool(cursor) if not anterior else hay_mas
+        self.primero = resultados[0] if resultados else None
+        self.ultimo = resultados[-1] if resultados else None
+        return resultados
+
+    @staticmethod
+    def clave(fila) -> tuple:
+        '''(fecha_reg, id) de un registro o de una fila de values().'''
+        if isinstance(fila, dict):
+            return fila['fecha_reg'], fila['id']
+        return fila.fecha_reg, fila.pk
+
+    def get_next_link(self):
+        if not self.tiene_siguiente or not self.ultimo:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.codificar_cursor(*self.clave(self.ultimo)))
+
+    def get_previous_link(self):
+        if not self.tiene_anterior or not self.primero:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.codificar_cursor(*self.clave(self.primero), anterior=True))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
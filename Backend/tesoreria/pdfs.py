@@ -0,0 +1,217 @@
+'''
+Servicio de generación de PDFs (órdenes de pago y recibos).
+
+Cada tipo de documento se arma en dos pasos: una función que lee la base y arma un diccionario con los textos ya
+formateados (datos_orden_pago, datos_recibo) y otra que solo dibuja esos datos con reportlab (dibujar_orden_pago,
+dibujar_recibo). Así:
+- los PDFs terminados se guardan en PDF_CACHE_DIR con el hash de sus datos como nombre, y volver a pedir el mismo
+  documento no lo vuelve a dibujar;
+- el logo y las fuentes se cargan una sola vez por proceso;
+- los lotes grandes se dibujan en paralelo en un pool de procesos, que no necesitan acceso a la base, y se pueden
+  devolver unidos en un solo archivo.
+
+El pool es de cada proceso que lo usa y se crea recién con el primer lote grande (MINIMO_PARALELO documentos sin
+caché). Cada proceso del pool arranca con spawn e inicializa Django, así que en el servidor web cada worker de gunicorn
+que dibuja un lote grande suma PDF_PROCESOS procesos con su propia memoria, que quedan vivos para los lotes siguientes.
+Con PDF_PROCESOS=1 no se crea el pool y los lotes se dibujan en el mismo proceso.
+'''
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import cache
+from io import BytesIO
+
+import pypdfium2 as pdfium
+from django.conf import settings
+from django.utils.module_loading import import_string
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen import canvas
+
+logger = logging.getLogger(__name__)
+
+# Función que dibuja cada tipo de documento a partir de sus datos
+DIBUJOS = {
+    'orden_pago': 'tesoreria.opdf.dibujar_orden_pago',
+    'recibo': 'tesoreria.recibopdf.dibujar_recibo',
+}
+
+# Se incrementa al cambiar el diseño de algún documento, para que no se sigan sirviendo los PDFs viejos de la caché
+VERSION = 1
+
+FUENTES = ['Helvetica', 'Helvetica-Bold']
+
+# Con menos documentos que esto no vale la pena repartir el lote entre procesos
+MINIMO_PARALELO = 16
+# Documentos que dibuja cada proceso por tarea
+DOCUMENTOS_POR_TAREA = 25
+
+_pool = None
+
+
+@cache
+def logo() -> ImageReader:
+    '''Logo de la empresa, leído y decodificado una sola vez por proceso.'''
+    return ImageReader(os.path.join(settings.BASE_DIR, 'jt.png'))
+
+
+@cache
+def dibujo(tipo: str):
+    if tipo not in DIBUJOS:
+        raise ValueError(f'Tipo de documento inválido: {tipo}')
+    return import_string(DIBUJOS[tipo])
+
+
+def precargar() -> None:
+    '''Carga las métricas de las fuentes y el logo, para que el primer documento no pague ese costo.'''
+    for fuente in FUENTES:
+        pdfmetrics.getFont(fuente)
+    logo().getSize()
+
+
+def clave(tipo: str, datos: dict) -> str:
+    contenido = json.dumps({'tipo': tipo, 'version': VERSION, 'datos': datos}, sort_keys=True, default=str)
+    return hashlib.sha256(contenido.encode()).hexdigest()
+
+
+def _ruta(clave_pdf: str) -> str:
+    return os.path.join(settings.PDF_CACHE_DIR, clave_pdf[:2], f'{clave_pdf}.pdf')
+
+
+def _leer_cache(clave_pdf: str) -> bytes | None:
+    ruta = _ruta(clave_pdf)
+    try:
+        with open(ruta, 'rb') as archivo:
+            contenido = archivo.read()
+        # Se actualiza la fecha de modificación para que limpiar_cache borre solo los que no se usan
+        os.utime(ruta)
+        return contenido
+    except OSError:
+        return None
+
+
+def _guardar_cache(clave_pdf: str, contenido: bytes) -> None:
+    ruta = _ruta(clave_pdf)
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        # Se escribe en un temporal y se renombra, así otro proceso nunca lee un PDF a medio escribir
+        temporal = f'{ruta}.{os.getpid()}.tmp'
+        with open(temporal, 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        logger.warning('No se pudo guardar el PDF %s en la caché: %s', clave_pdf, e)
+
+
+def dibujar(tipo: str, datos: dict) -> bytes:
+    '''Dibuja un documento sin pasar por la caché.'''
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    dibujo(tipo)(c, datos)
+    c.save()
+    return buffer.getvalue()
+
+
+def _dibujar_varios(tipo: str, lista_datos: list) -> list[bytes]:
+    return [dibujar(tipo, datos) for datos in lista_datos]
+
+
+def _inicializar_proceso():
+    # Los procesos del pool arrancan con spawn, así que cada uno inicializa Django por su cuenta
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gestion.settings')
+    django.setup()
+    precargar()
+
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    # El pool se crea la primera vez que hace falta y se reutiliza en los lotes siguientes del mismo proceso
+    global _pool
+    if _pool is None:
+        contexto = multiprocessing.get_context('spawn')
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.PDF_PROCESOS, mp_context=contexto, initializer=_inicializar_proceso
+        )
+    return _pool
+
+
+def _dibujar_en_paralelo(tipo: str, lista_datos: list) -> list[bytes]:
+    global _pool
+    tareas = [lista_datos[i:i + DOCUMENTOS_POR_TAREA] for i in range(0, len(lista_datos), DOCUMENTOS_POR_TAREA)]
+    try:
+        resultados = _obtener_pool().map(_dibujar_varios, [tipo] * len(tareas), tareas)
+        return [pdf for resultado in resultados for pdf in resultado]
+    except BrokenProcessPool:
+        # Se cayó un proceso del pool: se descarta el pool y el lote se dibuja en este proceso
+        logger.warning('Se detuvo un proceso del pool de PDFs, se dibuja el lote sin paralelizar')
+        _pool = None
+        return _dibujar_varios(tipo, lista_datos)
+
+
+def renderizar(tipo: str, datos: dict) -> bytes:
+    '''Devuelve el PDF de un documento, desde la caché si ya se había generado con los mismos datos.'''
+    return renderizar_lote(tipo, [datos])[0]
+
+
+def renderizar_lote(tipo: str, lista_datos: list, unir: bool = False):
+    '''
+    Devuelve los PDFs de varios documentos del mismo tipo, en el mismo orden que lista_datos. Los que no están en la
+    caché se dibujan, en paralelo si son muchos. Con unir=True devuelve un solo PDF con todos los documentos.
+    '''
+    claves = [clave(tipo, datos) for datos in lista_datos]
+    pdfs = {}
+    faltantes = {}
+    for clave_pdf, datos in zip(claves, lista_datos):
+        if clave_pdf in pdfs or clave_pdf in faltantes:
+            continue
+        contenido = _leer_cache(clave_pdf)
+        if contenido is None:
+            faltantes[clave_pdf] = datos
+        else:
+            pdfs[clave_pdf] = contenido
+
+    if faltantes:
+        inicio = time.monotonic()
+        if len(faltantes) >= MINIMO_PARALELO and settings.PDF_PROCESOS > 1:
+            dibujados = _dibujar_en_paralelo(tipo, list(faltantes.values()))
+        else:
+            dibujados = _dibujar_varios(tipo, list(faltantes.values()))
+        for clave_pdf, contenido in zip(faltantes, dibujados):
+            _guardar_cache(clave_pdf, contenido)
+            pdfs[clave_pdf] = contenido
+        logger.info('%s documentos %s dibujados en %.2fs', len(faltantes), tipo, time.monotonic() - inicio)
+
+    resultado = [pdfs[clave_pdf] for clave_pdf in claves]
+    return unir_pdfs(resultado) if unir else resultado
+
+
+def unir_pdfs(pdfs: list[bytes]) -> bytes:
+    '''Une varios PDFs en uno solo, en el orden recibido.'''
+    unido = pdfium.PdfDocument.new()
+    for contenido in pdfs:
+        unido.import_pages(pdfium.PdfDocument(contenido))
+    buffer = BytesIO()
+    unido.save(buffer)
+    return buffer.getvalue()
+
+
+def limpiar_cache() -> int:
+    '''Borra de la caché los PDFs que no se usaron en PDF_CACHE_RETENCION_DIAS. Devuelve la cantidad borrada.'''
+    limite = time.time() - settings.PDF_CACHE_RETENCION_DIAS * 86400
+    borrados = 0
+    for carpeta, _, archivos in os.walk(settings.PDF_CACHE_DIR):
+        for nombre in archivos:
+            ruta = os.path.join(carpeta, nombre)
+            try:
+                if os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+                    borrados += 1
+            except OSError:
+                continue
+    return borrados
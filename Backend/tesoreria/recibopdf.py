@@ -1,13 +1,11 @@
-from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.colors import HexColor, black
 from reportlab.lib.units import cm
-import datetime
 from .models import Registro
-import locale
 from io import BytesIO
 from django.core.files import File
 from django.http import HttpResponse
+from tesoreria import pdfs
 
 
 CODIGOS_CAJAS = {
@@ -17,6 +15,13 @@ CODIGOS_CAJAS = {
     "Banco ICBC": 'ICBC',
 }
 
+# Moneda de los registros en pesos
+PESOS = 1
+
+# Los nombres de los meses no dependen del locale del servidor (setlocale cambia todo el proceso y no es thread-safe)
+MESES = ['enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio', 'agosto', 'septiembre', 'octubre',
+         'noviembre', 'diciembre']
+
 def dividir_num(num: str) -> list:
     return [num[i:i+3] for i in range(0, len(num), 3)]
 
@@ -83,11 +88,34 @@ def numeros_a_palabras(numero:int) -> str:
         en_palabras = ('un ' if i > 1 else '') + en_palabras[3:]
     return en_palabras.strip()
 
-def generate_receipt(registro: Registro, pagador:str) -> File:
-
-    buffer = BytesIO()
+def datos_recibo(registro: Registro, pagador: str) -> dict:
+    """
+    Arma los textos del recibo. El dibujo (dibujar_recibo) solo usa este diccionario, que además es la clave de la caché
+    de PDFs.
+    """
     date_parts = str(registro.fecha_reg).split("-")
-    c = canvas.Canvas(buffer, pagesize=A4)
+    if registro.moneda_id == PESOS:
+        cantidad = f"Pesos {numeros_a_palabras(int(-registro.monto_op_rec))}"
+        son = f"${-registro.monto_op_rec} {registro.moneda}"
+    else:
+        cantidad = f"Dólares {numeros_a_palabras(int(-registro.monto_op_rec/registro.tipo_de_cambio))}"
+        son = f"{-registro.monto_op_rec/registro.tipo_de_cambio} {registro.moneda}"
+    return {
+        'dia': date_parts[2],
+        'mes': MESES[int(date_parts[1]) - 1],
+        'anio': date_parts[0][2:],
+        'numero': f"{registro.pk} {CODIGOS_CAJAS.get(registro.caja.caja) or registro.caja.codigo or ''}",
+        'pagador': pagador,
+        'cantidad': cantidad,
+        'concepto': registro.observacion or "",
+        'son': son,
+        'nombre_archivo': f"recibo{registro.pk}_{registro.caja}.pdf",
+    }
+
+def dibujar_recibo(c, datos: dict):
+    """
+    Dibuja el recibo en el canvas a partir de datos_recibo, sin consultar la base (ver tesoreria.pdfs).
+    """
     width, height = A4
     
     # Color principal (azul oscuro)
@@ -99,13 +127,6 @@ def generate_receipt(registro: Registro, pagador:str) -> File:
     c.setFont("Helvetica-Bold", 14)
     # "RECIBÍ" en la parte superior izquierda:
     c.drawString(2*cm, height - 3*cm, "RECIBÍ")
-    
-    # Ajuste de fecha. Por defecto, intentamos mostrar el mes en español.
-    try:
-        locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
-    except:
-        pass  # Si falla, por ejemplo en Windows sin locale, se deja inglés
-    month_name = datetime.date(1900, int(date_parts[1]), 1).strftime('%B')
 
     # Línea de fecha, similar a: ", de ___ de 20___ Nº ___"
     # Ajustamos la posición. Partiremos de un x base y dejaremos espacios subrayados.
@@ -116,7 +137,7 @@ def generate_receipt(registro: Registro, pagador:str) -> File:
     c.drawString(x_base+1.2*cm, height - 3*cm, day_line)
     # Imprimimos el día sobre la línea subrayada
     c.setFillColor(black)
-    c.drawString(x_base+1.2*cm, height - 3*cm, date_parts[2])
+    c.drawString(x_base+1.2*cm, height - 3*cm, datos['dia'])
     c.setFillColor(blue_color)
 
     c.drawString(x_base+2.3*cm, height - 3*cm, "de")
@@ -124,7 +145,7 @@ def generate_receipt(registro: Registro, pagador:str) -> File:
     month_line = "_" * 12
     c.drawString(x_base+3.0*cm, height - 3*cm, month_line)
     c.setFillColor(black)
-    c.drawString(x_base+3.5*cm, height - 3*cm, month_name)
+    c.drawString(x_base+3.5*cm, height - 3*cm, datos['mes'])
     c.setFillColor(blue_color)
 
     c.drawString(x_base+6*cm, height - 3*cm, "de 20")
@@ -132,7 +153,7 @@ def generate_receipt(registro: Registro, pagador:str) -> File:
     year_line = "_"*3
     c.drawString(x_base+7.1*cm, height - 3*cm, year_line)
     c.setFillColor(black)
-    c.drawString(x_base+7.2*cm, height - 3*cm, date_parts[0][2:])
+    c.drawString(x_base+7.2*cm, height - 3*cm, datos['anio'])
     c.setFillColor(blue_color)
 
     # Número de recibo
@@ -140,7 +161,7 @@ def generate_receipt(registro: Registro, pagador:str) -> File:
     nro_line = "_"*6
     c.drawString(x_base+9*cm, height - 3*cm, nro_line)
     c.setFillColor(black)
-    c.drawString(x_base+9.1*cm, height - 3*cm, f"{registro.pk} {CODIGOS_CAJAS[registro.caja.caja]}")
+    c.drawString(x_base+9.1*cm, height - 3*cm, datos['numero'])
     c.setFillColor(blue_color)
 
     # Ahora la línea de "RECIBÍ de"
@@ -151,7 +172,7 @@ def generate_receipt(registro: Registro, pagador:str) -> File:
     c.drawString(2.8*cm, height - 4*cm, line_recibi_de)
     # Aquí se podría colocar el nombre de la persona que paga, si existiera el campo
     c.setFillColor(black)
-    c.drawString(3*cm, height - 4*cm, pagador)
+    c.drawString(3*cm, height - 4*cm, datos['pagador'])
     c.setFillColor(blue_color)
 
     # "La cantidad de"
@@ -159,11 +180,7 @@ def generate_receipt(registro: Registro, pagador:str) -> File:
     cant_line = "_"*61
     c.drawString(5*cm, height - 6*cm, cant_line)
     c.setFillColor(black)
-    print(int(-registro.monto_op_rec))
-    if registro.moneda == 1:
-        c.drawString(5*cm, height - 6*cm, f"Pesos {numeros_a_palabras(int(-registro.monto_op_rec))}")
-    else:
-        c.drawString(5*cm, height - 6*cm, f"Dólares {numeros_a_palabras(int(-registro.monto_op_rec/registro.tipo_de_cambio))}")
+    c.drawString(5*cm, height - 6*cm, datos['cantidad'])
     c.setFillColor(blue_color)
 
     # "en concepto de"
@@ -171,7 +188,7 @@ def generate_receipt(registro: Registro, pagador:str) -> File:
     concept_line = "_"*60
     c.drawString(5.5*cm, height - 8*cm, concept_line)
     c.setFillColor(black)
-    c.drawString(5.5*cm, height - 8*cm, registro.observacion)
+    c.drawString(5.5*cm, height - 8*cm, datos['concepto'])
     c.setFillColor(blue_color)
 
     # "Son"
@@ -179,10 +196,7 @@ def generate_receipt(registro: Registro, pagador:str) -> File:
     son_line = "_"*30
     c.drawString(3*cm, height - 10*cm, son_line)
     c.setFillColor(black)
-    if registro.moneda == 1:
-        c.drawString(3.2*cm, height - 10*cm, f"${-registro.monto_op_rec} {registro.get_moneda_display()}")
-    else:
-        c.drawString(3.2*cm, height - 10*cm, f"{-registro.monto_op_rec/registro.tipo_de_cambio} {registro.get_moneda_display()}")
+    c.drawString(3.2*cm, height - 10*cm, datos['son'])
     c.setFillColor(blue_color)
 
     # Si se desean líneas decorativas a la izquierda, podemos dibujarlas:
@@ -195,9 +209,9 @@ def generate_receipt(registro: Registro, pagador:str) -> File:
     for i in range(20):
         c.line(20*cm, y_start - i*0.5*cm, 1.5*cm, y_start - i*0.5*cm)
 
-    # Guardamos el PDF
-    c.save()
+def generate_receipt(registro: Registro, pagador:str) -> File:
+    datos = datos_recibo(registro, pagador)
 
-    buffer.seek(0)
-    pdf = File(buffer, name=f"recibo{registro.pk}_{registro.caja}.pdf")
-    return HttpResponse(pdf, content_type='application/pdf')
\ No newline at end of file
+    # El PDF sale de la caché si ya se generó un recibo con los mismos datos
+    pdf = File(BytesIO(pdfs.renderizar('recibo', datos)), name=datos['nombre_archivo'])
+    return HttpResponse(pdf, content_type='application/pdf')
@@ -0,0 +1,186 @@
+'''
+Motor de saldos acumulados por caja.
+
+Cada Registro tiene una fila en SaldoCaja con su aporte al saldo de la caja y el saldo acumulado
+hasta él (inclusive), en el orden (fecha_reg, id). Al guardar o eliminar un registro solo se corrige
+el sufijo de la caja que queda después de él, en lugar de recalcular toda la historia con una window function.
+'''
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from shared import catalogos
+from .models import Caja, Registro, SaldoCaja
+
+# Tipos de registro que no mueven el saldo de la caja (mismo criterio que tenía la window function de RegistroViewSet)
+TIPOS_SIN_MOVIMIENTO = ['FC', 'SICC', 'RETS', 'RETH', 'PERCS']
+
+CUATRO_DECIMALES = Decimal('0.0001')
+
+
+def _decimal(valor) -> Decimal:
+    if valor is None:
+        return Decimal(0)
+    if isinstance(valor, Decimal):
+        return valor
+    return Decimal(str(valor))
+
+
+def _fecha(valor) -> date:
+    # fecha_reg puede venir como string cuando se asigna desde request.data
+    return valor if isinstance(valor, date) else date.fromisoformat(str(valor))
+
+
+def _imputaciones_diferencia_de_cambio() -> set:
+    from iva.models import Imputacion
+    return catalogos.ids_por_nombre(Imputacion, 'Diferencia de cambio')
+
+
+def aporte_saldo(registro: Registro, moneda_caja_id: int = None, imputaciones_dif: set = None) -> Decimal:
+    '''
+    Devuelve cuánto suma el registro al saldo de su caja.
+    '''
+    if not registro.activo or not registro.realizado:
+        return Decimal(0)
+    if registro.tipo_reg in TIPOS_SIN_MOVIMIENTO:
+        return Decimal(0)
+    if imputaciones_dif is None:
+        imputaciones_dif = _imputaciones_diferencia_de_cambio()
+    if registro.imputacion_id in imputaciones_dif:
+        return Decimal(0)
+
+    monto = _decimal(registro.monto_op_rec)
+    if moneda_caja_id is None:
+        moneda_caja_id = Caja.objects.filter(id=registro.caja_id).values_list('moneda_id', flat=True).first()
+    if moneda_caja_id and moneda_caja_id > 1:
+        tipo_de_cambio = _decimal(registro.tipo_de_cambio)
+        if not tipo_de_cambio:
+            return Decimal(0)
+        monto = monto / tipo_de_cambio
+    return monto.quantize(CUATRO_DECIMALES)
+
+
+def _posteriores(caja_id: int, fecha: date, registro_id: int):
+    return SaldoCaja.objects.filter(caja_id=caja_id).filter(
+        Q(fecha__gt=fecha) | Q(fecha=fecha, registro_id__gt=registro_id)
+    )
+
+
+def _bloquear_cajas(*cajas_id: int) -> None:
+    '''
+    Bloquea las filas de las cajas hasta el final de la transacción, así dos altas concurrentes en la misma caja no
+    calculan su saldo desde el mismo registro previo. Se bloquean en orden de id para no trabarse entre sí.
+    '''
+    list(Caja.objects.select_for_update().filter(id__in=set(cajas_id)).order_by('id').values_list('id', flat=True))
+
+
+def _desplazar(caja_id: int, fecha: date, registro_id: int, delta: Decimal) -> None:
+    '''Suma delta al saldo de todas las filas de la caja posteriores a (fecha, registro_id).'''
+    if delta:
+        _posteriores(caja_id, fecha, registro_id).update(saldo=F('saldo') + delta)
+
+
+@transaction.atomic
+def actualizar_saldo(registro: Registro) -> None:
+    '''
+    Actualiza de forma incremental la fila de SaldoCaja de un registro recién creado o modificado.
+    '''
+    anterior = SaldoCaja.objects.filter(registro_id=registro.pk).values_list('caja_id', flat=True).first()
+    _bloquear_cajas(registro.caja_id, *([anterior] if anterior else []))
+    anterior = SaldoCaja.objects.select_for_update().filter(registro_id=registro.pk).first()
+    fecha = _fecha(registro.fecha_reg)
+    aporte = aporte_saldo(registro)
+
+    # Si el registro no cambió de posición alcanza con corregir su propia fila y el sufijo
+    if anterior and anterior.caja_id == registro.caja_id and anterior.fecha == fecha:
+        delta = aporte - anterior.aporte
+        if delta:
+            _desplazar(registro.caja_id, fecha, registro.pk, delta)
+            anterior.aporte = aporte
+            anterior.saldo = anterior.saldo + delta
+            anterior.save(update_fields=['aporte', 'saldo'])
+        return
+
+    if anterior:
+        _desplazar(anterior.caja_id, anterior.fecha, registro.pk, -anterior.aporte)
+        anterior.delete()
+
+    previo = SaldoCaja.objects.filter(caja_id=registro.caja_id).filter(
+        Q(fecha__lt=fecha) | Q(fecha=fecha, registro_id__lt=registro.pk)
+    ).order_by('-fecha', '-registro_id').values_list('saldo', flat=True).first()
+
+    _desplazar(registro.caja_id, fecha, registro.pk, aporte)
+    SaldoCaja.objects.create(
+        registro_id=registro.pk,
+        caja_id=registro.caja_id,
+        fecha=fecha,
+        aporte=aporte,
+        saldo=(previo or Decimal(0)) + aporte,
+    )
+
+
+@transaction.atomic
+def eliminar_saldo(registro_id: int) -> None:
+    '''
+    Quita la fila de SaldoCaja de un registro y descuenta su aporte del resto de la caja.
+    '''
+    caja_id = SaldoCaja.objects.filter(registro_id=registro_id).values_list('caja_id', flat=True).first()
+    if caja_id is None:
+        return
+    _bloquear_cajas(caja_id)
+    anterior = SaldoCaja.objects.select_for_update().filter(registro_id=registro_id).first()
+    if not anterior:
+        return
+    _desplazar(anterior.caja_id, anterior.fecha, registro_id, -anterior.aporte)
+    anterior.delete()
+
+
+def sincronizar_saldos(registros) -> None:
+    '''
+    Actualiza los saldos de registros modificados con queryset.update(), que no dispara señales.
+    '''
+    for registro in registros:
+        actualizar_saldo(registro)
+
+
+@transaction.atomic
+def recalcular_saldos(caja_id: int, desde: date = None, chunk_size: int = 2000) -> int:
+    '''
+    Recalcula desde cero los saldos de una caja (o desde una fecha en adelante). Se usa para reparar
+    diferencias y después de altas masivas con bulk_create, que no disparan señales.
+    Devuelve la cantidad de filas escritas.
+    '''
+    _bloquear_cajas(caja_id)
+    moneda_caja_id = Caja.objects.filter(id=caja_id).values_list('moneda_id', flat=True).first()
+    imputaciones_dif = _imputaciones_diferencia_de_cambio()
+
+    registros = Registro.objects.filter(caja_id=caja_id).order_by('fecha_reg', 'id')
+    saldos = SaldoCaja.objects.filter(caja_id=caja_id)
+    saldo = Decimal(0)
+    if desde:
+        desde = _fecha(desde)
+        registros = registros.filter(fecha_reg__gte=desde)
+        saldos = saldos.filter(fecha__gte=desde)
+        saldo = SaldoCaja.objects.filter(caja_id=caja_id, fecha__lt=desde).order_by(
+            '-fecha', '-registro_id').values_list('saldo', flat=True).first() or Decimal(0)
+
+    # Borramos las filas del tramo y las de registros que se movieron a esta caja desde otra
+    saldos.delete()
+    SaldoCaja.objects.filter(registro__in=registros).delete()
+
+    filas = []
+    escritas = 0
+    for registro in registros.iterator(chunk_size=chunk_size):
+        aporte = aporte_saldo(registro, moneda_caja_id, imputaciones_dif)
+        saldo += aporte
+        filas.append(SaldoCaja(registro_id=registro.pk, caja_id=caja_id, fecha=registro.fecha_reg, aporte=aporte, saldo=saldo))
+        if len(filas) >= chunk_size:
+            SaldoCaja.objects.bulk_create(filas)
+            escritas += len(filas)
+            filas = []
+    if filas:
+        SaldoCaja.objects.bulk_create(filas)
+        escritas += len(filas)
+    return escritas
@@ -1,10 +1,17 @@
 from rest_framework import serializers
 from ..models import Registro, Caja, PagoFactura, Retencion, SaldoCaja, Echeq, CertificadoObra, Presupuesto, DbPresupuestosV2, EstadoPresupuesto, Comentario, Notificacion, DolarMEP, ConciliacionCaja, Tarea, PlantillaRegistro
 from iva.models import Documento, Imputacion, UnidadDeNegocio, ClienteProyecto, Persona
-from iva.serializers import DocumentoSerializer
+from iva.serializers import DocumentoSerializer, nombres_personas, rutas_persona
 from django.contrib.auth.models import User
 from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework.exceptions import ValidationError
+from decimal import Decimal
+from ..cotizaciones import cotizacion_exacta, cotizacion_vigente
+from .. import historial
+from shared import catalogos
+from shared.serializers import CatalogoSlugRelatedField
+from shared.proyecciones import Calculado, ProyeccionSerializer
 
 class SaldoCajaSerializer(serializers.ModelSerializer):
     class Meta:
@@ -49,8 +56,8 @@ def aplicar_logica_tipo_cambio(validated_data: dict, list_bool: bool = True) ->
             convertir_a_ars(validated_data, tc_reg)
 
             # Obtenemos el tipo de cambio MEP
-            tc_diario_obj = DolarMEP.objects.filter(fecha=validated_data.get('fecha_reg')).first()
-            tc_mep = float(tc_diario_obj.compra) if tc_diario_obj else None
+            tc_diario = cotizacion_exacta(validated_data.get('fecha_reg'))
+            tc_mep = float(tc_diario) if tc_diario else None
 
             # Si no hay tipo de cambio para la fecha, retornar
             if not tc_mep:
@@ -78,7 +85,7 @@ def aplicar_logica_tipo_cambio(validated_data: dict, list_bool: bool = True) ->
 
                     # Si el serializer es RegistroCrudSerializer, en validated_data obtenemos instancias en todos campos que son ForeignKeys
                     # Por esta razón es necesario obtener la instancia de imputación, para luego crear los registros de diferencia directamente desde el modelo de Registro, sin pasar por el serializer
-                    imputacion = Imputacion.objects.get(imputacion='Diferencia de cambio')
+                    imputacion = catalogos.por_nombre(Imputacion, 'Diferencia de cambio')
 
                 # Definimos el diccionario de clientes, que va a contener como clave el cliente y como valor el monto que le corresponde
                 clientes = {}
@@ -175,8 +182,8 @@ def aplicar_logica_tipo_cambio(validated_data: dict, list_bool: bool = True) ->
                 return validated_data
         if validated_data.get('moneda') == 2 and validated_data.get('tipo_de_cambio') == 1.00:
             # Si la moneda es USD y el tipo de cambio es 1, quiere decir que se está cargando un registro en ARS, por lo que hay que convertir los montos a USD
-            tc_diario_obj = DolarMEP.objects.filter(fecha=validated_data.get('fecha_reg')).first()
-            tc_mep = float(tc_diario_obj.compra) if tc_diario_obj else None
+            tc_diario = cotizacion_exacta(validated_data.get('fecha_reg'))
+            tc_mep = float(tc_diario) if tc_diario else None
             if not tc_mep:
                 return validated_data
             
@@ -219,12 +226,12 @@ class RegistroSerializer(serializers.ModelSerializer):
     **Métodos**:
     - **save**: aplica la lógica de tipo de cambio y crea los registros correspondientes.  
     """
-    caja = serializers.SlugRelatedField(slug_field='caja', queryset=Caja.objects.all())
-    unidad_de_negocio = serializers.SlugRelatedField(slug_field='unidad_de_negocio', queryset=UnidadDeNegocio.objects.all(), required=False, allow_null=True)
-    cliente_proyecto = serializers.SlugRelatedField(slug_field='cliente_proyecto', queryset=ClienteProyecto.objects.all(), required=False, allow_null=True)
+    caja = CatalogoSlugRelatedField(slug_field='caja', queryset=Caja.objects.all())
+    unidad_de_negocio = CatalogoSlugRelatedField(slug_field='unidad_de_negocio', queryset=UnidadDeNegocio.objects.all(), required=False, allow_null=True)
+    cliente_proyecto = CatalogoSlugRelatedField(slug_field='cliente_proyecto', queryset=ClienteProyecto.objects.all(), required=False, allow_null=True)
     proveedor = serializers.CharField(source="proveedor.nombre", read_only=True)
-    caja_contrapartida = serializers.SlugRelatedField(slug_field='caja', queryset=Caja.objects.all(), required=False, allow_null=True)
-    imputacion = serializers.SlugRelatedField(slug_field='imputacion', queryset=Imputacion.objects.all(), required=False)
+    caja_contrapartida = CatalogoSlugRelatedField(slug_field='caja', queryset=Caja.objects.all(), required=False, allow_null=True)
+    imputacion = CatalogoSlugRelatedField(slug_field='imputacion', queryset=Imputacion.objects.all(), required=False)
     presupuesto = serializers.StringRelatedField(required=False, allow_null=True)
     observacion = serializers.CharField(required=False, allow_null=True, allow_blank=True)
     realizado = serializers.BooleanField(default=False)
@@ -243,16 +250,32 @@ class RegistroSerializer(serializers.ModelSerializer):
         instance = super().save(**kwargs)
         return instance
 
+def monto_en_usd(value, moneda, tipo_de_cambio, cotizacion) -> float:
+    if value and float(value) != 0:
+        value_float = float(value)
+        tipo_de_cambio = float(tipo_de_cambio) if tipo_de_cambio else 1
+        dolar_mep_value = float(cotizacion) if cotizacion else 1
+
+        if moneda == 2:  # USD
+            if tipo_de_cambio and tipo_de_cambio > 1:
+                return value_float / tipo_de_cambio
+            elif dolar_mep_value and dolar_mep_value > 1:
+                return value_float / dolar_mep_value
+        elif moneda == 1 and dolar_mep_value:  # ARS
+            return value_float / dolar_mep_value
+
+    return 0.00
+
 class RegistroListSerializer(RegistroSerializer):
     """
     Serializer para el modelo Registro.  
     Muestra los slug de los campos relacionados en lugar de los ids. 
        
     ***Campos adicionales***:
-    - **saldo_acumulado**: saldo acumulado de la caja, solo lectura, se obtiene de la vista RegistroList a través del la clase Window.  
+    - **saldo_acumulado**: saldo acumulado de la caja, solo lectura, se obtiene de la tabla SaldoCaja (ver tesoreria.saldos).  
     - **total_gasto_ingreso_usd** (*SerializersMethodField*): suma de monto_gasto_ingreso_neto + iva_gasto_ingreso - monto_op_rec.  
     - **monto_op_rec_usd** (*SerializersMethodField*): monto_op_rec en USD, solo lectura, se usa en los reportes. 
-    - **dolar_mep_value** *SerializersDecimalField*: valor del dolar MEP para la fecha del registro, solo lectura, se usa en los reportes.  
+    - **dolar_mep_value** *SerializersMethodField*: valor del dolar MEP vigente a la fecha del registro (ver tesoreria.cotizaciones), solo lectura, se usa en los reportes.  
 
     **Métodos**:
     - **save**: aplica la lógica de tipo de cambio y crea los registros correspondientes.  
@@ -261,26 +284,22 @@ class RegistroListSerializer(RegistroSerializer):
     """
     # Campo para exponer el saldo acumulado (solo lectura)
     saldo_acumulado = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
-    dolar_mep_value = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    dolar_mep_value = serializers.SerializerMethodField(read_only=True)
     total_gasto_ingreso_usd = serializers.SerializerMethodField(read_only=True)
     monto_op_rec_usd = serializers.SerializerMethodField(read_only=True)
 
-    def convertir_a_usd(self, value, obj):
-        if value and float(value) != 0:
-            value_float = float(value)
-            moneda = obj.moneda
-            tipo_de_cambio = float(obj.tipo_de_cambio) if obj.tipo_de_cambio else 1
-            dolar_mep_value = float(obj.dolar_mep_value) if obj.dolar_mep_value else 1
-
-            if moneda == 2:  # USD
-                if tipo_de_cambio and tipo_de_cambio > 1:
-                    return value_float / tipo_de_cambio
-                elif dolar_mep_value and dolar_mep_value > 1:
-                    return value_float / dolar_mep_value
-            elif moneda == 1 and dolar_mep_value:  # ARS
-                return value_float / dolar_mep_value
+    def cotizacion_mep(self, obj):
+        # Si el queryset viene anotado con dolar_mep_value lo respetamos, si no usamos la caché de cotizaciones
+        if hasattr(obj, 'dolar_mep_value'):
+            return obj.dolar_mep_value
+        return cotizacion_vigente(obj.fecha_reg)
 
-        return 0.00
+    def get_dolar_mep_value(self, obj):
+        valor = self.cotizacion_mep(obj) or Decimal(0)
+        return str(Decimal(valor).quantize(Decimal('0.01')))
+
+    def convertir_a_usd(self, value, obj):
+        return monto_en_usd(value, obj.moneda_id, obj.tipo_de_cambio, self.cotizacion_mep(obj))
 
     def get_total_gasto_ingreso_usd(self, obj):
         return self.convertir_a_usd(obj.total_gasto_ingreso, obj)
@@ -295,6 +314,74 @@ class RegistroListSerializer(RegistroSerializer):
                   "total_gasto_ingreso", "total_gasto_ingreso_usd", "monto_op_rec", "monto_op_rec_usd", "moneda","tipo_de_cambio", "realizado", "saldo_acumulado",
                     "dolar_mep_value"]
 
+class RegistroProyeccion(ProyeccionSerializer):
+    """RegistroSerializer sobre filas de values(), para los listados de solo lectura (ver shared.proyecciones)."""
+    proveedor = Calculado(*rutas_persona('proveedor'))
+    presupuesto = Calculado('presupuesto', 'presupuesto__cliente_proyecto__cliente_proyecto', *rutas_persona('presupuesto__proveedor'), 'presupuesto__observacion')
+    total_gasto_ingreso = Calculado('monto_gasto_ingreso_neto', 'iva_gasto_ingreso')
+
+    class Meta:
+        serializer = RegistroSerializer
+
+    def calcular_proveedor(self, filas):
+        return nombres_personas(filas, 'proveedor')
+
+    def calcular_presupuesto(self, filas):
+        # Igual que str(Presupuesto): "cliente/proyecto - str(proveedor) - observación", con "None" en los vacíos
+        presupuestos = []
+        for fila in filas:
+            if fila['presupuesto'] is None:
+                presupuestos.append(None)
+                continue
+            razon_social, nombre_fantasia = fila['presupuesto__proveedor__razon_social'], fila['presupuesto__proveedor__nombre_fantasia']
+            if fila['presupuesto__proveedor'] is None:
+                proveedor = None
+            elif razon_social and nombre_fantasia:
+                proveedor = f"{razon_social} ({nombre_fantasia})"
+            else:
+                proveedor = razon_social or nombre_fantasia or "Sin nombre"
+            presupuestos.append(f"{fila['presupuesto__cliente_proyecto__cliente_proyecto']} - {proveedor} - {fila['presupuesto__observacion']}")
+        return presupuestos
+
+    def calcular_total_gasto_ingreso(self, filas):
+        return self.formatear('total_gasto_ingreso', [self.total(fila) for fila in filas])
+
+    @staticmethod
+    def total(fila):
+        # Igual que Registro.total_gasto_ingreso
+        return (fila['monto_gasto_ingreso_neto'] or 0) + (fila['iva_gasto_ingreso'] or 0)
+
+class RegistroListProyeccion(RegistroProyeccion):
+    """
+    RegistroListSerializer sobre filas de values(), para RegistroViewSet. La cotización MEP se busca una vez por fecha
+    distinta del lote.
+    """
+    dolar_mep_value = Calculado('fecha_reg')
+    total_gasto_ingreso_usd = Calculado('moneda', 'tipo_de_cambio', 'fecha_reg', 'monto_gasto_ingreso_neto', 'iva_gasto_ingreso')
+    monto_op_rec_usd = Calculado('moneda', 'tipo_de_cambio', 'fecha_reg', 'monto_op_rec')
+
+    class Meta:
+        serializer = RegistroListSerializer
+
+    def cotizaciones(self, filas) -> list:
+        por_fecha = {fecha: cotizacion_vigente(fecha) for fecha in {fila['fecha_reg'] for fila in filas}}
+        return [por_fecha[fila['fecha_reg']] for fila in filas]
+
+    def calcular_dolar_mep_value(self, filas):
+        return [str(Decimal(valor or Decimal(0)).quantize(Decimal('0.01'))) for valor in self.cotizaciones(filas)]
+
+    def calcular_total_gasto_ingreso_usd(self, filas):
+        return [
+            monto_en_usd(self.total(fila), fila['moneda'], fila['tipo_de_cambio'], cotizacion)
+            for fila, cotizacion in zip(filas, self.cotizaciones(filas))
+        ]
+
+    def calcular_monto_op_rec_usd(self, filas):
+        return [
+            monto_en_usd(fila['monto_op_rec'], fila['moneda'], fila['tipo_de_cambio'], cotizacion)
+            for fila, cotizacion in zip(filas, self.cotizaciones(filas))
+        ]
+
 class RegistroCC(RegistroSerializer):
     neto = serializers.SerializerMethodField('get_neto')
 
@@ -311,7 +398,7 @@ class RegistroCC(RegistroSerializer):
 
 class ConsumoPresupuestoSerializer(serializers.ModelSerializer):
     presupuesto = serializers.SlugRelatedField(slug_field='id', queryset=Presupuesto.objects.all())
-    caja = serializers.SlugRelatedField(slug_field='caja', queryset=Caja.objects.all())
+    caja = CatalogoSlugRelatedField(slug_field='caja', queryset=Caja.objects.all())
     total = serializers.SerializerMethodField('get_total')
     presupuesto = serializers.SlugRelatedField(slug_field='id', queryset=Presupuesto.objects.all())
 
@@ -347,7 +434,7 @@ class PagoFacturaSerializer(serializers.ModelSerializer): # Este es el serialize
 
 class MedioPagoSerializer(serializers.Serializer): # Este es el serializer que recibe los medios de pago
     tipo = serializers.CharField()
-    caja = serializers.SlugRelatedField(slug_field="caja",queryset=Caja.objects.all())
+    caja = CatalogoSlugRelatedField(slug_field="caja",queryset=Caja.objects.all())
     monto = serializers.DecimalField(max_digits=20, decimal_places=2)
     fecha = serializers.CharField()
     tipo_retencion = serializers.CharField(required = False, allow_null = True, allow_blank = True)
@@ -393,11 +480,19 @@ class PagoSerializer(serializers.Serializer): # Este es el serializer que recibe
     medios_pago = MedioPagoSerializer(many=True)
     imputaciones_multiples = ImputacionMultipleSerializer(many=True, required=False)
 
+class OrdenPagoLoteSerializer(serializers.Serializer): # Una orden de una corrida de pagos, las facturas se cargan juntas en corrida_pagos
+    facturas = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    medios_pago = MedioPagoSerializer(many=True, allow_empty=False)
+    imputaciones_multiples = ImputacionMultipleSerializer(many=True, required=False)
+
+class CorridaPagosSerializer(serializers.Serializer):
+    ordenes = OrdenPagoLoteSerializer(many=True, allow_empty=False)
+
 class CobroSerializer(serializers.Serializer):
     certificado = serializers.IntegerField(required=False, allow_null=True)
     documento = serializers.PrimaryKeyRelatedField(queryset=Documento.objects.all(), required=False, allow_null=True)
-    caja = serializers.SlugRelatedField(slug_field='caja', queryset=Caja.objects.all())
-    cliente_proyecto = serializers.SlugRelatedField(slug_field='cliente_proyecto', queryset=ClienteProyecto.objects.all())
+    caja = CatalogoSlugRelatedField(slug_field='caja', queryset=Caja.objects.all())
+    cliente_proyecto = CatalogoSlugRelatedField(slug_field='cliente_proyecto', queryset=ClienteProyecto.objects.all())
     monto = serializers.DecimalField(max_digits=20, decimal_places=2)
     fecha = serializers.DateField()
     moneda = serializers.IntegerField()
@@ -411,7 +506,7 @@ class CertificadoPDFSerializer(serializers.Serializer):
     pdf_file = serializers.FileField()
 
 class CertificadoSerializer(serializers.ModelSerializer):
-    cliente_proyecto = serializers.SlugRelatedField(slug_field='cliente_proyecto', queryset=ClienteProyecto.objects.all())
+    cliente_proyecto = CatalogoSlugRelatedField(slug_field='cliente_proyecto', queryset=ClienteProyecto.objects.all())
     neto = serializers.DecimalField(max_digits=20, decimal_places=2)
     iva = serializers.DecimalField(max_digits=20, decimal_places=2, required=False, allow_null=True)
     fecha = serializers.DateField()
@@ -444,6 +539,11 @@ class RetencionSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 class PagoUISerializer(serializers.ModelSerializer):
+    """
+    Serializer de lectura del listado de pagos (PagosList). Obra, caja y proveedor se calculan sobre las relaciones ya
+    cargadas: con el queryset de optimizar_queryset el listado hace la misma cantidad de consultas para cualquier
+    cantidad de pagos por página.
+    """
     id = serializers.IntegerField()
     proveedor = serializers.SerializerMethodField()
     documentos = DocumentoSerializer(many=True)
@@ -456,36 +556,54 @@ class PagoUISerializer(serializers.ModelSerializer):
         model = PagoFactura
         fields = ["id", "documentos","registros_fc", "registros_pago", "monto", "fecha_pago", "op", "proveedor", "obra", "caja"]
 
+    @staticmethod
+    def optimizar_queryset(queryset):
+        """Carga las relaciones que usa el serializer con una consulta por relación (Prefetch)."""
+        registros = Registro.objects.select_related(
+            'caja', 'caja_contrapartida', 'unidad_de_negocio', 'cliente_proyecto', 'proveedor', 'imputacion',
+            'presupuesto__cliente_proyecto', 'presupuesto__proveedor',
+        ).prefetch_related(Prefetch('documento', queryset=Documento.objects.only('id'))).order_by('id')
+        documentos = Documento.objects.select_related(
+            'tipo_documento', 'proveedor', 'receptor', 'imputacion', 'cliente_proyecto', 'unidad_de_negocio',
+        ).order_by('id')
+        return queryset.prefetch_related(
+            Prefetch('documentos', queryset=documentos),
+            Prefetch('registros_fc', queryset=registros),
+            Prefetch('registros_pago', queryset=registros),
+        )
+
     def get_obra(self, obj):
         # Obtener la obra a partir de los documentos relacionados
-        if obj.registros_fc.exists():
-            obra = obj.registros_fc.first().cliente_proyecto
-            for registro in obj.registros_fc.all():
-                if registro.cliente_proyecto != obra:
+        registros = list(obj.registros_fc.all())
+        if registros:
+            obra = registros[0].cliente_proyecto
+            for registro in registros:
+                if registro.cliente_proyecto_id != registros[0].cliente_proyecto_id:
                     return "Varias"
             return obra.cliente_proyecto if obra else None
-    
+
     def get_caja(self, obj):
         # Obtener la caja a partir de los documentos relacionados
-        if obj.registros_pago.exists():
-            caja = obj.registros_pago.first().caja
-            for registro in obj.registros_pago.all():
-                if registro.caja != caja:
+        registros = list(obj.registros_pago.all())
+        if registros:
+            for registro in registros:
+                if registro.caja_id != registros[0].caja_id:
                     return "Varias"
-            return caja.caja
+            return registros[0].caja.caja
 
     def get_proveedor(self, obj):
         # Obtener el proveedor a partir de los documentos relacionados
-        if obj.documentos.exists():
-            proveedor = obj.documentos.first().proveedor
+        documentos = list(obj.documentos.all())
+        if documentos:
+            proveedor = documentos[0].proveedor
             if proveedor:
                 return proveedor.nombre_fantasia if proveedor.nombre_fantasia else proveedor.razon_social
             else: return ""
         return None
 
 class MovimientoEntreCuentasSerializer(serializers.Serializer):
-    caja_origen = serializers.SlugRelatedField(slug_field='caja', queryset=Caja.objects.all())
-    caja_destino = serializers.SlugRelatedField(slug_field='caja', queryset=Caja.objects.all())
+    caja_origen = CatalogoSlugRelatedField(slug_field='caja', queryset=Caja.objects.all())
+    caja_destino = CatalogoSlugRelatedField(slug_field='caja', queryset=Caja.objects.all())
     monto = serializers.DecimalField(max_digits=20, decimal_places=2)
     observacion = serializers.CharField(allow_null=True, required=False, allow_blank=True)
     fecha = serializers.DateField()
@@ -504,7 +622,7 @@ class PresupuestoSerializer(serializers.ModelSerializer):
 class PresupuestoViewSerializer(serializers.ModelSerializer):
     '''Serializer para retornar los datos de un presupuesto creado o modificado al frontend.'''
     proveedor = serializers.SlugRelatedField(slug_field='nombre_fantasia', queryset=Persona.objects.all())
-    cliente_proyecto = serializers.SlugRelatedField(slug_field='cliente_proyecto', queryset=ClienteProyecto.objects.all())
+    cliente_proyecto = CatalogoSlugRelatedField(slug_field='cliente_proyecto', queryset=ClienteProyecto.objects.all())
     nombre = serializers.SerializerMethodField('get_nombre')
     estado = serializers.SerializerMethodField('get_estado')
     aprobado = serializers.SerializerMethodField('get_aprobado')
@@ -535,6 +653,22 @@ class PresupuestoListSerializer(serializers.ModelSerializer):
     def get_aprobado(self, obj):
         return obj.get_aprobado_display()
 
+class PresupuestoListProyeccion(ProyeccionSerializer):
+    """PresupuestoListSerializer sobre filas de values(), para PresupuestoListView (ver shared.proyecciones)."""
+    estado = Calculado('estado')
+    aprobado = Calculado('aprobado')
+
+    class Meta:
+        serializer = PresupuestoListSerializer
+
+    def calcular_estado(self, filas):
+        nombres = dict(DbPresupuestosV2._meta.get_field('estado').flatchoices)
+        return [nombres.get(fila['estado'], fila['estado']) for fila in filas]
+
+    def calcular_aprobado(self, filas):
+        nombres = dict(DbPresupuestosV2._meta.get_field('aprobado').flatchoices)
+        return [nombres.get(fila['aprobado'], fila['aprobado']) for fila in filas]
+
 class EstadoPresupuestoCreateSerializer(serializers.Serializer):
     presupuesto = serializers.SlugRelatedField(slug_field='id', queryset=Presupuesto.objects.all())
     estado = serializers.ChoiceField(choices=EstadoPresupuesto.estado_presupuesto_choices)
@@ -658,6 +792,25 @@ class PlantillaRegistroSerializer(serializers.ModelSerializer):
         fields = ["id", "nombre", "tipo_reg", "unidad_de_negocio", "unidad_de_negocio_label", "cliente_proyecto", "cliente_proyecto_label",
                   "proveedor", "imputacion", "imputacion_label", "proveedor_label", "observacion"]
 
+class HistoricalRegistroListSerializer(serializers.ListSerializer):
+    """
+    Serializa varias versiones de un registro resolviendo los nombres relacionados de todas juntas (una consulta por
+    modelo) y agrega a cada versión sus cambios respecto de la anterior. Las versiones deben venir de la más nueva a la
+    más vieja; la versión anterior a la última de la lista se puede pasar en el contexto como 'anterior'.
+    """
+
+    def to_representation(self, data):
+        versiones = list(data.all() if hasattr(data, 'all') else data)
+        anterior = self.context.get('anterior')
+        self.context['nombres'] = historial.resolver_nombres(versiones + ([anterior] if anterior else []))
+
+        filas = [self.child.to_representation(version) for version in versiones]
+        fila_anterior = self.child.to_representation(anterior) if anterior else None
+        for fila, siguiente in zip(filas, filas[1:] + [fila_anterior]):
+            fila['cambios'] = historial.cambios(fila, siguiente)
+        return filas
+
+
 class HistoricalRegistroSerializer(serializers.ModelSerializer):
     """Serializer para los registros históricos de Registro"""
     history_user = serializers.CharField(source='history_user.username', read_only=True)
@@ -666,61 +819,32 @@ class HistoricalRegistroSerializer(serializers.ModelSerializer):
     cliente_proyecto_nombre = serializers.SerializerMethodField()
     imputacion_nombre = serializers.SerializerMethodField()
     caja_nombre = serializers.SerializerMethodField()
-    
+
     def get_history_type_display(self, obj):
         """Obtiene el tipo de cambio en español"""
-        type_mapping = {
-            '+': 'Creado',
-            '~': 'Modificado',
-            '-': 'Eliminado'
-        }
-        return type_mapping.get(obj.history_type, obj.history_type)
-    
+        return historial.TIPOS_CAMBIO.get(obj.history_type, obj.history_type)
+
+    def nombres(self, obj) -> dict:
+        # En una lista los nombres ya los resolvió HistoricalRegistroListSerializer para todas las versiones
+        if 'nombres' not in self.context:
+            return historial.resolver_nombres([obj])
+        return self.context['nombres']
+
     def get_proveedor_nombre(self, obj):
-        """Obtiene el nombre del proveedor si existe"""
-        if obj.proveedor_id:
-            try:
-                from iva.models import Persona
-                proveedor = Persona.objects.get(id=obj.proveedor_id)
-                return proveedor.nombre()
-            except:
-                return f"Proveedor ID: {obj.proveedor_id}"
-        return None
-    
+        return historial.nombre(self.nombres(obj), 'proveedor_nombre', obj)
+
     def get_cliente_proyecto_nombre(self, obj):
-        """Obtiene el nombre del cliente proyecto si existe"""
-        if obj.cliente_proyecto_id:
-            try:
-                from iva.models import ClienteProyecto
-                cliente = ClienteProyecto.objects.get(id=obj.cliente_proyecto_id)
-                return str(cliente)
-            except:
-                return f"Cliente ID: {obj.cliente_proyecto_id}"
-        return None
-    
+        return historial.nombre(self.nombres(obj), 'cliente_proyecto_nombre', obj)
+
     def get_imputacion_nombre(self, obj):
-        """Obtiene el nombre de la imputación si existe"""
-        if obj.imputacion_id:
-            try:
-                from iva.models import Imputacion
-                imputacion = Imputacion.objects.get(id=obj.imputacion_id)
-                return str(imputacion)
-            except:
-                return f"Imputación ID: {obj.imputacion_id}"
-        return None
-    
+        return historial.nombre(self.nombres(obj), 'imputacion_nombre', obj)
+
     def get_caja_nombre(self, obj):
-        """Obtiene el nombre de la caja si existe"""
-        if obj.caja_id:
-            try:
-                caja = Caja.objects.get(id=obj.caja_id)
-                return str(caja)
-            except:
-                return f"Caja ID: {obj.caja_id}"
-        return None
+        return historial.nombre(self.nombres(obj), 'caja_nombre', obj)
 
     class Meta:
         model = Registro.history.model
+        list_serializer_class = HistoricalRegistroListSerializer
         fields = [
             'history_id', 'history_date', 'history_type', 'history_type_display', 'history_user',
             'id', 'tipo_reg', 'fecha_reg', 'monto_gasto_ingreso_neto', 'iva_gasto_ingreso', 
@@ -2,6 +2,38 @@ from rest_framework import serializers
 from iva.models import ClienteProyecto, Imputacion, UnidadDeNegocio
 from tesoreria.models import Caja
 
+
+class SlugRelatedFieldCacheado(serializers.SlugRelatedField):
+    """
+    SlugRelatedField que lee el queryset una sola vez y resuelve cada valor en memoria.
+    Con many=True todas las filas se validan con la misma instancia del campo, así que hay una consulta por campo
+    y no una por movimiento.
+    """
+
+    def __init__(self, *args, ignorar_mayusculas=False, **kwargs):
+        self.ignorar_mayusculas = ignorar_mayusculas
+        super().__init__(*args, **kwargs)
+
+    def _clave(self, valor):
+        valor = str(valor)
+        return valor.lower() if self.ignorar_mayusculas else valor
+
+    def _indice(self) -> dict:
+        if not hasattr(self, '_objetos'):
+            self._objetos = {}
+            for obj in self.get_queryset():
+                self._objetos.setdefault(self._clave(getattr(obj, self.slug_field)), []).append(obj)
+        return self._objetos
+
+    def to_internal_value(self, data):
+        encontrados = self._indice().get(self._clave(data), [])
+        if not encontrados:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=str(data))
+        if len(encontrados) > 1:
+            # Igual que queryset.get(), un nombre repetido no identifica a un único objeto
+            self.fail('invalid')
+        return encontrados[0]
+
 class MovimientoCajaSerializer(serializers.Serializer):
     """
     Serializer para la carga masiva de registros de caja.
@@ -14,9 +46,9 @@ class MovimientoCajaSerializer(serializers.Serializer):
     fecha = serializers.DateField(required=True)
     tipo_reg = serializers.ChoiceField(choices=TIPO_REG_CHOICES)
     nombre = serializers.CharField(required=False, allow_blank=True)
-    unidad_de_negocio = serializers.SlugRelatedField(slug_field='unidad_de_negocio', queryset=UnidadDeNegocio.objects.filter(activo=True), required=False, allow_null=True)
-    obra = serializers.SlugRelatedField(slug_field='cliente_proyecto__iexact', queryset=ClienteProyecto.objects.filter(activo=True), required=False, allow_null=True)
-    imputacion = serializers.SlugRelatedField(slug_field='imputacion', queryset=Imputacion.objects.filter(activo=True), required=False, allow_null=True)
+    unidad_de_negocio = SlugRelatedFieldCacheado(slug_field='unidad_de_negocio', queryset=UnidadDeNegocio.objects.filter(activo=True), required=False, allow_null=True)
+    obra = SlugRelatedFieldCacheado(slug_field='cliente_proyecto', ignorar_mayusculas=True, queryset=ClienteProyecto.objects.filter(activo=True).select_related('unidad_de_negocio'), required=False, allow_null=True)
+    imputacion = SlugRelatedFieldCacheado(slug_field='imputacion', queryset=Imputacion.objects.filter(activo=True), required=False, allow_null=True)
     observacion = serializers.CharField(allow_blank=True, required=False)
     entrada = serializers.DecimalField(max_digits=15, decimal_places=2, required=False)
     salida = serializers.DecimalField(max_digits=15, decimal_places=2, required=False)
@@ -39,7 +71,11 @@ class CargaCajaSerializer(serializers.Serializer):
     """
 
     movimientos = MovimientoCajaSerializer(many=True)
-    caja = serializers.PrimaryKeyRelatedField(queryset=Caja.objects.filter(activo=True), required=True)
+    caja = serializers.PrimaryKeyRelatedField(queryset=Caja.objects.filter(activo=True).select_related('moneda'), required=True)
     flag_crear_proveedor = serializers.BooleanField(default=False, required=False)
+    # Carga en dos fases: resuelve todos los nombres con una consulta por entidad y guarda con bulk_create
+    masivo = serializers.BooleanField(default=False, required=False)
+    # Solo valida la carga (con la misma resolución que el modo masivo) y devuelve los errores por movimiento
+    solo_validar = serializers.BooleanField(default=False, required=False)
 
         
@@ -1,9 +1,13 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models import Q
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Presupuesto, Tarea, Notificacion, EstadoPresupuesto, Registro
-import threading
+from .models import Presupuesto, Tarea, Notificacion, EstadoPresupuesto, Registro, Caja, DolarMEP
+from iva.models import Persona, ClienteProyecto, UnidadDeNegocio, Imputacion, Documento
 from tesoreria.mails import mail_nuevo_presupuesto, mail_gasto_a_recuperar
+from tesoreria.saldos import actualizar_saldo, eliminar_saldo
+from tesoreria.busqueda import indexar_registros
+from tesoreria.cotizaciones import actualizar_calendario
 
 # Constantes para EstadoPresupuesto
 APROBADO = 2
@@ -12,7 +16,7 @@ RECHAZADO = 99
 @receiver(pre_save, sender=Registro)
 def alerta_gasto_a_recuperar(sender, instance, **kwargs):
     """
-    Esta función envía una alerta por correo cuando un registro tiene el presupuesto "A REEMBOLSAR POR EL CLIENTE".
+    Esta función decide si hay que enviar una alerta por correo cuando un registro tiene el presupuesto "A REEMBOLSAR POR EL CLIENTE".
     Se ejecuta en pre_save para comparar el estado anterior con el nuevo.
     """
     # Verificar si el presupuesto nuevo tiene la observación "A REEMBOLSAR POR EL CLIENTE"
@@ -51,14 +55,128 @@ def alerta_gasto_a_recuperar(sender, instance, **kwargs):
                 # Si no existe el registro anterior (raro), enviamos alerta por seguridad
                 enviar_alerta = True
     
-    if enviar_alerta:
-        # Enviar alerta por correo en un hilo separado
-        thread = threading.Thread(
-            target=mail_gasto_a_recuperar, 
-            args=(instance,)
-        )
-        thread.daemon = True
-        thread.start()
+    # El correo se encola en post_save, cuando el registro ya tiene pk para referenciarlo en la bandeja de salida
+    instance._alerta_gasto_a_recuperar = enviar_alerta
+
+
+@receiver(post_save, sender=Registro)
+def encolar_alerta_gasto_a_recuperar(sender, instance, raw=False, **kwargs):
+    """
+    Encola el correo de gasto a recuperar decidido en alerta_gasto_a_recuperar (ver tesoreria.correos).
+    """
+    if raw or not getattr(instance, '_alerta_gasto_a_recuperar', False):
+        return
+    instance._alerta_gasto_a_recuperar = False
+    mail_gasto_a_recuperar(instance)
+
+
+@receiver(post_save, sender=Registro)
+def actualizar_saldo_caja(sender, instance, raw=False, **kwargs):
+    """
+    Mantiene actualizado el saldo acumulado de la caja (SaldoCaja) cada vez que se guarda un registro.
+    """
+    if raw:
+        return
+    actualizar_saldo(instance)
+
+@receiver(pre_delete, sender=Registro)
+def eliminar_saldo_caja(sender, instance, **kwargs):
+    """
+    Descuenta el aporte del registro del saldo de la caja antes de eliminarlo.
+    """
+    eliminar_saldo(instance.pk)
+
+@receiver(post_save, sender=Registro)
+def indexar_busqueda_registro(sender, instance, raw=False, **kwargs):
+    """
+    Regenera el texto de búsqueda del registro (ver tesoreria.busqueda).
+    """
+    if raw:
+        return
+    indexar_registros([instance.pk])
+
+@receiver(m2m_changed, sender=Registro.documento.through)
+def indexar_busqueda_documentos(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Los números de documento forman parte del texto de búsqueda, así que se reindexa al asociar o quitar documentos.
+    """
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if not reverse:
+        indexar_registros([instance.pk])
+    elif pk_set:
+        indexar_registros(list(pk_set))
+
+# Modelos relacionados cuyos campos aparecen en el texto de búsqueda: (modelo, campos, relaciones desde Registro)
+RELACIONADOS_BUSQUEDA = [
+    (Persona, ['razon_social', 'nombre_fantasia'], ['proveedor']),
+    (ClienteProyecto, ['cliente_proyecto'], ['cliente_proyecto']),
+    (UnidadDeNegocio, ['unidad_de_negocio'], ['unidad_de_negocio']),
+    (Imputacion, ['imputacion'], ['imputacion']),
+    (Caja, ['caja'], ['caja', 'caja_contrapartida']),
+    (Presupuesto, ['observacion'], ['presupuesto']),
+    (Documento, ['serie', 'numero'], ['documento']),
+]
+
+def guardar_campos_busqueda_anteriores(sender, instance, raw=False, **kwargs):
+    """
+    Guarda los valores de los campos de búsqueda antes de guardar, para reindexar solo si alguno cambió.
+    """
+    if raw or not instance.pk:
+        return
+    for modelo, campos, _ in RELACIONADOS_BUSQUEDA:
+        if modelo is sender:
+            instance._campos_busqueda_anteriores = sender.objects.filter(pk=instance.pk).values(*campos).first()
+
+def reindexar_relacionados(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    """
+    Cuando cambia el nombre de un proveedor, caja, imputación, etc. se reindexan los registros que lo referencian.
+    """
+    if created or raw:
+        return
+    for modelo, campos, relaciones in RELACIONADOS_BUSQUEDA:
+        if modelo is not sender:
+            continue
+        if update_fields and not set(update_fields) & set(campos):
+            return
+        anteriores = getattr(instance, '_campos_busqueda_anteriores', None)
+        instance._campos_busqueda_anteriores = None
+        if anteriores is not None and all(anteriores[campo] == getattr(instance, campo) for campo in campos):
+            return
+        filtro = Q()
+        for relacion in relaciones:
+            filtro |= Q(**{relacion: instance})
+        indexar_registros(Registro.objects.filter(filtro))
+
+for modelo, _, _ in RELACIONADOS_BUSQUEDA:
+    pre_save.connect(guardar_campos_busqueda_anteriores, sender=modelo, dispatch_uid=f'busqueda_anterior_{modelo.__name__}')
+    post_save.connect(reindexar_relacionados, sender=modelo, dispatch_uid=f'busqueda_{modelo.__name__}')
+
+@receiver(pre_save, sender=DolarMEP)
+def guardar_fecha_anterior_cotizacion(sender, instance, **kwargs):
+    """
+    Si se edita la fecha de una cotización, el calendario se tiene que recalcular desde la fecha más vieja de las dos.
+    """
+    instance._fecha_anterior = DolarMEP.objects.filter(pk=instance.pk).values_list('fecha', flat=True).first() if instance.pk else None
+
+@receiver(post_save, sender=DolarMEP)
+def actualizar_calendario_cotizaciones(sender, instance, raw=False, **kwargs):
+    """
+    Mantiene el calendario de cotizaciones (CotizacionDiaria) al cargar o editar una cotización.
+    """
+    if raw:
+        return
+    fechas = [str(instance.fecha)[:10]]
+    if getattr(instance, '_fecha_anterior', None):
+        fechas.append(str(instance._fecha_anterior))
+    actualizar_calendario(min(fechas))
+
+@receiver(post_delete, sender=DolarMEP)
+def quitar_cotizacion_del_calendario(sender, instance, **kwargs):
+    """
+    Al eliminar una cotización, los días que la usaban pasan a tomar la anterior.
+    """
+    actualizar_calendario(instance.fecha)
 
 
 # Este decorador permite que la función que lo precede sea llamada cada vez que se guarde un objeto de la clase Presupuesto
@@ -81,13 +199,8 @@ def crear_tareas_aprobacion(sender, instance, created, **kwargs):
                 mensaje=f"Nuevo presupuesto pendiente de aprobación: {instance}",
             )
 
-        # Iniciar un hilo para enviar los correos en segundo plano
-        thread = threading.Thread(
-            target=mail_nuevo_presupuesto, 
-            args=(instance,)
-        )
-        thread.daemon = True  # El hilo se cerrará cuando termine el programa principal
-        thread.start()
+        # Los correos quedan en la bandeja de salida y los envía el comando enviar_correos
+        mail_nuevo_presupuesto(instance)
 
 
 @receiver(post_save, sender=EstadoPresupuesto)
@@ -1,3 +1,289 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import transaction
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from iva.models import ClienteProyecto, Documento, Imputacion, Persona, TiposDocumento, UnidadDeNegocio
+from shared.models import Moneda
+from tesoreria import correos
+from tesoreria.historial_mantenimiento import CAMBIO_AUTOMATICO, VENTANA_AUTOMATICA, _a_borrar
+from tesoreria.models import Caja, CorreoSaliente, PagoFactura, Presupuesto, Registro
+
+
+class BackendCaido(EmailBackend):
+    '''Backend de prueba que rechaza todos los envíos.'''
+
+    def send_messages(self, messages):
+        raise OSError('Servidor rechazó el correo')
+
+
+class BandejaDeSalidaTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user(username='ana', email='ana@example.com')
+
+    def encolar(self, **contexto):
+        contexto = {'usuario': self.usuario, 'presupuesto': 'Obra Norte', **contexto}
+        return correos.encolar([correos.preparar('Nuevo presupuesto', 'emails/presupuesto', contexto, self.usuario.email)])
+
+    def test_encola_en_la_transaccion_del_cambio(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.encolar()
+                raise RuntimeError
+        self.assertFalse(CorreoSaliente.objects.exists())
+
+        with transaction.atomic():
+            self.encolar()
+        correo = CorreoSaliente.objects.get()
+        self.assertEqual(correo.estado, CorreoSaliente.PENDIENTE)
+        self.assertEqual(correo.contexto['usuario'], {'modelo': 'auth.User', 'pk': self.usuario.pk})
+        self.assertEqual(mail.outbox, [])
+
+    def test_envia_el_lote(self):
+        self.encolar()
+        lote = correos.tomar_lote()
+        self.assertEqual(correos.enviar_lote(lote), 1)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['ana@example.com'])
+        self.assertIn('ana', mail.outbox[0].body)
+        correo = CorreoSaliente.objects.get()
+        self.assertEqual(correo.estado, CorreoSaliente.ENVIADO)
+        self.assertIsNotNone(correo.enviado)
+        self.assertEqual(correos.tomar_lote(), [])
+
+    def test_reintenta_con_espera_creciente(self):
+        self.encolar()
+        esperas = []
+        for _ in range(2):
+            CorreoSaliente.objects.update(proximo_intento=timezone.now())
+            antes = timezone.now()
+            self.assertEqual(correos.enviar_lote(correos.tomar_lote(), BackendCaido()), 0)
+            correo = CorreoSaliente.objects.get()
+            self.assertEqual(correo.estado, CorreoSaliente.PENDIENTE)
+            self.assertIn('rechazó', correo.error)
+            esperas.append(correo.proximo_intento - antes)
+        self.assertGreaterEqual(esperas[0], correos.ESPERA_BASE)
+        self.assertLess(esperas[0], correos.ESPERA_BASE * 2)
+        self.assertGreaterEqual(esperas[1], correos.ESPERA_BASE * 2)
+        # Todavía no llegó el próximo intento
+        self.assertEqual(correos.tomar_lote(), [])
+
+    def test_queda_en_error_al_agotar_los_intentos(self):
+        self.encolar()
+        CorreoSaliente.objects.update(intentos=correos.MAX_INTENTOS - 1)
+        correos.enviar_lote(correos.tomar_lote(), BackendCaido())
+        self.assertEqual(CorreoSaliente.objects.get().estado, CorreoSaliente.ERROR)
+
+    def test_libera_los_correos_colgados(self):
+        self.encolar()
+        colgados = correos.tomar_lote()
+        CorreoSaliente.objects.update(tomado=timezone.now() - correos.TIEMPO_MAXIMO - timedelta(minutes=1))
+
+        self.assertEqual(correos.liberar_colgados(), 1)
+        correo = CorreoSaliente.objects.get()
+        self.assertEqual(correo.estado, CorreoSaliente.PENDIENTE)
+        self.assertEqual(correo.lote, '')
+
+        # Otro worker lo toma y lo envía; el worker colgado ya no puede cambiar su estado
+        nuevo = correos.tomar_lote()
+        self.assertEqual(correos.enviar_lote(nuevo), 1)
+        correos.enviar_lote(colgados, BackendCaido())
+        correo.refresh_from_db()
+        self.assertEqual(correo.estado, CorreoSaliente.ENVIADO)
+        self.assertEqual(correo.lote, nuevo[0].lote)
+
+    def test_falla_si_se_elimino_un_objeto_del_contexto(self):
+        self.encolar()
+        self.usuario.delete()
+        self.assertEqual(correos.enviar_lote(correos.tomar_lote()), 0)
+
+        correo = CorreoSaliente.objects.get()
+        self.assertEqual(correo.estado, CorreoSaliente.ERROR)
+        self.assertIn('ya no existe', correo.error)
+        self.assertEqual(mail.outbox, [])
+
+
+class CompactarHistorialTests(TestCase):
+    def setUp(self):
+        self.inicio = timezone.now() - timedelta(days=400)
+
+    def version(self, history_id, tipo='~', minutos=0, monto=1, motivo=None):
+        return {
+            'history_id': history_id, 'history_type': tipo, 'history_date': self.inicio + timedelta(minutes=minutos),
+            'history_user_id': 1, 'history_change_reason': motivo, 'monto_op_rec': monto,
+        }
+
+    def a_borrar(self, versiones, retener=True):
+        ahora = timezone.now()
+        return _a_borrar(versiones, ['monto_op_rec'], ahora - timedelta(days=30), ahora - timedelta(days=90) if retener else None)
+
+    def test_la_retencion_conserva_una_version_que_sobrevive_a_la_compactacion(self):
+        # La versión sin cambios se compacta: el estado inicial que queda es la creación
+        self.assertEqual(self.a_borrar([self.version(1, '+'), self.version(2)]), [2])
+
+    def test_une_versiones_automaticas_solo_dentro_de_la_ventana(self):
+        minutos = VENTANA_AUTOMATICA.total_seconds() / 60
+        versiones = [
+            self.version(1, '+'),
+            self.version(2, monto=2, minutos=60, motivo=CAMBIO_AUTOMATICO),
+            self.version(3, monto=3, minutos=60 + minutos / 2, motivo=CAMBIO_AUTOMATICO),
+            self.version(4, monto=4, minutos=60 + minutos * 10, motivo=CAMBIO_AUTOMATICO),
+        ]
+        self.assertEqual(self.a_borrar(versiones, retener=False), [2])
+
+    def test_no_une_versiones_de_usuarios(self):
+        # Dos guardados seguidos del mismo usuario son dos cambios que se auditan por separado
+        versiones = [self.version(1, '+'), self.version(2, monto=2, minutos=60), self.version(3, monto=3, minutos=60.01)]
+        self.assertEqual(self.a_borrar(versiones, retener=False), [])
+
+
+class PagosListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        cls.moneda = Moneda.objects.create(nombre='ARS')
+        cls.caja = Caja.objects.create(caja='Banco', moneda=cls.moneda)
+        cls.proveedor = Persona.objects.create(razon_social='Proveedor')
+        cls.receptor = Persona.objects.create(razon_social='Receptor')
+        cls.tipo_documento = TiposDocumento.objects.create(tipo_documento='NF')
+        unidad = UnidadDeNegocio.objects.create(unidad_de_negocio='Obras')
+        cls.obra = ClienteProyecto.objects.create(cliente_proyecto='Obra Norte', unidad_de_negocio=unidad)
+        cls.presupuesto = Presupuesto.objects.create(
+            observacion='P', fecha=date(2024, 1, 1), monto=1, cliente_proyecto=cls.obra, proveedor=cls.proveedor
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def registro(self, tipo_reg, **campos):
+        return Registro.objects.create(
+            tipo_reg=tipo_reg, caja=self.caja, fecha_reg=date(2024, 3, 5), añomes_imputacion=202403,
+            proveedor=self.proveedor, moneda=self.moneda, tipo_de_cambio=1, monto_op_rec=-5, **campos
+        )
+
+    def pago(self, facturas: int = 3):
+        op = self.registro('OP', presupuesto=self.presupuesto)
+        pago = PagoFactura.objects.create(monto=1)
+        for _ in range(facturas):
+            documento = Documento.objects.create(
+                tipo_documento=self.tipo_documento, fecha_documento=date(2024, 3, 1), proveedor=self.proveedor,
+                receptor=self.receptor, numero=Documento.objects.count() + 1, añomes_imputacion_gasto=202403,
+                cliente_proyecto=self.obra, moneda=self.moneda,
+            )
+            fc = self.registro('FC', cliente_proyecto=self.obra)
+            fc.documento.add(documento)
+            op.documento.add(documento)
+            pago.documentos.add(documento)
+            pago.registros_fc.add(fc)
+        pago.registros_pago.add(op)
+        return pago
+
+    def test_cantidad_de_consultas_no_depende_de_los_pagos(self):
+        # Una consulta por relación (ver PagoUISerializer.optimizar_queryset), no por pago ni por factura
+        for cantidad in (1, 10):
+            while PagoFactura.objects.count() < cantidad:
+                self.pago()
+            with self.assertNumQueries(7):
+                respuesta = self.client.get('/api/tesoreria/pagos/', {'page_size': 50})
+            self.assertEqual(respuesta.status_code, 200)
+            filas = respuesta.data['results'] if isinstance(respuesta.data, dict) else respuesta.data
+            self.assertEqual(len(filas), cantidad)
+            self.assertEqual(filas[0]['obra'], 'Obra Norte')
+            self.assertEqual(len(filas[0]['documentos']), 3)
+
+
+class CorridaPagosTests(TestCase):
+    CAMPOS = [
+        'tipo_reg', 'caja_id', 'fecha_reg', 'añomes_imputacion', 'cliente_proyecto_id', 'unidad_de_negocio_id',
+        'imputacion_id', 'observacion', 'proveedor_id', 'presupuesto_id', 'monto_gasto_ingreso_neto', 'iva_gasto_ingreso',
+        'monto_op_rec', 'moneda_id', 'tipo_de_cambio', 'realizado', 'activo', 'documentos',
+    ]
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        self.moneda = Moneda.objects.create(nombre='ARS')
+        Caja.objects.create(caja='Facturas', moneda=self.moneda)
+        Caja.objects.create(caja='Banco', moneda=self.moneda)
+        Imputacion.objects.create(imputacion='Impuesto a las Ganancias ret/perc')
+        self.imputacion = Imputacion.objects.create(imputacion='Materiales')
+        self.receptor = Persona.objects.create(razon_social='Receptor')
+        self.tipo_documento = TiposDocumento.objects.create(tipo_documento='NF')
+        unidad = UnidadDeNegocio.objects.create(unidad_de_negocio='Obras')
+        self.obras = [
+            ClienteProyecto.objects.create(cliente_proyecto=nombre, unidad_de_negocio=unidad)
+            for nombre in ('Obra Norte', 'Obra Sur', 'Varios')
+        ]
+
+    def orden(self, proveedor):
+        facturas = [
+            Documento.objects.create(
+                tipo_documento=self.tipo_documento, fecha_documento=date(2024, 3, 1), proveedor=proveedor,
+                receptor=self.receptor, numero=numero, añomes_imputacion_gasto=202403, cliente_proyecto=obra,
+                unidad_de_negocio=obra.unidad_de_negocio, imputacion=self.imputacion, concepto='Materiales',
+                moneda=self.moneda, total=total,
+            )
+            for numero, obra, total in [(1, self.obras[0], 121), (2, self.obras[2], 200)]
+        ]
+        return {
+            'facturas': [factura.id for factura in facturas],
+            'medios_pago': [
+                {'tipo': 'Transferencia', 'caja': 'Banco', 'monto': '300', 'fecha': '2024-04-02', 'tipo_de_cambio': None,
+                 'numero_certificado': None},
+                {'tipo': 'Retención', 'caja': 'Banco', 'monto': '21', 'fecha': '2024-04-03', 'tipo_de_cambio': None,
+                 'numero_certificado': 'C1', 'tipo_retencion': 'IIGG'},
+            ],
+            'imputaciones_multiples': [
+                {'factura_id': facturas[1].id, 'cliente_proyecto': self.obras[0].id, 'monto': 120.5},
+                {'factura_id': facturas[1].id, 'cliente_proyecto': self.obras[1].id, 'monto': 79.5},
+            ],
+        }
+
+    def registros(self, pago):
+        registros = Registro.objects.filter(id__in=[
+            *pago.registros_fc.values_list('id', flat=True), *pago.registros_pago.values_list('id', flat=True)
+        ]).annotate(documentos=Count('documento'))
+        # El proveedor es otro en cada camino: se compara si es el de las facturas
+        proveedor = pago.documentos.first().proveedor_id
+        return sorted(
+            tuple(str(fila[campo]) if campo != 'proveedor_id' else fila[campo] == proveedor for campo in self.CAMPOS)
+            for fila in registros.values(*self.CAMPOS)
+        )
+
+    def test_registra_lo_mismo_que_process_payment_view(self):
+        respuesta = self.client.post(
+            '/api/tesoreria/pagos/nuevo_pago/', self.orden(Persona.objects.create(razon_social='A')), format='json'
+        )
+        self.assertEqual(respuesta.status_code, 201, respuesta.content)
+        respuesta = self.client.post(
+            '/api/tesoreria/pagos/corrida/', {'ordenes': [self.orden(Persona.objects.create(razon_social='B'))]},
+            format='json',
+        )
+        self.assertEqual(respuesta.status_code, 201, respuesta.content)
+
+        individual, corrida = PagoFactura.objects.order_by('id')
+        registros = self.registros(individual)
+        self.assertEqual(len(registros), 5)
+        self.assertEqual(registros, self.registros(corrida))
+        # La factura "Varios" queda repartida entre las obras de sus imputaciones
+        self.assertEqual(
+            sorted(corrida.registros_fc.values_list('cliente_proyecto__cliente_proyecto', 'monto_gasto_ingreso_neto')),
+            [('Obra Norte', Decimal('-121')), ('Obra Norte', Decimal('-120.5')), ('Obra Sur', Decimal('-79.5'))],
+        )
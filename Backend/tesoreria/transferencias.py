@@ -0,0 +1,160 @@
+'''
+Archivos de transferencias masivas a partir de OPs (vista TransferenciaMasivaPorArchivo).
+
+Las OPs, sus proveedores y sus documentos se leen juntos (una consulta para las OPs con su proveedor y una para los
+documentos con su tipo), sin importar cuántas transferencias tenga el archivo. Cada OP se convierte una sola vez en una
+transferencia y los formatos solo la escriben:
+- xlsx: la planilla de carga masiva del banco, en modo write_only;
+- csv: las mismas columnas, para la interfaz de lotes del banco;
+- txt: ancho fijo según LAYOUT_TXT.
+'''
+import csv
+import io
+import tempfile
+import unicodedata
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import Prefetch
+from openpyxl import Workbook
+
+from iva.models import Documento
+
+from .models import Registro
+
+ENCABEZADO = [
+    'CUIL/CNPJ/CDI', 'CBU/CVU/ALIAS', 'DESCRIPCION DEL CONTACTO (MAXIMO 50 CARACTERES)',
+    'MONTO (SIN SEPARADORES DE MILES, CON SEPARADOR DECIMAL)', 'COMENTARIOS (OPCIONAL, MAXIMO 100 CARACTERES)',
+    'COMPROBANTE DE TRANSFERENCIA (OPCIONAL, INGRESE HASTA CINCO EMAILS A NOTIFICAR)',
+]
+CAMPOS = ['cnpj', 'cbu_alias', 'descripcion', 'monto', 'comentarios', 'comprobante']
+
+# Ancho fijo del TXT: (campo, ancho, relleno). Los números van alineados a la derecha con ceros, el texto a la izquierda
+# con espacios; el monto va en centavos, sin separadores
+LAYOUT_TXT = [
+    ('cnpj', 14, '0'),
+    ('cbu_alias', 35, ' '),
+    ('descripcion', 50, ' '),
+    ('monto', 15, '0'),
+    ('comentarios', 100, ' '),
+]
+
+FORMATOS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'txt': ('text/plain; charset=ascii', 'txt'),
+}
+
+
+class ErrorTransferencia(Exception):
+    '''OP que no se puede transferir. detail es el mensaje (o la lista de avisos) que devuelve la vista.'''
+
+    def __init__(self, detail):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def cargar_transferencias(ops_id: list) -> tuple[list, list]:
+    '''
+    Devuelve (transferencias, avisos) para las OPs pedidas, en el mismo orden. Lanza ErrorTransferencia si falta
+    alguna OP o si una no tiene los datos necesarios para transferir (mismas validaciones que tenía la vista).
+    '''
+    documentos = Prefetch(
+        'documento',
+        queryset=Documento.objects.select_related('tipo_documento').only(
+            'id', 'serie', 'numero', 'tipo_documento__tipo_documento'
+        ).order_by('id'),
+    )
+    ops = Registro.objects.select_related('proveedor').prefetch_related(documentos).only(
+        'id', 'tipo_reg', 'fecha_reg', 'monto_op_rec',
+        'proveedor__cnpj', 'proveedor__cbu_alias', 'proveedor__razon_social', 'proveedor__nombre_fantasia',
+    ).in_bulk(ops_id)
+    if len(set(ops_id)) != len(ops_id):
+        raise ErrorTransferencia('Hay ids de OP repetidos')
+    if len(ops) != len(ops_id):
+        raise ErrorTransferencia('Algunos de los ids de OP no existen')
+
+    avisos = []
+    transferencias = []
+    hoy = date.today()
+    for op_id in ops_id:
+        op = ops[op_id]
+        proveedor = op.proveedor
+        docs = op.documento.all()
+        if op.tipo_reg != 'OP':
+            raise ErrorTransferencia('El registro no es una OP')
+        if op.fecha_reg > hoy:
+            avisos.append('La fecha de la OP es mayor a la fecha actual.')
+        if not docs:
+            avisos.append('El registro no tiene documentos asociados.')
+        if not proveedor:
+            raise ErrorTransferencia(avisos + ['FATAL: El registro no tiene proveedor asociado.'])
+        if not proveedor.cnpj or not proveedor.cbu_alias or not (proveedor.razon_social or proveedor.nombre_fantasia):
+            raise ErrorTransferencia(avisos + ['FATAL: El proveedor no tiene CNPJ cargado.'])
+        if not op.monto_op_rec:
+            raise ErrorTransferencia(avisos + ['FATAL: El registro no tiene monto.'])
+
+        transferencias.append({
+            'cnpj': str(proveedor.cnpj),
+            'cbu_alias': proveedor.cbu_alias,
+            'descripcion': proveedor.razon_social or proveedor.nombre_fantasia,
+            'monto': abs(op.monto_op_rec),
+            'comentarios': ', '.join(f"{doc.tipo_documento.tipo_documento}{doc.serie}-{doc.numero}" for doc in docs),
+            'comprobante': '',
+        })
+    return transferencias, avisos
+
+
+def archivo_xlsx(transferencias: list):
+    '''Planilla de carga masiva del banco. Devuelve un archivo temporal ya posicionado al principio.'''
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(ENCABEZADO)
+    for transferencia in transferencias:
+        ws.append([transferencia[campo] for campo in CAMPOS])
+    archivo = tempfile.TemporaryFile()
+    wb.save(archivo)
+    archivo.seek(0)
+    return archivo
+
+
+def archivo_csv(transferencias: list) -> bytes:
+    salida = io.StringIO()
+    writer = csv.writer(salida)
+    writer.writerow(ENCABEZADO)
+    for transferencia in transferencias:
+        writer.writerow([f"{transferencia[campo]:.2f}" if campo == 'monto' else transferencia[campo] for campo in CAMPOS])
+    # BOM para que Excel reconozca los acentos
+    return ('\ufeff' + salida.getvalue()).encode('utf-8')
+
+
+def _ascii(valor) -> str:
+    # Los archivos de ancho fijo del banco no aceptan acentos ni caracteres especiales
+    texto = unicodedata.normalize('NFKD', str(valor)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(texto.split()).upper()
+
+
+def _campo_txt(campo: str, valor, ancho: int, relleno: str) -> str:
+    '''
+    Campo de ancho fijo. Lanza ErrorTransferencia si el valor no entra: cortarlo cambiaría el CNPJ, el monto o la
+    cuenta de destino.
+    '''
+    if campo == 'monto':
+        texto = str(int((Decimal(valor) * 100).quantize(Decimal(1))))
+    elif relleno == '0':
+        texto = ''.join(caracter for caracter in str(valor) if caracter.isdigit())
+    else:
+        texto = _ascii(valor)
+    if len(texto) > ancho:
+        raise ErrorTransferencia(f'El campo {campo} ({texto}) supera los {ancho} caracteres del archivo TXT')
+    if relleno == '0':
+        return texto.rjust(ancho, '0')
+    return texto.ljust(ancho)
+
+
+def archivo_txt(transferencias: list) -> bytes:
+    lineas = [
+        ''.join(_campo_txt(campo, transferencia[campo], ancho, relleno) for campo, ancho, relleno in LAYOUT_TXT)
+        for transferencia in transferencias
+    ]
+    return ''.join(linea + '\r\n' for linea in lineas).encode('ascii')
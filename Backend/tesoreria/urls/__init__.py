@@ -13,6 +13,7 @@ urlpatterns = [
     path("cajas/",views.CajaList.as_view(), name="caja_index"),
     path("cajas/<int:pk>/",views.CajaDetail.as_view(), name="caja_detail"),
     path("recibo/",views.GenerarReciboRegistro.as_view(), name="recibo"),
+    path("recibo/lote/",views.GenerarRecibosLote.as_view(), name="recibos_lote"),
     path("pagos/", include("tesoreria.urls.pagos")),
     path("cuentas_corrientes_proveedores/",views.CuentasCorrientesProveedores.as_view(), name="cuentas_corrientes_proveedores"),
     path("cuentas_corrientes_clientes/",views.CuentasCorrientesClientes.as_view(), name="cuentas_corrientes_clientes"),
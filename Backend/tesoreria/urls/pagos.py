@@ -3,6 +3,7 @@ from ..views import pagos
 
 urlpatterns = [
     path("nuevo_pago/",pagos.ProcessPaymentView.as_view(), name="pagos"),
+    path("corrida/",pagos.CorridaPagosView.as_view(), name="corrida_pagos"),
     path("",pagos.PagosList.as_view(), name="pagos_index"),
     path("<int:pk>/",pagos.PagoDetail.as_view(), name="pago_detail"),
     path("transferencia_masiva/",pagos.TransferenciaMasivaPorArchivo.as_view(), name="transferencia_masiva"),
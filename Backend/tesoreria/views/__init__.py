@@ -1,7 +1,7 @@
 from ..models import Caja, Presupuesto, Registro, Retencion, CertificadoObra, PagoFactura, Notificacion, DolarMEP, ConciliacionCaja, Tarea, PlantillaRegistro
 from ..models.archivos import Archivo
 from ..serializers.archivos import ArchivoSerializer
-from iva.models import Documento, Imputacion, ClienteProyecto, UnidadDeNegocio
+from iva.models import Documento, Imputacion, ClienteProyecto, UnidadDeNegocio, Persona
 from iva.serializers import DocumentoSerializer
 from iva.utils import registro_desde_documento_real
 from rest_framework import generics, permissions, status, filters
@@ -11,7 +11,8 @@ from ..serializers import (
     CajaSerializer, CertificadoSerializer, CobroSerializer, NotificacionSerializer,
     MovimientoEntreCuentasSerializer, PagoFacturaSerializer, 
     RetencionSerializer, CuentaCorrienteProveedorSerializer,
-    ImputacionFacturasSerializer, TareaSerializer, RegistroListSerializer, PlantillaRegistroSerializer
+    ImputacionFacturasSerializer, TareaSerializer, RegistroListSerializer, PlantillaRegistroSerializer,
+    RegistroProyeccion, RegistroListProyeccion
 )
 from django.db import transaction
 from rest_framework.response import Response
@@ -20,24 +21,35 @@ from datetime import datetime
 from django.db.models import Case, When, F, DecimalField, Window, Sum, Q, OuterRef, Subquery, Value
 from django.db.models.functions import Coalesce
 from rest_framework.exceptions import ValidationError
-from .. import recibopdf
-from rest_framework.pagination import PageNumberPagination
+from .. import pdfs, recibopdf
+from ..saldos import sincronizar_saldos
+from ..busqueda import RegistroSearchFilter, indexar_registros
+from reportes.hechos import sincronizar_hechos
+from ..cotizaciones import cotizacion_vigente
+from ..diferencia_cambio import revaluar_fechas
+from ..historial_mantenimiento import CAMBIO_AUTOMATICO
+from ..asociados import cargar_asociados
+from ..paginacion import RegistroPagination, RegistroKeysetPagination
+from shared import catalogos, versiones
+from shared.models import Moneda
+from shared.condicional import RespuestaCondicionalMixin
+from shared.proyecciones import ListadoProyectadoMixin
 from django_filters import rest_framework as drf_filters
 from decimal import Decimal
+from django.http import HttpResponse
+from io import BytesIO
+import zipfile
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
-class RegistroPagination(PageNumberPagination):
-    page_size = 30
-    page_size_query_param = 'page_size'
-    max_page_size = 1000
-
-class RegistroViewSet(ModelViewSet):
+class RegistroViewSet(RespuestaCondicionalMixin, ListadoProyectadoMixin, ModelViewSet):
     serializer_class = RegistroListSerializer
+    # El listado lee las filas con values(), sin instanciar los registros (ver shared.proyecciones)
+    serializer_proyeccion = RegistroListProyeccion
     permission_classes = [IsAuthenticated]
     pagination_class = RegistroPagination
-    filter_backends = [filters.SearchFilter, drf_filters.DjangoFilterBackend]
+    filter_backends = [RegistroSearchFilter, drf_filters.DjangoFilterBackend]
     search_fields = [
         'id',
         'fecha_reg',
@@ -73,45 +85,29 @@ class RegistroViewSet(ModelViewSet):
         'presupuesto': ['exact', 'isnull']
     }
     #ordering_fields = search_fields
+    # El saldo acumulado (SaldoCaja) cambia junto con los registros y la cotización MEP sale de DolarMEP
+    modelos_etag = [Registro, Caja, UnidadDeNegocio, ClienteProyecto, Persona, Imputacion, Presupuesto, DolarMEP]
+
+    @property
+    def paginator(self):
+        '''
+        Con ?paginacion=cursor se usa paginación por cursor sobre (fecha_reg, id) en lugar de números de página.
+        '''
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('paginacion') == 'cursor':
+                self._paginator = RegistroKeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_queryset(self):
         # 1. Query base
         queryset = Registro.objects.filter(activo=True)
 
-        # 2. Anotamos el saldo acumulado con la window function
-        queryset = queryset.annotate(
-            saldo_acumulado=Window(
-                expression=Sum(
-                    Case(
-                        When(tipo_reg__in=['FC', 'SICC', 'RETS', 'RETH', 'PERCS'], then=0),
-                        When(imputacion__imputacion="Diferencia de cambio", then=0),
-                        When(realizado=False, then=0),
-                        When(caja__moneda__id__gt=1, then=F('monto_op_rec') / F('tipo_de_cambio')),
-                        default=F('monto_op_rec'),
-                        output_field=DecimalField()
-                    )
-                ),
-                partition_by=[F('caja_id')],
-                order_by=[
-                    F('fecha_reg').asc(),
-                    F('id').asc()
-                ]
-            )
-        )
-
-        # Subquery to get the DolarMEP compra rate for each registro's fecha_reg
-        dolar_subquery = DolarMEP.objects.filter(
-            fecha=OuterRef('fecha_reg')
-        ).values('compra')[:1]  # Only take the first match
-
-        # Annotate the queryset with the dolar_mep value
-        queryset = queryset.annotate(
-            dolar_mep_value=Coalesce(
-                Subquery(dolar_subquery),
-                Value(0),  # Default value when no match
-                output_field=DecimalField(max_digits=10, decimal_places=2)
-            )
-        )
+        # 2. Anotamos el saldo acumulado, que se mantiene persistido por registro en SaldoCaja (ver tesoreria.saldos)
+        queryset = queryset.annotate(saldo_acumulado=F('saldo_caja__saldo'))
+
+        # La cotización MEP de cada registro la resuelve el serializer con la caché de tesoreria.cotizaciones
         # Check if there's a user-specified ordering
         ordering = self.request.query_params.get('ordering')
         if ordering:
@@ -185,21 +181,35 @@ class RegistroViewSet(ModelViewSet):
 
         presupuesto_reembolso = Presupuesto.objects.get(observacion="REEMBOLSADO POR EL CLIENTE")
         registros.update(presupuesto=presupuesto_reembolso)
+        indexar_registros(registros)
+        versiones.incrementar(Registro)
 
         return Response({'detail': 'Registros actualizados correctamente'}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['get'], url_path='historial')
     def historial(self, request, pk=None):
-        """Obtiene el historial de cambios de un registro específico"""
+        """
+        Obtiene el historial de cambios de un registro específico, de la versión más nueva a la más vieja, con los
+        cambios de cada versión respecto de la anterior. Con ?page= (y opcionalmente ?page_size=) devuelve el historial
+        paginado.
+        """
         try:
             registro = self.get_object()
             # Obtener todos los registros históricos para este registro
-            historical_records = registro.history.all().order_by('-history_date')
-            
+            historical_records = registro.history.select_related('history_user').order_by('-history_date', '-history_id')
+
             from tesoreria.serializers import HistoricalRegistroSerializer
-            serializer = HistoricalRegistroSerializer(historical_records, many=True)
-            return Response(serializer.data)
-            
+            if 'page' not in request.query_params:
+                serializer = HistoricalRegistroSerializer(historical_records, many=True)
+                return Response(serializer.data)
+
+            paginator = RegistroPagination()
+            pagina = paginator.paginate_queryset(historical_records, request, view=self)
+            # La versión que sigue a la página hace falta para calcular los cambios de la última versión de la página
+            anterior = historical_records[paginator.page.end_index():paginator.page.end_index() + 1].first()
+            serializer = HistoricalRegistroSerializer(pagina, many=True, context={'anterior': anterior})
+            return paginator.get_paginated_response(serializer.data)
+
         except Registro.DoesNotExist:
             return Response({'detail': 'Registro no encontrado'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -274,10 +284,11 @@ class CuentasCorrientesClientes(generics.ListAPIView):
             
         return Response(cuentas_corrientes)
 
-class CajaList(generics.ListCreateAPIView):
+class CajaList(RespuestaCondicionalMixin, generics.ListCreateAPIView):
     queryset = Caja.objects.all().order_by('-id')
     serializer_class = CajaSerializer
     permission_classes = [IsAuthenticated]
+    modelos_etag = [Caja, Moneda]
     filter_backends = [filters.OrderingFilter, filters.SearchFilter, drf_filters.DjangoFilterBackend]
     filterset_fields = {
          'caja': ['icontains', 'isnull', 'exact'],
@@ -286,10 +297,11 @@ class CajaList(generics.ListCreateAPIView):
     }
     search_fields = ['caja', 'dueño__username']
 
-class CajaDetail(generics.RetrieveUpdateDestroyAPIView):
+class CajaDetail(RespuestaCondicionalMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Caja.objects.all()
     serializer_class = CajaSerializer
     permission_classes = [IsAuthenticated]
+    modelos_etag = [Caja]
 
 '''
 Método para que se pueda buscar por razon_social y por nombre_fantasia en simultaneo TODO: Reemplazar implementaciones por filter backend de django
@@ -308,20 +320,16 @@ class MovimientoEntreCuentas(APIView):
         serializer = MovimientoEntreCuentasSerializer(data=request.data)
         if serializer.is_valid():
             datos = serializer.validated_data
-            caja_origen = Caja.objects.get(caja=datos['caja_origen'])
-            caja_destino = Caja.objects.get(caja=datos['caja_destino'])
+            caja_origen = catalogos.por_nombre(Caja, datos['caja_origen'])
+            caja_destino = catalogos.por_nombre(Caja, datos['caja_destino'])
             monto = datos['monto']
             fecha = datos['fecha']
             observacion = datos['observacion']
             tipo_de_cambio = datos['tipo_de_cambio'] or 1
 
-            # Si ambas cajas son de USD traer la cotización del día de la tabla DolarMEP
+            # Si ambas cajas son de USD traer la cotización MEP vigente a la fecha
             if caja_origen.moneda.id == caja_destino.moneda.id == 2:
-                try:
-                    tc = DolarMEP.objects.get(fecha=fecha)
-                    tipo_de_cambio = tc.compra
-                except DolarMEP.DoesNotExist:
-                    tipo_de_cambio = 1
+                tipo_de_cambio = cotizacion_vigente(fecha) or 1
 
             registro_data = {
                 'tipo_reg': 'MC',
@@ -422,6 +430,7 @@ class ProcesarCobroCertificado(APIView):
                 saldo_a_restar = monto * tipo_de_cambio if serializer.validated_data['moneda'] != 1 else monto
                 if 'certificado' in serializer.validated_data:
                     CertificadoObra.objects.filter(id=serializer.validated_data['certificado']).update(saldo=F('saldo') - saldo_a_restar)
+                    versiones.incrementar(CertificadoObra)
 
                 # Creación del registro
                 registro_serializer = RegistroSerializer(data=registro_data)
@@ -458,19 +467,28 @@ class RealizarRegistro(APIView): # TODO: analizar que pasa con la lógica de TC
                 return Response({'detail': 'Registro no encontrado'}, status=status.HTTP_404_NOT_FOUND)
             registro.realizado = True
             registro.fecha_reg = fecha
+            # La versión del historial se marca como automática, así la compactación la une con la revaluación que sigue
+            registro._change_reason = CAMBIO_AUTOMATICO
             registro.save()
 
             # Actualizar fecha_reg de registros FC asociados
             for documento in registro.documento.all(): 
-                Registro.objects.filter(Q(tipo_reg="FC") | Q(tipo_reg="PERCS")).filter(documento=documento).update(fecha_reg=fecha)
+                asociados = Registro.objects.filter(Q(tipo_reg="FC") | Q(tipo_reg="PERCS")).filter(documento=documento)
+                asociados.update(fecha_reg=fecha)
+                # update() no dispara señales, así que reubicamos los saldos a mano
+                sincronizar_saldos(asociados)
+                indexar_registros(asociados)
+                sincronizar_hechos(asociados)
+                versiones.incrementar(Registro)
             return Response(RegistroSerializer(registro).data, status=status.HTTP_200_OK)
         except Exception as e:
             transaction.set_rollback(True)
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
             
-class CertificadosList(generics.ListCreateAPIView):
+class CertificadosList(RespuestaCondicionalMixin, generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = CertificadoSerializer
+    modelos_etag = [CertificadoObra, ClienteProyecto]
 
     def get_queryset(self,):
         if not self.request.query_params:
@@ -490,7 +508,7 @@ class CertificadosList(generics.ListCreateAPIView):
             registro_data = {
                 'tipo_reg': 'FCV',
                 'certificado': certificado.id,
-                'caja': Caja.objects.get(caja='Facturas'),
+                'caja': catalogos.por_nombre(Caja, 'Facturas'),
                 'cliente_proyecto': serializer.validated_data['cliente_proyecto'],
                 'unidad_de_negocio': serializer.validated_data['cliente_proyecto'].unidad_de_negocio,
                 'imputacion': 'Ingreso x proyecto',
@@ -540,6 +558,9 @@ class CertificadoDetail(generics.RetrieveUpdateDestroyAPIView):
                     registro.fecha_reg = request.data['fecha']
                 if 'cliente_proyecto' in request.data:
                     Registro.objects.filter(certificado=certificado).update(cliente_proyecto=certificado.cliente_proyecto)
+                    indexar_registros(Registro.objects.filter(certificado=certificado))
+                    sincronizar_hechos(Registro.objects.filter(certificado=certificado))
+                    versiones.incrementar(Registro)
                 certificado.save()
                 registro.save()
                 return Response(serializer.data, status=status.HTTP_200_OK)
@@ -555,7 +576,11 @@ class CertificadoDetail(generics.RetrieveUpdateDestroyAPIView):
             certificado = CertificadoObra.objects.get(id=kwargs['pk'])
             certificado.activo = False
             certificado.save()
-            Registro.objects.filter(tipo_reg="FCV").filter(certificado=certificado).update(activo=False)
+            registros = Registro.objects.filter(tipo_reg="FCV").filter(certificado=certificado)
+            registros.update(activo=False)
+            sincronizar_saldos(registros)
+            sincronizar_hechos(registros)
+            versiones.incrementar(Registro)
             return Response({'detail': 'Certificado eliminado correctamente'}, status=status.HTTP_204_NO_CONTENT)
         except CertificadoObra.DoesNotExist:
             return Response({'detail': 'Certificado no encontrado'}, status=status.HTTP_404_NOT_FOUND)
@@ -606,122 +631,16 @@ class DolarMEPList(generics.ListCreateAPIView):
             return Response({'detail': 'Debe especificar una fecha'}, status=status.HTTP_400_BAD_REQUEST)
         if DolarMEP.objects.filter(fecha=fecha).exists():
             return Response({'detail': 'Ya existe una cotización para la fecha especificada'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        fecha_parts = fecha.split('-')
-        registros = Registro.objects.filter(fecha_reg=fecha)
-        tc_mep = Decimal(request.data.get('compra'))
         try:
-            for reg in registros:
-                # Obtengo el tipo de cambio del registro
-                tc_reg = reg.tipo_de_cambio
-                # Si el valor obtenido no es nulo y es distinto del tc MEP del día
-                if tc_reg and tc_reg > 1 and tc_reg != tc_mep:
-                    # Calcular la diferencia de cambio
-                    dif = ((tc_mep - tc_reg) * (reg.monto_op_rec / tc_reg)).quantize(Decimal('0.01'))
-
-                    # Si la diferencia es 0, no crear registro
-                    if dif == 0:
-                        continue
-
-                    # Esto debería moverse al serializer, porque la lógica de distribución de diferencia de cambio solo se aplica al cargar una cotización y debería aplicarse siempre
-
-                    documentos: list[Documento] = reg.documento.all()
-                    clientes = {}
-                    # Si hay documentos asociados al registro
-                    if documentos:
-                        total_docs = sum(documento.total for documento in documentos)
-                        # Calcular la diferencia proporcional por cliente_proyecto
-                        for documento in documentos:
-                            proporcion = (documento.total / total_docs * dif).quantize(Decimal('0.01'))
-                            if documento.cliente_proyecto.pk not in clientes:
-                                clientes[documento.cliente_proyecto.pk] = proporcion
-                            else:
-                                clientes[documento.cliente_proyecto.pk] += proporcion
-
-                        for cliente in clientes:
-                            docs = documentos.filter(cliente_proyecto=cliente)
-                            reg_data = {
-                                'tipo_reg': 'PSF' if reg.tipo_reg in ['PSF','OP','OPFC'] else 'ISF',
-                                'caja': reg.caja.pk if reg.caja else None,
-                                'documento': [doc.id for doc in docs],
-                                'fecha_reg': fecha,
-                                'añomes_imputacion': int(fecha_parts[0]) * 100 + int(fecha_parts[1]),
-                                'unidad_de_negocio': reg.unidad_de_negocio.pk if reg.unidad_de_negocio else docs[0].unidad_de_negocio.pk,
-                                'cliente_proyecto': cliente,
-                                'proveedor': reg.proveedor.pk if reg.proveedor else None,
-                                'imputacion': Imputacion.objects.get(imputacion='Diferencia de cambio').pk,
-                                'observacion': 'Diferencia de cambio',
-                                'monto_gasto_ingreso_neto': clientes[cliente],
-                                'monto_op_rec': clientes[cliente],
-                                'tipo_de_cambio': tc_reg,
-                                'moneda': 1,
-                                'realizado': True
-                            }
-                            reg_serializer = RegistroCrudSerializer(data=reg_data)
-                            if reg_serializer.is_valid():
-                                reg_serializer.save()
-                            else:
-                                transaction.set_rollback(True)
-                                return Response(reg_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-                    else:
-                        if reg.tipo_reg == 'MC':
-                            if reg.monto_op_rec > 0: continue
-                            reg_data={
-                                'tipo_reg': 'ISF',
-                                'caja': reg.caja.pk if reg.caja else None,
-                                'fecha_reg': reg.fecha_reg,
-                                'añomes_imputacion': reg.añomes_imputacion if reg.añomes_imputacion else None,
-                                'unidad_de_negocio': UnidadDeNegocio.objects.get(unidad_de_negocio='Indirectos').pk,
-                                'cliente_proyecto': ClienteProyecto.objects.get(cliente_proyecto='Indirectos').pk,
-                                'caja_contrapartida': reg.caja_contrapartida.pk if reg.caja_contrapartida else None,
-                                'imputacion': Imputacion.objects.get(imputacion='Diferencia de cambio').pk,
-                                'observacion': 'Diferencia de cambio',
-                                'monto_gasto_ingreso_neto': dif,
-                                'monto_op_rec': dif,
-                                'tipo_de_cambio': tc_reg,
-                                'realizado': True,
-                                'moneda': 1,
-                            }
-                        else:
-                            reg_data = {
-                                'tipo_reg': 'PSF' if reg.tipo_reg in ['PSF','OP','OPFC'] else 'ISF',
-                                'caja': reg.caja.pk if reg.caja else None,
-                                'fecha_reg': fecha,
-                                'añomes_imputacion': int(fecha_parts[0]) * 100 + int(fecha_parts[1]),
-                                'unidad_de_negocio': reg.unidad_de_negocio.pk if reg.unidad_de_negocio else None,
-                                'cliente_proyecto': reg.cliente_proyecto.pk if reg.cliente_proyecto else None,
-                                'proveedor': reg.proveedor.pk if reg.proveedor else None,
-                                'imputacion': Imputacion.objects.get(imputacion='Diferencia de cambio').pk,
-                                'observacion': 'Diferencia de cambio',
-                                'monto_gasto_ingreso_neto': dif,
-                                'monto_op_rec': dif,
-                                'tipo_de_cambio': tc_reg,
-                                'moneda': 1,
-                            }
-                        reg_serializer = RegistroCrudSerializer(data=reg_data)
-                        if reg_serializer.is_valid():
-                            reg_serializer.save()
-                        else:
-                            transaction.set_rollback(True)
-                            return Response(reg_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-                        
-                # Si el registro es en USD y el tipo de cambio es 1, quiere decir que le falta el TC, entonces multiplicamos los montos por el TC MEP y guardamos el TC
-                elif reg.moneda.id == 2 and tc_reg and tc_reg == 1:
-                    try:
-                        print("Moneda = 2")
-                        reg.tipo_de_cambio = tc_mep
-                        reg.monto_gasto_ingreso_neto = (reg.monto_gasto_ingreso_neto * tc_mep).quantize(Decimal('0.0001')) if reg.monto_gasto_ingreso_neto else None
-                        reg.iva_gasto_ingreso = (reg.iva_gasto_ingreso * tc_mep).quantize(Decimal('0.0001')) if reg.iva_gasto_ingreso else None
-                        reg.monto_op_rec = (reg.monto_op_rec * tc_mep).quantize(Decimal('0.0001')) if reg.monto_op_rec else None
-                        reg.save()
-                    except Exception as e:
-                        transaction.set_rollback(True)
-                        return Response({'Error al actualizar registro de caja en USD': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-
+            return super().post(request)
         except Exception as e:
             transaction.set_rollback(True)
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        return super().post(request)
+
+    def perform_create(self, serializer):
+        # Genera las diferencias de cambio de la fecha y pasa a pesos los registros en USD sin tipo de cambio
+        cotizacion = serializer.save()
+        revaluar_fechas([cotizacion.fecha], self.request.user)
     
 class DolarMEPDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
@@ -734,19 +653,13 @@ class DolarMEPDetail(generics.RetrieveUpdateDestroyAPIView):
     @transaction.atomic
     def patch(self, request, *args, **kwargs):
         try:
-            registros: list[Registro] = Registro.objects.filter(fecha_reg=self.get_object().fecha).filter(imputacion__imputacion='Diferencia de cambio')
             cotizacion: DolarMEP = self.get_object()
-            for reg in registros:
-                usd = reg.monto_gasto_ingreso_neto / (
-                    cotizacion.compra - reg.tipo_de_cambio
-                )
-                dif = round(usd * (self.request.data['compra'] - reg.tipo_de_cambio),2)
-                reg.monto_gasto_ingreso_neto = dif
-                reg.monto_op_rec = dif
-                reg.save()
+            fecha_anterior = cotizacion.fecha
             serializer = DolarMEPSerializer(cotizacion, data=request.data, partial=True)
             if serializer.is_valid():
-                serializer.save()
+                cotizacion = serializer.save()
+                # Se recalculan las diferencias de la fecha (y de la anterior, si se cambió la fecha)
+                revaluar_fechas({fecha_anterior, cotizacion.fecha}, request.user)
                 return Response(serializer.data, status=status.HTTP_200_OK)
             else:
                 transaction.set_rollback(True)
@@ -758,10 +671,11 @@ class DolarMEPDetail(generics.RetrieveUpdateDestroyAPIView):
     @transaction.atomic
     def delete(self, request, *args, **kwargs):
         try:
-            registros: list[Registro] = Registro.objects.filter(fecha_reg=self.get_object().fecha).filter(imputacion__imputacion='Diferencia de cambio')
-            for reg in registros:
-                reg.delete()
-            return super().delete(request, *args, **kwargs)
+            fecha = self.get_object().fecha
+            response = super().delete(request, *args, **kwargs)
+            # Sin cotización la fecha no tiene diferencias de cambio (salvo que haya otra cotización cargada ese día)
+            revaluar_fechas([fecha], request.user)
+            return response
         except Exception as e:
             transaction.set_rollback(True)
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -790,11 +704,11 @@ class ConciliacionCajaData(APIView):
         # Si no hay conciliación retornar todos los registros de la caja
         if not ultima_conciliacion:
             registros = Registro.objects.filter(caja=caja)
-            registros_data = RegistroSerializer(registros, many=True).data
+            registros_data = RegistroProyeccion(RegistroProyeccion.proyectar(registros), many=True).data
             return Response(registros_data)
         
         registros = Registro.objects.filter(caja=caja, id__gt=ultima_conciliacion.registro.id)
-        registros_data = RegistroSerializer(registros, many=True).data
+        registros_data = RegistroProyeccion(RegistroProyeccion.proyectar(registros), many=True).data
         return Response(registros_data)
     
 class GenerarReciboRegistro(APIView):
@@ -822,6 +736,57 @@ class GenerarReciboRegistro(APIView):
 
         return response
 
+class GenerarRecibosLote(APIView):
+    permission_classes = [IsAuthenticated]
+    """
+    Clase para generar los recibos de varios registros de una vez: los indicados en `registros` (ids separados por coma)
+    o los de la caja `caja` entre `desde` y `hasta`. Devuelve un solo PDF, o un ZIP con un PDF por recibo si unir=false.
+    Los recibos se dibujan en paralelo y los que ya se habían generado salen de la caché (ver tesoreria.pdfs).
+    """
+    def get(self, request):
+        pagador = request.query_params.get('pagador')
+        if not pagador:
+            return Response({'detail': 'Debe especificar un pagador'}, status=status.HTTP_400_BAD_REQUEST)
+
+        registros = Registro.objects.select_related('caja', 'moneda').order_by('fecha_reg', 'id')
+        ids = request.query_params.get('registros')
+        caja = request.query_params.get('caja')
+        if ids:
+            try:
+                registros = registros.filter(id__in=[int(registro_id) for registro_id in ids.split(',')])
+            except ValueError:
+                return Response({'detail': 'Los ids de registros deben ser números separados por coma'}, status=status.HTTP_400_BAD_REQUEST)
+        elif caja and request.query_params.get('desde') and request.query_params.get('hasta'):
+            registros = registros.filter(
+                caja__caja=caja, activo=True, monto_op_rec__lt=0,
+                fecha_reg__range=(request.query_params['desde'], request.query_params['hasta']),
+            )
+        else:
+            return Response({'detail': 'Debe especificar los registros o la caja y el rango de fechas'}, status=status.HTTP_400_BAD_REQUEST)
+
+        registros = list(registros)
+        if not registros:
+            return Response({'detail': 'No se encontraron registros'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            datos = [recibopdf.datos_recibo(registro, pagador) for registro in registros]
+        except Exception as e:
+            return Response({'detail': f'Error al armar los recibos: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.query_params.get('unir', 'true').lower() != 'false':
+            contenido = pdfs.renderizar_lote('recibo', datos, unir=True)
+            response = HttpResponse(contenido, content_type='application/pdf')
+            response['Content-Disposition'] = 'attachment; filename="recibos.pdf"'
+            return response
+
+        zip_buffer = BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for datos_recibo, contenido in zip(datos, pdfs.renderizar_lote('recibo', datos)):
+                zip_file.writestr(datos_recibo['nombre_archivo'], contenido)
+        response = HttpResponse(zip_buffer.getvalue(), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="recibos.zip"'
+        return response
+
 class ImputacionFacturas(APIView):
     permission_classes = [IsAuthenticated]
     """
@@ -847,47 +812,28 @@ class ImputacionFacturas(APIView):
 class RegistrosAsociados(APIView):
     permission_classes = [IsAuthenticated]
     '''
-    Clase que retorna las instancias de los distintos modelos asociados a un registro
+    Clase que retorna las instancias de los distintos modelos asociados a un registro, cargadas con una cantidad fija de
+    consultas (ver tesoreria.asociados). En 'registros' vienen, una vez cada uno, los registros vinculados a las
+    retenciones y órdenes de pago, que en esas listas aparecen solo por id.
     '''
     allowed_methods = ['get']
     def get(self,request,**kwargs):
         try:
-            registro: Registro = Registro.objects.get(id=kwargs['pk'])
-            registros_fc = registro.documento.all()
-            
-            # Get retenciones related to the main registro
-            retenciones_main = list(Retencion.objects.filter(registro=registro))
-            
-            # Get retenciones related to the registro_fc entries
-            retenciones_fc = []
-            for reg_fc in registros_fc:
-                # Buscamos directamente las retenciones que tengan este documento en la relación M2M
-                # La relación inversa se debe acceder desde el registro que contiene al documento
-                registros_con_este_documento = Registro.objects.filter(documento=reg_fc)
-                for reg_documento in registros_con_este_documento:
-                    retenciones_fc.extend(list(Retencion.objects.filter(registro_fc=reg_documento)))
-            
-            # Combine all retenciones
-            seen_ids = set()
-            all_retenciones = []
-            for ret in retenciones_main + retenciones_fc:
-                if ret.id not in seen_ids:
-                    seen_ids.add(ret.id)
-                    all_retenciones.append(ret)
-
-            certificado = registro.certificado
-            pagos_factura = PagoFactura.objects.filter(registros_pago__id=registro.pk) if registro.tipo_reg != 'FC' else PagoFactura.objects.filter(registros_fc=registro)
-            archivos = registro.archivos.all()
-            return Response({
-                'registros_fc': DocumentoSerializer(registros_fc,many=True).data,
-                'retencion': RetencionSerializer(all_retenciones, many=True).data if all_retenciones else None,
-                'certificado': CertificadoSerializer(certificado).data if certificado else None,
-                'pagos': PagoFacturaSerializer(pagos_factura,many=True).data,
-                'archivos': ArchivoSerializer(archivos,many=True).data
-            })
+            asociados = cargar_asociados(kwargs['pk'])
         except Registro.DoesNotExist:
             return Response({'detail': 'Registro no encontrado'}, status=status.HTTP_404_NOT_FOUND)
 
+        retenciones = asociados['retenciones']
+        certificado = asociados['certificado']
+        return Response({
+            'registros_fc': DocumentoSerializer(asociados['documentos'], many=True).data,
+            'retencion': RetencionSerializer(retenciones, many=True).data if retenciones else None,
+            'certificado': CertificadoSerializer(certificado).data if certificado else None,
+            'pagos': PagoFacturaSerializer(asociados['pagos'], many=True).data,
+            'archivos': ArchivoSerializer(asociados['archivos'], many=True).data,
+            'registros': asociados['registros'],
+        })
+
 class TareasList(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     queryset = Tarea.objects.all().order_by('-id')
@@ -1007,13 +953,11 @@ class FCI(APIView):
                 return Response({'detail': 'Fecha debe estar en formato YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
 
             try:
-                fondo = Caja.objects.get(caja='Fondo inversión')
-                banco = Caja.objects.get(caja='Banco ICBC')
+                fondo = catalogos.por_nombre(Caja, 'Fondo inversión')
+                banco = catalogos.por_nombre(Caja, 'Banco ICBC')
             except Caja.DoesNotExist:
                 return Response({'detail': 'Una o ambas cajas especificadas no existen en la base de datos'}, status=status.HTTP_400_BAD_REQUEST)
-            fondo = Caja.objects.get(caja='Fondo inversión')
-            banco = Caja.objects.get(caja='Banco ICBC')
-            imputacion_mc = Imputacion.objects.get(imputacion='Mov. entre cuentas')
+            imputacion_mc = catalogos.por_nombre(Imputacion, 'Mov. entre cuentas')
 
             reg_base = {
                 'tipo_reg': 'MC',
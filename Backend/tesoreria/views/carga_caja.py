@@ -2,14 +2,27 @@ from decimal import Decimal
 from encodings.punycode import T
 from http import client
 from rest_framework.views import APIView
-from rest_framework import permissions
+from rest_framework import permissions, serializers
 from django.db import transaction
 from iva.models import ClienteProyecto, Imputacion, Persona
 from tesoreria.serializers import RegistroSerializer
 from tesoreria.models import Caja, DolarMEP, Presupuesto, Registro
+from tesoreria.cotizaciones import cotizacion_vigente
 from tesoreria.serializers.carga_caja import CargaCajaSerializer
 from django.db.models import Q
+from django.db.models.functions import Lower
 from rest_framework.response import Response
+from simple_history.utils import bulk_create_with_history
+from tesoreria.mails import mail_gasto_a_recuperar
+from tesoreria.saldos import recalcular_saldos
+from tesoreria.busqueda import indexar_registros
+from reportes.hechos import sincronizar_hechos
+from shared import catalogos, versiones
+
+# Tipos de registro que no necesitan proveedor ni contrapartida (ver Registro.save)
+TIPOS_SIN_CONTRAPARTIDA = ["FCV", "REC", "ISF", "AJU", "SICC", "RECFC", "RETS"]
+PRESUPUESTO_A_REEMBOLSAR = "A REEMBOLSAR POR EL CLIENTE"
+CUATRO_DECIMALES = Decimal('0.0001')
 
 class CargaCaja(APIView):
     """
@@ -27,12 +40,16 @@ class CargaCaja(APIView):
             return None, None
         
         # Si se encuentra una caja con el nombre proporcionado, retorna la caja y None
-        if Caja.objects.filter(caja=item['nombre']).exists():
-            return Caja.objects.get(caja=item['nombre']), None
+        if catalogos.ids_por_nombre(Caja, item['nombre']):
+            return catalogos.por_nombre(Caja, item['nombre']), None
         
         # Si se encuentra un proveedor con el nombre proporcionado, retorna None y el proveedor
-        if Persona.objects.filter(proveedor_receptor=1, activo=True).filter(Q(razon_social__iexact=item['nombre'])|Q(nombre_fantasia__iexact=item['nombre'])).exists():
-            return None, Persona.objects.filter(proveedor_receptor=1, activo=True).get(Q(razon_social__iexact=item['nombre'])|Q(nombre_fantasia__iexact=item['nombre']))
+        # Se leen hasta dos para fallar igual que .get() si el nombre está repetido, sin consultar antes con .exists()
+        proveedores = list(Persona.objects.filter(proveedor_receptor=1, activo=True).filter(Q(razon_social__iexact=item['nombre'])|Q(nombre_fantasia__iexact=item['nombre']))[:2])
+        if len(proveedores) > 1:
+            raise Persona.MultipleObjectsReturned(f"Hay más de un proveedor con el nombre {item['nombre']}")
+        if proveedores:
+            return None, proveedores[0]
     
         # Si no se encuentra ni caja ni proveedor, crea un nuevo proveedor
         elif flag_crear_proveedor:
@@ -49,9 +66,8 @@ class CargaCaja(APIView):
             if moneda != 1 and valor is not None:
                 tc = item['tipo_de_cambio']
                 if tc == Decimal(1.0):
-                    try:
-                        tc = DolarMEP.objects.filter(fecha=item['fecha']).first().compra
-                    except Exception as e:
+                    tc = cotizacion_vigente(item['fecha'])
+                    if not tc:
                         return Decimal(valor), None
                 return Decimal(valor) * tc, tc
             return Decimal(valor) if valor is not None else None, None
@@ -145,7 +161,7 @@ class CargaCaja(APIView):
             añomes_imputacion=item['fecha'].strftime('%Y%m'),
             tipo_reg="MC",
             caja_contrapartida=caja,
-            imputacion=Imputacion.objects.get(imputacion='Mov. entre cuentas'),
+            imputacion=catalogos.por_nombre(Imputacion, 'Mov. entre cuentas'),
             caja=caja_contrapartida,
             monto_op_rec=-monto_op_rec,
             moneda=caja_contrapartida.moneda,
@@ -162,7 +178,7 @@ class CargaCaja(APIView):
             añomes_imputacion=item['fecha'].strftime('%Y%m'),
             tipo_reg="MC",
             caja_contrapartida=caja,
-            imputacion=Imputacion.objects.get(imputacion='Mov. entre cuentas'),
+            imputacion=catalogos.por_nombre(Imputacion, 'Mov. entre cuentas'),
             observacion=item['observacion'],
             caja=caja_contrapartida,
             activo=True,
@@ -175,10 +191,292 @@ class CargaCaja(APIView):
         return registro
 
 
+    def partes_presupuesto(self, presupuesto: str):
+        """
+        Separa la etiqueta de un presupuesto en (cliente_proyecto, proveedor, observación), con los mismos formatos que
+        get_presupuesto. cliente_proyecto y proveedor son None para los presupuestos sin obra ni proveedor.
+        Devuelve None si la etiqueta no tiene un formato válido.
+        """
+        partes = presupuesto.split(' - ')
+        if len(partes) == 2 and (partes[0] == "" or partes[0].strip() == "-"):
+            return None, None, partes[1]
+        if len(partes) >= 3 and partes[0] == "" and partes[1] == "":
+            return None, None, ' - '.join(partes[2:])
+        if len(partes) >= 3:
+            return partes[0], partes[1], ' - '.join(partes[2:])
+        return None
+
+    def resolver_presupuestos(self, movimientos) -> dict:
+        """
+        Resuelve todas las etiquetas de presupuesto de la carga con una sola consulta.
+        Devuelve etiqueta -> presupuesto (None si no se encontró), igual que get_presupuesto se queda con el de menor id.
+        """
+        etiquetas = {item['presupuesto']: self.partes_presupuesto(item['presupuesto']) for item in movimientos if item.get('presupuesto')}
+        observaciones = {partes[2] for partes in etiquetas.values() if partes}
+        if not observaciones:
+            return {etiqueta: None for etiqueta in etiquetas}
+
+        candidatos = Presupuesto.objects.filter(observacion__in=observaciones).select_related(
+            'cliente_proyecto', 'proveedor').order_by('pk')
+        por_observacion = {}
+        for presupuesto in candidatos:
+            por_observacion.setdefault(presupuesto.observacion, []).append(presupuesto)
+
+        def coincide(presupuesto, obra, proveedor):
+            if obra is None:
+                return presupuesto.cliente_proyecto_id is None and presupuesto.proveedor_id is None
+            return (
+                presupuesto.cliente_proyecto is not None and presupuesto.cliente_proyecto.cliente_proyecto == obra
+                and presupuesto.proveedor is not None
+                and proveedor in [presupuesto.proveedor.razon_social, presupuesto.proveedor.nombre_fantasia]
+            )
+
+        resueltos = {}
+        for etiqueta, partes in etiquetas.items():
+            if not partes:
+                resueltos[etiqueta] = None
+                continue
+            obra, proveedor, observacion = partes
+            resueltos[etiqueta] = next(
+                (presupuesto for presupuesto in por_observacion.get(observacion, []) if coincide(presupuesto, obra, proveedor)), None
+            )
+        return resueltos
+
+    def resolver_contrapartidas(self, movimientos, flag_crear_proveedor: bool) -> dict:
+        """
+        Resuelve todos los nombres de la carga con una consulta de cajas y una de proveedores, con los mismos criterios
+        que get_contrapartida. Devuelve nombre -> (caja, proveedor, error). Los proveedores a crear quedan como
+        instancias sin guardar (una por nombre), que se guardan con bulk_create junto con los registros.
+        """
+        nombres = {item['nombre'] for item in movimientos if item.get('nombre')}
+        if not nombres:
+            return {}
+        cajas = {caja.caja: caja for caja in Caja.objects.filter(caja__in=nombres).order_by('-pk')}
+
+        buscados = {nombre.lower() for nombre in nombres if nombre not in cajas}
+        personas = {}
+        if buscados:
+            candidatos = Persona.objects.filter(proveedor_receptor=1, activo=True).annotate(
+                razon_social_minusculas=Lower('razon_social'), nombre_fantasia_minusculas=Lower('nombre_fantasia')
+            ).filter(Q(razon_social_minusculas__in=buscados) | Q(nombre_fantasia_minusculas__in=buscados))
+            for persona in candidatos:
+                for nombre in {persona.razon_social_minusculas, persona.nombre_fantasia_minusculas} & buscados:
+                    personas.setdefault(nombre, {})[persona.pk] = persona
+
+        resueltos = {}
+        nuevos = {}
+        for nombre in nombres:
+            if nombre in cajas:
+                resueltos[nombre] = (cajas[nombre], None, None)
+                continue
+            encontradas = list(personas.get(nombre.lower(), {}).values())
+            if len(encontradas) > 1:
+                resueltos[nombre] = (None, None, f"Hay más de un proveedor activo con el nombre {nombre}")
+            elif encontradas:
+                resueltos[nombre] = (None, encontradas[0], None)
+            elif flag_crear_proveedor:
+                # Si el nombre se repite con otras mayúsculas se crea un solo proveedor, como en la carga uno a uno
+                proveedor = nuevos.setdefault(nombre.lower(), Persona(nombre_fantasia=nombre, proveedor_receptor=1))
+                resueltos[nombre] = (None, proveedor, None)
+            else:
+                resueltos[nombre] = (None, None, None)
+        return resueltos
+
+    def movimientos_existentes(self, registros, caja: Caja, imputacion_mc) -> set:
+        """
+        Claves de los movimientos entre cuentas que ya existen para los registros MC de la carga, en una sola consulta.
+        """
+        if imputacion_mc is None or not registros:
+            return set()
+        existentes = Registro.objects.filter(
+            tipo_reg="MC",
+            imputacion=imputacion_mc,
+            caja_contrapartida=caja,
+            fecha_reg__in={registro.fecha_reg for registro in registros},
+            caja_id__in={registro.caja_id for registro in registros},
+        ).values_list('fecha_reg', 'caja_contrapartida_id', 'caja_id', 'monto_op_rec', 'moneda_id', 'tipo_de_cambio')
+        return {self.clave_movimiento(*fila) for fila in existentes}
+
+    def clave_movimiento(self, fecha, caja_contrapartida_id, caja_id, monto_op_rec, moneda_id, tipo_de_cambio) -> tuple:
+        # Los montos se comparan con los 4 decimales con los que se guardan
+        def redondear(valor):
+            return None if valor is None else Decimal(valor).quantize(CUATRO_DECIMALES)
+        return (str(fecha)[:10], caja_contrapartida_id, caja_id, redondear(monto_op_rec), moneda_id, redondear(tipo_de_cambio))
+
+    def preparar_registros(self, datos) -> tuple:
+        """
+        Primera fase de la carga masiva: resuelve cajas, proveedores, presupuestos y cotizaciones de toda la carga con
+        consultas por conjunto y arma los registros sin guardarlos.
+        Devuelve (registros, proveedores nuevos, errores por movimiento).
+        """
+        caja: Caja = datos['caja']
+        movimientos = datos['movimientos']
+        contrapartidas = self.resolver_contrapartidas(movimientos, datos.get('flag_crear_proveedor', False))
+        presupuestos = self.resolver_presupuestos(movimientos)
+
+        imputacion_mc = None
+        if any(item['tipo_reg'] == "MC" and contrapartidas.get(item.get('nombre'), (None,))[0] for item in movimientos):
+            imputacion_mc = Imputacion.objects.filter(imputacion='Mov. entre cuentas').first()
+
+        registros = []
+        movimientos_mc = []
+        errores = []
+        for fila, item in enumerate(movimientos):
+            errores_fila = []
+            caja_contrapartida, proveedor, error = contrapartidas.get(item.get('nombre'), (None, None, None))
+            if error:
+                errores_fila.append(error)
+
+            try:
+                # Las cotizaciones salen de la caché del calendario (tesoreria.cotizaciones), no de una consulta por fila
+                neto, iva, monto_op_rec, tc = self.get_montos(item, caja.moneda_id)
+            except (ValueError, TypeError) as e:
+                errores_fila.append(f"No se pudieron calcular los montos: {e}")
+                neto = iva = monto_op_rec = tc = None
+
+            presupuesto = None
+            if item.get('presupuesto'):
+                presupuesto = presupuestos.get(item['presupuesto'])
+                if presupuesto is None:
+                    errores_fila.append(f"Presupuesto no encontrado para: {item['presupuesto']}")
+
+            if not caja_contrapartida and not proveedor and item['tipo_reg'] not in TIPOS_SIN_CONTRAPARTIDA:
+                if item.get('nombre') and not error:
+                    errores_fila.append(f"No se encontró una caja ni un proveedor con el nombre {item['nombre']}")
+                elif not error:
+                    errores_fila.append(f"Debe especificar un proveedor o una contrapartida para el tipo de registro {item['tipo_reg']}")
+
+            if item['tipo_reg'] == "MC" and caja_contrapartida and imputacion_mc is None:
+                errores_fila.append("No existe la imputación 'Mov. entre cuentas'")
+
+            if errores_fila:
+                errores.append({'fila': fila, 'errores': errores_fila})
+                continue
+
+            if item['tipo_reg'] == "MC" and caja_contrapartida:
+                mc = Registro(
+                    fecha_reg=item['fecha'],
+                    añomes_imputacion=item['fecha'].strftime('%Y%m'),
+                    tipo_reg="MC",
+                    caja_contrapartida=caja,
+                    imputacion=imputacion_mc,
+                    observacion=item.get('observacion'),
+                    caja=caja_contrapartida,
+                    activo=True,
+                    realizado=True,
+                    monto_op_rec=-monto_op_rec,
+                    moneda_id=caja_contrapartida.moneda_id,
+                    tipo_de_cambio=item['tipo_de_cambio']
+                )
+                movimientos_mc.append(mc)
+                registros.append(mc)
+
+            registros.append(Registro(
+                fecha_reg=item['fecha'],
+                añomes_imputacion=item['fecha'].strftime('%Y%m'),
+                tipo_reg=item['tipo_reg'],
+                caja_contrapartida=caja_contrapartida,
+                proveedor=proveedor,
+                unidad_de_negocio=self.get_unidad_de_negocio(item),
+                cliente_proyecto=item.get('obra'),
+                imputacion=item.get('imputacion'),
+                observacion=item.get('observacion'),
+                monto_gasto_ingreso_neto=neto,
+                iva_gasto_ingreso=iva,
+                monto_op_rec=monto_op_rec,
+                presupuesto=presupuesto,
+                caja=caja,
+                moneda_id=caja.moneda_id,
+                realizado=True,
+                tipo_de_cambio=tc if tc else Decimal('1.0')
+            ))
+
+        # Igual que movimiento_entre_cuentas, no se duplican los movimientos que ya existen (ni los repetidos en la carga)
+        existentes = self.movimientos_existentes(movimientos_mc, caja, imputacion_mc)
+        for mc in movimientos_mc:
+            clave = self.clave_movimiento(mc.fecha_reg, caja.pk, mc.caja_id, mc.monto_op_rec, mc.moneda_id, mc.tipo_de_cambio)
+            if clave in existentes:
+                registros.remove(mc)
+            existentes.add(clave)
+
+        proveedores_nuevos = list({
+            id(proveedor): proveedor for registro in registros
+            if (proveedor := registro.proveedor) is not None and proveedor.pk is None
+        }.values())
+        return registros, proveedores_nuevos, errores
+
+    def errores_serializer(self, errores: dict) -> list:
+        """
+        Pasa los errores del serializer al formato de la validación masiva: una entrada por movimiento con errores y
+        los errores generales (caja, etc.) con fila None.
+        """
+        resultado = []
+        for campo, detalle in errores.items():
+            if campo == 'movimientos' and isinstance(detalle, (list, dict)):
+                # Según el caso el ListSerializer devuelve una lista por fila o un dict fila -> errores
+                filas = detalle.items() if isinstance(detalle, dict) else enumerate(detalle)
+                resultado.extend({'fila': fila, 'errores': error} for fila, error in filas if error)
+            else:
+                resultado.append({'fila': None, 'errores': {campo: detalle}})
+        return resultado
+
+    def carga_masiva(self, request, serializer):
+        """
+        Carga en dos fases: preparar_registros resuelve toda la carga con una consulta por entidad y después se guardan
+        todos los registros (y su historial) con bulk_create. Si algún movimiento tiene errores no se guarda nada.
+        Con solo_validar devuelve el resultado de la primera fase sin escribir.
+        """
+        datos = serializer.validated_data
+        registros, proveedores_nuevos, errores = self.preparar_registros(datos)
+
+        if datos.get('solo_validar'):
+            return Response({
+                'valido': not errores,
+                'movimientos': len(datos['movimientos']),
+                'registros': len(registros),
+                'proveedores_nuevos': [proveedor.nombre_fantasia for proveedor in proveedores_nuevos],
+                'errores': errores,
+            }, status=200)
+
+        if errores:
+            return Response({"error": "La carga tiene errores, no se guardó ningún registro.", "errores": errores}, status=400)
+
+        with transaction.atomic():
+            Persona.objects.bulk_create(proveedores_nuevos)
+            creados = bulk_create_with_history(registros, Registro, batch_size=500, default_user=request.user)
+            ids = [registro.pk for registro in creados]
+
+            # bulk_create no dispara señales: se actualizan saldos, búsqueda y tabla de hechos de una vez
+            desde_por_caja = {}
+            for registro in creados:
+                desde_por_caja[registro.caja_id] = min(registro.fecha_reg, desde_por_caja.get(registro.caja_id, registro.fecha_reg))
+            for caja_id, desde in desde_por_caja.items():
+                recalcular_saldos(caja_id, desde=desde)
+            indexar_registros(ids)
+            sincronizar_hechos(ids)
+            versiones.incrementar(Registro, Persona)
+
+            # Misma alerta que la señal alerta_gasto_a_recuperar: se encola en la misma transacción que la carga
+            for registro in creados:
+                if registro.presupuesto and registro.presupuesto.observacion == PRESUPUESTO_A_REEMBOLSAR:
+                    mail_gasto_a_recuperar(registro)
+
+        guardados = Registro.objects.filter(id__in=ids).select_related(
+            'caja', 'unidad_de_negocio', 'cliente_proyecto', 'proveedor', 'caja_contrapartida', 'imputacion',
+            'presupuesto__cliente_proyecto', 'presupuesto__proveedor',
+        ).prefetch_related('documento').order_by('id')
+        return Response(RegistroSerializer(guardados, many=True).data, status=201)
+
     def post(self, request, *args, **kwargs):
 
         serializer = CargaCajaSerializer(data=request.data)
 
+        if not serializer.is_valid() and request.data.get('solo_validar') in serializers.BooleanField.TRUE_VALUES:
+            return Response({'valido': False, 'errores': self.errores_serializer(serializer.errors)}, status=200)
+
+        if serializer.is_valid() and (serializer.validated_data.get('masivo') or serializer.validated_data.get('solo_validar')):
+            return self.carga_masiva(request, serializer)
+
         if serializer.is_valid():
             try:
                 with transaction.atomic():
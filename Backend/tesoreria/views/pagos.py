@@ -3,17 +3,21 @@ from rest_framework import status, generics
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from tesoreria.models import PagoFactura, Caja
-from iva.models import ClienteProyecto, Documento, EstadoDocumento, Imputacion, Persona
-from tesoreria.serializers import PagoFacturaSerializer, PagoManoDeObraSerializer, RegistroCrudSerializer, PagoUISerializer, PagoSerializer, RetencionSerializer
+from iva.models import ClienteProyecto, Documento, EstadoDocumento, Imputacion
+from tesoreria.serializers import PagoFacturaSerializer, PagoManoDeObraSerializer, RegistroCrudSerializer, PagoUISerializer, PagoSerializer, RetencionSerializer, CorridaPagosSerializer
 from tesoreria.models import Registro
 from rest_framework.permissions import IsAuthenticated
-from iva.utils import registro_desde_documento_real, registro_desde_documento_temporal, registros_percepciones
+from iva.utils import importes_documento, registro_desde_documento_real, registro_desde_imputacion, registros_percepciones
 from tesoreria.views import handle_proveedor_search
-from tesoreria.opdf import generar_pdf_orden_pago
+from tesoreria.corrida_pagos import preparar_corrida, aplicar_corrida, generar_ops
+from tesoreria.saldos import sincronizar_saldos
+from tesoreria.busqueda import indexar_registros
+from reportes.hechos import sincronizar_hechos
 from django.db.models import Q
 from datetime import datetime
-from openpyxl import Workbook
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse
+from tesoreria import transferencias
+from shared import catalogos, versiones
 from rest_framework import filters
 from django_filters import rest_framework as drf_filters
 
@@ -33,7 +37,7 @@ class NuevoPagoMDO(APIView):
         if serializer.is_valid():
             pagos = serializer.validated_data['pagos']
             fecha = serializer.validated_data['fecha']
-            caja = Caja.objects.get(caja='Caja Fede').pk
+            caja = catalogos.por_nombre(Caja, 'Caja Fede').pk
             for pago in pagos:
                 unidad_de_negocio = ClienteProyecto.objects.get(id=pago['cliente_proyecto']).unidad_de_negocio.pk
                 registro_data = {
@@ -80,7 +84,7 @@ class PagosList(generics.ListCreateAPIView):
     }
     
     def get_queryset(self):
-        queryset = PagoFactura.objects.filter(activo=True).order_by('-id')
+        queryset = PagoUISerializer.optimizar_queryset(PagoFactura.objects.filter(activo=True).order_by('-id'))
         ordering = self.request.query_params.get('ordering', None)
         if ordering:
             # Tengo que agregar "registro__" o "-registro__" porque los campos por los que se ordena son de la tabla Registro
@@ -111,7 +115,6 @@ class PagosList(generics.ListCreateAPIView):
 class ProcessPaymentView(APIView):
     permission_classes = [IsAuthenticated]
 
-    @transaction.atomic
     def post(self, request):
         try:
             serializer = PagoSerializer(data=request.data)
@@ -126,189 +129,202 @@ class ProcessPaymentView(APIView):
                     return Response({
                         'detail': 'Imputación múltiple requerida',
                         'facturas_varios': [{'id': f.id, 'numero': f"{f.serie}{f.tipo_documento.tipo_documento}{f.numero}", 
-                                            'proveedor': f.proveedor.razon_social, 'total': f.total, 'neto': f.neto, 'iva': f.iva} 
+                                            'proveedor': f.proveedor.razon_social, 'total': f.total,
+                                            'neto': importes_documento(f)['neto'], 'iva': importes_documento(f)['iva']}
                                         for f in facturas_varios]
                     }, status=status.HTTP_400_BAD_REQUEST)
 
-                # Generar PDF de orden de pago
-                op_nro = PagoFactura.objects.filter().order_by('-id').first().id + 1
-                datos_proveedor = {
-                    'op_nro': op_nro,
-                    'nombre': documentos[0].proveedor.razon_social,
-                    'cnpj': documentos[0].proveedor.cnpj,
-                }
-                op = generar_pdf_orden_pago("orden_de_pago.pdf",datos_proveedor,medios_pago, documentos)
+            else:
+                return Response('Error de validación4: ' + str(serializer.errors), status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-                registros_fc = []
-                registros_pago = []
-                for factura in documentos:
-                    if not factura.imputado:
-                        factura.imputado = True
-                        factura.save()
-                    
-                    # Si la factura tiene cliente "Varios" y hay imputaciones múltiples
-                    if (factura.cliente_proyecto and factura.cliente_proyecto.cliente_proyecto == "Varios" 
-                        and 'imputaciones_multiples' in serializer.validated_data):
-                        
-                        # Filtrar las imputaciones para esta factura
-                        imputaciones_factura = [imp for imp in serializer.validated_data['imputaciones_multiples'] 
-                                            if imp['factura_id'] == factura.id]
-                        
-                        # Crear un registro FC para cada imputación
-                        for imputacion in imputaciones_factura:
-                            cliente_proyecto: ClienteProyecto = imputacion['cliente_proyecto']
-                            monto = float(imputacion['monto'])
-                            
-                            # Crear copia temporal del documento con cliente_proyecto específico para registro
-                            porcentaje_iva = float(factura.iva) * 100 / float(factura.neto) if float(factura.iva) != 0.00 else 0
-                            neto = 100 / (porcentaje_iva+100) * monto
-                            iva = monto-neto
+        pago = self.registrar_pago(request, serializer, documentos, medios_pago)
+        if isinstance(pago, Response):
+            return pago
 
-                            factura_temp = Documento (
-                                id=                         factura.id,
-                                numero=                     factura.numero,
-                                serie=             factura.serie,
-                                añomes_imputacion_gasto=    factura.añomes_imputacion_gasto,
-                                fecha_documento=            factura.fecha_documento,
-                                tipo_documento=             factura.tipo_documento,
-                                fecha_carga=                factura.fecha_carga,
-                                proveedor=                  factura.proveedor,
-                                imputacion=                 factura.imputacion,
-                                receptor=                   factura.receptor,
-                                unidad_de_negocio=          cliente_proyecto.unidad_de_negocio,
-                                cliente_proyecto=           cliente_proyecto,
-                                concepto=                   factura.concepto,
-                                neto=                       neto,
-                                iva=                        iva,
-                                moneda=                     factura.moneda,
-                                tipo_de_cambio=             factura.tipo_de_cambio,
-                            )
-                            
-                            try:
+        # El número de la OP es el id del pago, que asigna la base dentro de la transacción (igual que en la corrida de
+        # pagos). El PDF se dibuja con el pago ya guardado, así no mantiene la transacción abierta mientras se dibuja
+        generar_ops([{'facturas': documentos, 'medios': [{'medio': medio} for medio in medios_pago]}], [pago])
+        return Response(PagoFacturaSerializer(pago).data['op'], status=status.HTTP_201_CREATED)
 
-                                # A partir de la copia temporal, se crea el registro FC
-                                registro_fc = registro_desde_documento_temporal(factura,factura_temp)
-                                registros_fc.append(registro_fc)
+    @transaction.atomic
+    def registrar_pago(self, request, serializer, documentos: list[Documento], medios_pago):
+        '''Guarda el pago y sus registros. Devuelve el PagoFactura, o la Response con el error.'''
+        try:
+            registros_fc = []
+            registros_pago = []
+            for factura in documentos:
+                if not factura.imputado:
+                    factura.imputado = True
+                    factura.save()
+                
+                # Si la factura tiene cliente "Varios" y hay imputaciones múltiples
+                if (factura.cliente_proyecto and factura.cliente_proyecto.cliente_proyecto == "Varios" 
+                    and 'imputaciones_multiples' in serializer.validated_data):
+                    
+                    # Filtrar las imputaciones para esta factura
+                    imputaciones_factura = [imp for imp in serializer.validated_data['imputaciones_multiples'] 
+                                        if imp['factura_id'] == factura.id]
+                    
+                    # Crear un registro FC para cada imputación, con el monto repartido entre neto e IVA
+                    for imputacion in imputaciones_factura:
+                        try:
+                            registro_fc = registro_desde_imputacion(factura, imputacion['cliente_proyecto'], imputacion['monto'])
+                            registros_fc.append(registro_fc)
 
-                            except Exception as e:
+                        except Exception as e:
 
-                                transaction.set_rollback(True)
-                                return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-                            
-                        percs = registros_percepciones(factura)
+                            transaction.set_rollback(True)
+                            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                        
+                    percs = registros_percepciones(factura)
+                    if percs:
+                        registros_fc.extend(percs)
+                else:
+                    # Comportamiento normal para facturas con un solo cliente/proyecto
+                    try:
+                        registros, percs = registro_desde_documento_real(factura)
+                        registros_fc.append(registros)
                         if percs:
                             registros_fc.extend(percs)
-                    else:
-                        # Comportamiento normal para facturas con un solo cliente/proyecto
-                        try:
-                            registros, percs = registro_desde_documento_real(factura)
-                            registros_fc.append(registros)
-                            if percs:
-                                registros_fc.extend(percs)
-                        except Exception as e:
-                            import traceback
-                            error_details = {
-                                'detail':       str(e),
-                                'factura_id':   factura.id,
-                                'proveedor':    factura.proveedor.razon_social if factura.proveedor else 'No disponible',
-                                'traceback':    traceback.format_exc()
-                            }
-                            transaction.set_rollback(True)
-                            return Response(error_details, status=status.HTTP_400_BAD_REQUEST)
+                    except Exception as e:
+                        import traceback
+                        error_details = {
+                            'detail':       str(e),
+                            'factura_id':   factura.id,
+                            'proveedor':    factura.proveedor.razon_social if factura.proveedor else 'No disponible',
+                            'traceback':    traceback.format_exc()
+                        }
+                        transaction.set_rollback(True)
+                        return Response(error_details, status=status.HTTP_400_BAD_REQUEST)
 
-                # 2) Iteración sobre medios_pago
-                retenciones = []
-                for medio in medios_pago:
-                    # Resto del código sin cambios...
-                    anio_mes = int(medio['fecha'][0:4]) * 100 + int(medio['fecha'][5:7])
+            # 2) Iteración sobre medios_pago
+            retenciones = []
+            for medio in medios_pago:
+                # Resto del código sin cambios...
+                anio_mes = int(medio['fecha'][0:4]) * 100 + int(medio['fecha'][5:7])
 
-                    # 2.1) Creación de registro
-                    facturas_ids = [factura.id for factura in documentos]
-                    
-                    registro_data = {
-                        'tipo_reg':             'OP' if medio['tipo'] != 'Retención' else 'RETH',
-                        'caja':                 medio['caja'].id,
-                        'documento':            facturas_ids,
-                        'añomes_imputacion':    anio_mes,
-                        'imputacion':           Imputacion.objects.get(imputacion="Impuesto a las Ganancias ret/perc").pk if medio['tipo'] == 'Retención' else None,
-                        'fecha_reg':            medio['fecha'],
-                        'proveedor':            documentos[0].proveedor.id,
-                        'observacion':          documentos[0].concepto if documentos[0].concepto else None if medio['tipo'] != 'Retención' else 'Retención',
+                # 2.1) Creación de registro
+                facturas_ids = [factura.id for factura in documentos]
+                
+                registro_data = {
+                    'tipo_reg':             'OP' if medio['tipo'] != 'Retención' else 'RETH',
+                    'caja':                 medio['caja'].id,
+                    'documento':            facturas_ids,
+                    'añomes_imputacion':    anio_mes,
+                    'imputacion':           catalogos.por_nombre(Imputacion, "Impuesto a las Ganancias ret/perc").pk if medio['tipo'] == 'Retención' else None,
+                    'fecha_reg':            medio['fecha'],
+                    'proveedor':            documentos[0].proveedor.id,
+                    'observacion':          documentos[0].concepto if documentos[0].concepto else None if medio['tipo'] != 'Retención' else 'Retención',
 
-                        # El usuario para una mejor experiencia indica los montos positivos, pero los registros al ser gastos deben ser negativos
-                        'monto_op_rec':         -medio['monto'],
+                    # El usuario para una mejor experiencia indica los montos positivos, pero los registros al ser gastos deben ser negativos
+                    'monto_op_rec':         -medio['monto'],
 
-                        'moneda':               medio['caja'].moneda,
-                        'tipo_de_cambio':       medio['tipo_de_cambio'],
-                        'realizado':            1 if datetime.fromisoformat(medio['fecha']).date() <= datetime.now().date() else 0
-                    }
+                    'moneda':               medio['caja'].moneda_id,
+                    'tipo_de_cambio':       medio['tipo_de_cambio'],
+                    'realizado':            1 if datetime.fromisoformat(medio['fecha']).date() <= datetime.now().date() else 0
+                }
 
-                    registro_serializer = RegistroCrudSerializer(data=registro_data)
-                    if registro_serializer.is_valid():
-                        registro = registro_serializer.save()
-                        registros_pago.append(registro_serializer.data)
-                        
-                    else:
-                        transaction.set_rollback(True)
-                        return Response('Error de validación3: ' + str(registro_serializer.errors), 
-                                    status=status.HTTP_400_BAD_REQUEST)
+                registro_serializer = RegistroCrudSerializer(data=registro_data)
+                if registro_serializer.is_valid():
+                    registro = registro_serializer.save()
+                    registros_pago.append(registro_serializer.data)
                     
-                    if medio['tipo'] == 'Retención':
-                        retencion_data = {
-                            'registro':     registro.id,
-                            'numero':       medio.get('numero_certificado'),
-                            'tipo':         medio.get('tipo_retencion'),
-                            'pdf_file':     medio.get('pdf_file'),
-                            'registro_fc':  [registro.pk for registro in registros_fc]
-                        }
-                        retencion_serializer = RetencionSerializer(data=retencion_data)
-                        if retencion_serializer.is_valid():
-                            retencion_serializer.save()
-                            retenciones.append(retencion_serializer.data)
-                        else:
-                            transaction.set_rollback(True)
-                            return Response('Error de validación2: ' + str(retencion_serializer.errors), 
-                                            status=status.HTTP_400_BAD_REQUEST)
-                
-                # Asociar registro con facturas y PERCS, acá se crea la relacion many to many
-                monto = sum([medio['monto'] for medio in medios_pago])
-                pago_factura_data = {
-                    'documentos':       [documento.id for documento in documentos],
-                    'registros_pago':   [registro['id'] for registro in registros_pago],
-                    'registros_fc':     [registro_fc.pk for registro_fc in registros_fc],
-                    'monto':            monto,
-                    'fecha_pago':       datetime.now().isoformat()[0:10],
-                    'op':               op
-                }
-                pago_factura_serializer = PagoFacturaSerializer(data=pago_factura_data)
-                if pago_factura_serializer.is_valid():
-                    pago = pago_factura_serializer.save()
                 else:
                     transaction.set_rollback(True)
-                    return Response('Error de validación1' + str(pago_factura_serializer.errors), 
-                                    status=status.HTTP_400_BAD_REQUEST)
-
-                # Actualizamos la fecha del registro para la factura pagada
-                Registro.objects.filter(documento__id__in=[factura.id for factura in documentos]).filter(
-                    Q(tipo_reg="FC") | Q(tipo_reg="PERCS")
-                ).update(fecha_reg=medio['fecha'])
+                    return Response('Error de validación3: ' + str(registro_serializer.errors), 
+                                status=status.HTTP_400_BAD_REQUEST)
+                
+                if medio['tipo'] == 'Retención':
+                    retencion_data = {
+                        'registro':     registro.id,
+                        'numero':       medio.get('numero_certificado'),
+                        'tipo':         medio.get('tipo_retencion'),
+                        'pdf_file':     medio.get('pdf_file'),
+                        'registro_fc':  [registro.pk for registro in registros_fc]
+                    }
+                    retencion_serializer = RetencionSerializer(data=retencion_data)
+                    if retencion_serializer.is_valid():
+                        retencion_serializer.save()
+                        retenciones.append(retencion_serializer.data)
+                    else:
+                        transaction.set_rollback(True)
+                        return Response('Error de validación2: ' + str(retencion_serializer.errors), 
+                                        status=status.HTTP_400_BAD_REQUEST)
             
-                # Actualizar estados de documentos
-                for factura in documentos:
-                    documento = Documento.objects.get(id=factura.id)
-                    EstadoDocumento.objects.create(documento=documento, estado=3, usuario=request.user)
-                return Response(PagoFacturaSerializer(pago).data['op'], status=status.HTTP_201_CREATED)
+            # Asociar registro con facturas y PERCS, acá se crea la relacion many to many
+            monto = sum([medio['monto'] for medio in medios_pago])
+            pago_factura_data = {
+                'documentos':       [documento.id for documento in documentos],
+                'registros_pago':   [registro['id'] for registro in registros_pago],
+                'registros_fc':     [registro_fc.pk for registro_fc in registros_fc],
+                'monto':            monto,
+                'fecha_pago':       datetime.now().isoformat()[0:10],
+            }
+            pago_factura_serializer = PagoFacturaSerializer(data=pago_factura_data)
+            if pago_factura_serializer.is_valid():
+                pago = pago_factura_serializer.save()
             else:
-                return Response('Error de validación4: ' + str(serializer.errors), status=status.HTTP_400_BAD_REQUEST)
+                transaction.set_rollback(True)
+                return Response('Error de validación1' + str(pago_factura_serializer.errors), 
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            # Actualizamos la fecha del registro para la factura pagada
+            registros_factura = Registro.objects.filter(documento__id__in=[factura.id for factura in documentos]).filter(
+                Q(tipo_reg="FC") | Q(tipo_reg="PERCS")
+            )
+            registros_factura.update(fecha_reg=medio['fecha'])
+            sincronizar_saldos(registros_factura)
+            indexar_registros(registros_factura)
+            sincronizar_hechos(registros_factura)
+            versiones.incrementar(Registro)
+        
+            # Actualizar estados de documentos
+            for factura in documentos:
+                documento = Documento.objects.get(id=factura.id)
+                EstadoDocumento.objects.create(documento=documento, estado=3, usuario=request.user)
+            return pago
         except Exception as e:
             transaction.set_rollback(True)
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        
+
+class CorridaPagosView(APIView):
+    """
+    **APIView** para registrar varias órdenes de pago, de uno o varios proveedores, en un solo request.
+    Cada orden recibe lo mismo que ProcessPaymentView (facturas, medios_pago e imputaciones_multiples). Se guardan
+    todas o ninguna (ver tesoreria.corrida_pagos).
+    ## Métodos:
+        post(request): Registra la corrida y devuelve, por orden, el id del pago y la URL de la OP.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = CorridaPagosSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'detail': 'Error de validación', 'errores': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            plan, errores = preparar_corrida(serializer.validated_data['ordenes'])
+            if errores:
+                return Response({'detail': 'La corrida tiene órdenes con errores, no se registró ningún pago', 'errores': errores},
+                                status=status.HTTP_400_BAD_REQUEST)
+            pagos = aplicar_corrida(plan, usuario=request.user)
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Los PDFs se dibujan con la corrida ya guardada, fuera de la transacción
+        generar_ops(plan, pagos)
+        return Response([
+            {'orden': orden['orden'], 'pago': pago.pk, 'op': request.build_absolute_uri(pago.op.url) if pago.op else None}
+            for orden, pago in zip(plan, pagos)
+        ], status=status.HTTP_201_CREATED)
+
 class TransferenciaMasivaPorArchivo(APIView):
     """
-    **APIView** para exportar a partir de OPs un archivo .xlsx con el formato establecido por el banco para la carga masiva de transferencias.
+    **APIView** para exportar a partir de OPs un archivo con el formato establecido por el banco para la carga masiva de transferencias.
+    Con `formato` se elige la planilla .xlsx (por defecto), .csv o .txt de ancho fijo (ver tesoreria.transferencias).
     ## Métodos:
-        get(request): Procesa la solicitud POST para generar un archivo de transferencia masiva.
+        get(request): Procesa la solicitud GET para generar un archivo de transferencia masiva.
     """
     permission_classes = [IsAuthenticated]
     def get(self, request):
@@ -316,54 +332,23 @@ class TransferenciaMasivaPorArchivo(APIView):
             op_id_array = request.query_params.get('op')
             if not op_id_array:
                 return Response({'detail': 'Falta el id de la OP'}, status=status.HTTP_400_BAD_REQUEST)
-            response_flags = []
+            formato = request.query_params.get('formato', 'xlsx')
+            if formato not in transferencias.FORMATOS:
+                return Response({'detail': f'Formato inválido: {formato}'}, status=status.HTTP_400_BAD_REQUEST)
             ops_id = [int(op_id) for op_id in op_id_array.split(',')]
-            if len(ops_id) > 0:
-                ops = Registro.objects.filter(id__in=ops_id)
-                if len(ops) != len(ops_id):
-                    return Response({'detail': 'Algunos de los ids de OP no existen'}, status=status.HTTP_400_BAD_REQUEST)
-            # Generar el archivo de transferencia masiva con el encabezado
-            wb = Workbook()
-            ws = wb.active
-            ws.append(['CUIL/CNPJ/CDI', 'CBU/CVU/ALIAS', 'DESCRIPCION DEL CONTACTO (MAXIMO 50 CARACTERES)', 'MONTO (SIN SEPARADORES DE MILES, CON SEPARADOR DECIMAL)', 'COMENTARIOS (OPCIONAL, MAXIMO 100 CARACTERES)', 'COMPROBANTE DE TRANSFERENCIA (OPCIONAL, INGRESE HASTA CINCO EMAILS A NOTIFICAR)'])
-            for op in ops:
-                proveedor: Persona = op.proveedor
-                documentos = op.documento.all()
-                if op.tipo_reg != 'OP':
-                    return Response({'detail': 'El registro no es una OP'}, status=status.HTTP_400_BAD_REQUEST)
-                if op.fecha_reg > datetime.now().date():
-                    response_flags.append('La fecha de la OP es mayor a la fecha actual.')
-                if not documentos:
-                    response_flags.append('El registro no tiene documentos asociados.')
-                if not proveedor:
-                    response_flags.append('FATAL: El registro no tiene proveedor asociado.')
-                    return Response({'detail': response_flags}, status=status.HTTP_400_BAD_REQUEST)
-                if not proveedor.cnpj or not proveedor.cbu_alias or not (proveedor.razon_social or proveedor.nombre_fantasia):
-                    response_flags.append('FATAL: El proveedor no tiene CNPJ cargado.')
-                    return Response({'detail': response_flags}, status=status.HTTP_400_BAD_REQUEST)
-                if not op.monto_op_rec:
-                    response_flags.append('FATAL: El registro no tiene monto.')
-                    return Response({'detail': response_flags}, status=status.HTTP_400_BAD_REQUEST)
-                
-                transferencia = {
-                    'cnpj': str(proveedor.cnpj),
-                    'CBU/Alias': proveedor.cbu_alias,
-                    'descripcion': proveedor.razon_social or proveedor.nombre_fantasia,
-                    'monto': abs(op.monto_op_rec),
-                    'comentarios': ', '.join([f"{doc.tipo_documento.tipo_documento}{doc.serie}-{doc.numero}" for doc in op.documento.all()]),
-                    'comprobante': ''
-                }
-
-                ws.append(transferencia[key] for key in transferencia.keys())
+            content_type, extension = transferencias.FORMATOS[formato]
+            nombre = f'transferencia_masiva.{extension}'
+            try:
+                lista, _ = transferencias.cargar_transferencias(ops_id)
+                if formato == 'xlsx':
+                    return FileResponse(transferencias.archivo_xlsx(lista), as_attachment=True, filename=nombre, content_type=content_type)
+                contenido = transferencias.archivo_csv(lista) if formato == 'csv' else transferencias.archivo_txt(lista)
+            except transferencias.ErrorTransferencia as e:
+                return Response({'detail': e.detail}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Create the HttpResponse object with appropriate headers
-            response = HttpResponse(
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-            response['Content-Disposition'] = f'attachment; filename=transferencia_masiva.xlsx'
-            wb.save(response)
+            response = HttpResponse(contenido, content_type=content_type)
+            response['Content-Disposition'] = f'attachment; filename={nombre}'
+            return response
 
-            return response  # Devolver el archivo como respuesta
-        
         except Exception as e:
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
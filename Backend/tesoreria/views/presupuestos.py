@@ -6,18 +6,20 @@ from django.db import transaction
 from django_filters import rest_framework as drf_filters
 from django_filters import FilterSet
 
-from ..models import Presupuesto, DbPresupuestosV2, EstadoPresupuesto, Comentario, Registro
+from ..models import Presupuesto, DbPresupuestosV2, EstadoPresupuesto, Comentario, Registro, DolarMEP
+from iva.models import Persona, ClienteProyecto, Imputacion
 from ..models.archivos import Archivo
 from ..serializers import (
     PresupuestoSerializer, PresupuestoListSerializer, PresupuestoViewSerializer,
     EstadoPresupuestoCreateSerializer, EstadoPresupuestoSerializer,
-    ComentarioSerializer, ConsumoPresupuestoSerializer, RegistroSerializer
+    ComentarioSerializer, ConsumoPresupuestoSerializer, RegistroSerializer, RegistroProyeccion, PresupuestoListProyeccion
 )
 from ..serializers.archivos import ArchivoSerializer
 from tesoreria.mails import mail_mencion_comentario_presupuesto
 from django.contrib.auth.models import User
-import threading
 from rest_framework.permissions import IsAuthenticated
+from shared.condicional import RespuestaCondicionalMixin
+from shared.proyecciones import ListadoProyectadoMixin
 
 
 class DbPresupuestosV2FilterSet(FilterSet):
@@ -57,7 +59,7 @@ class PresupuestoFilterSet(FilterSet):
         }
 
 
-class PresupuestoListView(generics.ListCreateAPIView):
+class PresupuestoListView(RespuestaCondicionalMixin, ListadoProyectadoMixin, generics.ListCreateAPIView):
     """
     Vista dedicada para listar y crear presupuestos usando DbPresupuestosV2 para GET
     y Presupuesto para POST.
@@ -72,6 +74,9 @@ class PresupuestoListView(generics.ListCreateAPIView):
     # Campos de ordenación
     ordering_fields = ['fecha', 'proveedor', 'cliente_proyecto', 'observacion', 'monto', 'saldo', 'estado', 'aprobado']
     ordering = ['-id']  # Ordenación por defecto
+    # Tablas que lee la vista db_presupuestos_v2 (ver DB_Presupuestos.sql)
+    modelos_etag = [Presupuesto, EstadoPresupuesto, Registro, Persona, ClienteProyecto, Imputacion, DolarMEP]
+    serializer_proyeccion = PresupuestoListProyeccion
 
     def get_queryset(self):
         """Aplica filtros y devuelve el queryset optimizado"""
@@ -273,13 +278,8 @@ class ComentarioPresupuesto(APIView):
                             mensaje=f"{comentario.usuario} te mencionó en un comentario en el presupuesto {presupuesto}"
                         )
 
-                        # Iniciar un hilo para enviar los correos en segundo plano
-                        thread = threading.Thread(
-                            target=mail_mencion_comentario_presupuesto, 
-                            args=(mentioned_user, comentario, presupuesto)
-                        )
-                        thread.daemon = True
-                        thread.start()
+                        # El correo queda en la bandeja de salida y lo envía el comando enviar_correos
+                        mail_mencion_comentario_presupuesto(mentioned_user, comentario, presupuesto)
 
                     except User.DoesNotExist:
                         # User does not exist, skip or handle accordingly
@@ -419,8 +419,7 @@ class ListadoConsumosPresupuesto(APIView):
             return Response({'detail': 'Debe especificar un presupuesto'}, status=status.HTTP_400_BAD_REQUEST)
         
         consumos = Registro.objects.filter(presupuesto=presupuesto_id).order_by('fecha_reg')
-        from ..serializers import RegistroSerializer
-        serializer = RegistroSerializer(consumos, many=True)
+        serializer = RegistroProyeccion(RegistroProyeccion.proyectar(consumos), many=True)
         return Response(serializer.data)
 
 class ListadoConsumosFueraPresupuesto(APIView):
@@ -434,5 +433,5 @@ class ListadoConsumosFueraPresupuesto(APIView):
 
         presupuesto = Presupuesto.objects.get(id=presupuesto_id)
         consumos = Registro.objects.filter(proveedor=presupuesto.proveedor, cliente_proyecto=presupuesto.cliente_proyecto).exclude(presupuesto=presupuesto_id).order_by('fecha_reg')
-        serializer = RegistroSerializer(consumos, many=True)
+        serializer = RegistroProyeccion(RegistroProyeccion.proyectar(consumos), many=True)
         return Response(serializer.data)